@@ -155,6 +155,46 @@ function adpcm_decode(string $adpcmBytes): array
     return $pcm;
 }
 
+/**
+ * Encode a 16-bit mono WAV file as one IMA ADPCM stream, e.g. a reply
+ * <name>_chat.wav into <name>_chat.adpcm for download. The predictor
+ * state runs on through the whole file, so the device decodes any split
+ * of it seamlessly if it carries the state from piece to piece. The
+ * device plays ADPCM at 8 kHz: other rates are refused (false), convert
+ * them with convert_to_mono_wav() first.
+ */
+function wav_to_adpcm(string $wavFile, string $adpcmFile): bool
+{
+    $wav = file_get_contents($wavFile);
+    if ($wav === false || strlen($wav) < 12 || substr($wav, 0, 4) !== "RIFF" || substr($wav, 8, 4) !== "WAVE") {
+        return false;
+    }
+    $pos = 12;
+    $format = null;
+    while ($pos + 8 <= strlen($wav)) {
+        $id = substr($wav, $pos, 4);
+        $size = unpack('V', substr($wav, $pos + 4, 4))[1];
+        if ($id === "fmt ") {
+            $format = unpack('vformat/vchannels/Vrate/Vbyterate/valign/vbits', substr($wav, $pos + 8, 16));
+        } elseif ($id === "data") {
+            if ($format === null || $format['format'] !== 1 || $format['channels'] !== 1 || $format['bits'] !== 16
+                || $format['rate'] !== 8000) {
+                return false;
+            }
+            $data = substr($wav, $pos + 8, min($size, strlen($wav) - $pos - 8));
+            $samples = array_values(unpack('v*', substr($data, 0, strlen($data) & ~1)) ?: []);
+            foreach ($samples as $i => $v) {
+                if ($v & 0x8000) {
+                    $samples[$i] = $v - 0x10000;
+                }
+            }
+            return file_put_contents($adpcmFile, adpcm_encode($samples)) !== false;
+        }
+        $pos += 8 + $size + ($size & 1);
+    }
+    return false;
+}
+
 /**
  * Maximise volume of int16 PCM with some headroom.
  *
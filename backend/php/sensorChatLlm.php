@@ -46,6 +46,10 @@ curl -X POST https://api.murf.ai/v1/speech/stream \
 
 */
 
+require_once __DIR__ . '/codec.php';
+use function Adpcm\wav_to_adpcm;
+use function Adpcm\convert_to_mono_wav;
+
 // $key   = InMemory::plainText(random_bytes(32));
 $config = parse_ini_file('/var/www/files/platane/config.ini', true);
 if (
@@ -431,6 +435,22 @@ function handleQuery($name, $tts = "murf", $voicenum = 1)
                     file_put_contents($audioDir . $name . '_chat.wav', $ttsResult['audio_data']);
                 }
                 $llmResponse['tts_audio_file'] = $audioDir . $name . '_chat.wav';
+                // a quarter of the bytes for devices downloading format "adpcm"
+                $adpcmFile = $audioDir . $name . '_chat.adpcm';
+                if (!wav_to_adpcm($audioDir . $name . '_chat.wav', $adpcmFile)) {
+                    // not 8 kHz mono (e.g. local TTS): resample first
+                    $wav8k = $audioDir . $name . '_chat_8k.wav';
+                    try {
+                        convert_to_mono_wav($audioDir . $name . '_chat.wav', $wav8k, 8000);
+                        $converted = wav_to_adpcm($wav8k, $adpcmFile);
+                    } catch (\RuntimeException $e) {
+                        $converted = false;
+                    }
+                    @unlink($wav8k);
+                    if (!$converted) {
+                        error_log("ADPCM conversion failed for " . $name . '_chat.wav');
+                    }
+                }
             } else {
                 $llmResponse["status"] = "error";
                 $llmResponse["reply"] = "TTS Error: " . $ttsResult['reply'];
@@ -29,6 +29,10 @@ $issuedBy = $config['JWT']['issuedBy'];
 
 $audioDir = __DIR__ . "/audio/";
 $chunkSize = 4096*16; // adpcm might work with 4 or 8*4096. wav needs 16*4096
+$chunkSizeMin = 512;  // "down" with an "offset" serves the client's "chunksize" within these
+// adpcm replies (<name>_chat.adpcm, see wav_to_adpcm() in codec.php) are one
+// stream: the device decodes the chunks with the predictor state carried over
+$longPollMax = 20.0; // seconds a check with "wait" may be held, below max_execution_time
 
 
 // ===== INPUT =====
@@ -77,12 +81,19 @@ if ($command === "check" && isset($input['name']) && isset($input['id']) && isse
         }
     }
 
-    // then check audio file exists
+    // then check audio file exists; with "wait" (long-poll) keep looking
+    // for up to that many seconds before answering "not ready"
     $audioFormat = $input['format'] ?? 'adpcm';
     $filePath = $audioDir . $name . "_chat." . ($audioFormat == "adpcm" ? "adpcm" : "wav");
+    $wait = min((float)($input['wait'] ?? 0), $longPollMax);
+    $deadline = microtime(true) + $wait;
+    while (!file_exists($filePath) && microtime(true) < $deadline) {
+        usleep(100000);
+        clearstatcache(true, $filePath);
+    }
     if (!file_exists($filePath)) {
         http_response_code(408);
-        echo json_encode(["status" => "file not ready. retry later"]);
+        echo json_encode(["status" => "file not ready. retry later", "longpoll" => true]);
         exit;
     }
 
@@ -130,6 +141,42 @@ if ($command === "down" && isset($input['name']) && isset($input['chunk']) && is
     $fileSize = filesize($filePath);
     $numChunks = (int)ceil($fileSize / $chunkSize);
 
+    // byte offset and chunk size of the client's choosing (ProtoEngine's chunk tuner)
+    if (isset($input['offset'])) {
+        $offset = (int)$input['offset'];
+        $size = (int)($input['chunksize'] ?? 0);
+        if ($offset < 0) {
+            http_response_code(400);
+            echo json_encode(["status" => "invalid range"]);
+            exit;
+        }
+        $size = max($chunkSizeMin, min($size > 0 ? $size : $chunkSize, $chunkSize));
+        $offset = min($offset, $fileSize);
+        $data = "";
+        if ($offset < $fileSize) {
+            $handle = fopen($filePath, 'rb');
+            if ($handle === false) {
+                http_response_code(500);
+                echo json_encode(["error" => "Failed to open file"]);
+                exit;
+            }
+            fseek($handle, $offset);
+            $data = fread($handle, $size);
+            fclose($handle);
+        }
+        echo json_encode([
+            "data" => base64_encode($data),
+            "format" => $audioFormat,
+            "offset" => $offset,
+            "length" => strlen($data),
+            "chunksize" => $size,
+            "size" => $fileSize,
+            "chunks" => $numChunks,
+            "crc32" => crc32($data)
+        ]);
+        exit;
+    }
+
     if ($chunk < 0 || $chunk >= $numChunks) {
         echo json_encode([
             "length" => 0,
@@ -154,12 +201,109 @@ if ($command === "down" && isset($input['name']) && isset($input['chunk']) && is
             "format" => $audioFormat,
             "chunk" => $chunk,
             "length" => $dataLength,
-            "chunks" => $numChunks
+            "chunks" => $numChunks,
+            "crc32" => crc32($data)   // the device checks the chunk before using it
         ]);
         exit;
     }
     exit;
 }
 
+// 3) RANGE RESPONSE: chunks start .. start+count-1 (count 0: up to the end)
+// in one reply, raw with "transport" => "binary", else base64 JSON.
+// "offset" (bytes) instead of start resumes a download that broke off; the
+// CRC-32 of every "block" bytes (default: a chunk) goes along to check it
+if ($command === "range" && isset($input['name']) && isset($input['id']) && isset($input['token'])) {
+    $token = $input['token'];
+    $identifiedBy = "Sensor_" . $input['id'];
+    try {
+        if (!validateToken($token, $relatedTo, $issuedBy, $identifiedBy, $key)) {
+            throw new Exception("Invalid token");
+        }
+    } catch (Exception $e) {
+        http_response_code(401);
+        echo json_encode(["status" => "not authorized"]);
+        exit;
+    }
+
+    $name = str_replace("\0", '', basename((string)$input['name']));
+    $start = (int)($input['start'] ?? 0);
+    $count = (int)($input['count'] ?? 0);
+    $block = (int)($input['block'] ?? 0);
+    if ($block <= 0) {
+        $block = $chunkSize;
+    }
+
+    $audioFormat = $input['format'] ?? 'adpcm';
+    $filePath = $audioDir . $name . "_chat." . ($audioFormat == "adpcm" ? "adpcm" : "wav");
+    if ($name === '' || !file_exists($filePath)) {
+        http_response_code(404);
+        echo json_encode(["status" => "file not found"]);
+        exit;
+    }
+
+    $fileSize = filesize($filePath);
+    $numChunks = (int)ceil($fileSize / $chunkSize);
+    if (isset($input['offset'])) {
+        $offset = min(max((int)$input['offset'], 0), $fileSize);
+        $start = intdiv($offset, $chunkSize);
+        $end = $count <= 0 ? $fileSize : min($fileSize, $offset + $count * $chunkSize);
+        $length = $end - $offset;
+    } elseif ($start < 0 || $start >= $numChunks) {
+        $offset = 0;
+        $length = 0;
+    } else {
+        $end = $count <= 0 ? $numChunks : min($numChunks, $start + $count);
+        $offset = $start * $chunkSize;
+        $length = min($fileSize, $end * $chunkSize) - $offset;
+    }
+
+    $handle = fopen($filePath, 'rb');
+    if ($handle === false) {
+        http_response_code(500);
+        echo json_encode(["error" => "Failed to open file"]);
+        exit;
+    }
+    fseek($handle, $offset);
+    $data = $length > 0 ? fread($handle, $length) : '';
+    fclose($handle);
+    $crcs = [];
+    for ($pos = 0; $pos < strlen($data); $pos += $block) {
+        $crcs[] = crc32(substr($data, $pos, $block));
+    }
+
+    if (($input['transport'] ?? 'base64') === "binary") {
+        header('Content-Type: application/octet-stream');
+        header('Content-Length: ' . $length);
+        header('X-Sensor-Chunks: ' . $numChunks);
+        header('X-Sensor-Chunksize: ' . $chunkSize);
+        header('X-Sensor-Size: ' . $fileSize);
+        header('X-Sensor-Start: ' . $start);
+        header('X-Sensor-Offset: ' . $offset);
+        header('X-Sensor-Crc32: ' . implode(',', $crcs));
+        // send chunk by chunk, the device plays while the rest arrives
+        for ($pos = 0; $pos < strlen($data); $pos += $chunkSize) {
+            echo substr($data, $pos, $chunkSize);
+            flush();
+        }
+        exit;
+    }
+
+    echo json_encode([
+        "data" => base64_encode($data),
+        "format" => $audioFormat,
+        "start" => $start,
+        "count" => (int)ceil(strlen($data) / $chunkSize),
+        "length" => strlen($data),
+        "chunks" => $numChunks,
+        "chunksize" => $chunkSize,
+        "size" => $fileSize,
+        "offset" => $offset,
+        "block" => $block,
+        "crc32" => $crcs
+    ]);
+    exit;
+}
+
 http_response_code(400);
 echo json_encode(["error" => "Unknown command"]);
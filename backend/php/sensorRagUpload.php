@@ -77,6 +77,9 @@ $whisper_mdl = $config["SENSOR"]["whisper_mdl"] ?? "/opt/llama/whisper/models/gg
 $piper_cmd = $config["SENSOR"]["piper_cmd"] ?? "/opt/pyenvs/pipertts/bin/piper";
 $piper_mdl = $config["SENSOR"]["piper_mdl"] ?? "/opt/pyenvs/pipertts/voices/de_DE-thorsten-low.onnx";
 
+// resident whisper/piper worker (backend/python/speechWorker.py), used if running
+$speech_socket = $config["SENSOR"]["speech_socket"] ?? "";
+
 $play_cmd = $config["SENSOR"]["play_cmd"] ?? "aplay";
 
 // ===== INPUT =====
@@ -232,10 +235,40 @@ function queryOllama($url, $model, $messages): array
     }
 }
 
+// Helper function to send one request to the resident speech worker.
+// Returns null if it is not configured, not running or failed, so the
+// caller can fall back to running the command itself.
+function speechWorker(array $request): ?array
+{
+    global $speech_socket;
+    if (!$speech_socket || !file_exists($speech_socket)) {
+        return null;
+    }
+    $sock = @stream_socket_client("unix://" . $speech_socket, $errno, $errstr, 5);
+    if ($sock === false) {
+        error_log("Speech worker unavailable: " . $errstr . PHP_EOL, 3, "llm.log");
+        return null;
+    }
+    stream_set_timeout($sock, 120);
+    fwrite($sock, json_encode($request) . "\n");
+    $line = fgets($sock);
+    fclose($sock);
+    $reply = $line === false ? null : json_decode($line, true);
+    if (!is_array($reply) || !($reply["ok"] ?? false)) {
+        error_log("Speech worker failed: " . ($reply["error"] ?? "no reply") . PHP_EOL, 3, "llm.log");
+        return null;
+    }
+    return $reply;
+}
+
 // Helper function to transcribe audio using Whisper
 function transcribeAudio($audioFile): string
 {
     global $whisper_cmd, $whisper_mdl;
+    $reply = speechWorker(["op" => "stt", "files" => [realpath($audioFile)]]);
+    if ($reply !== null) {
+        return trim($reply["texts"][0] ?? "");
+    }
     $outputFile = substr($audioFile, 0, -4) . '_txt';
     $cmd = sprintf(
         $whisper_cmd . ' -m ' . $whisper_mdl . ' -otxt -of %s -f %s -l de 2>&1',
@@ -266,6 +299,16 @@ function synthesizeSpeech($text, $outputFile): bool
 {
     global $piper_cmd, $piper_mdl, $keep_files;
     
+    $outputDir = dirname($outputFile);
+    if (!is_dir($outputDir)) {
+        mkdir($outputDir, 0755, true);
+    }
+
+    $reply = speechWorker(["op" => "tts", "texts" => [$text], "files" => [realpath($outputDir) . "/" . basename($outputFile)]]);
+    if ($reply !== null) {
+        return file_exists($outputFile);
+    }
+
     $tempTextFile = tempnam(sys_get_temp_dir(), 'piper_');
     file_put_contents($tempTextFile, $text);
 
@@ -273,11 +316,6 @@ function synthesizeSpeech($text, $outputFile): bool
     error_log("Tempfile: " . $tempTextFile, 3, "llm.log");
 
 
-    $outputDir = dirname($outputFile);
-    if (!is_dir($outputDir)) {
-        mkdir($outputDir, 0755, true);
-    }
-    
     // do not run this in background. returns only when finished
     $cmd = sprintf(
         $piper_cmd . ' -m ' . $piper_mdl . ' -i %s -f %s',
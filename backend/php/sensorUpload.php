@@ -41,6 +41,9 @@ if (file_exists($devicesFile)) {
 }
 
 $audioDir = __DIR__ . "/audio/";
+// seconds a resumable upload is kept after it was last touched, also once
+// it is complete (UPLOAD_TTL in the Python reference server)
+$uploadTtl = 600;
 
 
 // ===== INPUT =====
@@ -179,6 +182,68 @@ function pcmToWav(string $pcmData, int $sampleRate = 8000, int $bitsPerSample =
 
 
 
+/**
+ * Store an upload: readings as JSON, audio as WAV with a lock file for the
+ * pipeline.  Returns [HTTP status, reply].
+ */
+function storeUpload(string $identifiedBy, string $audioFormat, string $audioData, string $audioDir): array
+{
+    $uuid = uniqid($identifiedBy . "_", true);
+    // Check size limit 512 KB
+    if (strlen($audioData) > 512 * 1024) {
+        return [401, ["status" => "not authorized7"]];
+    }
+    try {
+        // spooled sensor readings (a JSON array), no audio to process
+        if ($audioFormat == "readings") {
+            if (!is_array(json_decode($audioData, true))) {
+                return [400, ["status" => "data invalid"]];
+            }
+            if (file_put_contents($audioDir . $uuid . ".json", $audioData) === false) {
+                return [500, ["error" => "Failed to write readings file"]];
+            }
+            return [200, ["uuid" => $uuid, "status" => "stored"]];
+        }
+        // check if conversion to wav is required
+        if ($audioFormat == "adpcm") {
+            $audioData = adpcm_decode($audioData);
+            if (is_array($audioData)) {
+                $pcm = '';
+                foreach ($audioData as $sample) {
+                    $val = (int)$sample;
+                    if ($val < -32768) $val = -32768;
+                    elseif ($val > 32767) $val = 32767;
+                    $pcm .= pack('v', $val & 0xFFFF); // little-endian 16-bit
+                }
+                $audioData = $pcm;
+            }
+        }
+        // add wav header
+        $audioData = pcmToWav($audioData, 8000, 16);
+        // save to wav
+        $audioFile = $audioDir . $uuid . ".wav";
+        if (file_put_contents($audioFile, $audioData) === false) {
+            return [500, ["error" => "Failed to write audio file"]];
+        }
+        // simulate some processing by saving a lock file
+        $lockFile = $audioDir . $uuid . ".lock";
+        if (file_put_contents($lockFile, "locked") === false) {
+            return [500, ["error" => "Failed to write lock file"]];
+        }
+    } catch (Exception $e) {
+        return [500, ["error" => "Failed to save data"]];
+    }
+    return [200, ["uuid" => $uuid, "status" => "processing"]];
+}
+
+function reply(array $result): void
+{
+    http_response_code($result[0]);
+    echo json_encode($result[1]);
+    exit;
+}
+
+
 // 3) DATA PACKET
 if ($command === "data" && isset($input['id']) && isset($input['token'], $input['data'])) {
     $token = $input['token'];
@@ -203,59 +268,127 @@ if ($command === "data" && isset($input['id']) && isset($input['token'], $input[
     }
     $id = $parsedToken->claims()->get('sensor');
 
-    $uuid = uniqid($identifiedBy . "_", true);
+    $audioFormat = $input['format'] ?? 'adpcm';
+    $audioData = base64_decode($input['data'], true);
+    if ($audioData === false) {
+        http_response_code(400);
+        echo json_encode(["status" => "data invalid"]);
+        exit;
+    }
+    reply(storeUpload($identifiedBy, $audioFormat, $audioData, $audioDir));
+}
+
+// 4) RESUMABLE UPLOAD: "open" finds (or starts) an upload by sensor, format,
+// size, CRC-32 and the client's nonce and returns the offset committed so
+// far, and the result once complete; "part" appends base64 data with its
+// CRC-32 at exactly that offset (409 with the committed offset otherwise).
+// The last part stores the whole upload like a data packet.  Uploads not
+// touched for $uploadTtl seconds are dropped.
+if (($command === "open" || $command === "part") && isset($input['id'], $input['token'])) {
+    $identifiedBy = "Sensor_" . $input['id'];
     try {
-        $audioFormat = $input['format'] ?? 'adpcm';
-        $audioData = base64_decode($input['data'], true);
-        if ($audioData === false) {
-            http_response_code(400);
-            echo json_encode(["status" => "data invalid"]);
-            exit;
+        if (!validateToken($input['token'], $relatedTo, $issuedBy, $identifiedBy, $key)) {
+            throw new Exception("Invalid token");
         }
-        // Check size limit 512 KB
-        if (strlen($audioData) > 512 * 1024) {
-            http_response_code(401);
-            echo json_encode(["status" => "not authorized7"]);
-            exit;
+    } catch (Exception $e) {
+        http_response_code(401);
+        echo json_encode(["status" => "not authorized5"]);
+        exit;
+    }
+
+    if ($command === "open") {
+        $size = (int)($input['size'] ?? 0);
+        $crc = (int)($input['crc32'] ?? 0);
+        $audioFormat = preg_replace('/[^a-z0-9]/', '', (string)($input['format'] ?? 'adpcm'));
+        $nonce = (string)($input['nonce'] ?? '');
+        if (!preg_match('/^[A-Za-z0-9]{1,32}$/', $nonce)) {
+            reply([400, ["status" => "invalid upload"]]);
         }
-        // check if conversion to wav is required
-        if ($audioFormat == "adpcm") {
-            $audioData = adpcm_decode($audioData);
-            if (is_array($audioData)) {
-                $pcm = '';
-                foreach ($audioData as $sample) {
-                    $val = (int)$sample;
-                    if ($val < -32768) $val = -32768;
-                    elseif ($val > 32767) $val = 32767;
-                    $pcm .= pack('v', $val & 0xFFFF); // little-endian 16-bit
-                }
-                $audioData = $pcm;
+        if ($size <= 0 || $size > 512 * 1024) {
+            reply([401, ["status" => "not authorized7"]]);
+        }
+        foreach (glob($audioDir . "upload_*") ?: [] as $stale) {
+            if (filemtime($stale) < time() - $uploadTtl) {
+                @unlink($stale);
             }
         }
-        // add wav header
-        $audioData = pcmToWav($audioData, 8000, 16);
-        // save to wav
-        $audioFile = $audioDir . $uuid . ".wav";
-        if (file_put_contents($audioFile, $audioData) === false) {
-            http_response_code(500);
-            echo json_encode(["error" => "Failed to write audio file"]);
-            exit;
+        $upload = preg_replace('/[^A-Za-z0-9_-]/', '', (string)$input['id']) . "-" . $audioFormat . "-" . $size . "-" . sprintf('%08x', $crc) . "-" . $nonce;
+    } else {
+        $upload = preg_replace('/[^A-Za-z0-9_-]/', '', (string)($input['upload'] ?? ''));
+    }
+    // the upload key carries sensor, format, size, CRC-32 and nonce
+    $parts = explode("-", $upload);
+    if (count($parts) !== 5 || $parts[0] !== preg_replace('/[^A-Za-z0-9_-]/', '', (string)$input['id'])) {
+        reply([404, ["status" => "upload not found"]]);
+    }
+    [, $audioFormat, $size, $crcHex, ] = $parts;
+    $size = (int)$size;
+    $partFile = $audioDir . "upload_" . $upload . ".part";
+    $resultFile = $audioDir . "upload_" . $upload . ".json";
+
+    $state = function (array $extra = []) use ($upload, $size, $partFile, $resultFile): array {
+        clearstatcache();
+        if (file_exists($resultFile)) {
+            $result = json_decode((string)file_get_contents($resultFile), true) ?: [];
+            return ["upload" => $upload, "offset" => $size, "size" => $size] + $result;
         }
-        // simulate some processing by saving a lock file
-        $lockFile = $audioDir . $uuid . ".lock";
-        if (file_put_contents($lockFile, "locked") === false) {
-            http_response_code(500);
-            echo json_encode(["error" => "Failed to write lock file"]);
-            exit;
+        $offset = file_exists($partFile) ? filesize($partFile) : 0;
+        return ["upload" => $upload, "offset" => $offset, "size" => $size] + $extra;
+    };
+
+    if ($command === "open") {
+        if (!file_exists($partFile) && !file_exists($resultFile)) {
+            touch($partFile);
         }
-    } catch (Exception $e) {
-        http_response_code(500);
-        echo json_encode(["error" => "Failed to save data"]);
-        exit;
+        reply([200, $state()]);
     }
-    // respond with uuid
-    echo json_encode(["uuid" => $uuid,"status" => "processing"]);
-    exit;
+
+    $data = base64_decode((string)($input['data'] ?? ''), true);
+    if ($data === false) {
+        reply([400, ["status" => "data invalid"]]);
+    }
+    // the offset check and the append happen under one lock, so a part
+    // sent twice at the same offset is appended once; reply() exits, which
+    // releases the lock.  A completed upload writes its result before it
+    // removes the part file, so a part waiting for the lock finds it.
+    $fp = file_exists($partFile) ? @fopen($partFile, 'r+b') : false;
+    if ($fp === false || !flock($fp, LOCK_EX)) {
+        reply(file_exists($resultFile) ? [200, $state()] : [404, ["status" => "upload not found"]]);
+    }
+    clearstatcache();
+    if (file_exists($resultFile)) {
+        reply([200, $state()]);
+    }
+    if (!file_exists($partFile)) {
+        reply([404, ["status" => "upload not found"]]);
+    }
+    $offset = fstat($fp)['size'];
+    if ((int)($input['offset'] ?? -1) !== $offset) {
+        reply([409, ["status" => "offset mismatch", "offset" => $offset]]);
+    }
+    if (crc32($data) !== (int)($input['crc32'] ?? -1) || $offset + strlen($data) > $size) {
+        reply([409, ["status" => "crc mismatch", "offset" => $offset]]);
+    }
+    fseek($fp, 0, SEEK_END);
+    fwrite($fp, $data);
+    fflush($fp);
+    $offset += strlen($data);
+    if ($offset < $size) {
+        reply([200, ["upload" => $upload, "offset" => $offset, "size" => $size]]);
+    }
+    rewind($fp);
+    $audioData = (string)stream_get_contents($fp);
+    if (sprintf('%08x', crc32($audioData)) !== $crcHex) {
+        unlink($partFile);
+        reply([409, ["status" => "crc mismatch", "offset" => 0]]);
+    }
+    $result = storeUpload($identifiedBy, $audioFormat, $audioData, $audioDir);
+    if ($result[0] === 200) {
+        file_put_contents($resultFile, json_encode($result[1]));
+        $result[1] = $state();
+    }
+    unlink($partFile);
+    reply($result);
 }
 
 http_response_code(400);
@@ -0,0 +1,214 @@
+"""
+Batch transcoder for archives of sensor recordings.
+
+Runs the codec.py pipeline (decode -> optional maximise_volume -> encode ->
+WAV write) over a directory or glob in a process pool.  Every worker
+writes its outputs directly to disk via a temporary file and rename, and
+the parent appends one line per finished file to a manifest in the output
+directory.  Outputs mirror the files' places below the input directory (or
+the glob's leading directories) and keep the source extension:
+recordings/a/x.adpcm -> out/a/x.adpcm.wav, out/a/x.adpcm.adpcm.  A rerun (or a resumed run after an interruption) skips files
+whose source is unchanged -- same size and mtime, or same SHA-1 -- and
+whose outputs are still present.
+
+Usage:
+    python batch.py -i recordings/ -o out/ [-s 8000] [-m] [-j 4]
+    python batch.py -i "recordings/**/*.adpcm" -o out/ --blockwav
+"""
+import glob
+import hashlib
+import json
+import os
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import codec
+
+INPUT_EXTENSIONS = (".adpcm", ".wav", ".raw")
+MANIFEST_NAME = "manifest.jsonl"
+
+
+def collect_inputs(pattern: str) -> list:
+    """Expand a directory (recursively) or glob into a sorted list of input files."""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "**", "*")
+    return sorted(p for p in glob.glob(pattern, recursive=True)
+                  if os.path.isfile(p) and p.lower().endswith(INPUT_EXTENSIONS))
+
+
+def input_root(pattern: str) -> str:
+    """The directory outputs are laid out below: the input directory, or the glob's fixed leading part."""
+    if os.path.isdir(pattern):
+        return os.path.abspath(pattern)
+    parts = []
+    for part in os.path.dirname(pattern).split(os.sep):
+        if any(c in part for c in "*?["):
+            break
+        parts.append(part)
+    return os.path.abspath(os.sep.join(parts) or ".")
+
+
+def file_sha1(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def output_stem(src: str, root: str, outdir: str) -> str:
+    """
+    Output path without the output extension, mirroring src's location
+    below root.  The source extension is kept (x.adpcm -> x.adpcm.wav), so
+    x.adpcm and x.wav side by side do not write the same outputs.
+    """
+    rel = os.path.relpath(os.path.abspath(src), root)
+    return os.path.join(outdir, rel)
+
+
+def output_paths(stem: str, options: dict) -> dict:
+    paths = {"wav": stem + ".wav", "adpcm": stem + ".adpcm"}
+    if options.get("blockwav"):
+        paths["blockwav"] = stem + ".ima.wav"
+    return paths
+
+
+def _replace_atomic(path: str, write):
+    tmp = path + ".part"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def _write_pcm_wav(path: str, pcm: np.ndarray, rate: int):
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+
+
+def transcode_file(src: str, stem: str, options: dict) -> dict:
+    """Worker: transcode one file and return its manifest record."""
+    t0 = time.perf_counter()
+    rate = options["samplingrate"]
+    with open(src, "rb") as f:
+        raw = np.frombuffer(f.read(), dtype=np.uint8)
+
+    ext = os.path.splitext(src)[1].lower()
+    if ext == ".raw":
+        decoded = raw[:raw.size & ~1].view(np.int16)
+    elif ext == ".wav":
+        decoded = codec.convertFromWav(raw, rate)
+    else:
+        decoded = codec.adpcm_decode(raw)
+
+    if options.get("maximise"):
+        decoded = codec.maximise_volume(decoded)
+    encoded = codec.adpcm_encode(decoded)
+
+    paths = output_paths(stem, options)
+    os.makedirs(os.path.dirname(stem) or ".", exist_ok=True)
+    _replace_atomic(paths["wav"], lambda p: _write_pcm_wav(p, decoded, rate))
+    _replace_atomic(paths["adpcm"], lambda p: encoded.tofile(p))
+    if "blockwav" in paths:
+        _replace_atomic(paths["blockwav"], lambda p: codec.write_ima_wav(p, decoded, rate))
+
+    st = os.stat(src)
+    return {"src": os.path.abspath(src), "size": st.st_size, "mtime": st.st_mtime,
+            "sha1": file_sha1(src), "options": options, "outputs": paths,
+            "samples": int(decoded.size), "seconds": time.perf_counter() - t0}
+
+
+def load_manifest(path: str) -> dict:
+    """Last record per source; a torn last line from an interrupted run is ignored."""
+    records = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                records[rec["src"]] = rec
+    return records
+
+
+def is_unchanged(src: str, rec: dict, options: dict) -> bool:
+    if rec is None or rec.get("options") != options:
+        return False
+    if not all(os.path.exists(p) for p in rec["outputs"].values()):
+        return False
+    st = os.stat(src)
+    if st.st_size != rec["size"]:
+        return False
+    return st.st_mtime == rec["mtime"] or file_sha1(src) == rec["sha1"]
+
+
+def run_batch(pattern: str, outdir: str, options: dict, workers: int = None, force: bool = False) -> dict:
+    os.makedirs(outdir, exist_ok=True)
+    manifest_path = os.path.join(outdir, MANIFEST_NAME)
+    done = {} if force else load_manifest(manifest_path)
+
+    # never pick up our own outputs when outdir lies below the input directory
+    out_abs = os.path.abspath(outdir) + os.sep
+    inputs = [p for p in collect_inputs(pattern) if not os.path.abspath(p).startswith(out_abs)]
+    # from the pattern, not the matches: the layout stays put when the inputs change between runs
+    root = input_root(pattern)
+    todo, skipped = [], 0
+    for src in inputs:
+        if is_unchanged(src, done.get(os.path.abspath(src)), options):
+            skipped += 1
+        else:
+            todo.append(src)
+    print(f"{len(todo)} files to transcode, {skipped} unchanged")
+
+    rate = options["samplingrate"]
+    total_samples, failed = 0, 0
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(manifest_path, "a") as manifest:
+        futures = {pool.submit(transcode_file, src, output_stem(src, root, outdir), options): src
+                   for src in todo}
+        for fut in as_completed(futures):
+            src = futures[fut]
+            try:
+                rec = fut.result()
+            except Exception as e:
+                failed += 1
+                print(f"FAILED {src}: {e}")
+                continue
+            manifest.write(json.dumps(rec) + "\n")
+            manifest.flush()
+            total_samples += rec["samples"]
+            print(f"{os.path.basename(src)}: {rec['samples']} samples in {rec['seconds']:.3f} s "
+                  f"({rec['samples'] / max(rec['seconds'], 1e-9):,.0f} samples/s)")
+
+    wall = time.perf_counter() - t0
+    stats = {"files": len(todo) - failed, "skipped": skipped, "failed": failed,
+             "samples": total_samples, "wall": wall}
+    print(f"Total: {stats['files']} files, {total_samples} samples "
+          f"({total_samples / rate:.1f} s audio) in {wall:.2f} s, "
+          f"{total_samples / max(wall, 1e-9):,.0f} samples/s, "
+          f"{total_samples / rate / max(wall, 1e-9):.0f}x realtime")
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Batch ADPCM transcoder")
+    parser.add_argument("-i", "--input", required=True, type=str, help="Input directory or glob pattern")
+    parser.add_argument("-o", "--outdir", required=True, type=str, help="Output directory")
+    parser.add_argument("-s", "--samplingrate", type=int, default=22050, help="Sampling rate for output WAV files")
+    parser.add_argument("-m", "--maximise", action="store_true", help="Maximise volume of output files")
+    parser.add_argument("-b", "--blockwav", action="store_true", help="Also write block-framed IMA ADPCM WAV (format 0x11)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("-f", "--force", action="store_true", help="Ignore the manifest and transcode everything")
+    args = parser.parse_args()
+
+    options = {"samplingrate": args.samplingrate, "maximise": args.maximise, "blockwav": args.blockwav}
+    stats = run_batch(args.input, args.outdir, options, args.jobs, args.force)
+    if stats["failed"]:
+        raise SystemExit(1)
@@ -1,6 +1,12 @@
+import array
+import mmap
 import numpy as np
+import struct
 import wave
 
+from normalize import CLICK_SAMPLES, array_blocks, normalize_blocks
+from wavreader import WavReader, riff_chunks
+
 # IMA ADPCM step and index tables
 step_table = np.array([
     7, 8, 9, 10, 11, 12, 13, 14, 16, 17,
@@ -19,90 +25,517 @@ index_table = np.array([
     -1, -1, -1, -1, 2, 4, 6, 8
 ], dtype=np.int8)
 
-def adpcm_encode(pcm_data: np.ndarray) -> np.ndarray:
-    assert pcm_data.dtype == np.int16
-    nsamples = len(pcm_data)
-    out = np.zeros((nsamples + 1) // 2, dtype=np.uint8)
-
-    index = 0
-    valprev = 0
-    step = step_table[index]
-    buffer = 0
-    toggle = False
-
-    for i, sample in enumerate(pcm_data):
-        diff = sample - valprev
-        sign = 8 if diff < 0 else 0
-        if sign:
+# ---------------------------------------------------------------------
+# ⚙️  Codec engine
+# ---------------------------------------------------------------------
+# Every (step_index, nibble) pair maps to a fixed signed predictor delta
+# and a fixed next step index, so both directions are driven from flat
+# lookup tables (position index * 16 + nibble).  The encoder additionally
+# uses the quantiser thresholds of each step: nibble magnitude k is the
+# largest k whose reconstruction (k&4: step, k&2: step>>1, k&1: step>>2)
+# does not exceed |diff|, which is exactly what the bitwise IMA search does.
+
+def _build_tables():
+    diffs = np.zeros(89 * 16, dtype=np.int32)
+    nexts = np.zeros(89 * 16, dtype=np.int32)
+    thresholds = np.zeros(89 * 8, dtype=np.int32)
+    for index in range(89):
+        step = int(step_table[index])
+        for code in range(8):
+            recon = 0
+            if code & 4: recon += step
+            if code & 2: recon += step >> 1
+            if code & 1: recon += step >> 2
+            thresholds[index * 8 + code] = recon
+            vpdiff = (step >> 3) + recon
+            diffs[index * 16 + code] = vpdiff
+            diffs[index * 16 + code + 8] = -vpdiff
+        for code in range(16):
+            nexts[index * 16 + code] = min(max(index + int(index_table[code]), 0), 88)
+    return diffs, nexts, thresholds
+
+_DIFF_TABLE, _NEXT_INDEX, _THRESHOLDS = _build_tables()
+# plain lists are much faster than numpy scalars in interpreted loops
+_DIFF_LIST, _NEXT_LIST = _DIFF_TABLE.tolist(), _NEXT_INDEX.tolist()
+_INDEX_STEP = index_table.astype(np.int64)
+
+# The NumPy engine's encoder goes one step further: a flat table maps
+# (step index, signed diff) straight to index * 16 + nibble, the position
+# in the tables above, so a sample costs one lookup instead of the three
+# threshold comparisons.  Diffs run from -65535 to 65535; a row is
+# _DIFF_SPAN entries, starting at _DIFF_SPAN * index + _DIFF_OFFSET for diff
+# 0.  The 89 rows take 23 MB and are built on first use.
+_DIFF_SPAN = 1 << 17
+_DIFF_OFFSET = 65535
+_encode_table = None
+
+# samples per vectorised decode block
+_BLOCK = 4096
+# clamp events per block before the vectorised decoder gives up on a block
+_MAX_RESTARTS = 32
+
+
+def _encode_codes(samples, codes, valprev, index, diffs, nexts, thresholds):
+    """Scalar encoder core: one nibble per sample into `codes`, returns state."""
+    for i in range(len(samples)):
+        diff = samples[i] - valprev
+        sign = 0
+        if diff < 0:
+            sign = 8
             diff = -diff
+        base = index * 8
+        code = 0
+        if diff >= thresholds[base + 4]: code = 4
+        if diff >= thresholds[base + code + 2]: code += 2
+        if diff >= thresholds[base + code + 1]: code += 1
+        code |= sign
+
+        pos = index * 16 + code
+        valprev += diffs[pos]
+        if valprev > 32767: valprev = 32767
+        elif valprev < -32768: valprev = -32768
+        index = nexts[pos]
+        codes[i] = code
+    return valprev, index
+
+
+def _build_encode_table():
+    """(position per (index, diff), row start of each position's next index) for _encode_positions."""
+    diff = np.arange(-_DIFF_OFFSET, _DIFF_SPAN - _DIFF_OFFSET, dtype=np.int64)
+    magnitude = np.abs(diff)
+    sign = np.where(diff < 0, 8, 0)
+    table = np.empty((89, _DIFF_SPAN), dtype=np.uint16)
+    for index in range(89):
+        code = np.searchsorted(_THRESHOLDS[index * 8:index * 8 + 8], magnitude, side="right") - 1
+        table[index] = index * 16 + code + sign
+    rows = _NEXT_INDEX.astype(np.int64) * _DIFF_SPAN + _DIFF_OFFSET
+    return array.array("H", table.tobytes()), rows.tolist()
+
+
+def _encoder_tables():
+    global _encode_table
+    if _encode_table is None:
+        _encode_table = _build_encode_table()
+    return _encode_table
+
+
+def _encode_positions(samples, valprev, index, table, rows, diffs):
+    """Table-driven encoder core: index * 16 + nibble per sample, returns state."""
+    row = index * _DIFF_SPAN + _DIFF_OFFSET
+    positions = []
+    append = positions.append
+    for sample in samples:
+        pos = table[row + sample - valprev]
+        valprev += diffs[pos]
+        if valprev > 32767: valprev = 32767
+        elif valprev < -32768: valprev = -32768
+        row = rows[pos]
+        append(pos)
+    return positions, valprev, (row - _DIFF_OFFSET) // _DIFF_SPAN
+
+
+def _decode_codes(codes, pcm, valprev, index, diffs, nexts):
+    """Scalar decoder core: one sample per nibble into `pcm`, returns state."""
+    for i in range(len(codes)):
+        pos = index * 16 + codes[i]
+        valprev += diffs[pos]
+        if valprev > 32767: valprev = 32767
+        elif valprev < -32768: valprev = -32768
+        index = nexts[pos]
+        pcm[i] = valprev
+    return valprev, index
+
 
-        delta = 0
-        tempstep = step
-        if diff >= tempstep:
-            delta |= 4
-            diff -= tempstep
-        tempstep >>= 1
-        if diff >= tempstep:
-            delta |= 2
-            diff -= tempstep
-        tempstep >>= 1
-        if diff >= tempstep:
-            delta |= 1
-
-        delta |= sign
-
-        vpdiff = step >> 3
-        if delta & 4: vpdiff += step
-        if delta & 2: vpdiff += step >> 1
-        if delta & 1: vpdiff += step >> 2
-
-        valprev += -vpdiff if sign else vpdiff
-        valprev = np.clip(valprev, -32768, 32767)
-
-        index += index_table[delta & 0x0F]
-        index = np.clip(index, 0, 88)
-        step = step_table[index]
-
-        if toggle:
-            out[i >> 1] |= delta & 0x0F
-        else:
-            out[i >> 1] = (delta << 4) & 0xF0
-        toggle = not toggle
-
-    return out
+def _clamped_cumsum(steps: np.ndarray, start: int, lo: int, hi: int):
+    """
+    Running sum of `steps` from `start`, clamped to [lo, hi] after every step.
+
+    The lower bound is handled in closed form (x = s + max(0, lo - min s)),
+    the upper bound by restarting after each clamp.  Returns None when a
+    block clamps more than _MAX_RESTARTS times (e.g. hard clipped audio).
+    """
+    out = np.empty(steps.size, dtype=np.int64)
+    pos = 0
+    for _ in range(_MAX_RESTARTS):
+        s = np.cumsum(steps[pos:]) + start
+        s -= np.minimum(np.minimum.accumulate(s) - lo, 0)
+        over = np.flatnonzero(s > hi)
+        if over.size == 0:
+            out[pos:] = s
+            return out
+        k = int(over[0])
+        out[pos:pos + k] = s[:k]
+        out[pos + k] = hi
+        start = hi
+        pos += k + 1
+        if pos == steps.size:
+            return out
+    return None
+
+
+def _decode_codes_numpy(codes: np.ndarray, pcm: np.ndarray, valprev: int, index: int):
+    """Vectorised decoder core over blocks of _BLOCK nibbles, returns state."""
+    for start in range(0, codes.size, _BLOCK):
+        block = codes[start:start + _BLOCK].astype(np.intp)
+        out = pcm[start:start + block.size]
+        idx = _clamped_cumsum(_INDEX_STEP[block], index, 0, 88)
+        if idx is not None:
+            before = np.empty_like(idx)
+            before[0] = index
+            before[1:] = idx[:-1]
+            vals = _clamped_cumsum(_DIFF_TABLE[before * 16 + block], valprev, -32768, 32767)
+        if idx is None or vals is None:
+            valprev, index = _decode_codes(block.tolist(), out, valprev, index,
+                                           _DIFF_LIST, _NEXT_LIST)
+            continue
+        out[:] = vals
+        valprev, index = int(vals[-1]), int(idx[-1])
+    return valprev, index
+
+
+try:
+    import numba
+except ImportError:  # compiled kernels are optional
+    numba = None
+
+if numba is not None:
+    _encode_codes_jit = numba.njit(cache=True, nogil=True)(_encode_codes)
+    _decode_codes_jit = numba.njit(cache=True, nogil=True)(_decode_codes)
+
+# "numba" when the compiled kernels are used, "numpy" for the fallback
+ENGINE = "numba" if numba is not None else "numpy"
+
+
+def encode_codes(pcm_data: np.ndarray, valprev: int = 0, index: int = 0, engine: str = None):
+    """
+    Encode int16 PCM to one ADPCM nibble per sample (unpacked).
+
+    Returns
+    -------
+    (np.ndarray[uint8], int, int)
+        Nibbles plus the predictor value and step index after the last sample.
+    """
+    engine = engine or ENGINE
+    codes = np.empty(len(pcm_data), dtype=np.uint8)
+    if engine == "numba":
+        valprev, index = _encode_codes_jit(pcm_data, codes, valprev, index,
+                                           _DIFF_TABLE, _NEXT_INDEX, _THRESHOLDS)
+    else:
+        positions, valprev, index = _encode_positions(pcm_data.tolist(), valprev, index,
+                                                      *_encoder_tables(), _DIFF_LIST)
+        codes[:] = np.array(positions, dtype=np.uint16) & 15
+    return codes, int(valprev), int(index)
+
+
+def decode_codes(codes: np.ndarray, valprev: int = 0, index: int = 0, engine: str = None):
+    """
+    Decode unpacked ADPCM nibbles (one per sample) to int16 PCM.
+
+    Returns
+    -------
+    (np.ndarray[int16], int, int)
+        Samples plus the predictor value and step index after the last nibble.
+    """
+    engine = engine or ENGINE
+    pcm = np.empty(len(codes), dtype=np.int16)
+    if engine == "numba":
+        valprev, index = _decode_codes_jit(codes, pcm, valprev, index,
+                                           _DIFF_TABLE, _NEXT_INDEX)
+    else:
+        valprev, index = _decode_codes_numpy(codes, pcm, valprev, index)
+    return pcm, int(valprev), int(index)
+
+
+def pack_codes(codes: np.ndarray) -> np.ndarray:
+    """Pack nibbles two per byte, first sample in the high nibble."""
+    if codes.size & 1:
+        codes = np.append(codes, np.uint8(0))
+    return (codes[0::2] << 4) | codes[1::2]
+
+
+def unpack_codes(adpcm_data: np.ndarray) -> np.ndarray:
+    """Split packed ADPCM bytes into nibbles, high nibble first."""
+    codes = np.empty(adpcm_data.size * 2, dtype=np.uint8)
+    codes[0::2] = adpcm_data >> 4
+    codes[1::2] = adpcm_data & 0x0F
+    return codes
+
+
+def adpcm_encode(pcm_data: np.ndarray) -> np.ndarray:
+    assert pcm_data.dtype == np.int16
+    codes, _, _ = encode_codes(pcm_data)
+    return pack_codes(codes)
 
 def adpcm_decode(adpcm_data: np.ndarray) -> np.ndarray:
     assert adpcm_data.dtype == np.uint8
-    nsamples = len(adpcm_data) * 2
-    pcm = np.zeros(nsamples, dtype=np.int16)
+    pcm, _, _ = decode_codes(unpack_codes(adpcm_data))
+    return pcm
 
-    index = 0
-    valprev = 0
-    step = step_table[index]
 
-    for i in range(nsamples):
-        delta = adpcm_data[i >> 1]
-        delta = delta & 0x0F if i & 1 else delta >> 4
+# ---------------------------------------------------------------------
+# 🌊  Streaming encoder / decoder
+# ---------------------------------------------------------------------
+class AdpcmEncoder:
+    """
+    Incremental IMA ADPCM encoder with carried predictor state.
+
+    feed() accepts int16 sample arrays or little-endian PCM bytes of any
+    length (an odd trailing byte is held back, also across a following
+    array) and returns the complete ADPCM bytes produced so far.  With an
+    odd sample count the high nibble waits for the next call; flush()
+    emits it the way adpcm_encode() pads the last byte.  Concatenating all
+    feed() results plus flush() equals adpcm_encode() over the whole
+    stream.
+    """
+    def __init__(self, valprev: int = 0, index: int = 0):
+        self.valprev = valprev
+        self.index = index
+        self.phase = 0          # 1 while a high nibble is pending
+        self.pending = 0        # pending high nibble
+        self.tail = b""         # odd PCM byte not yet forming a sample
+
+    def feed(self, chunk) -> bytes:
+        if isinstance(chunk, np.ndarray) and self.tail:
+            # a byte is held back: go on as bytes so the samples stay aligned
+            chunk = chunk.astype("<i2", copy=False).tobytes()
+        if not isinstance(chunk, np.ndarray):
+            data = self.tail + bytes(chunk)
+            self.tail = data[len(data) & ~1:]
+            chunk = np.frombuffer(data, dtype="<i2", count=len(data) // 2)
+        if chunk.size == 0:
+            return b""
+        codes, self.valprev, self.index = encode_codes(chunk.astype(np.int16, copy=False),
+                                                       self.valprev, self.index)
+        if self.phase:
+            codes = np.concatenate(([self.pending], codes)).astype(np.uint8)
+        self.phase = codes.size & 1
+        if self.phase:
+            self.pending = int(codes[-1])
+            codes = codes[:-1]
+        return pack_codes(codes).tobytes()
+
+    def flush(self) -> bytes:
+        """Emit a pending high nibble (low nibble zero) and reset the phase."""
+        if not self.phase:
+            return b""
+        self.phase = 0
+        return bytes([(self.pending << 4) & 0xF0])
+
+    def get_state(self) -> dict:
+        """JSON-serialisable state, restore with AdpcmEncoder.from_state()."""
+        return {"valprev": self.valprev, "index": self.index, "phase": self.phase,
+                "pending": self.pending, "tail": self.tail.hex()}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "AdpcmEncoder":
+        enc = cls(state["valprev"], state["index"])
+        enc.phase = state.get("phase", 0)
+        enc.pending = state.get("pending", 0)
+        enc.tail = bytes.fromhex(state.get("tail", ""))
+        return enc
+
+
+class AdpcmDecoder:
+    """
+    Incremental IMA ADPCM decoder with carried predictor state.
 
-        sign = delta & 8
-        delta &= 7
+    feed() accepts ADPCM bytes (or a uint8 array) of any length and returns
+    the decoded int16 samples, two per byte, high nibble first.  The
+    concatenated output equals adpcm_decode() over the whole stream.
+    """
+    def __init__(self, valprev: int = 0, index: int = 0):
+        self.valprev = valprev
+        self.index = index
+
+    def feed(self, chunk) -> np.ndarray:
+        if not isinstance(chunk, np.ndarray):
+            chunk = np.frombuffer(bytes(chunk), dtype=np.uint8)
+        pcm, self.valprev, self.index = decode_codes(unpack_codes(chunk), self.valprev, self.index)
+        return pcm
 
-        vpdiff = step >> 3
-        if delta & 4: vpdiff += step
-        if delta & 2: vpdiff += step >> 1
-        if delta & 1: vpdiff += step >> 2
+    def get_state(self) -> dict:
+        """JSON-serialisable state, restore with AdpcmDecoder.from_state()."""
+        return {"valprev": self.valprev, "index": self.index}
 
-        valprev += -vpdiff if sign else vpdiff
-        valprev = np.clip(valprev, -32768, 32767)
-        pcm[i] = valprev
+    @classmethod
+    def from_state(cls, state: dict) -> "AdpcmDecoder":
+        return cls(state["valprev"], state["index"])
 
-        index += index_table[delta | sign]
-        index = np.clip(index, 0, 88)
-        step = step_table[index]
 
+# ---------------------------------------------------------------------
+# 🧱  Block-framed IMA ADPCM (WAV format 0x11)
+# ---------------------------------------------------------------------
+# Each block starts with the 4-byte preamble <int16 predictor, uint8 step
+# index, uint8 reserved>; the predictor is the block's first sample and the
+# remaining samples follow as nibbles, low nibble first.  Blocks decode on
+# their own, so a file can be seeked, cut into download chunks on block
+# boundaries and decoded on several cores.
+WAVE_FORMAT_IMA_ADPCM = 0x11
+DEFAULT_BLOCK_ALIGN = 256
+
+
+def samples_per_block(block_align: int = DEFAULT_BLOCK_ALIGN) -> int:
+    return (block_align - 4) * 2 + 1
+
+
+def encode_blocks(pcm_data: np.ndarray, block_align: int = DEFAULT_BLOCK_ALIGN) -> bytes:
+    """
+    Encode int16 PCM into IMA ADPCM blocks of block_align bytes.
+    The step index is carried from block to block, the last block is short.
+    """
+    assert pcm_data.dtype == np.int16
+    spb = samples_per_block(block_align)
+    out = bytearray()
+    index = 0
+    for start in range(0, pcm_data.size, spb):
+        block = pcm_data[start:start + spb]
+        valprev = int(block[0])
+        out += struct.pack("<hBB", valprev, index, 0)
+        codes, _, index = encode_codes(block[1:], valprev, index)
+        if codes.size & 1:
+            codes = np.append(codes, np.uint8(0))
+        out += ((codes[1::2] << 4) | codes[0::2]).astype(np.uint8).tobytes()
+    return bytes(out)
+
+
+def decode_block(block: bytes) -> np.ndarray:
+    """Decode one IMA ADPCM block (preamble + low-nibble-first data)."""
+    valprev, index, _ = struct.unpack_from("<hBB", block)
+    if index > 88:
+        raise ValueError(f"Invalid step index {index} in block preamble")
+    data = np.frombuffer(block, dtype=np.uint8, offset=4)
+    codes = np.empty(data.size * 2, dtype=np.uint8)
+    codes[0::2] = data & 0x0F
+    codes[1::2] = data >> 4
+    pcm = np.empty(codes.size + 1, dtype=np.int16)
+    pcm[0] = valprev
+    pcm[1:], _, _ = decode_codes(codes, valprev, index)
     return pcm
 
 
+def _decode_block_run(args) -> np.ndarray:
+    """Worker entry point: decode a run of consecutive blocks."""
+    data, block_align = args
+    return np.concatenate([decode_block(data[pos:pos + block_align])
+                           for pos in range(0, len(data), block_align)])
+
+
+def decode_blocks(data: bytes, block_align: int = DEFAULT_BLOCK_ALIGN,
+                  nsamples: int = None, workers: int = 1) -> np.ndarray:
+    """
+    Decode block-framed IMA ADPCM to int16 PCM.
+
+    With workers > 1 runs of blocks are decoded in a process pool.  nsamples
+    (the WAV fact chunk) trims the padding nibble of a short last block.
+    """
+    if not data:
+        return np.zeros(0, dtype=np.int16)
+    nblocks = -(-len(data) // block_align)
+    if workers > 1 and nblocks > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        per_run = -(-nblocks // (workers * 4)) * block_align
+        runs = [(data[pos:pos + per_run], block_align) for pos in range(0, len(data), per_run)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pcm = np.concatenate(list(pool.map(_decode_block_run, runs)))
+    else:
+        pcm = _decode_block_run((data, block_align))
+    return pcm if nsamples is None else pcm[:nsamples]
+
+
+def write_ima_wav(path: str, pcm_data: np.ndarray, sample_rate: int,
+                  block_align: int = DEFAULT_BLOCK_ALIGN):
+    """Write int16 mono PCM as a block-framed IMA ADPCM WAV file."""
+    data = encode_blocks(pcm_data, block_align)
+    spb = samples_per_block(block_align)
+    fmt = struct.pack("<HHIIHHHH", WAVE_FORMAT_IMA_ADPCM, 1, sample_rate,
+                      sample_rate * block_align // spb, block_align, 4, 2, spb)
+    fact = struct.pack("<I", pcm_data.size)
+    riff_size = 4 + (8 + len(fmt)) + (8 + len(fact)) + (8 + len(data) + (len(data) & 1))
+    with open(path, "wb") as f:
+        f.write(struct.pack("<4sI4s", b"RIFF", riff_size, b"WAVE"))
+        f.write(struct.pack("<4sI", b"fmt ", len(fmt)) + fmt)
+        f.write(struct.pack("<4sI", b"fact", len(fact)) + fact)
+        f.write(struct.pack("<4sI", b"data", len(data)) + data)
+        if len(data) & 1:
+            f.write(b"\0")
+
+
+class ImaWavReader:
+    """
+    Random-access reader for mono IMA ADPCM WAV files (format 0x11).
+
+    seek() jumps to any sample by decoding only the block containing it,
+    read() continues from there block by block.
+    """
+    def __init__(self, path: str):
+        self._f = open(path, "rb")
+        self._map = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.nsamples = None
+        fmt = data = None
+        try:
+            for chunk_id, offset, size in riff_chunks(self._map):
+                if chunk_id == b"fmt ":
+                    fmt = self._map[offset:offset + size]
+                elif chunk_id == b"fact":
+                    self.nsamples = struct.unpack_from("<I", self._map, offset)[0]
+                elif chunk_id == b"data":
+                    data = (offset, size)
+            if fmt is None or data is None:
+                raise ValueError("WAV file lacks fmt or data chunk")
+            tag, channels, self.sample_rate, _, self.block_align = struct.unpack_from("<HHIIH", fmt)
+            if tag != WAVE_FORMAT_IMA_ADPCM or channels != 1:
+                raise ValueError(f"Expected mono IMA ADPCM, got format 0x{tag:x} with {channels} channels")
+        except Exception:
+            self.close()
+            raise
+        self._data_offset, self._data_size = data
+        self.samples_per_block = samples_per_block(self.block_align)
+        nblocks = -(-self._data_size // self.block_align)
+        if self.nsamples is None:
+            self.nsamples = nblocks * self.samples_per_block
+        self._pos = 0
+
+    def close(self):
+        self._map.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, sample: int):
+        self._pos = min(max(sample, 0), self.nsamples)
+
+    def _read_block(self, block: int) -> np.ndarray:
+        start = self._data_offset + block * self.block_align
+        end = self._data_offset + min((block + 1) * self.block_align, self._data_size)
+        return decode_block(self._map[start:end])
+
+    def read(self, n: int = -1) -> np.ndarray:
+        """Read up to n samples (all remaining if n < 0) from the current position."""
+        end = self.nsamples if n < 0 else min(self._pos + n, self.nsamples)
+        out = []
+        while self._pos < end:
+            block, skip = divmod(self._pos, self.samples_per_block)
+            pcm = self._read_block(block)[skip:skip + end - self._pos]
+            if pcm.size == 0:
+                break
+            out.append(pcm)
+            self._pos += pcm.size
+        return np.concatenate(out) if out else np.zeros(0, dtype=np.int16)
+
+    def read_all(self, workers: int = 1) -> np.ndarray:
+        """Decode the whole file, fanning blocks out over `workers` processes."""
+        data = self._map[self._data_offset:self._data_offset + self._data_size]
+        self._pos = self.nsamples
+        return decode_blocks(data, self.block_align, self.nsamples, workers)
+
+
 # ---------------------------------------------------------------------
 # 🎵  WAV converter
 # ---------------------------------------------------------------------
@@ -120,85 +553,9 @@ def convertFromWav(wav_bytes: bytes, target_rate: int = 22050) -> np.ndarray:
     np.ndarray[int16]
         PCM samples as int16 numpy array.
     """
-    import io
-
-    with wave.open(io.BytesIO(wav_bytes), 'rb') as wav_file:
-        n_channels = wav_file.getnchannels()
-        sampwidth = wav_file.getsampwidth()
-        n_frames = wav_file.getnframes()
-        framerate = wav_file.getframerate()
-
-        frames = wav_file.readframes(n_frames)
-
-        # Convert raw bytes to PCM int16, handling various sample widths
-        if sampwidth == 1:
-            # 8-bit WAV: unsigned
-            raw = np.frombuffer(frames, dtype=np.uint8).astype(np.int16)
-            raw = (raw - 128) << 8
-        elif sampwidth == 2:
-            # 16-bit WAV: signed little-endian
-            raw = np.frombuffer(frames, dtype='<i2').astype(np.int32)
-        elif sampwidth == 3:
-            # 24-bit WAV: convert manually to int32 then to int16
-            b = np.frombuffer(frames, dtype=np.uint8)
-            # Ensure length is multiple of 3
-            if b.size % 3 != 0:
-                b = b[:-(b.size % 3)]
-            b = b.reshape(-1, 3)
-            # Little-endian: b0 + b1<<8 + b2<<16, sign extend if b2 & 0x80
-            raw32 = (b[:, 0].astype(np.int32) |
-                 (b[:, 1].astype(np.int32) << 8) |
-                 (b[:, 2].astype(np.int32) << 16))
-            sign_mask = (raw32 & 0x800000) != 0
-            raw32[sign_mask] |= ~0xFFFFFF  # sign extend
-            # Reduce 24->16 by shifting
-            raw = (raw32 >> 8).astype(np.int32)
-        elif sampwidth == 4:
-            # 32-bit WAV: signed little-endian -> convert to int16 by shifting
-            raw32 = np.frombuffer(frames, dtype='<i4').astype(np.int32)
-            raw = (raw32 >> 16).astype(np.int32)
-        else:
-            # Unknown sample width: treat bytes as silence
-            raw = np.zeros(n_frames * n_channels, dtype=np.int32)
-
-        # Convert to shape (n_frames, n_channels)
-        try:
-            raw = raw.reshape(-1, n_channels)
-        except Exception:
-            # If reshape fails, try to infer channels by truncation/padding
-            total_samples = raw.size
-            expected = n_frames * n_channels
-            if total_samples > expected:
-                raw = raw[:expected].reshape(-1, n_channels)
-            else:
-                # pad with zeros
-                pad = expected - total_samples
-                raw = np.concatenate([raw, np.zeros(pad, dtype=raw.dtype)])
-                raw = raw.reshape(-1, n_channels)
-
-        # Convert to mono by averaging channels (preserve as float for resampling precision)
-        if n_channels == 1:
-            pcm = raw[:, 0].astype(np.float32)
-        else:
-            pcm = raw.mean(axis=1).astype(np.float32)
-
-        # Clip to int16 range just in case, then resample if target_rate differs
-        pcm = np.clip(pcm, -32768, 32767)
-
-        if target_rate != framerate and pcm.size > 1:
-            # Simple linear resampling (no external deps)
-            src_len = pcm.size
-            dst_len = int(round(src_len * float(target_rate) / float(framerate)))
-            if dst_len <= 0:
-                dst_len = 1
-            xp = np.linspace(0, src_len - 1, num=src_len)
-            xnew = np.linspace(0, src_len - 1, num=dst_len)
-            pcm_resampled = np.interp(xnew, xp, pcm).astype(np.float32)
-            pcm_data = np.round(pcm_resampled).astype(np.int16)
-        else:
-            pcm_data = np.round(pcm).astype(np.int16)
-
-    return pcm_data
+    # parsed in place, mixed down and resampled block by block
+    with WavReader(wav_bytes) as reader:
+        return reader.read_mono_int16(target_rate)
 
 # ------------------------------------------------------
 #  wav format converter
@@ -212,34 +569,8 @@ def load_wav_as_mono_pcm(path: str, target_rate: int) -> np.ndarray:
     Load a WAV file, convert to mono and resample to target_rate.
     Returns int16 numpy array.
     """
-    with wave.open(path, "rb") as wf:
-        n_channels = wf.getnchannels()
-        sampwidth = wf.getsampwidth()
-        framerate = wf.getframerate()
-        n_frames = wf.getnframes()
-        frames = wf.readframes(n_frames)
-
-    if sampwidth != 2:
-        raise RuntimeError(f"Only 16-bit WAV supported, got {8 * sampwidth}-bit")
-
-    pcm = np.frombuffer(frames, dtype=np.int16)
-
-    # Mix down to mono if needed
-    if n_channels > 1:
-        pcm = pcm.reshape(-1, n_channels)
-        pcm = pcm.mean(axis=1).astype(np.int16)
-
-    if framerate == target_rate:
-        return pcm
-
-    # Simple linear resample using numpy
-    duration = pcm.shape[0] / framerate
-    old_t = np.linspace(0.0, duration, num=pcm.shape[0], endpoint=False)
-    new_n = int(round(duration * target_rate))
-    new_t = np.linspace(0.0, duration, num=new_n, endpoint=False)
-    resampled = np.interp(new_t, old_t, pcm).astype(np.int16)
-
-    return resampled
+    with WavReader(path) as reader:
+        return reader.read_mono_int16(target_rate)
 
 
 
@@ -261,54 +592,42 @@ def maximise_volume(pcm_i16: np.ndarray, headroom: float = 0.002) -> np.ndarray:
     Returns
     -------
     np.ndarray[int16]
-        Scaled samples (same length).
+        Scaled samples (same length, unless a start click was dropped).
     """
-    
-    clickSize = 512 * 2  # 256 samples, 2 bytes per sample
-    if pcm_i16.size == 0 or pcm_i16.size < clickSize:
-        return pcm_i16
-
-    max_abs = np.abs(pcm_i16).max()
-    if max_abs == 0:
+    if pcm_i16.size == 0 or pcm_i16.size < CLICK_SAMPLES:
         return pcm_i16
-
-    mean_abs = np.mean(np.abs(pcm_i16[clickSize:]))
-    mean_abs_start = np.mean(np.abs(pcm_i16[:clickSize]))
-
-    print(f"Max absolute value: {max_abs}, Mean absolute value: {mean_abs}")
-    print(f"Mean absolute value of first 256 samples: {mean_abs_start}")
-
-    if mean_abs_start > 10 * mean_abs:
-        print(f"Warning: First {clickSize/2} samples have significantly higher mean absolute value than the rest of the audio.")
-        pcm_i16 = pcm_i16[clickSize:]  # Remove the first 256 samples
-        max_abs = np.abs(pcm_i16).max() # recalculate max_abs after removing samples
-
-    target = int((1.0 - headroom) * 32767)
-    gain   = target / max_abs
-    # Multiply in float32 to avoid overflow/rounding artefacts
-    scaled = (pcm_i16.astype(np.float32) * gain).round()
-    return scaled.astype(np.int16)
+    out = list(normalize_blocks(array_blocks(pcm_i16), "peak", headroom))
+    return np.concatenate(out) if out else pcm_i16[:0]
 
 
 if __name__ == "__main__":
     import argparse
+    import logging
+
+    import g726
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
 
     parser = argparse.ArgumentParser(description="ADPCM Encoder/Decoder")
     parser.add_argument("-i", "--input", required=True, type=str, help="Input RAW file")
     parser.add_argument("-o", "--output", default=None, type=str, help="Output WAV file")
     parser.add_argument("-e", "--encoded", default=None, type=str, help="Output Encoded file")
+    parser.add_argument("-b", "--blockwav", default=None, type=str, help="Output block-framed IMA ADPCM WAV file (format 0x11)")
     parser.add_argument("-s", "--samplingrate", type=int, default=22050, help="Sampling rate for output WAV file")
     parser.add_argument("-m", "--maximise", action="store_true", help="Maximise volume of output WAV file")
     parser.add_argument("-r", "--raw", action="store_true", help="Input is raw audio, not encoded")
     parser.add_argument("-w", "--wav", action="store_true", help="Input is wav audio")
+    parser.add_argument("-f", "--format", choices=["adpcm", "g726", "g726-itu"], default="adpcm",
+                        help="Encoded format of the input and of --encoded: 4-bit IMA ADPCM, "
+                             "G.726-16 as decoded by the device, or standard G.726-16")
     args = parser.parse_args()
 
     # Load samples from Input
     with open(args.input, "rb") as f:
         raw = np.frombuffer(f.read(), dtype=np.uint8)
 
-    if args.output is None and args.encoded is None:
-        raise RuntimeError("At least one of --output or --encoded must be specified")
+    if args.output is None and args.encoded is None and args.blockwav is None:
+        raise RuntimeError("At least one of --output, --encoded or --blockwav must be specified")
     
     if args.raw and args.wav:
         raise RuntimeError("Only one of --raw or --wav can be specified")
@@ -321,18 +640,24 @@ if __name__ == "__main__":
         # Convert from WAV
         decoded = convertFromWav(raw,args.samplingrate)
         print(f"Using {len(decoded)} WAV PCM samples")
-    else:
+    elif args.format == "adpcm":
         # Decode from ADPCM
         decoded = adpcm_decode(raw)
         print(f"Decoded {len(decoded)} samples from ADPCM")
+    else:
+        decoded = g726.g726_decode(raw, "itu" if args.format == "g726-itu" else "device")
+        print(f"Decoded {len(decoded)} samples from G.726")
 
     # maximize option
     if args.maximise:
         decoded = maximise_volume(decoded)
 
-    # Encode to ADPCM
-    encoded = adpcm_encode(decoded)
-    print(f"Encoded {len(encoded)} samples to ADPCM")
+    # Encode to ADPCM or G.726
+    if args.format == "adpcm":
+        encoded = adpcm_encode(decoded)
+    else:
+        encoded = g726.g726_encode(decoded, "itu" if args.format == "g726-itu" else "device")
+    print(f"Encoded {len(decoded)} samples to {len(encoded)} bytes of {args.format}")
 
 
     # Save decoded PCM as WAV
@@ -349,5 +674,10 @@ if __name__ == "__main__":
     if args.encoded is not None:
         with open(args.encoded, "wb") as f:
             f.write(encoded.tobytes())
-        print(f"Encoded ADPCM to {args.encoded}")
+        print(f"Saved {args.format} to {args.encoded}")
+
+    # Save decoded PCM as block-framed IMA ADPCM WAV
+    if args.blockwav is not None:
+        write_ima_wav(args.blockwav, decoded, args.samplingrate)
+        print(f"Saved IMA ADPCM WAV to {args.blockwav}")
     
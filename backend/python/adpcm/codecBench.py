@@ -0,0 +1,299 @@
+"""
+Golden-vector check and throughput benchmark for the ADPCM engine in codec.py.
+
+The reference functions below are the original per-sample implementation
+of adpcm_encode/adpcm_decode.  Every engine available here (numba kernel,
+NumPy fallback) must reproduce their output bit for bit on generated
+signals and on the recorded sensor/speaker/test_8000.adpcm, and the
+streaming AdpcmEncoder/AdpcmDecoder must match the one-shot functions.
+The block-framed (WAV 0x11) decoder is timed with 1..N worker processes,
+and ADPCM is set against G.726-16 (g726.py) in bytes on the wire, CPU
+time and round-trip SNR.
+
+Usage:
+    python codecBench.py [-n SAMPLES] [-f ADPCM_FILE]
+"""
+import json
+import os
+import time
+import warnings
+
+import numpy as np
+
+import codec
+import g726
+from codec import step_table, index_table
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FILE = os.path.join(_HERE, "..", "..", "..", "sensor", "speaker", "test_8000.adpcm")
+
+
+# ---------------------------------------------------------------------
+# 📜  Reference implementation (original per-sample loops)
+# ---------------------------------------------------------------------
+def reference_encode(pcm_data: np.ndarray) -> np.ndarray:
+    nsamples = len(pcm_data)
+    out = np.zeros((nsamples + 1) // 2, dtype=np.uint8)
+
+    index = 0
+    valprev = 0
+    step = step_table[index]
+    toggle = False
+
+    for i, sample in enumerate(pcm_data):
+        diff = sample - valprev
+        sign = 8 if diff < 0 else 0
+        if sign:
+            diff = -diff
+
+        delta = 0
+        tempstep = step
+        if diff >= tempstep:
+            delta |= 4
+            diff -= tempstep
+        tempstep >>= 1
+        if diff >= tempstep:
+            delta |= 2
+            diff -= tempstep
+        tempstep >>= 1
+        if diff >= tempstep:
+            delta |= 1
+
+        delta |= sign
+
+        vpdiff = step >> 3
+        if delta & 4: vpdiff += step
+        if delta & 2: vpdiff += step >> 1
+        if delta & 1: vpdiff += step >> 2
+
+        valprev += -vpdiff if sign else vpdiff
+        valprev = np.clip(valprev, -32768, 32767)
+
+        index += index_table[delta & 0x0F]
+        index = np.clip(index, 0, 88)
+        step = step_table[index]
+
+        if toggle:
+            out[i >> 1] |= delta & 0x0F
+        else:
+            out[i >> 1] = (delta << 4) & 0xF0
+        toggle = not toggle
+
+    return out
+
+
+def reference_decode(adpcm_data: np.ndarray) -> np.ndarray:
+    nsamples = len(adpcm_data) * 2
+    pcm = np.zeros(nsamples, dtype=np.int16)
+
+    index = 0
+    valprev = 0
+    step = step_table[index]
+
+    for i in range(nsamples):
+        delta = adpcm_data[i >> 1]
+        delta = delta & 0x0F if i & 1 else delta >> 4
+
+        sign = delta & 8
+        delta &= 7
+
+        vpdiff = step >> 3
+        if delta & 4: vpdiff += step
+        if delta & 2: vpdiff += step >> 1
+        if delta & 1: vpdiff += step >> 2
+
+        valprev += -vpdiff if sign else vpdiff
+        valprev = np.clip(valprev, -32768, 32767)
+        pcm[i] = valprev
+
+        index += index_table[delta | sign]
+        index = np.clip(index, 0, 88)
+        step = step_table[index]
+
+    return pcm
+
+
+# ---------------------------------------------------------------------
+# 🧪  Golden vectors
+# ---------------------------------------------------------------------
+def golden_signals(n: int, seed: int = 0) -> dict:
+    """
+    Test signals covering quiet, speech-like, full-scale and clipping input.
+    The first sample is never -32768: the reference wraps -diff in int16
+    there, while codec.py (like the C and PHP codecs) does not.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / 8000.0
+    tone = np.sin(2 * np.pi * 440 * t) * 12000 + rng.normal(0, 2000, n)
+    signals = {
+        "silence": np.zeros(n, dtype=np.int16),
+        "tone+noise": tone.astype(np.int16),
+        "white": rng.integers(-32768, 32768, n).astype(np.int16),
+        "square": (np.sign(np.sin(2 * np.pi * 50 * t)) * 32767).astype(np.int16),
+        "odd-length": rng.integers(-2000, 2000, n | 1).astype(np.int16),
+    }
+    for pcm in signals.values():
+        pcm[0] = max(int(pcm[0]), -32767)
+    return signals
+
+
+def engines() -> list:
+    return ["numba", "numpy"] if codec.numba is not None else ["numpy"]
+
+
+def check_golden(n: int, adpcm_file: str) -> bool:
+    ok = True
+    for name, pcm in golden_signals(n).items():
+        ref_enc = reference_encode(pcm)
+        ref_dec = reference_decode(ref_enc)
+        for engine in engines():
+            codes, _, _ = codec.encode_codes(pcm, engine=engine)
+            enc = codec.pack_codes(codes)
+            dec, _, _ = codec.decode_codes(codec.unpack_codes(ref_enc), engine=engine)
+            match = np.array_equal(enc, ref_enc) and np.array_equal(dec, ref_dec)
+            ok &= match
+            print(f"{name:12s} {engine:6s} {'OK' if match else 'MISMATCH'}")
+
+    if os.path.exists(adpcm_file):
+        data = np.fromfile(adpcm_file, dtype=np.uint8)
+        ref = reference_decode(data)
+        for engine in engines():
+            dec, _, _ = codec.decode_codes(codec.unpack_codes(data), engine=engine)
+            match = np.array_equal(dec, ref)
+            ok &= match
+            print(f"{os.path.basename(adpcm_file):12s} {engine:6s} {'OK' if match else 'MISMATCH'}")
+    else:
+        print(f"Skipping {adpcm_file}: not found")
+    return ok
+
+
+def check_streaming(n: int, chunk_sizes=(4096, 4095, 1001, 1)) -> bool:
+    """
+    Streamed output in network-sized chunks, also bytes and arrays mixed,
+    must equal the one-shot output.  The coder state is round-tripped
+    through JSON between chunks, as a backend handing a stream between
+    requests would do.
+    """
+    ok = True
+    pcm = golden_signals(n)["tone+noise"]
+    raw = pcm.astype("<i2").tobytes()
+    encoded = codec.adpcm_encode(pcm).tobytes()
+    decoded = codec.adpcm_decode(np.frombuffer(encoded, dtype=np.uint8))
+    for size in chunk_sizes:
+        enc = codec.AdpcmEncoder()
+        dec = codec.AdpcmDecoder()
+        enc_out, dec_out = [], []
+        for pos in range(0, len(raw), size):
+            enc_out.append(enc.feed(raw[pos:pos + size]))
+            enc = codec.AdpcmEncoder.from_state(json.loads(json.dumps(enc.get_state())))
+        enc_out.append(enc.flush())
+        for pos in range(0, len(encoded), size):
+            dec_out.append(dec.feed(encoded[pos:pos + size]))
+            dec = codec.AdpcmDecoder.from_state(json.loads(json.dumps(dec.get_state())))
+        match = (b"".join(enc_out) == encoded
+                 and np.array_equal(np.concatenate(dec_out), decoded))
+        ok &= match
+        print(f"{'stream/' + str(size):12s} {codec.ENGINE:6s} {'OK' if match else 'MISMATCH'}")
+    # odd byte chunks alternating with sample arrays: the held-back byte
+    # must carry over into the array
+    enc = codec.AdpcmEncoder()
+    enc_out = []
+    pos = 0
+    while pos < len(raw):
+        enc_out.append(enc.feed(raw[pos:pos + 1001]))
+        pos += 1001
+        enc_out.append(enc.feed(np.frombuffer(raw[pos:pos + 2000], dtype="<i2")))
+        pos += 2000
+    enc_out.append(enc.flush())
+    match = b"".join(enc_out) == encoded
+    ok &= match
+    print(f"{'stream/mixed':12s} {codec.ENGINE:6s} {'OK' if match else 'MISMATCH'}")
+    return ok
+
+
+# ---------------------------------------------------------------------
+# ⏱️  Throughput
+# ---------------------------------------------------------------------
+def _rate(fn, nsamples: int, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return nsamples / best
+
+
+def benchmark(n: int):
+    pcm = golden_signals(n)["tone+noise"]
+    ref_n = min(n, 48000)
+    enc = reference_encode(pcm[:ref_n])
+    ref_enc_rate = _rate(lambda: reference_encode(pcm[:ref_n]), ref_n, repeat=1)
+    ref_dec_rate = _rate(lambda: reference_decode(enc), 2 * enc.size, repeat=1)
+    print(f"{'reference':8s} encode {ref_enc_rate:14,.0f} samples/s   decode {ref_dec_rate:14,.0f} samples/s")
+
+    codes = codec.unpack_codes(codec.adpcm_encode(pcm))
+    for engine in engines():
+        # warm up (JIT compile / cache load)
+        codec.encode_codes(pcm[:16], engine=engine)
+        codec.decode_codes(codes[:16], engine=engine)
+        enc_rate = _rate(lambda: codec.encode_codes(pcm, engine=engine), pcm.size)
+        dec_rate = _rate(lambda: codec.decode_codes(codes, engine=engine), codes.size)
+        print(f"{engine:8s} encode {enc_rate:14,.0f} samples/s ({enc_rate / ref_enc_rate:6.0f}x)"
+              f"   decode {dec_rate:14,.0f} samples/s ({dec_rate / ref_dec_rate:6.0f}x)")
+
+
+def benchmark_blocks(n: int, workers=(1, 2, 4)):
+    """Parallel decode of block-framed ADPCM, speedup relative to one worker."""
+    pcm = golden_signals(n)["tone+noise"]
+    data = codec.encode_blocks(pcm)
+    ref = codec.decode_blocks(data, nsamples=pcm.size)
+    print(f"block decode ({os.cpu_count()} cpus, engine {codec.ENGINE})")
+    base = None
+    for w in workers:
+        rate = _rate(lambda: codec.decode_blocks(data, nsamples=pcm.size, workers=w), pcm.size)
+        base = base or rate
+        match = np.array_equal(codec.decode_blocks(data, nsamples=pcm.size, workers=w), ref)
+        print(f"  workers {w:2d} {rate:14,.0f} samples/s ({rate / base:4.2f}x) {'OK' if match else 'MISMATCH'}")
+
+
+def benchmark_formats(n: int, rate: int = 8000):
+    """Bytes on the wire against CPU time and round-trip SNR, ADPCM vs G.726-16."""
+    pcm = golden_signals(n)["tone+noise"]
+    ref = pcm.astype(np.float64)
+    formats = {
+        "adpcm": (codec.adpcm_encode, codec.adpcm_decode),
+        "g726": (g726.g726_encode, g726.g726_decode),
+        "g726-itu": (lambda x: g726.g726_encode(x, "itu"), lambda b: g726.g726_decode(b, "itu")),
+    }
+    print(f"formats at {rate} Hz (engines {codec.ENGINE} / {g726.ENGINE})")
+    for name, (encode, decode) in formats.items():
+        encode(pcm[:16])  # warm up
+        data = encode(pcm)
+        out = decode(data)[:pcm.size].astype(np.float64)
+        enc_rate = _rate(lambda: encode(pcm), pcm.size)
+        dec_rate = _rate(lambda: decode(data), pcm.size)
+        snr = 10 * np.log10(np.dot(ref, ref) / max(np.dot(ref - out, ref - out), 1e-9))
+        print(f"  {name:9s} {data.size * rate / pcm.size:6.0f} bytes/s on wire, "
+              f"encode {enc_rate:12,.0f} samples/s ({1e6 * rate / enc_rate:7.1f} us CPU per s audio), "
+              f"decode {dec_rate:12,.0f} samples/s, SNR {snr:6.2f} dB")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ADPCM golden-vector check and benchmark")
+    parser.add_argument("-n", "--samples", type=int, default=8000 * 60, help="Samples per benchmark signal")
+    parser.add_argument("-f", "--file", default=DEFAULT_FILE, help="Recorded ADPCM file to cross-check")
+    parser.add_argument("-w", "--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts for the block decode benchmark")
+    args = parser.parse_args()
+
+    # the reference loops may overflow numpy int16 scalars; keep the output readable
+    warnings.simplefilter("ignore", RuntimeWarning)
+
+    ok = check_golden(min(args.samples, 20000), args.file)
+    ok &= check_streaming(min(args.samples, 20001))
+    benchmark(args.samples)
+    benchmark_blocks(args.samples, args.workers)
+    benchmark_formats(args.samples)
+    if not ok:
+        raise SystemExit("Golden-vector mismatch")
@@ -0,0 +1,395 @@
+"""
+Cross-implementation ADPCM conformance and benchmark harness.
+
+Implementations under test:
+  python/<engine>  codec.py (numba kernel if installed, NumPy fallback)
+  c/<path>         every adpcm.c / modadpcm.c in micropython/, with the codec
+                   core cut out of the MicroPython glue and built as a host
+                   shared library, called through ctypes
+  php              backend/php/codec.php through the PHP CLI, if `php` exists
+
+g726.py is checked against the device G.726 decoder (g72x.c, g726_16.c and
+the decode loop of dec726.c) built the same way, and against a build with
+the dq[] stores corrected for its "itu" variant.
+
+For each implementation and corpus the harness reports encode and decode
+samples/sec, bit-exactness against codec.py and the SNR of an encode ->
+decode round trip.  Results go to a JSON file; --compare prints the
+change against an earlier result file, e.g. one from the previous commit.
+
+Usage:
+    python conformance.py [-o results.json] [--compare old.json] [-c recording.adpcm ...]
+"""
+import ctypes
+import glob
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import codec
+import g726
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.normpath(os.path.join(_HERE, "..", "..", ".."))
+C_SOURCES = sorted(glob.glob(os.path.join(REPO, "micropython", "cmodules", "adpcm", "*.c"))
+                   + glob.glob(os.path.join(REPO, "micropython", "mpyMods", "*", "adpcm", "adpcm.c")))
+G726_DIR = os.path.join(REPO, "micropython", "mpyMods", "mpy1.25.0", "g726")
+PHP_CODEC = os.path.join(REPO, "backend", "php", "codec.php")
+RECORDED = [os.path.join(REPO, "sensor", "speaker", "test_8000.adpcm")]
+
+
+# ---------------------------------------------------------------------
+# 📦  Corpora
+# ---------------------------------------------------------------------
+def generated_corpora(n: int, seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / 8000.0
+    # even lengths: the device codecs drop a trailing odd sample
+    n &= ~1
+    chirp = np.sin(2 * np.pi * (100 + 1800 * t / t[-1]) * t) * 10000
+    speechy = rng.normal(0, 1, n) * (4000 * (1 + np.sin(2 * np.pi * 3 * t))[:n])
+    return {
+        "silence": np.zeros(n, dtype=np.int16),
+        "chirp": chirp[:n].astype(np.int16),
+        "speech-like": np.clip(speechy, -32768, 32767).astype(np.int16),
+        "white": rng.integers(-32767, 32768, n).astype(np.int16),
+        "square": (np.sign(np.sin(2 * np.pi * 50 * t[:n])) * 32767).astype(np.int16),
+    }
+
+
+def recorded_corpora(paths) -> dict:
+    """Recordings as PCM: ADPCM streams are decoded, WAV files read as mono."""
+    out = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        if path.lower().endswith(".wav"):
+            pcm = codec.load_wav_as_mono_pcm(path, 8000)
+        else:
+            pcm = codec.adpcm_decode(np.fromfile(path, dtype=np.uint8))
+        out[os.path.basename(path)] = pcm[:pcm.size & ~1]
+    return out
+
+
+# ---------------------------------------------------------------------
+# 🔌  Implementations: each offers encode(pcm) -> bytes and decode(bytes) -> pcm
+# ---------------------------------------------------------------------
+class PythonImpl:
+    def __init__(self, engine: str):
+        self.name = f"python/{engine}"
+        self.engine = engine
+
+    def encode(self, pcm):
+        codes, _, _ = codec.encode_codes(pcm, engine=self.engine)
+        return codec.pack_codes(codes).tobytes(), None
+
+    def decode(self, data):
+        pcm, _, _ = codec.decode_codes(codec.unpack_codes(np.frombuffer(data, dtype=np.uint8)),
+                                       engine=self.engine)
+        return pcm, None
+
+
+_C_SHIM = """
+#include <stdint.h>
+typedef struct { int valprev; int index; } adpcm_state_t;
+"""
+
+
+def _c_function(src: str, name: str) -> str:
+    """Cut one function definition (signature through matching brace) out of C source."""
+    m = re.search(r"(?:static\s+)?void\s+%s\s*\([^)]*\)\s*\{" % name, src)
+    if not m:
+        raise ValueError(f"{name} not found")
+    depth, pos = 0, m.end() - 1
+    while True:
+        if src[pos] == "{":
+            depth += 1
+        elif src[pos] == "}":
+            depth -= 1
+            if depth == 0:
+                return re.sub(r"^static\s+", "", src[m.start():pos + 1])
+        pos += 1
+
+
+def build_c_library(path: str, workdir: str) -> str:
+    """Build the codec core of a MicroPython module source as a host .so."""
+    with open(path) as f:
+        src = f.read()
+    tables = [re.search(r"static const int %s\[\d+\]\s*=\s*\{.*?\};" % t, src, re.S).group(0)
+              for t in ("step_table", "index_table")]
+    body = "\n".join([_C_SHIM] + tables + [_c_function(src, "adpcm_encode"), _c_function(src, "adpcm_decode")])
+    tag = re.sub(r"[^A-Za-z0-9]+", "_", os.path.relpath(path, REPO))
+    c_path = os.path.join(workdir, tag + ".c")
+    so_path = os.path.join(workdir, tag + ".so")
+    with open(c_path, "w") as f:
+        f.write(body)
+    cc = os.environ.get("CC", "cc")
+    subprocess.run([cc, "-O2", "-shared", "-fPIC", "-o", so_path, c_path], check=True)
+    return so_path
+
+
+class _State(ctypes.Structure):
+    _fields_ = [("valprev", ctypes.c_int), ("index", ctypes.c_int)]
+
+
+class CImpl:
+    def __init__(self, path: str, workdir: str):
+        self.name = "c/" + os.path.relpath(path, os.path.join(REPO, "micropython"))
+        self.lib = ctypes.CDLL(build_c_library(path, workdir))
+        for fn in (self.lib.adpcm_encode, self.lib.adpcm_decode):
+            fn.restype = None
+            fn.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(_State)]
+
+    def encode(self, pcm):
+        pcm = np.ascontiguousarray(pcm, dtype=np.int16)
+        out = np.zeros(pcm.size // 2, dtype=np.uint8)
+        self.lib.adpcm_encode(pcm.ctypes.data, out.ctypes.data, pcm.size, ctypes.byref(_State()))
+        return out.tobytes(), None
+
+    def decode(self, data):
+        src = np.frombuffer(data, dtype=np.uint8)
+        pcm = np.zeros(src.size * 2, dtype=np.int16)
+        self.lib.adpcm_decode(src.ctypes.data, pcm.ctypes.data, pcm.size, ctypes.byref(_State()))
+        return pcm, None
+
+
+_PHP_RUNNER = r"""<?php
+declare(strict_types=1);
+require $argv[1];
+[$mode, $in, $out] = [$argv[2], $argv[3], $argv[4]];
+if ($mode === 'encode') {
+    $pcm = Adpcm\load_raw_pcm($in);
+    $t0 = hrtime(true);
+    $res = Adpcm\adpcm_encode($pcm);
+    $dt = hrtime(true) - $t0;
+    file_put_contents($out, $res);
+} else {
+    $data = file_get_contents($in);
+    $t0 = hrtime(true);
+    $res = Adpcm\adpcm_decode($data);
+    $dt = hrtime(true) - $t0;
+    Adpcm\save_raw_pcm($out, $res);
+}
+echo json_encode(['seconds' => $dt / 1e9]);
+"""
+
+
+class PhpImpl:
+    """codec.php via the CLI; timing is measured inside PHP, excluding file I/O."""
+    name = "php"
+
+    def __init__(self, workdir: str):
+        self.workdir = workdir
+        self.runner = os.path.join(workdir, "runner.php")
+        with open(self.runner, "w") as f:
+            f.write(_PHP_RUNNER)
+
+    def _run(self, mode: str, data: bytes) -> tuple:
+        src, dst = os.path.join(self.workdir, "in.bin"), os.path.join(self.workdir, "out.bin")
+        with open(src, "wb") as f:
+            f.write(data)
+        r = subprocess.run(["php", self.runner, PHP_CODEC, mode, src, dst],
+                           check=True, capture_output=True, text=True)
+        with open(dst, "rb") as f:
+            return f.read(), json.loads(r.stdout)["seconds"]
+
+    def encode(self, pcm):
+        return self._run("encode", pcm.astype("<i2").tobytes())
+
+    def decode(self, data):
+        raw, seconds = self._run("decode", data)
+        return np.frombuffer(raw, dtype="<i2").astype(np.int16), seconds
+
+
+def implementations(workdir: str, with_c: bool = True, with_php: bool = True) -> list:
+    impls = [PythonImpl(e) for e in (["numba", "numpy"] if codec.numba is not None else ["numpy"])]
+    if with_c and shutil.which(os.environ.get("CC", "cc")):
+        for path in C_SOURCES:
+            try:
+                impls.append(CImpl(path, workdir))
+            except (OSError, ValueError, AttributeError, subprocess.CalledProcessError) as e:
+                print(f"Skipping {path}: {e}")
+    if with_php and shutil.which("php"):
+        impls.append(PhpImpl(workdir))
+    return impls
+
+
+# the prototypes g72x.c and g726_16.c expect from the missing private.h
+_G726_PRIVATE_H = """
+int quan(int val, const int *table, int size);
+int fmult(int an, int srn);
+int predictor_zero(g726_state *state_ptr);
+int predictor_pole(g726_state *state_ptr);
+int step_size(g726_state *state_ptr);
+int reconstruct(int sign, int dqln, int y);
+void update(int code_size, int y, int wi, int fi, int dq, int sr, int dqsez, g726_state *state_ptr);
+"""
+
+
+def build_g726_library(workdir: str, variant: str = "device") -> str:
+    """Build the dec726 decoder as a host .so; "itu" stores dq[] as int16 as intended."""
+    with open(os.path.join(G726_DIR, "dec726.c")) as f:
+        src = f.read()
+    start, end = src.index("void g726_init_state"), src.index("//-----------------------------------------")
+    decode = _c_function(src, "g726_decode").replace(
+        "g726_state *state = m_new(g726_state, 1);", "g726_state st, *state = &st;").replace(
+        "int16_t samples", "int samples")
+    dec = '#include <stdint.h>\n#include "g72x.h"\n#include "private.h"\n' + src[start:end] + decode
+    with open(os.path.join(G726_DIR, "g72x.c")) as f:
+        g72x = f.read()
+    if variant == "itu":
+        g72x = g72x.replace("volatile int *dqp = (volatile int *)", "short *dqp = ")
+        dec = dec.replace("volatile int *dqp = (volatile int *)", "short *dqp = ")
+    build = os.path.join(workdir, "g726_" + variant)
+    os.makedirs(build, exist_ok=True)
+    for name, text in (("private.h", _G726_PRIVATE_H), ("g72x.c", g72x), ("dec.c", dec)):
+        with open(os.path.join(build, name), "w") as f:
+            f.write(text)
+    so_path = os.path.join(build, "libg726.so")
+    subprocess.run([os.environ.get("CC", "cc"), "-O2", "-shared", "-fPIC", "-I", build, "-I", G726_DIR,
+                    "-o", so_path, os.path.join(build, "g72x.c"), os.path.join(G726_DIR, "g726_16.c"),
+                    os.path.join(build, "dec.c")], check=True)
+    return so_path
+
+
+def check_g726(corpora: dict, workdir: str) -> list:
+    """g726.py against the C decoder: decode of g726.py's stream and of random bytes."""
+    results = []
+    rng = np.random.default_rng(1)
+    for variant in g726.VARIANTS:
+        lib = ctypes.CDLL(build_g726_library(workdir, variant))
+        lib.g726_decode.restype = None
+        lib.g726_decode.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int]
+
+        def c_decode(data):
+            pcm = np.zeros(data.size * 4, dtype=np.int16)
+            lib.g726_decode(data.ctypes.data, pcm.ctypes.data, data.size)
+            return pcm
+
+        streams = {"random-bytes": rng.integers(0, 256, 4000).astype(np.uint8)}
+        streams.update({name: g726.g726_encode(pcm, variant) for name, pcm in corpora.items()})
+        for name, data in streams.items():
+            exact = bool(np.array_equal(g726.g726_decode(data, variant), c_decode(data)))
+            results.append({"variant": variant, "corpus": name, "decode_exact": exact})
+            print(f"g726/{variant:6s} {name:16s} decode exact {'Y' if exact else 'N'}")
+    return results
+
+
+# ---------------------------------------------------------------------
+# 📏  Measurements
+# ---------------------------------------------------------------------
+def snr_db(ref: np.ndarray, test: np.ndarray):
+    """SNR of test against ref in dB; None when they are identical."""
+    ref = ref.astype(np.float64)
+    err = ref - test[:ref.size].astype(np.float64)
+    noise = float(np.dot(err, err))
+    if noise == 0:
+        return None
+    return 10 * np.log10(max(float(np.dot(ref, ref)), 1e-12) / noise)
+
+
+def _db(value) -> str:
+    return "lossless" if value is None else f"{value:6.2f} dB"
+
+
+def _timed(fn, arg, repeat: int):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result, inner = fn(arg)
+        best = min(best, inner if inner is not None else time.perf_counter() - t0)
+    return result, best
+
+
+def run(impls, corpora: dict, repeat: int = 3) -> list:
+    results = []
+    for cname, pcm in corpora.items():
+        ref_enc = codec.adpcm_encode(pcm).tobytes()
+        ref_dec = codec.adpcm_decode(np.frombuffer(ref_enc, dtype=np.uint8))
+        for impl in impls:
+            # warm up (JIT compile, page in the library)
+            impl.encode(pcm[:64])
+            enc, t_enc = _timed(impl.encode, pcm, repeat)
+            dec, t_dec = _timed(impl.decode, ref_enc, repeat)
+            own, _ = impl.decode(enc)
+            res = {
+                "impl": impl.name, "corpus": cname, "samples": int(pcm.size),
+                "encode_sps": pcm.size / max(t_enc, 1e-12),
+                "decode_sps": pcm.size / max(t_dec, 1e-12),
+                "encode_exact": enc == ref_enc,
+                "decode_exact": bool(np.array_equal(dec, ref_dec)),
+                "snr_db": snr_db(pcm, own),
+            }
+            results.append(res)
+            print(f"{impl.name:38s} {cname:16s} enc {res['encode_sps']:14,.0f}/s "
+                  f"dec {res['decode_sps']:14,.0f}/s "
+                  f"exact {'Y' if res['encode_exact'] else 'N'}{'Y' if res['decode_exact'] else 'N'} "
+                  f"SNR {_db(res['snr_db'])}")
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "-C", REPO, "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(old_path: str, results: list):
+    """Print throughput ratios and exactness changes against an older result file."""
+    with open(old_path) as f:
+        old = json.load(f)
+    before = {(r["impl"], r["corpus"]): r for r in old["results"]}
+    print(f"Compared with {old.get('commit', '?')}:")
+    for r in results:
+        o = before.get((r["impl"], r["corpus"]))
+        if o is None:
+            continue
+        flags = ""
+        if o["encode_exact"] and not r["encode_exact"] or o["decode_exact"] and not r["decode_exact"]:
+            flags = "  LOST BIT-EXACTNESS"
+        print(f"{r['impl']:38s} {r['corpus']:16s} enc x{r['encode_sps'] / o['encode_sps']:5.2f} "
+              f"dec x{r['decode_sps'] / o['decode_sps']:5.2f} SNR {_db(o['snr_db'])} -> {_db(r['snr_db'])}{flags}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ADPCM conformance and benchmark harness")
+    parser.add_argument("-n", "--samples", type=int, default=8000 * 30, help="Samples per generated corpus")
+    parser.add_argument("-c", "--corpus", nargs="*", default=RECORDED, help="Recorded .adpcm/.wav files")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Timing repeats (best is kept)")
+    parser.add_argument("-o", "--output", default=None, help="Write JSON results here")
+    parser.add_argument("--compare", default=None, help="Earlier JSON results to compare against")
+    parser.add_argument("--no-c", action="store_true", help="Skip the C implementations")
+    parser.add_argument("--no-php", action="store_true", help="Skip the PHP implementation")
+    args = parser.parse_args()
+
+    corpora = generated_corpora(args.samples)
+    corpora.update(recorded_corpora(args.corpus))
+    with tempfile.TemporaryDirectory() as workdir:
+        impls = implementations(workdir, not args.no_c, not args.no_php)
+        results = run(impls, corpora, args.repeat)
+        g726_results = check_g726(corpora, workdir) if not args.no_c and shutil.which(
+            os.environ.get("CC", "cc")) else []
+
+    report = {"commit": git_commit(), "timestamp": time.time(), "python": sys.version.split()[0],
+              "machine": platform.machine(), "engine": codec.ENGINE, "results": results, "g726": g726_results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+        print(f"Saved results to {args.output}")
+    if args.compare:
+        compare(args.compare, results)
+    if not all(r["encode_exact"] and r["decode_exact"] for r in results) or \
+            not all(r["decode_exact"] for r in g726_results):
+        raise SystemExit("Implementations disagree")
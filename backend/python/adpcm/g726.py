@@ -0,0 +1,366 @@
+"""
+G.726 16 kbit/s (2 bits per sample) codec, bit-compatible with the device
+decoder in micropython/mpyMods/mpy1.25.0/g726 (dec726 module).
+
+The algorithm is the Sun reference coder (g72x.c, g726_16.c).  Codes are
+packed four per byte, first sample in the two most significant bits, and
+every stream starts from the initial state -- dec726.decode() resets the
+decoder on each call.  Against the 4-bit IMA ADPCM of codec.py this halves
+the bytes on the wire.
+
+Two state variants are supported:
+
+* "device" (default) reproduces g72x.c as compiled for the sensor.  Its
+  delay line shift and g726_init_state() write the int16 dq[] history
+  through `volatile int *`, so each store also overwrites the next entry
+  with the sign extension of the value, and the last one lands in the low
+  half of sr[0].  The encoder tracks that same state, so the device
+  reconstructs exactly what the encoder predicted.
+* "itu" is the plain G.726 recursion, for streams exchanged with other
+  G.726 implementations (ffmpeg -c:a g726 -b:a 16k).
+
+The per-sample recursion cannot be vectorised; it runs as a numba kernel
+when numba is installed and as a plain Python loop otherwise.  Packing,
+unpacking and the 16 <-> 14 bit scaling are NumPy operations.
+"""
+import numpy as np
+
+try:
+    import numba
+    from numba.extending import register_jitable
+except ImportError:  # compiled kernels are optional
+    numba = None
+
+    def register_jitable(fn):
+        return fn
+
+# "numba" when the compiled kernel is used, "python" for the fallback
+ENGINE = "numba" if numba is not None else "python"
+VARIANTS = ("device", "itu")
+BITS_PER_SAMPLE = 2
+
+# Table 11/G.726 reconstruction log magnitudes, scale factor multipliers
+# (WI << 5) and transition values (FUNCTF) per 2-bit code
+_DQLN = np.array([116, 365, 365, 116], dtype=np.int64)
+_WI = np.array([-704, 14048, 14048, -704], dtype=np.int64)
+_FI = np.array([0, 0xE00, 0xE00, 0], dtype=np.int64)
+# quantizer decision level (qtab_723_16)
+_QTAB0 = 261
+
+# state vector layout, names as in g726_state
+YL, YU, DMS, DML, AP, A, B, PK, DQ, SR, TD = 0, 1, 2, 3, 4, 5, 7, 13, 15, 21, 23
+STATE_SIZE = 24
+
+
+def initial_state(variant: str = "device") -> np.ndarray:
+    """State after g726_init_state(), as an int64 vector (layout above)."""
+    if variant not in VARIANTS:
+        raise ValueError(f"Unknown G.726 variant {variant!r}")
+    st = np.zeros(STATE_SIZE, dtype=np.int64)
+    st[YL] = 34816
+    st[YU] = 544
+    st[DQ:DQ + 6] = 32
+    st[SR:SR + 2] = 32
+    if variant == "device":
+        # the int store of dq[5] zeroes the low half of sr[0]
+        st[SR] = 0
+    return st
+
+
+@register_jitable
+def _quan_pow2(val):
+    """quan(val, power2, 15): number of powers of two <= val, at most 15."""
+    i = 0
+    while i < 15 and val >= (1 << i):
+        i += 1
+    return i
+
+
+@register_jitable
+def _fmult(an, srn):
+    """Product of a 14-bit coefficient and a 4-bit exponent / 6-bit mantissa value."""
+    anmag = an if an > 0 else ((-an) & 0x1FFF)
+    anexp = _quan_pow2(anmag) - 6
+    if anmag == 0:
+        anmant = 32
+    elif anexp >= 0:
+        anmant = anmag >> anexp
+    else:
+        anmant = anmag << -anexp
+    wanexp = anexp + ((srn >> 6) & 0xF) - 13
+    wanmant = (anmant * (srn & 0o77) + 0x30) >> 4
+    if wanexp >= 0:
+        retval = (wanmant << wanexp) & 0x7FFF
+    else:
+        retval = wanmant >> -wanexp
+    return -retval if (an ^ srn) < 0 else retval
+
+
+@register_jitable
+def _to_short(v):
+    return ((v + 0x8000) & 0xFFFF) - 0x8000
+
+
+@register_jitable
+def _predict(st):
+    """Returns (sez, se): zero-predictor and full signal estimates."""
+    sezi = 0
+    for k in range(6):
+        sezi += _fmult(st[B + k] >> 2, st[DQ + k])
+    sei = sezi + _fmult(st[A + 1] >> 2, st[SR + 1]) + _fmult(st[A] >> 2, st[SR])
+    return sezi >> 1, sei >> 1
+
+
+@register_jitable
+def _step_size(st):
+    if st[AP] >= 256:
+        return st[YU]
+    y = st[YL] >> 6
+    dif = st[YU] - y
+    al = st[AP] >> 2
+    if dif > 0:
+        y += (dif * al) >> 6
+    elif dif < 0:
+        y += (dif * al + 0x3F) >> 6
+    return y
+
+
+@register_jitable
+def _reconstruct(sign, dqln, y):
+    dql = dqln + (y >> 2)
+    if dql < 0:
+        return -0x8000 if sign else 0
+    dex = (dql >> 7) & 15
+    dqt = 128 + (dql & 127)
+    dq = _to_short((dqt << 7) >> (14 - dex))
+    return dq - 0x8000 if sign else dq
+
+
+@register_jitable
+def _float_a(dq, mag):
+    """FLOAT A: dq as a 4-bit exponent, 6-bit mantissa int16."""
+    if mag == 0:
+        return 0x20 if dq >= 0 else _to_short(0xFC20)
+    e = _quan_pow2(mag)
+    v = (e << 6) + ((mag << 6) >> e)
+    return _to_short(v if dq >= 0 else v - 0x400)
+
+
+@register_jitable
+def _update(y, wi, fi, dq, sr, dqsez, st, device):
+    """update() of g72x.c for code_size 2."""
+    pk0 = 1 if dqsez < 0 else 0
+    mag = dq & 0x7FFF
+    # TRANS
+    ylint = st[YL] >> 15
+    ylfrac = (st[YL] >> 10) & 0x1F
+    thr1 = (32 + ylfrac) << ylint
+    thr2 = (31 << 10) if ylint > 9 else thr1
+    dqthr = (thr2 + (thr2 >> 1)) >> 1
+    tr = 1 if st[TD] != 0 and mag > dqthr else 0
+
+    # quantizer scale factor adaptation
+    yu = y + ((wi - y) >> 5)
+    st[YU] = min(max(yu, 544), 5120)
+    st[YL] += st[YU] + ((-st[YL]) >> 6)
+
+    # adaptive predictor coefficients
+    if tr == 1:
+        for k in range(2):
+            st[A + k] = 0
+        for k in range(6):
+            st[B + k] = 0
+        a2p = 0
+    else:
+        pks1 = pk0 ^ st[PK]
+        a2p = st[A + 1] - (st[A + 1] >> 7)
+        if dqsez != 0:
+            fa1 = st[A] if pks1 else -st[A]
+            if fa1 < -8191:
+                a2p -= 0x100
+            elif fa1 > 8191:
+                a2p += 0xFF
+            else:
+                a2p += fa1 >> 5
+            if pk0 ^ st[PK + 1]:
+                if a2p <= -12160:
+                    a2p = -12288
+                elif a2p >= 12416:
+                    a2p = 12288
+                else:
+                    a2p -= 0x80
+            elif a2p <= -12416:
+                a2p = -12288
+            elif a2p >= 12160:
+                a2p = 12288
+            else:
+                a2p += 0x80
+        st[A + 1] = a2p
+
+        st[A] -= st[A] >> 8
+        if dqsez != 0:
+            st[A] += -192 if pks1 else 192
+        a1ul = 15360 - a2p
+        st[A] = min(max(st[A], -a1ul), a1ul)
+
+        for k in range(6):
+            st[B + k] -= st[B + k] >> 8
+            if dq & 0x7FFF:
+                st[B + k] += 128 if (dq ^ st[DQ + k]) >= 0 else -128
+
+    # delay line of dq
+    if device:
+        # each 32-bit store into dq[k] also writes the sign of the value
+        # into dq[k + 1]; the store into dq[5] spills into sr[0]
+        d0, d1, d2, d3, d4 = st[DQ], st[DQ + 1], st[DQ + 2], st[DQ + 3], st[DQ + 4]
+        st[DQ + 1] = d0
+        st[DQ + 2] = -1 if d0 < 0 else 0
+        st[DQ + 3] = -1 if d1 < 0 else 0
+        st[DQ + 4] = -1 if d2 < 0 else 0
+        st[DQ + 5] = -1 if d3 < 0 else 0
+        st[SR] = (st[SR] & -0x10000) | (0xFFFF if d4 < 0 else 0)
+    else:
+        for k in range(5, 0, -1):
+            st[DQ + k] = st[DQ + k - 1]
+    st[DQ] = _float_a(dq, mag)
+
+    # FLOAT B
+    st[SR + 1] = st[SR]
+    if sr == 0:
+        st[SR] = 0x20
+    elif sr > 0:
+        e = _quan_pow2(sr)
+        st[SR] = (e << 6) + ((sr << 6) >> e)
+    elif sr > -32768:
+        e = _quan_pow2(-sr)
+        st[SR] = (e << 6) + ((-sr << 6) >> e) - 0x400
+    else:
+        st[SR] = 0xFC20  # sr[] is int, no sign extension here
+
+    st[PK + 1] = st[PK]
+    st[PK] = pk0
+
+    # TONE
+    if tr == 1:
+        st[TD] = 0
+    elif a2p < -11776:
+        st[TD] = 1
+    else:
+        st[TD] = 0
+
+    # adaptation speed control
+    st[DMS] += (fi - st[DMS]) >> 5
+    st[DML] += ((fi << 2) - st[DML]) >> 7
+    if tr == 1:
+        st[AP] = 256
+    elif y < 1536 or st[TD] == 1 or abs((st[DMS] << 2) - st[DML]) >= (st[DML] >> 3):
+        st[AP] += (0x200 - st[AP]) >> 4
+    else:
+        st[AP] += (-st[AP]) >> 4
+
+
+def _encode_codes(samples, codes, st, device, dqln, wi, fi):
+    """Encoder core: 14-bit samples to one 2-bit code each into `codes`."""
+    for n in range(len(samples)):
+        sez, se = _predict(st)
+        d = samples[n] - se
+        y = _step_size(st)
+        # quantize() against the single decision level
+        dqm = abs(d)
+        e = _quan_pow2(dqm >> 1)
+        dln = (e << 7) + (((dqm << 7) >> e) & 0x7F) - (y >> 2)
+        if d < 0:
+            i = 2 if dln >= _QTAB0 else 3
+        else:
+            i = 1 if dln >= _QTAB0 else 0
+        dq = _reconstruct(i & 2, dqln[i], y)
+        sr = se - (dq & 0x3FFF) if dq < 0 else se + dq
+        _update(y, wi[i], fi[i], dq, sr, sr - se + sez, st, device)
+        codes[n] = i
+
+
+def _decode_codes(codes, pcm, st, device, dqln, wi, fi):
+    """Decoder core: one 16-bit sample per 2-bit code into `pcm`."""
+    for n in range(len(codes)):
+        i = codes[n] & 3
+        sez, se = _predict(st)
+        y = _step_size(st)
+        dq = _reconstruct(i & 2, dqln[i], y)
+        sr = se - (dq & 0x3FFF) if dq < 0 else se + dq
+        _update(y, wi[i], fi[i], dq, sr, sr - se + sez, st, device)
+        pcm[n] = _to_short(sr << 2)
+
+
+if numba is not None:
+    _encode_codes_jit = numba.njit(cache=True, nogil=True)(_encode_codes)
+    _decode_codes_jit = numba.njit(cache=True, nogil=True)(_decode_codes)
+
+_TABLE_LISTS = (_DQLN.tolist(), _WI.tolist(), _FI.tolist())
+
+
+def encode_codes(pcm_data: np.ndarray, state: np.ndarray = None, variant: str = "device",
+                 engine: str = None) -> np.ndarray:
+    """
+    Encode int16 PCM to one 2-bit code per sample (unpacked).
+
+    `state` (from initial_state()) is updated in place, so consecutive calls
+    continue one stream; by default every call starts a new one.
+    """
+    engine = engine or ENGINE
+    if state is None:
+        state = initial_state(variant)
+    samples = np.asarray(pcm_data, dtype=np.int16).astype(np.int64) >> 2
+    codes = np.empty(samples.size, dtype=np.uint8)
+    device = variant == "device"
+    if engine == "numba":
+        _encode_codes_jit(samples, codes, state, device, _DQLN, _WI, _FI)
+    else:
+        st, out = state.tolist(), [0] * samples.size
+        _encode_codes(samples.tolist(), out, st, device, *_TABLE_LISTS)
+        codes[:] = out
+        state[:] = st
+    return codes
+
+
+def decode_codes(codes: np.ndarray, state: np.ndarray = None, variant: str = "device",
+                 engine: str = None) -> np.ndarray:
+    """Decode unpacked 2-bit codes to int16 PCM; `state` as for encode_codes()."""
+    engine = engine or ENGINE
+    if state is None:
+        state = initial_state(variant)
+    codes = np.asarray(codes, dtype=np.uint8)
+    pcm = np.empty(codes.size, dtype=np.int16)
+    device = variant == "device"
+    if engine == "numba":
+        _decode_codes_jit(codes, pcm, state, device, _DQLN, _WI, _FI)
+    else:
+        st, out = state.tolist(), [0] * codes.size
+        _decode_codes(codes.tolist(), out, st, device, *_TABLE_LISTS)
+        pcm[:] = out
+        state[:] = st
+    return pcm
+
+
+def pack_codes(codes: np.ndarray) -> np.ndarray:
+    """Pack 2-bit codes four per byte, first sample in the top bits; pads with code 0."""
+    codes = np.asarray(codes, dtype=np.uint8)
+    if codes.size & 3:
+        codes = np.concatenate((codes, np.zeros(4 - (codes.size & 3), dtype=np.uint8)))
+    c = codes.reshape(-1, 4)
+    return (c[:, 0] << 6) | (c[:, 1] << 4) | (c[:, 2] << 2) | c[:, 3]
+
+
+def unpack_codes(data: np.ndarray) -> np.ndarray:
+    """Split packed G.726-16 bytes into 2-bit codes, top bits first."""
+    data = np.asarray(data, dtype=np.uint8)
+    return ((data[:, None] >> np.array([6, 4, 2, 0], dtype=np.uint8)) & 3).reshape(-1)
+
+
+def g726_encode(pcm_data: np.ndarray, variant: str = "device") -> np.ndarray:
+    assert pcm_data.dtype == np.int16
+    return pack_codes(encode_codes(pcm_data, variant=variant))
+
+
+def g726_decode(g726_data: np.ndarray, variant: str = "device") -> np.ndarray:
+    assert g726_data.dtype == np.uint8
+    return decode_codes(unpack_codes(g726_data), variant=variant)
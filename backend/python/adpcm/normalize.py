@@ -0,0 +1,219 @@
+"""
+Loudness normalisation for int16 PCM.
+
+Two modes:
+
+* two-pass (normalize_blocks): pass one measures peak / mean / RMS over a
+  block source -- an array, or WavReader.mono_blocks() on a memory-mapped
+  file -- and pass two applies one gain block by block.  With
+  click_samples set, a loud start (mean |x| of the head more than ten times
+  that of the rest) is treated as a click and dropped, as maximise_volume
+  always did.
+* one-pass (StreamingNormalizer): makeup gain with a look-ahead peak
+  limiter, for audio that is normalised while it is being produced or
+  chunked for download.  Output lags input by `lookahead` samples.
+"""
+import logging
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+log = logging.getLogger(__name__)
+
+# head length checked for a start click (maximise_volume's 512 * 2)
+CLICK_SAMPLES = 512 * 2
+CLICK_RATIO = 10.0
+BLOCK = 1 << 16
+
+
+def array_blocks(pcm: np.ndarray, block: int = BLOCK):
+    """Block source over an in-memory array: a callable returning a fresh iterator."""
+    return lambda: (pcm[pos:pos + block] for pos in range(0, len(pcm), block))
+
+
+def measure(blocks, head: int = 0) -> dict:
+    """
+    One pass over `blocks`, keeping the first `head` samples apart.
+    Returns peak, sum of |x|, sum of x^2 and count for head and rest.
+    """
+    stats = {"head_peak": 0, "head_sum": 0, "head_sq": 0.0, "head_n": 0,
+             "peak": 0, "sum_abs": 0, "sum_sq": 0.0, "n": 0}
+    seen = 0
+    for block in blocks:
+        a = np.abs(np.asarray(block, dtype=np.int32))
+        if seen < head:
+            h = a[:head - seen]
+            stats["head_peak"] = max(stats["head_peak"], int(h.max(initial=0)))
+            stats["head_sum"] += int(h.sum())
+            stats["head_sq"] += float(np.dot(h.astype(np.float64), h))
+            stats["head_n"] += h.size
+            a = a[h.size:]
+        seen += len(block)
+        if a.size:
+            stats["peak"] = max(stats["peak"], int(a.max()))
+            stats["sum_abs"] += int(a.sum())
+            stats["sum_sq"] += float(np.dot(a.astype(np.float64), a))
+            stats["n"] += a.size
+    return stats
+
+
+def has_click(stats: dict) -> bool:
+    if not stats["head_n"] or not stats["n"]:
+        return False
+    mean_start = stats["head_sum"] / stats["head_n"]
+    mean_rest = stats["sum_abs"] / stats["n"]
+    log.debug("Mean absolute value: %.1f, first %d samples: %.1f", mean_rest, stats["head_n"], mean_start)
+    return mean_start > CLICK_RATIO * mean_rest
+
+
+def normalize_blocks(source, mode: str = "peak", headroom: float = 0.002,
+                     target_rms: float = 3000.0, click_samples: int = CLICK_SAMPLES):
+    """
+    Two-pass normalisation of a block source; yields int16 blocks.
+
+    Parameters
+    ----------
+    source : callable
+        Returns a fresh iterator of int16 (or int16-scaled) blocks per call.
+    mode : str
+        "peak" scales the peak to (1 - headroom) full scale, "rms" scales
+        the RMS to target_rms but never beyond that peak limit.
+    click_samples : int
+        Head checked for a start click and dropped if found; 0 disables.
+    """
+    stats = measure(source(), click_samples)
+    peak = max(stats["peak"], stats["head_peak"])
+    skip = 0
+    if click_samples and has_click(stats):
+        log.warning("First %d samples are much louder than the rest, dropping them", stats["head_n"])
+        skip = stats["head_n"]
+        peak = stats["peak"]
+    if peak == 0:
+        gain = 1.0
+    else:
+        gain = int((1.0 - headroom) * 32767) / peak
+        if mode == "rms":
+            n = stats["n"] + (0 if skip else stats["head_n"])
+            sum_sq = stats["sum_sq"] + (0 if skip else stats["head_sq"])
+            rms = math.sqrt(sum_sq / n) if n else 0.0
+            if rms > 0:
+                gain = min(gain, target_rms / rms)
+        elif mode != "peak":
+            raise ValueError(f"Unknown normalisation mode {mode!r}")
+    log.info("Peak %d, gain %.3f", peak, gain)
+
+    for block in source():
+        if skip:
+            drop = min(skip, len(block))
+            block, skip = block[drop:], skip - drop
+            if not len(block):
+                continue
+        scaled = (np.asarray(block, dtype=np.float64) * gain).round()
+        yield np.clip(scaled, -32768, 32767).astype(np.int16)
+
+
+class StreamingNormalizer:
+    """
+    One-pass normaliser: makeup gain plus a look-ahead peak limiter.
+
+    Each sample asks for gain min(max_gain, target / |x|).  The applied gain
+    is the minimum request over the next `lookahead` samples, so it is
+    already down when a peak arrives, and recovers by at most `release_db`
+    per second afterwards.  feed() returns samples delayed by `lookahead`;
+    flush() returns the rest.  A start click is dropped as in the two-pass
+    mode, judged against the following click_reference samples.
+    """
+    def __init__(self, sample_rate: int, headroom: float = 0.002, max_gain: float = 4.0,
+                 lookahead: int = 256, release_db: float = 20.0,
+                 click_samples: int = CLICK_SAMPLES, click_reference: int = 4 * CLICK_SAMPLES):
+        self.target = int((1.0 - headroom) * 32767)
+        self.log_max = math.log(max_gain)
+        self.lookahead = lookahead
+        self.release = release_db / 20.0 * math.log(10) / sample_rate
+        self.click_samples = click_samples
+        self.click_reference = click_reference
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.head_done = click_samples == 0
+        self.log_gain = self.log_max
+
+    def _limit(self, x: np.ndarray, final: bool) -> np.ndarray:
+        """Process all of x except the last lookahead samples (unless final)."""
+        a = np.abs(x)
+        want = np.minimum(self.log_max, np.log(self.target / np.maximum(a, 1.0)))
+        if final:
+            want = np.concatenate((want, np.full(self.lookahead, self.log_max)))
+        n = want.size - self.lookahead
+        if n <= 0:
+            return np.zeros(0, dtype=np.float32)
+        hold = sliding_window_view(want, self.lookahead + 1).min(axis=1)[:n]
+        # gain rises at most `release` per sample: g_i = min(hold_i, g_{i-1} + r)
+        # = i*r + running min of (hold_j - j*r), seeded with the carried gain
+        ramp = np.arange(1, n + 1) * self.release
+        g = np.minimum(np.minimum.accumulate(hold - ramp), self.log_gain) + ramp
+        self.log_gain = float(g[-1])
+        return x[:n] * np.exp(g).astype(np.float32)
+
+    def feed(self, chunk) -> np.ndarray:
+        self.pending = np.concatenate((self.pending, np.asarray(chunk, dtype=np.float32)))
+        if not self.head_done:
+            if self.pending.size < self.click_samples + self.click_reference:
+                return np.zeros(0, dtype=np.int16)
+            self._check_click()
+        out = self._limit(self.pending, final=False)
+        self.pending = self.pending[out.size:]
+        return _to_int16(out)
+
+    def flush(self) -> np.ndarray:
+        if not self.head_done:
+            self._check_click()
+        out = self._limit(self.pending, final=True)
+        self.pending = np.zeros(0, dtype=np.float32)
+        return _to_int16(out)
+
+    def _check_click(self):
+        self.head_done = True
+        stats = measure([self.pending[:self.click_samples + self.click_reference]], self.click_samples)
+        if has_click(stats):
+            log.warning("First %d samples are much louder than the rest, dropping them", self.click_samples)
+            self.pending = self.pending[self.click_samples:]
+
+
+def _to_int16(x: np.ndarray) -> np.ndarray:
+    return np.clip(np.round(x), -32768, 32767).astype(np.int16)
+
+
+def normalize_wav(src_path: str, dst_path: str, **kwargs) -> int:
+    """
+    Two-pass normalisation of a WAV file to a mono 16-bit WAV.
+    Both passes read the memory-mapped source; returns samples written.
+    """
+    import wave
+    from wavreader import WavReader
+
+    written = 0
+    with WavReader(src_path) as reader, wave.open(dst_path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(reader.sample_rate)
+        for block in normalize_blocks(reader.mono_blocks, **kwargs):
+            w.writeframes(block.tobytes())
+            written += block.size
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Normalise a WAV file to mono 16-bit")
+    parser.add_argument("-i", "--input", required=True, help="Input WAV file (memory-mapped)")
+    parser.add_argument("-o", "--output", required=True, help="Output WAV file")
+    parser.add_argument("--mode", choices=["peak", "rms"], default="peak", help="Normalisation target")
+    parser.add_argument("--rms", type=float, default=3000.0, help="Target RMS for --mode rms")
+    parser.add_argument("--no-click", action="store_true", help="Disable start click detection")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    n = normalize_wav(args.input, args.output, mode=args.mode, target_rms=args.rms,
+                      click_samples=0 if args.no_click else CLICK_SAMPLES)
+    print(f"Wrote {n} samples to {args.output}")
@@ -0,0 +1,216 @@
+"""
+Memory-mapped WAV reader for the codec toolchain.
+
+The RIFF structure is parsed directly on an mmap of the file (or on any
+bytes-like buffer), skipping unknown chunks and honouring the pad byte of
+odd-sized ones.  The data chunk is exposed as a NumPy view without
+copying; mono mixdown, bit-depth conversion and resampling then run block
+by block, so peak memory is one block plus the output array.
+"""
+import mmap
+import struct
+
+import numpy as np
+
+from resample import Resampler, to_int16
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# frames converted per step
+BLOCK_FRAMES = 1 << 16
+
+
+def riff_chunks(buf):
+    """
+    Yield (chunk_id, offset, size) for every chunk of a RIFF/WAVE buffer.
+    A size running past the end (streamed or truncated files) is clipped.
+    """
+    if len(buf) < 12 or bytes(buf[0:4]) != b"RIFF" or bytes(buf[8:12]) != b"WAVE":
+        raise ValueError("Not a RIFF/WAVE file")
+    pos = 12
+    while pos + 8 <= len(buf):
+        chunk_id, size = struct.unpack_from("<4sI", buf, pos)
+        offset = pos + 8
+        size = min(size, len(buf) - offset)
+        yield chunk_id, offset, size
+        # chunks are word aligned, odd sizes carry a pad byte
+        pos = offset + size + (size & 1)
+
+
+class WavReader:
+    """
+    Zero-copy reader for PCM (8/16/24/32-bit int, 32/64-bit float) WAV data.
+
+    `source` is a file path (memory-mapped) or a bytes-like object.  After
+    opening, `data` is a view of the data chunk shaped (frames, channels),
+    or (frames, channels, 3) uint8 for 24-bit files.
+    """
+    def __init__(self, source, block_frames: int = BLOCK_FRAMES):
+        self.block_frames = block_frames
+        self._file = self._map = None
+        if isinstance(source, str):
+            self._file = open(source, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            buf = self._map
+        else:
+            buf = source
+        try:
+            self._parse(buf)
+        except Exception:
+            self.close()
+            raise
+
+    def _parse(self, buf):
+        fmt = data = None
+        for chunk_id, offset, size in riff_chunks(buf):
+            if chunk_id == b"fmt ":
+                fmt = bytes(buf[offset:offset + size])
+            elif chunk_id == b"data":
+                data = (offset, size)
+        if fmt is None or data is None:
+            raise ValueError("WAV file lacks fmt or data chunk")
+
+        tag, self.channels, self.sample_rate, _, block_align, bits = struct.unpack_from("<HHIIHH", fmt)
+        if tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+            # the sub-format GUID starts with the actual format tag
+            tag = struct.unpack_from("<H", fmt, 24)[0]
+        self.format_tag = tag
+        self.sampwidth = bits // 8
+        if self.channels < 1 or block_align != self.channels * self.sampwidth:
+            raise ValueError(f"Unsupported WAV layout: {self.channels} channels, block align {block_align}")
+
+        if tag == WAVE_FORMAT_IEEE_FLOAT and self.sampwidth in (4, 8):
+            dtype = "<f%d" % self.sampwidth
+        elif tag == WAVE_FORMAT_PCM and self.sampwidth in (1, 2, 3, 4):
+            dtype = {1: np.uint8, 2: "<i2", 3: np.uint8, 4: "<i4"}[self.sampwidth]
+        else:
+            raise ValueError(f"Unsupported WAV format 0x{tag:x} with {bits} bits")
+
+        offset, size = data
+        self.nframes = size // block_align
+        count = self.nframes * self.channels * (3 if self.sampwidth == 3 else 1)
+        view = np.frombuffer(buf, dtype=dtype, count=count, offset=offset)
+        shape = (self.nframes, self.channels, 3) if self.sampwidth == 3 else (self.nframes, self.channels)
+        self.data = view.reshape(shape)
+
+    def close(self):
+        self.data = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # views handed out are still alive; the map goes with them
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _to_int16_scale(self, block: np.ndarray) -> np.ndarray:
+        """Convert one block of frames to float64 in int16 scale, shape (frames, channels)."""
+        if self.sampwidth == 1:
+            return (block.astype(np.float64) - 128) * 256
+        if self.sampwidth == 2:
+            return block.astype(np.float64)
+        if self.sampwidth == 3:
+            b = block.astype(np.int32)
+            raw32 = b[..., 0] | (b[..., 1] << 8) | (b[..., 2] << 16)
+            raw32 = (raw32 ^ 0x800000) - 0x800000  # sign extend
+            return (raw32 >> 8).astype(np.float64)
+        if self.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+            return block.astype(np.float64) * 32767.0
+        return (block >> 16).astype(np.float64)
+
+    def mono_blocks(self):
+        """Yield float32 mono blocks in int16 scale, clipped to the int16 range."""
+        for pos in range(0, self.nframes, self.block_frames):
+            block = self._to_int16_scale(self.data[pos:pos + self.block_frames])
+            mono = block[:, 0] if self.channels == 1 else block.mean(axis=1)
+            yield np.clip(mono, -32768, 32767).astype(np.float32)
+
+    def read_mono_int16(self, target_rate: int = None) -> np.ndarray:
+        """
+        Mix down to mono int16, resampled to target_rate if given.
+        The output array is allocated once; everything else is per block.
+        """
+        if target_rate is None or target_rate == self.sample_rate or self.nframes < 2:
+            out = np.empty(self.nframes, dtype=np.int16)
+            pos = 0
+            for mono in self.mono_blocks():
+                out[pos:pos + mono.size] = to_int16(mono)
+                pos += mono.size
+            return out
+
+        rs = Resampler(self.sample_rate, target_rate)
+        out = np.empty(-(-self.nframes * rs.L // rs.M), dtype=np.int16)
+        pos = 0
+        for mono in self.mono_blocks():
+            y = rs.process(mono)
+            out[pos:pos + y.size] = to_int16(y)
+            pos += y.size
+        y = rs.flush()
+        out[pos:pos + y.size] = to_int16(y)
+        return out
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import tempfile
+    import time
+    import tracemalloc
+    import wave
+
+    parser = argparse.ArgumentParser(description="Memory-mapped WAV reader benchmark")
+    parser.add_argument("-m", "--minutes", type=float, default=10.0, help="Length of the generated test file")
+    parser.add_argument("-r", "--rate", type=int, default=22050, help="Sample rate of the generated test file")
+    parser.add_argument("-t", "--target", type=int, default=22050, help="Target rate")
+    args = parser.parse_args()
+
+    nframes = int(args.minutes * 60 * args.rate)
+    path = os.path.join(tempfile.mkdtemp(), "bench.wav")
+    with wave.open(path, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(args.rate)
+        rng = np.random.default_rng(0)
+        for pos in range(0, nframes, BLOCK_FRAMES):
+            n = min(BLOCK_FRAMES, nframes - pos)
+            w.writeframes(rng.integers(-8000, 8000, (n, 2)).astype("<i2").tobytes())
+
+    def legacy(path):
+        # the former convertFromWav path: readframes plus full-size copies
+        with wave.open(path, "rb") as wf:
+            frames = wf.readframes(wf.getnframes())
+        raw = np.frombuffer(frames, dtype="<i2").astype(np.int32).reshape(-1, 2)
+        pcm = np.clip(raw.mean(axis=1).astype(np.float32), -32768, 32767)
+        if args.target != args.rate:
+            xp = np.linspace(0, pcm.size - 1, num=pcm.size)
+            xnew = np.linspace(0, pcm.size - 1, num=int(round(pcm.size * args.target / args.rate)))
+            pcm = np.interp(xnew, xp, pcm)
+        return np.round(pcm).astype(np.int16)
+
+    def mapped(path):
+        with WavReader(path) as r:
+            return r.read_mono_int16(args.target)
+
+    # warm the page cache so both paths read from memory
+    with open(path, "rb") as f:
+        while f.read(1 << 24):
+            pass
+
+    for name, fn in (("readframes", legacy), ("mmap", mapped)):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        out = fn(path)
+        dt = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name:10s} {dt:6.2f} s, peak {peak / 1e6:8.1f} MB (output {out.nbytes / 1e6:.1f} MB)")
+    os.remove(path)
@@ -0,0 +1,78 @@
+"""
+HS256 JWTs with the semantics of the PHP backend (buildToken.php and
+checkToken.php on lcobucci/jwt), so tokens from either side are accepted by
+the other when they share the [JWT] key of config.ini.
+
+A token for sensor <id> carries
+    iss = issuedBy, sub = relatedTo, jti = "Sensor_<id>",
+    iat = now, nbf = now + 1 s, exp = now + 10 min,
+    model = "any", sensor = "Sensor_<id>"
+and is valid when jti, sub and iss match, the signature checks out (if a
+key is given) and the time is within nbf .. exp, with 10 s leeway.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+TOKEN_TTL = 600
+NOT_BEFORE = 1
+LEEWAY = 10
+
+
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _unb64url(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(key: bytes, signing_input: str) -> bytes:
+    return hmac.new(key, signing_input.encode(), hashlib.sha256).digest()
+
+
+def create_token(key: bytes, identified_by: str, related_to: str, issued_by: str,
+                 now: float = None, ttl: int = TOKEN_TTL) -> str:
+    """createToken() of buildToken.php; identified_by is "Sensor_<id>"."""
+    now = int(time.time() if now is None else now)
+    header = {"typ": "JWT", "alg": "HS256"}
+    claims = {"iss": issued_by, "sub": related_to, "jti": identified_by, "iat": now,
+              "nbf": now + NOT_BEFORE, "exp": now + ttl, "model": "any", "sensor": identified_by}
+    signing_input = _b64url(json.dumps(header, separators=(",", ":")).encode()) + "." + \
+        _b64url(json.dumps(claims, separators=(",", ":")).encode())
+    return signing_input + "." + _b64url(_sign(key, signing_input))
+
+
+def parse_token(token: str) -> dict:
+    """Claims of a token without any check; ValueError if it is no JWT."""
+    try:
+        return json.loads(_unb64url(token.split(".")[1]))
+    except (IndexError, ValueError, TypeError) as e:
+        raise ValueError("malformed token") from e
+
+
+def validate_token(token: str, related_to: str, issued_by: str, identified_by: str,
+                   key: bytes = None, now: float = None) -> bool:
+    """validateToken() of checkToken.php."""
+    try:
+        head, body, sig = token.split(".")
+        header = json.loads(_unb64url(head))
+        claims = json.loads(_unb64url(body))
+        signature = _unb64url(sig)
+    except (AttributeError, ValueError, TypeError):
+        return False
+    if claims.get("jti") != identified_by or claims.get("sub") != related_to or claims.get("iss") != issued_by:
+        return False
+    if key is not None:
+        if header.get("alg") != "HS256" or not hmac.compare_digest(_sign(key, head + "." + body), signature):
+            return False
+    now = time.time() if now is None else now
+    try:
+        # StrictValidAt: iat, nbf and exp must all be present
+        if now + LEEWAY < float(claims["iat"]) or now + LEEWAY < float(claims["nbf"]):
+            return False
+        return now - LEEWAY < float(claims["exp"])
+    except (KeyError, TypeError, ValueError):
+        return False
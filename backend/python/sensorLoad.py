@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Load generator and soak test for the sensor backend.
+
+Runs N simulated sensors, each a ProtoEngine (threads) or AsyncProtoEngine
+(one asyncio loop), doing turns of
+
+    join -> challenge -> upload -> check (wait_ready) -> download
+
+at --rate turns per second per sensor, for --duration seconds.  Payloads
+are the sample sentences of generate_german_audio.py: with --samples the
+PCM files it generated (metadata.json), otherwise speech-like signals of
+the length each sentence takes to say.  They go up as ADPCM (--format
+adpcm, encoded with adpcm/codec.py) or 16-bit PCM.
+
+Every request is timed through ProtoEngine's per-request timing hook, and
+at the end (and every --report seconds) latency percentiles per phase,
+error counts and rates, and throughput are printed.  Without --url the
+sensors run against sensorServer.py started in a child process (mock
+backend), so no services are needed; --delay sets its processing time.
+
+Usage:
+    python sensorLoad.py -n 20 --rate 0.2 -d 60
+    python sensorLoad.py -n 50 --mode async -d 600 --report 60
+    python sensorLoad.py -u https://host/platane/php --devices keys.json -n 5
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "..", "sensor", "protocoll"))
+sys.path.insert(0, os.path.join(HERE, "..", "..", "sensor", "protocoll", "embeddedBackend"))
+sys.path.insert(0, os.path.join(HERE, "adpcm"))
+
+import sensorServer
+from protoEngine import ProtoEngine
+from asyncProtoEngine import AsyncProtoEngine
+from generate_german_audio import SAMPLE_SENTENCES
+
+PHASES = ("join", "challenge", "upload", "check", "download", "turn")
+# ProtoEngine request names -> reported phase
+PHASE_OF = {"join": "join", "challenge": "challenge", "upload": "upload", "check": "check",
+            "download": "download", "range": "download"}
+SAMPLE_RATE = 8000
+# speaking rate for the synthetic payloads
+SECONDS_PER_CHAR = 0.065
+
+
+class Recorder:
+    """Latencies (ms), errors and byte counts, shared by all sensors."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {p: [] for p in PHASES}
+        self.errors = {p: {} for p in PHASES}
+        self.up_bytes = 0
+        self.down_bytes = 0
+        self.since = time.perf_counter()
+
+    def add(self, phase, ms):
+        with self.lock:
+            self.latency[phase].append(ms)
+
+    def error(self, phase, exc):
+        kind = type(exc).__name__ + ": " + str(exc)[:60]
+        with self.lock:
+            self.errors[phase][kind] = self.errors[phase].get(kind, 0) + 1
+
+    def transferred(self, up, down):
+        with self.lock:
+            self.up_bytes += up
+            self.down_bytes += down
+
+    def summary(self) -> dict:
+        with self.lock:
+            elapsed = time.perf_counter() - self.since
+            result = {"elapsed": elapsed, "phases": {}}
+            requests = 0
+            for p in PHASES:
+                ms = np.array(self.latency[p], dtype=float)
+                errors = sum(self.errors[p].values())
+                entry = {"count": len(ms), "errors": errors,
+                         "error_rate": errors / (len(ms) + errors) if len(ms) + errors else 0.0}
+                if len(ms):
+                    entry.update({k: float(np.percentile(ms, q)) for k, q in (("p50", 50), ("p90", 90), ("p99", 99))})
+                    entry["max"] = float(ms.max())
+                if self.errors[p]:
+                    entry["error_kinds"] = dict(self.errors[p])
+                result["phases"][p] = entry
+                if p != "turn":
+                    requests += len(ms)
+            result["turns_per_s"] = len(self.latency["turn"]) / elapsed
+            result["requests_per_s"] = requests / elapsed
+            result["upload_kib_per_s"] = self.up_bytes / 1024 / elapsed
+            result["download_kib_per_s"] = self.down_bytes / 1024 / elapsed
+        return result
+
+
+def print_summary(s: dict, title: str):
+    print(f"{title}: {s['elapsed']:.1f} s, {s['turns_per_s']:.2f} turns/s, {s['requests_per_s']:.1f} requests/s, "
+          f"up {s['upload_kib_per_s']:.1f} KiB/s, down {s['download_kib_per_s']:.1f} KiB/s")
+    print(f"  {'phase':10s} {'count':>6s} {'errors':>6s} {'err %':>6s} {'p50':>8s} {'p90':>8s} {'p99':>8s} {'max':>8s}  (ms)")
+    for p in PHASES:
+        e = s["phases"][p]
+        if not e["count"] and not e["errors"]:
+            continue
+        cols = " ".join(f"{e[k]:8.1f}" if k in e else f"{'-':>8s}" for k in ("p50", "p90", "p99", "max"))
+        print(f"  {p:10s} {e['count']:6d} {e['errors']:6d} {e['error_rate'] * 100:6.2f} {cols}")
+        for kind, n in e.get("error_kinds", {}).items():
+            print(f"    {n:5d} x {kind}")
+
+
+def speech_like(seconds: float, seed: int) -> bytes:
+    """Tone bursts with pauses, `seconds` of 16-bit PCM."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    f0 = rng.uniform(100, 220)
+    envelope = np.abs(np.sin(2 * np.pi * rng.uniform(1.5, 3.0) * t)) ** 0.5
+    x = envelope * (np.sin(2 * np.pi * f0 * t) + 0.5 * np.sin(2 * np.pi * 3 * f0 * t))
+    return (x * 9000).astype("<i2").tobytes()
+
+
+def load_payloads(samples: str, format: str) -> list:
+    """[(sentence, upload bytes)] from generate_german_audio.py's output or synthesized."""
+    pcm = []
+    if samples:
+        with open(os.path.join(samples, "metadata.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        for entry in meta["files"]:
+            with open(os.path.join(samples, entry["pcm"]), "rb") as f:
+                pcm.append((entry["text"], f.read()))
+    else:
+        for i, text in enumerate(SAMPLE_SENTENCES):
+            pcm.append((text, speech_like(0.4 + SECONDS_PER_CHAR * len(text), i)))
+    if format == "wav":
+        return pcm
+    import codec
+    return [(text, codec.adpcm_encode(np.frombuffer(data, dtype="<i2")).tobytes()) for text, data in pcm]
+
+
+def load_devices(path: str, count: int) -> list:
+    """[(id, key)] for `count` sensors, cycling through the file's entries."""
+    if path:
+        with open(path) as f:
+            devices = list(json.load(f).items())
+    else:
+        devices = list(sensorServer.DEFAULT_DEVICES.items())
+    return [devices[i % len(devices)] for i in range(count)]
+
+
+def mock_devices(count: int) -> dict:
+    return {str(1000 + i): os.urandom(16).hex() for i in range(count)}
+
+
+def _timed(cls, recorder):
+    """cls whose per-request timings also go to the recorder."""
+    class Timed(cls):
+        def _timed(self, name, dt):
+            super()._timed(name, dt)
+            recorder.add(PHASE_OF.get(name, name), dt)
+    return Timed
+
+
+class Schedule:
+    """Turn start times for one sensor: every 1/rate s, or Poisson arrivals."""
+    def __init__(self, rate: float, poisson: bool, seed: int):
+        self.interval = 1 / rate
+        self.poisson = poisson
+        self.rng = random.Random(seed)
+        self.next = time.perf_counter() + self.rng.uniform(0, self.interval)
+
+    def delay(self) -> float:
+        """Seconds until the next turn is due (0 if behind) and advance."""
+        wait = max(0.0, self.next - time.perf_counter())
+        step = self.rng.expovariate(1 / self.interval) if self.poisson else self.interval
+        # a sensor that fell behind starts its next turn at once, it does
+        # not try to catch up with a burst
+        self.next = max(self.next, time.perf_counter()) + step
+        return wait
+
+
+def sensor_thread(n, device, args, payloads, recorder, stop):
+    pt = _timed(ProtoEngine, recorder)("load", args.url, device[0], device[1])
+    pt.transports = tuple(args.transports)
+    pt.connect()
+    schedule = Schedule(args.rate, args.poisson, n)
+    turn = 0
+    while not stop.wait(schedule.delay()):
+        text, data = payloads[(n + turn) % len(payloads)]
+        turn += 1
+        phase = "join"
+        t0 = time.perf_counter()
+        try:
+            if pt.state != "connected" or not args.keep_token:
+                pt.disconnect()
+                pt.connect()
+                pt.join()
+            phase = "upload"
+            name = pt.upload(data, format=args.format)["uuid"]
+            phase = "check"
+            ready = pt.wait_ready(name, timeout=args.timeout, format=args.format)
+            if ready.get("status") != "ready":
+                raise TimeoutError(f"reply not ready after {args.timeout} s")
+            phase = "download"
+            down = sum(len(buf) for buf in pt.iter_download(name, format=args.format))
+            recorder.transferred(len(data), down)
+            recorder.add("turn", (time.perf_counter() - t0) * 1000)
+        except Exception as e:
+            recorder.error(phase, e)
+            recorder.error("turn", e)
+            pt.disconnect()
+            pt.connect()
+    pt.disconnect()
+
+
+async def sensor_task(n, device, args, payloads, recorder, stop):
+    pt = _timed(AsyncProtoEngine, recorder)("load", args.url, device[0], device[1])
+    pt.transports = tuple(args.transports)
+    await pt.connect()
+    schedule = Schedule(args.rate, args.poisson, n)
+    turn = 0
+    while not stop.is_set():
+        # in steps, so a stop is noticed while waiting for the next turn
+        due = time.perf_counter() + schedule.delay()
+        while not stop.is_set() and time.perf_counter() < due:
+            await asyncio.sleep(min(0.1, due - time.perf_counter()))
+        if stop.is_set():
+            break
+        text, data = payloads[(n + turn) % len(payloads)]
+        turn += 1
+        phase = "join"
+        t0 = time.perf_counter()
+        try:
+            if pt.state != "connected" or not args.keep_token:
+                await pt.disconnect()
+                await pt.connect()
+                await pt.join()
+            phase = "upload"
+            name = (await pt.upload(data, format=args.format))["uuid"]
+            phase = "check"
+            ready = await pt.wait_ready(name, timeout=args.timeout, format=args.format)
+            if ready.get("status") != "ready":
+                raise TimeoutError(f"reply not ready after {args.timeout} s")
+            phase = "download"
+            down = 0
+            async for buf in pt.iter_download(name, format=args.format):
+                down += len(buf)
+            recorder.transferred(len(data), down)
+            recorder.add("turn", (time.perf_counter() - t0) * 1000)
+        except Exception as e:
+            recorder.error(phase, e)
+            recorder.error("turn", e)
+            await pt.disconnect()
+            await pt.connect()
+    await pt.disconnect()
+
+
+def reporter(args, recorder, stop):
+    """Print the figures so far every --report seconds of a soak run."""
+    while not stop.wait(args.report):
+        print_summary(recorder.summary(), "so far")
+
+
+def run(args) -> dict:
+    payloads = load_payloads(args.samples, args.format)
+    print(f"{args.sensors} sensors ({args.mode}), {args.rate} turns/s each, {args.duration} s, "
+          f"{len(payloads)} payloads of {min(len(p) for _, p in payloads)}-{max(len(p) for _, p in payloads)} "
+          f"bytes {args.format}, {'/'.join(args.transports)} at {args.url}")
+    devices = load_devices(args.devices, args.sensors)
+    recorder = Recorder()
+    stop = threading.Event()
+    if args.report:
+        threading.Thread(target=reporter, args=(args, recorder, stop), daemon=True).start()
+    if args.mode == "threads":
+        threads = [threading.Thread(target=sensor_thread, args=(n, devices[n], args, payloads, recorder, stop))
+                   for n in range(args.sensors)]
+        for t in threads:
+            t.start()
+        time.sleep(args.duration)
+        stop.set()
+        for t in threads:
+            t.join()
+    else:
+        async def main():
+            tasks = [asyncio.create_task(sensor_task(n, devices[n], args, payloads, recorder, stop))
+                     for n in range(args.sensors)]
+            await asyncio.sleep(args.duration)
+            stop.set()
+            await asyncio.gather(*tasks)
+        asyncio.run(main())
+    stop.set()
+    return recorder.summary()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Multi-sensor load generator for the sensor backend")
+    parser.add_argument("-u", "--url", default=None, help="Backend base URL (default: mock backend in a child process)")
+    parser.add_argument("-n", "--sensors", type=int, default=10, help="Simulated sensors")
+    parser.add_argument("-r", "--rate", type=float, default=0.2, help="Turns per second per sensor")
+    parser.add_argument("-d", "--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument("-m", "--mode", choices=("threads", "async"), default="threads",
+                        help="One thread with ProtoEngine per sensor, or AsyncProtoEngine tasks in one loop")
+    parser.add_argument("-f", "--format", choices=("adpcm", "wav"), default="adpcm", help="Upload format")
+    parser.add_argument("-t", "--transports", nargs="+", choices=sensorServer.TRANSPORTS, default=list(sensorServer.TRANSPORTS),
+                        help="Transports offered in join, preferred first")
+    parser.add_argument("--samples", default=None, help="Directory written by generate_german_audio.py")
+    parser.add_argument("--devices", default=None, help="JSON file {id: key} for a real backend")
+    parser.add_argument("--poisson", action="store_true", help="Poisson turn arrivals instead of a fixed interval")
+    parser.add_argument("--keep-token", action="store_true", help="Join once per sensor instead of every turn")
+    parser.add_argument("--timeout", type=float, default=30, help="wait_ready() timeout per turn")
+    parser.add_argument("--delay", type=float, default=0.5, help="Mock backend processing time per upload")
+    parser.add_argument("--report", type=float, default=0, help="Print interim figures every this many seconds")
+    parser.add_argument("--json", default=None, help="Write the summary to this file")
+    args = parser.parse_args()
+
+    proc = None
+    if args.url is None:
+        devices = mock_devices(args.sensors)
+        proc, args.url = sensorServer.start_in_process(devices=devices, processing_delay=args.delay)
+        args.devices = os.path.join(os.environ.get("TMPDIR", "/tmp"), f"sensorLoad_{os.getpid()}.json")
+        with open(args.devices, "w") as f:
+            json.dump(devices, f)
+    try:
+        summary = run(args)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            os.unlink(args.devices)
+    print_summary(summary, "total")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    errors = sum(e["errors"] for e in summary["phases"].values())
+    return 0 if errors == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
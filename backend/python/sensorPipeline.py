@@ -0,0 +1,270 @@
+"""
+Speech pipeline of the Python sensor backend (sensorService.py): STT, LLM
+and TTS stages run by a bounded pool of worker threads behind a job queue.
+
+The stages are objects with one method each, so any of them can be
+swapped for a stub:
+
+    stt.transcribe(pcm, rate) -> str
+    llm.reply(messages) -> str          (OpenAI style chat messages)
+    tts.synthesize(text) -> (pcm, rate)
+
+pcm is mono int16 numpy.  WhisperCli, OllamaChat and PiperCli do what
+sensorRagUpload.php does (whisper-cli and piper per call, Ollama over
+HTTP); FakeStt, FakeLlm and FakeTts take a fixed time and need nothing,
+so the backend runs fully offline.
+
+WorkerPool.submit() queues a job and returns at once.  A job moves through
+the states queued -> stt -> llm -> tts -> ready (or failed); each worker
+handles one job at a time and reports the stage it is in, which is what
+sensorDownload's check reports.  The answer is handed to the backend
+as a WAV file (8 kHz mono, what sensorChatLlm.php leaves as _chat.wav)
+and as ADPCM.
+"""
+import io
+import json
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "adpcm"))
+import codec
+
+STAGES = ("stt", "llm", "tts")
+SAMPLE_RATE = 8000
+# conversation memory per sensor, as in sensorRagUpload.php
+HISTORY = 10
+CONVERSATION_TIMEOUT = 120
+SYSTEM_PROMPT = "Du bist eine Platane in Karlsruhe. Antworte kurz und freundlich auf Deutsch."
+
+
+def wav_bytes(pcm: np.ndarray, rate: int = SAMPLE_RATE) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.astype("<i2").tobytes())
+    return buf.getvalue()
+
+
+class WhisperCli:
+    """whisper-cli per utterance, like transcribeAudio() in sensorRagUpload.php."""
+    def __init__(self, cmd: str = "whisper-cli", model: str = "/opt/llama/whisper/models/ggml-base-q8_0.bin",
+                 language: str = "de", timeout: float = 120):
+        self.cmd = cmd
+        self.model = model
+        self.language = language
+        self.timeout = timeout
+
+    def transcribe(self, pcm: np.ndarray, rate: int) -> str:
+        with tempfile.TemporaryDirectory() as tmp:
+            audio = os.path.join(tmp, "in.wav")
+            with open(audio, "wb") as f:
+                f.write(wav_bytes(pcm, rate))
+            out = os.path.join(tmp, "in_txt")
+            result = subprocess.run(self.cmd.split() + ["-m", self.model, "-otxt", "-of", out, "-f", audio,
+                                                        "-l", self.language],
+                                    capture_output=True, text=True, timeout=self.timeout)
+            if result.returncode != 0 or not os.path.exists(out + ".txt"):
+                raise RuntimeError(f"whisper failed: {result.stderr.strip()[-200:]}")
+            with open(out + ".txt", encoding="utf-8") as f:
+                return f.read().strip()
+
+
+class OllamaChat:
+    """Chat completion against Ollama's OpenAI compatible endpoint (queryOllama())."""
+    def __init__(self, url: str = "http://localhost:11434/v1/chat/completions", model: str = "granite4.1:3b",
+                 key: str = None, timeout: float = 60):
+        self.url = url
+        self.model = model
+        self.key = key
+        self.timeout = timeout
+
+    def reply(self, messages: list) -> str:
+        headers = {"Content-Type": "application/json"}
+        if self.key:
+            headers["Authorization"] = "Bearer " + self.key
+        body = json.dumps({"model": self.model, "messages": messages, "stream": False}).encode()
+        req = urllib.request.Request(self.url, data=body, headers=headers, method="POST")
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            result = json.load(resp)
+        reply = (result.get("choices") or [{}])[0].get("message", {}).get("content") \
+            or result.get("message", {}).get("content", "")
+        return reply.strip()
+
+
+class PiperCli:
+    """piper per answer, like synthesizeSpeech() in sensorRagUpload.php."""
+    def __init__(self, cmd: str = "/opt/pyenvs/pipertts/bin/piper",
+                 model: str = "/opt/pyenvs/pipertts/voices/de_DE-thorsten-low.onnx", timeout: float = 120):
+        self.cmd = cmd
+        self.model = model
+        self.timeout = timeout
+
+    def synthesize(self, text: str) -> tuple:
+        with tempfile.TemporaryDirectory() as tmp:
+            text_file = os.path.join(tmp, "in.txt")
+            with open(text_file, "w", encoding="utf-8") as f:
+                f.write(text)
+            out = os.path.join(tmp, "out.wav")
+            result = subprocess.run(self.cmd.split() + ["-m", self.model, "-i", text_file, "-f", out],
+                                    capture_output=True, text=True, timeout=self.timeout)
+            if result.returncode != 0 or not os.path.exists(out):
+                raise RuntimeError(f"piper failed: {result.stderr.strip()[-200:]}")
+            return codec.load_wav_as_mono_pcm(out, SAMPLE_RATE), SAMPLE_RATE
+
+
+class FakeStt:
+    """Takes `seconds` and hears the same sentence every time."""
+    def __init__(self, seconds: float = 0.0, text: str = "Hallo, wie geht es dir?"):
+        self.seconds = seconds
+        self.text = text
+
+    def transcribe(self, pcm: np.ndarray, rate: int) -> str:
+        time.sleep(self.seconds)
+        return self.text if len(pcm) else ""
+
+
+class FakeLlm:
+    """Takes `seconds` and answers with what it was told."""
+    def __init__(self, seconds: float = 0.0):
+        self.seconds = seconds
+
+    def reply(self, messages: list) -> str:
+        time.sleep(self.seconds)
+        return "Du hast gesagt: " + messages[-1]["content"]
+
+
+class FakeTts:
+    """Takes `seconds` and returns a tone as long as the text would take to say."""
+    SECONDS_PER_CHAR = 0.065
+
+    def __init__(self, seconds: float = 0.0):
+        self.seconds = seconds
+
+    def synthesize(self, text: str) -> tuple:
+        time.sleep(self.seconds)
+        t = np.arange(int((0.3 + self.SECONDS_PER_CHAR * len(text)) * SAMPLE_RATE)) / SAMPLE_RATE
+        return (np.sin(2 * np.pi * 220 * t) * 8000).astype(np.int16), SAMPLE_RATE
+
+
+class Conversations:
+    """Last HISTORY messages per sensor; cleared after a pause or on "stop"."""
+    def __init__(self, system_prompt: str = SYSTEM_PROMPT):
+        self.system_prompt = system_prompt
+        self.lock = threading.Lock()
+        self.state = {}  # sensor -> {"messages", "last"}
+
+    def messages(self, sensor: str, text: str) -> list:
+        with self.lock:
+            entry = self.state.get(sensor)
+            if entry is None or time.time() - entry["last"] > CONVERSATION_TIMEOUT \
+                    or text.strip().lower().startswith("stop"):
+                entry = self.state[sensor] = {"messages": [], "last": time.time()}
+            history = list(entry["messages"])
+        return [{"role": "system", "content": self.system_prompt}] + history + [{"role": "user", "content": text}]
+
+    def add(self, sensor: str, text: str, answer: str):
+        with self.lock:
+            entry = self.state.setdefault(sensor, {"messages": [], "last": 0})
+            entry["messages"] = (entry["messages"] + [{"role": "user", "content": text},
+                                                      {"role": "assistant", "content": answer}])[-HISTORY:]
+            entry["last"] = time.time()
+
+
+class WorkerPool:
+    """
+    `workers` threads running the STT/LLM/TTS stages for queued jobs.  At
+    most `max_queue` jobs wait; submit() raises queue.Full beyond that, so
+    a flood of uploads is turned away instead of piling up.  done(job) is
+    called for every finished job, ready or failed.
+    """
+    def __init__(self, stt, llm, tts, done, workers: int = 2, max_queue: int = 16):
+        self.stt = stt
+        self.llm = llm
+        self.tts = tts
+        self.done = done
+        self.conversations = Conversations()
+        self.queue = queue.Queue(max_queue)
+        self.lock = threading.Lock()
+        self.jobs = {}      # name -> job dict
+        self.waiting = []   # names in queue order, for the queue position
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, name: str, sensor: str, pcm: np.ndarray, rate: int = SAMPLE_RATE) -> dict:
+        job = {"name": name, "sensor": sensor, "state": "queued", "queued": time.time(),
+               "started": None, "finished": None, "stage_times": {}}
+        with self.lock:
+            self.queue.put_nowait((job, pcm, rate))
+            self.jobs[name] = job
+            self.waiting.append(name)
+        return job
+
+    def status(self, name: str) -> dict:
+        """State of a job plus its place in the queue (0: being worked on)."""
+        with self.lock:
+            job = self.jobs.get(name)
+            if job is None:
+                return None
+            result = {k: job[k] for k in ("state", "queued", "started", "finished")}
+            result["position"] = self.waiting.index(name) + 1 if name in self.waiting else 0
+            if job["state"] in STAGES:
+                result["progress"] = STAGES.index(job["state"]) / len(STAGES)
+            if "error" in job:
+                result["error"] = job["error"]
+        return result
+
+    def expire(self, before: float):
+        """Forget the jobs that finished before `before` (time.time())."""
+        with self.lock:
+            for name in [n for n, job in self.jobs.items() if job["finished"] is not None and job["finished"] < before]:
+                del self.jobs[name]
+
+    def _set(self, job, **fields):
+        with self.lock:
+            job.update(fields)
+
+    def _stage(self, job, stage, fn, *args):
+        self._set(job, state=stage)
+        t0 = time.perf_counter()
+        result = fn(*args)
+        job["stage_times"][stage] = time.perf_counter() - t0
+        return result
+
+    def _work(self):
+        while True:
+            job, pcm, rate = self.queue.get()
+            with self.lock:
+                self.waiting.remove(job["name"])
+                job["started"] = time.time()
+            try:
+                text = self._stage(job, "stt", self.stt.transcribe, pcm, rate)
+                if not text:
+                    raise RuntimeError("transcription_failed")
+                messages = self.conversations.messages(job["sensor"], text)
+                answer = self._stage(job, "llm", self.llm.reply, messages)
+                if not answer:
+                    raise RuntimeError("llm_failed")
+                self.conversations.add(job["sensor"], text, answer)
+                audio, out_rate = self._stage(job, "tts", self.tts.synthesize, answer)
+                if out_rate != SAMPLE_RATE:
+                    from resample import resample, to_int16
+                    audio = to_int16(resample(audio.astype(np.float64), out_rate, SAMPLE_RATE))
+                self._set(job, state="ready", transcription=text, response=answer, finished=time.time())
+                self.done(job, audio)
+            except Exception as e:
+                self._set(job, state="failed", error=str(e)[:200], finished=time.time())
+                self.done(job, None)
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,1153 @@
+#!/usr/bin/env python3
+"""
+Reference sensor backend for testing ProtoEngine locally.
+
+Speaks the sensorUpload.php protocol (join, challenge, data) with the
+device keys held in memory, and also accepts the binary upload transport:
+a raw `application/octet-stream` body with the token, session, sensor id
+and format in headers.  Binary is offered during join when the client
+lists it in `transports`; clients that do not ask keep base64 in JSON.
+
+Request bodies may use chunked transfer encoding (ProtoEngine.upload_stream).
+Uploads are kept in memory and, with --outdir, written as <uuid>.<format>;
+the reply carries size and CRC-32 of what arrived.  sensorDownload.php's
+check/down serve replies set with SensorBackend.set_reply(), by default an
+echo of the upload in its own format.  Format "readings" (a JSON array,
+spool.py's batches of sensor readings) is collected in backend.readings
+per sensor and gets no reply.  The range command returns several
+chunks at once (count 0: up to the end), with transport "binary" as a raw
+body and the chunk layout in X-Sensor-* headers; server.send_rate
+throttles reply bodies to model a slow downlink.  A check with "wait" is
+held until the reply exists (long-poll), and backend.processing_delay
+stands in for the speech pipeline.
+
+Transfers can be resumed: "open" starts (or finds) an upload by sensor,
+size, CRC-32 and a client nonce and returns the offset committed so far; "part" appends
+a piece with its CRC-32 at that offset.  "down" and "range" replies carry
+the CRC-32 of each chunk (or of each "block" bytes), and "range" also
+starts at a byte "offset".  "down" with an "offset" returns "chunksize"
+bytes from there (up to the server's chunk size), so a client can change
+its chunk size from request to request (chunkTuner.py).
+
+Connections are kept alive (HTTP/1.1); server.connections counts the ones
+accepted, and server.idle_timeout closes idle ones, to test clients that
+reuse their connection.
+
+Usage:
+    python sensorServer.py [-p 9000] [-o uploads/]
+    python sensorServer.py --selftest
+"""
+import binascii
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from Crypto.Cipher import AES
+
+DEFAULT_DEVICES = {"1": "00112233445566778899aabbccddeeff"}
+# transports this server understands, preferred first
+TRANSPORTS = ("binary", "base64")
+# same limit as sensorUpload.php
+MAX_UPLOAD = 512 * 1024
+CHALLENGE_TTL = 60
+# lifetime of issued tokens, as createToken() in buildToken.php
+TOKEN_TTL = 600
+UPLOAD_PATHS = ("/sensorUpload.php", "/sensorRagUpload.php")
+DOWNLOAD_PATH = "/sensorDownload.php"
+# same chunk size as sensorDownload.php: the largest served; clients may
+# ask "down" for smaller ones (not below DOWNLOAD_CHUNK_MIN)
+DOWNLOAD_CHUNK = 4096 * 16
+DOWNLOAD_CHUNK_MIN = 512
+SEND_PIECE = 4096
+# longest a check with "wait" is held (sensorDownload.php: 20 s)
+LONGPOLL_MAX = 20
+# how long a resumable upload is kept, also once it is complete
+UPLOAD_TTL = 600
+# how long an upload and its reply are kept for check/down
+REPLY_TTL = 600
+
+# headers of the binary transport
+H_ID = "X-Sensor-Id"
+H_SESSION = "X-Sensor-Session"
+H_FORMAT = "X-Sensor-Format"
+# headers of a binary range reply
+H_CHUNKS = "X-Sensor-Chunks"
+H_CHUNKSIZE = "X-Sensor-Chunksize"
+H_SIZE = "X-Sensor-Size"
+H_START = "X-Sensor-Start"
+# resumable transfers: upload key, byte offset and CRC-32 (decimal; in a
+# range reply a comma separated list, one per block)
+H_UPLOAD = "X-Sensor-Upload"
+H_OFFSET = "X-Sensor-Offset"
+H_CRC = "X-Sensor-Crc32"
+
+
+def _b64url(data: bytes) -> str:
+    return binascii.b2a_base64(data, newline=False).decode().rstrip("=").replace("+", "-").replace("/", "_")
+
+
+class SensorBackend:
+    """Protocol state shared by all request handler threads."""
+    def __init__(self, devices: dict = None, outdir: str = None):
+        self.devices = dict(devices or DEFAULT_DEVICES)
+        self.outdir = outdir
+        self.challenges = {}   # (id, session) -> (challenge, iv, time)
+        self.tokens = {}       # token -> (sensor id, expiry)
+        self.token_ttl = TOKEN_TTL
+        self.uploads = {}      # uuid -> {"id", "format", "data", "transport", "time"}
+        self.replies = {}      # uuid -> {format: bytes}, what check/down serve
+        self.readings = {}     # sensor id -> readings uploaded as "readings"
+        self.resumable = {}    # upload key -> {"id", "format", "size", "crc32", "offset", "data", "result", "time"}
+        self.chunk_size = DOWNLOAD_CHUNK
+        self.processing_delay = 0.0  # seconds until the echo reply is ready
+        self.longpoll = True         # honour "wait" in check
+        self.lock = threading.Lock()
+        self.reply_set = threading.Condition(self.lock)
+
+    def join(self, msg: dict):
+        sid = str(msg.get("id"))
+        if sid not in self.devices:
+            return 401, {"status": "not authorized0"}
+        session = secrets.token_hex(8)
+        challenge, iv = secrets.token_hex(16), secrets.token_hex(16)
+        with self.lock:
+            self.challenges[(sid, session)] = (challenge, iv, time.time())
+        reply = {"session": session, "challenge": challenge, "iv": iv}
+        offered = msg.get("transports") or []
+        reply["transport"] = next((t for t in TRANSPORTS if t in offered), "base64")
+        return 200, reply
+
+    def challenge(self, msg: dict):
+        sid, session = str(msg.get("id")), msg.get("session")
+        with self.lock:
+            stored = self.challenges.pop((sid, session), None)
+        if stored is None or time.time() - stored[2] > CHALLENGE_TTL:
+            return 401, {"status": "not authorized2"}
+        challenge, iv, _ = stored
+        crypt = AES.new(bytes.fromhex(self.devices[sid]), AES.MODE_CBC, bytes.fromhex(iv))
+        expected = crypt.encrypt(bytes.fromhex(challenge)).hex()
+        if not secrets.compare_digest(expected, str(msg.get("challenge", ""))):
+            return 401, {"status": "not authorized4"}
+        return 200, {"token": self.issue_token(sid)}
+
+    def issue_token(self, sid: str) -> str:
+        # shaped like the PHP backend's JWT so clients read exp the same
+        # way; only its presence in self.tokens makes it valid here
+        expires = int(time.time() + self.token_ttl)
+        claims = json.dumps({"sensor": sid, "exp": expires}).encode()
+        token = ".".join((_b64url(b'{"alg":"none"}'), _b64url(claims), secrets.token_hex(16)))
+        with self.lock:
+            self.tokens[token] = (sid, expires)
+        return token
+
+    def authorized(self, sid, token) -> bool:
+        with self.lock:
+            entry = self.tokens.get(token) if token is not None else None
+        return entry is not None and entry[0] == str(sid) and time.time() < entry[1]
+
+    def store(self, sid, fmt: str, data: bytes, transport: str):
+        if len(data) > MAX_UPLOAD:
+            return 401, {"status": "not authorized7"}
+        name = f"Sensor_{sid}_{uuid.uuid4().hex}"
+        if fmt == "readings":
+            # spooled sensor readings (a JSON array), nothing to reply to
+            try:
+                readings = json.loads(data)
+            except ValueError:
+                readings = None
+            if not isinstance(readings, list):
+                return 400, {"status": "data invalid"}
+            with self.lock:
+                self.readings.setdefault(str(sid), []).extend(readings)
+            return 200, {"uuid": name, "status": "stored"}
+        with self.lock:
+            self._expire(time.time())
+            self.uploads[name] = {"id": str(sid), "format": fmt, "data": data, "transport": transport,
+                                  "time": time.time()}
+        # no speech pipeline here: the reply echoes the upload
+        if self.processing_delay > 0:
+            threading.Timer(self.processing_delay, self.set_reply, (name, fmt, data)).start()
+        else:
+            self.set_reply(name, fmt, data)
+        if self.outdir:
+            os.makedirs(self.outdir, exist_ok=True)
+            with open(os.path.join(self.outdir, f"{name}.{fmt}"), "wb") as f:
+                f.write(data)
+        return 200, {"uuid": name, "status": "processing", "size": len(data), "crc32": zlib.crc32(data)}
+
+    def data_json(self, msg: dict):
+        if not self.authorized(msg.get("id"), msg.get("token")):
+            return 401, {"status": "not authorized5"}
+        try:
+            data = binascii.a2b_base64(msg.get("data", ""))
+        except (binascii.Error, TypeError):
+            return 400, {"status": "data invalid"}
+        return self.store(msg["id"], msg.get("format", "adpcm"), data, "base64")
+
+    def data_binary(self, headers, body: bytes):
+        sid = headers.get(H_ID)
+        auth = headers.get("Authorization", "")
+        token = auth[7:] if auth.startswith("Bearer ") else None
+        if H_UPLOAD in headers:
+            return self.part(sid, token, headers[H_UPLOAD], headers.get(H_OFFSET), headers.get(H_CRC), body, "binary")
+        if not self.authorized(sid, token):
+            return 401, {"status": "not authorized5"}
+        return self.store(sid, headers.get(H_FORMAT, "adpcm"), body, "binary")
+
+    def open_upload(self, msg: dict):
+        """
+        Start or look up a resumable upload.  Uploads are matched by
+        sensor, format, size, CRC-32 and the client's nonce, so a device
+        that lost the connection (or restarted) gets the offset committed
+        so far, and for a complete upload its result; the same data with a
+        new nonce is a new upload.  Uploads are forgotten UPLOAD_TTL after
+        they were last touched.
+        """
+        if not self.authorized(msg.get("id"), msg.get("token")):
+            return 401, {"status": "not authorized5"}
+        try:
+            size, crc = int(msg["size"]), int(msg["crc32"])
+        except (KeyError, TypeError, ValueError):
+            return 400, {"status": "invalid upload"}
+        nonce = str(msg.get("nonce", ""))
+        if not nonce.isalnum() or len(nonce) > 32:
+            return 400, {"status": "invalid upload"}
+        if size <= 0 or size > MAX_UPLOAD:
+            return 401, {"status": "not authorized7"}
+        sid, fmt = str(msg["id"]), msg.get("format", "adpcm")
+        key = f"{sid}-{fmt}-{size}-{crc:08x}-{nonce}"
+        now = time.time()
+        with self.lock:
+            for k in [k for k, up in self.resumable.items() if now - up["time"] > UPLOAD_TTL]:
+                del self.resumable[k]
+            up = self.resumable.setdefault(key, {"id": sid, "format": fmt, "size": size, "crc32": crc, "offset": 0,
+                                                 "data": bytearray(), "result": None, "time": now})
+            return 200, self._upload_state(key, up)
+
+    def _upload_state(self, key: str, up: dict) -> dict:
+        reply = {"upload": key, "offset": up["offset"], "size": up["size"]}
+        if up["result"] is not None:
+            reply.update(up["result"])
+        return reply
+
+    def part(self, sid, token, key, offset, crc, data: bytes, transport: str):
+        """
+        Append a part at `offset` if that is where the upload stands and
+        its CRC-32 matches; 409 with the committed offset otherwise.  The
+        last part stores the whole upload and returns store()'s result.
+        """
+        if not self.authorized(sid, token):
+            return 401, {"status": "not authorized5"}
+        try:
+            offset, crc = int(offset), int(crc)
+        except (TypeError, ValueError):
+            return 400, {"status": "invalid part"}
+        with self.lock:
+            up = self.resumable.get(str(key))
+            if up is None or up["id"] != str(sid):
+                return 404, {"status": "upload not found"}
+            if up["result"] is not None:
+                return 200, self._upload_state(key, up)
+            if offset != up["offset"]:
+                return 409, {"status": "offset mismatch", "offset": up["offset"]}
+            if zlib.crc32(data) != crc or offset + len(data) > up["size"]:
+                return 409, {"status": "crc mismatch", "offset": up["offset"]}
+            up["data"] += data
+            up["offset"] += len(data)
+            up["time"] = time.time()
+            if up["offset"] < up["size"]:
+                return 200, {"upload": key, "offset": up["offset"], "size": up["size"]}
+            whole = bytes(up["data"])
+            up["data"] = bytearray()
+            if zlib.crc32(whole) != up["crc32"]:
+                up["offset"] = 0
+                return 409, {"status": "crc mismatch", "offset": 0}
+        code, result = self.store(sid, up["format"], whole, transport)
+        if code != 200:
+            return code, result
+        with self.lock:
+            up["result"] = result
+            return 200, self._upload_state(key, up)
+
+    def part_json(self, msg: dict):
+        try:
+            data = binascii.a2b_base64(msg.get("data", ""))
+        except (binascii.Error, TypeError):
+            return 400, {"status": "data invalid"}
+        return self.part(msg.get("id"), msg.get("token"), msg.get("upload"), msg.get("offset"), msg.get("crc32"),
+                         data, "base64")
+
+    def _expire(self, now: float):
+        """Forget uploads older than REPLY_TTL and their replies (called with self.lock held)."""
+        for name in [n for n, up in self.uploads.items() if now - up["time"] > REPLY_TTL]:
+            del self.uploads[name]
+            self.replies.pop(name, None)
+
+    def set_reply(self, name: str, fmt: str, data: bytes):
+        with self.lock:
+            self.replies.setdefault(name, {})[fmt] = data
+            self.reply_set.notify_all()
+
+    def _reply_data(self, msg: dict):
+        with self.lock:
+            return self.replies.get(str(msg.get("name")), {}).get(msg.get("format", "adpcm"))
+
+    def check(self, msg: dict):
+        if not self.authorized(msg.get("id"), msg.get("token")):
+            return 401, {"status": "not authorized"}
+        name = str(msg.get("name", ""))
+        if name not in self.uploads:
+            return 404, {"status": "file not found " + name}
+        data = self._reply_data(msg)
+        try:
+            wait = float(msg.get("wait", 0) or 0) if self.longpoll else 0
+        except (TypeError, ValueError):
+            wait = 0
+        if data is None and wait > 0:
+            # long-poll: hold the request until the reply is set
+            deadline = time.monotonic() + min(wait, LONGPOLL_MAX)
+            with self.reply_set:
+                while data is None and self._pending(name) and time.monotonic() < deadline:
+                    self.reply_set.wait(deadline - time.monotonic())
+                    data = self.replies.get(name, {}).get(msg.get("format", "adpcm"))
+        if data is None:
+            return self._not_ready(name)
+        return 200, {"status": "ready", "size": len(data), "chunks": -(-len(data) // self.chunk_size),
+                     "chunksize": self.chunk_size}
+
+    def _pending(self, name: str) -> bool:
+        """Whether a reply for `name` may still come (called with self.lock held)."""
+        return True
+
+    def _not_ready(self, name: str):
+        reply = {"status": "file not ready. retry later"}
+        if self.longpoll:
+            reply["longpoll"] = True
+        return 408, reply
+
+    def down(self, msg: dict):
+        if not self.authorized(msg.get("id"), msg.get("token")):
+            return 401, {"status": "not authorized"}
+        data = self._reply_data(msg)
+        if data is None:
+            return 404, {"status": "file not found"}
+        chunks = -(-len(data) // self.chunk_size)
+        if msg.get("offset") is not None:
+            return self._down_bytes(msg, data, chunks)
+        chunk = int(msg.get("chunk", -1))
+        if chunk < 0 or chunk >= chunks:
+            return 200, {"length": 0, "chunks": chunks}
+        part = data[chunk * self.chunk_size:(chunk + 1) * self.chunk_size]
+        return 200, {"data": binascii.b2a_base64(part, newline=False).decode(), "format": msg.get("format", "adpcm"),
+                     "chunk": chunk, "length": len(part), "chunks": chunks, "crc32": zlib.crc32(part)}
+
+    def _down_bytes(self, msg: dict, data: bytes, chunks: int):
+        """"chunksize" bytes (within the server's limits) from byte "offset" on."""
+        try:
+            offset = int(msg["offset"])
+            size = int(msg.get("chunksize", 0) or 0) or self.chunk_size
+        except (TypeError, ValueError):
+            return 400, {"status": "invalid range"}
+        if offset < 0:
+            return 400, {"status": "invalid range"}
+        size = max(DOWNLOAD_CHUNK_MIN, min(size, self.chunk_size))
+        part = data[offset:offset + size]
+        return 200, {"data": binascii.b2a_base64(part, newline=False).decode(), "format": msg.get("format", "adpcm"),
+                     "offset": min(offset, len(data)), "length": len(part), "chunksize": size, "size": len(data),
+                     "chunks": chunks, "crc32": zlib.crc32(part)}
+
+    def range(self, msg: dict):
+        """
+        Chunks start .. start+count-1 (count 0: up to the end) in one reply,
+        or from byte "offset" on to resume a download that broke off.  The
+        CRC-32 of every "block" bytes (default: a chunk) of the reply is
+        sent along.  Returns (status, obj) like the other commands, or with
+        transport "binary" (status, bytes, headers) for a raw body.
+        """
+        if not self.authorized(msg.get("id"), msg.get("token")):
+            return 401, {"status": "not authorized"}
+        data = self._reply_data(msg)
+        if data is None:
+            return 404, {"status": "file not found"}
+        chunks = -(-len(data) // self.chunk_size)
+        try:
+            start, count = int(msg.get("start", 0)), int(msg.get("count", 0))
+            offset = None if msg.get("offset") is None else int(msg["offset"])
+            block = int(msg.get("block", 0) or 0) or self.chunk_size
+        except (TypeError, ValueError):
+            return 400, {"status": "invalid range"}
+        if offset is not None:
+            if offset < 0 or block < 0:
+                return 400, {"status": "invalid range"}
+            offset = min(offset, len(data))
+            start = offset // self.chunk_size
+            end = len(data) if count <= 0 else min(len(data), offset + count * self.chunk_size)
+        elif start < 0 or start >= chunks:
+            offset = end = len(data)
+        else:
+            offset = start * self.chunk_size
+            end = len(data) if count <= 0 else min(len(data), (start + count) * self.chunk_size)
+        part = data[offset:end]
+        crcs = [zlib.crc32(part[i:i + block]) for i in range(0, len(part), block)]
+        if msg.get("transport") == "binary":
+            return 200, part, {H_CHUNKS: chunks, H_CHUNKSIZE: self.chunk_size, H_SIZE: len(data), H_START: start,
+                               H_OFFSET: offset, H_CRC: ",".join(str(c) for c in crcs)}
+        return 200, {"data": binascii.b2a_base64(part, newline=False).decode(), "format": msg.get("format", "adpcm"),
+                     "start": start, "count": -(-len(part) // self.chunk_size), "length": len(part),
+                     "chunks": chunks, "chunksize": self.chunk_size, "size": len(data), "offset": offset,
+                     "block": block, "crc32": crcs}
+
+
+class SensorHandler(BaseHTTPRequestHandler):
+    backend = None  # set by make_server()
+    protocol_version = "HTTP/1.1"
+
+    # headers and body go out in separate writes; without this every reply
+    # on a kept-alive connection waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        with self.server.count_lock:
+            self.server.connections += 1
+        super().setup()
+
+    def handle_one_request(self):
+        # idle kept-alive connections are closed after server.idle_timeout
+        self.connection.settimeout(self.server.idle_timeout)
+        try:
+            super().handle_one_request()
+        except ConnectionError:
+            # clients drop the connection to leave a reply half read
+            # (iter_download() stopped early), or after one that failed its CRC
+            self.close_connection = True
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _reply(self, status: int, obj, headers: dict = None):
+        if headers is None:
+            body, ctype = json.dumps(obj).encode(), "application/json"
+        else:
+            body, ctype = obj, "application/octet-stream"
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, str(v))
+        self.end_headers()
+        self._send_body(body)
+
+    def _send_body(self, body: bytes):
+        rate = self.server.send_rate
+        if not rate:
+            self.wfile.write(body)
+            return
+        # a slow downlink: SEND_PIECE bytes at a time
+        for pos in range(0, len(body), SEND_PIECE):
+            self.wfile.write(body[pos:pos + SEND_PIECE])
+            time.sleep(min(SEND_PIECE, len(body) - pos) / rate)
+
+    def _read_body(self) -> bytes:
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            return self._read_chunked()
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_UPLOAD * 2:
+            raise ValueError("body too large")
+        return self.rfile.read(length)
+
+    def _read_chunked(self) -> bytes:
+        body = bytearray()
+        while True:
+            size = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                break
+            if len(body) + size > MAX_UPLOAD * 2:
+                raise ValueError("body too large")
+            body += self.rfile.read(size)
+            self.rfile.readline()  # CRLF after the chunk
+        # optional trailers up to the empty line
+        while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+            pass
+        return bytes(body)
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        if path not in UPLOAD_PATHS and path != DOWNLOAD_PATH:
+            return self._reply(404, {"error": "Unknown path"})
+        try:
+            body = self._read_body()
+        except ValueError:
+            self.close_connection = True
+            return self._reply(413, {"error": "Too large"})
+        if self.headers.get("Content-Type", "").startswith("application/octet-stream"):
+            return self._reply(*self.backend.data_binary(self.headers, body))
+        try:
+            msg = json.loads(body)
+        except ValueError:
+            return self._reply(400, {"error": "Invalid JSON"})
+        command = msg.get("command")
+        if path == DOWNLOAD_PATH:
+            if command == "check":
+                return self._reply(*self.backend.check(msg))
+            if command == "down":
+                return self._reply(*self.backend.down(msg))
+            if command == "range":
+                return self._reply(*self.backend.range(msg))
+            return self._reply(400, {"error": "Unknown command"})
+        if command == "join":
+            return self._reply(*self.backend.join(msg))
+        if command == "challenge":
+            return self._reply(*self.backend.challenge(msg))
+        if command == "data":
+            return self._reply(*self.backend.data_json(msg))
+        if command == "open":
+            return self._reply(*self.backend.open_upload(msg))
+        if command == "part":
+            return self._reply(*self.backend.part_json(msg))
+        return self._reply(400, {"error": "Unknown command"})
+
+
+class _Dropped(Exception):
+    """Raised by FaultyHandler to break the connection off."""
+
+
+class FaultyHandler(SensorHandler):
+    """
+    SensorHandler behind a bad link, to test resumed transfers.  Per 4 KiB
+    (SEND_PIECE) of a body, with the probabilities in server.faults: a
+    request is lost before the server acts on it ("request"), a binary
+    byte is flipped ("flip", request and reply bodies), a reply body breaks
+    off ("cut"); and per request, the reply is lost after the server acted
+    on it ("reply").  server.wire counts body bytes in and out.
+    """
+    def _roll(self, what: str, size: int = SEND_PIECE) -> bool:
+        p = self.server.faults.get(what, 0)
+        return p > 0 and self.server.fault_rng.random() < 1 - (1 - p) ** max(1, -(-size // SEND_PIECE))
+
+    def _flip(self, body: bytes) -> bytes:
+        body = bytearray(body)
+        body[self.server.fault_rng.randrange(len(body))] ^= 0x40
+        return bytes(body)
+
+    def _read_body(self) -> bytes:
+        body = super()._read_body()
+        self.server.wire[0] += len(body)
+        if self._roll("request", len(body)):
+            raise _Dropped()
+        if body and self.headers.get("Content-Type", "").startswith("application/octet-stream") \
+                and self._roll("flip", len(body)):
+            body = self._flip(body)
+        return body
+
+    def _reply(self, status: int, obj, headers: dict = None):
+        if self._roll("reply", 1):
+            raise _Dropped()
+        super()._reply(status, obj, headers)
+
+    def _send_body(self, body: bytes):
+        binary = not body.startswith(b"{")
+        for pos in range(0, len(body), SEND_PIECE):
+            piece = body[pos:pos + SEND_PIECE]
+            if self._roll("cut"):
+                piece = piece[:len(piece) // 2]
+                self.wfile.write(piece)
+                self.server.wire[1] += len(piece)
+                raise _Dropped()
+            if binary and self._roll("flip"):
+                piece = self._flip(piece)
+            self.wfile.write(piece)
+            self.server.wire[1] += len(piece)
+
+    def do_POST(self):
+        try:
+            super().do_POST()
+        except _Dropped:
+            self.close_connection = True
+
+
+def make_server(port: int = 9000, backend: SensorBackend = None, host: str = "127.0.0.1",
+                verbose: bool = False, handler_class: type = None) -> ThreadingHTTPServer:
+    """Create (but do not start) a server; port 0 picks a free port."""
+    handler = type("Handler", (handler_class or SensorHandler,), {"backend": backend or SensorBackend()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.verbose = verbose
+    server.backend = handler.backend
+    server.idle_timeout = None
+    server.send_rate = None  # bytes/s of reply bodies, None: unthrottled
+    # accepted connections, to see how often clients reconnect
+    server.connections = 0
+    server.count_lock = threading.Lock()
+    # FaultyHandler: probabilities, their random source, body bytes [in, out]
+    server.faults = {}
+    server.fault_rng = random.Random(1)
+    server.wire = [0, 0]
+    return server
+
+
+def start_in_thread(server: ThreadingHTTPServer) -> str:
+    """Serve in a daemon thread, returns the base URL."""
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def _serve(port: int, devices: dict = None, processing_delay: float = 0.0):
+    server = make_server(port, SensorBackend(devices))
+    server.backend.processing_delay = processing_delay
+    server.serve_forever()
+
+
+def start_in_process(port: int = 0, devices: dict = None, processing_delay: float = 0.0) -> tuple:
+    """
+    Serve from a child process, returns (process, base URL).  Keeps server
+    allocations out of tracemalloc measurements taken in the client, and
+    the server off the client's GIL under load.
+    """
+    import multiprocessing
+    import socket
+
+    if port == 0:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+    proc = multiprocessing.Process(target=_serve, args=(port, devices, processing_delay), daemon=True)
+    proc.start()
+    deadline = time.time() + 5
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            break
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.02)
+    return proc, f"http://127.0.0.1:{port}"
+
+
+def _engine(url: str, transport: str, session=None, **attrs):
+    """Connected ProtoEngine; `attrs` (keepalive, token_cache, ...) are set before joining."""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "sensor", "protocoll"))
+    from protoEngine import ProtoEngine
+
+    pt = ProtoEngine("test", url, 1, DEFAULT_DEVICES["1"])
+    pt.transports = (transport,)
+    if session is not None:
+        pt.http = session()
+    for name, value in attrs.items():
+        setattr(pt, name, value)
+    pt.connect()
+    pt.join()
+    return pt
+
+
+def selftest_transports(url: str) -> bool:
+    """Upload over both transports and compare what arrived."""
+    payload = os.urandom(100 * 1024)
+    ok = True
+    for transport in TRANSPORTS:
+        pt = _engine(url, transport)
+        resp = pt.upload(payload, format="adpcm")
+        match = resp.get("size") == len(payload) and resp.get("crc32") == zlib.crc32(payload)
+        ok &= match
+        print(f"{transport:7s} negotiated {pt.transport:7s} "
+              f"{pt.last_upload_bytes:7d} bytes on wire for {len(payload)} bytes: {'OK' if match else 'MISMATCH'}")
+        pt.disconnect()
+    return ok
+
+
+def selftest_stream(url: str, chunk: int = 4096) -> bool:
+    """
+    Record buffer -> ADPCM -> upload, once encoding the whole buffer and
+    calling upload(), once encoding 4 KiB at a time into upload_stream().
+    Reports the client's peak allocation beyond the record buffer itself.
+    """
+    import tracemalloc
+
+    import numpy as np
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "adpcm"))
+    import codec
+
+    # 100 KB record buffer as in chatBotLoop.py
+    t = np.arange(50000) / 8000
+    recbuf = bytearray((np.sin(2 * np.pi * 440 * t) * 8000).astype("<i2").tobytes())
+    expected = codec.adpcm_encode(np.frombuffer(recbuf, dtype="<i2")).tobytes()
+
+    def whole(pt):
+        encoded = codec.adpcm_encode(np.frombuffer(recbuf, dtype="<i2"))
+        return pt.upload(encoded.tobytes(), format="adpcm")
+
+    def streamed(pt):
+        def chunks():
+            enc = codec.AdpcmEncoder()
+            mv = memoryview(recbuf)
+            for pos in range(0, len(recbuf), chunk):
+                yield enc.feed(mv[pos:pos + chunk])
+            yield enc.flush()
+        return pt.upload_stream(chunks(), format="adpcm")
+
+    ok = True
+    for transport in TRANSPORTS:
+        for name, fn in (("upload", whole), ("upload_stream", streamed)):
+            pt = _engine(url, transport)
+            fn(pt)  # warm up connection pools and imports
+            tracemalloc.start()
+            resp = fn(pt)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            match = resp.get("size") == len(expected) and resp.get("crc32") == zlib.crc32(expected)
+            ok &= match
+            print(f"{transport:7s} {name:14s} peak {peak / 1024:7.1f} KiB for {len(recbuf) // 1024} KiB PCM "
+                  f"({len(expected)} bytes ADPCM, {pt.last_upload_bytes} on wire): {'OK' if match else 'MISMATCH'}")
+            pt.disconnect()
+    return ok
+
+
+def selftest_keepalive(reply_chunks: int = 40) -> bool:
+    """
+    One conversation turn (join, upload, check, download the reply in
+    reply_chunks chunks) per HTTP client, counting the connections the
+    server accepted; then a request after the server dropped the idle
+    connection, which the client has to survive by reconnecting.
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "sensor", "protocoll"))
+    from keepAlive import KeepAliveSession
+
+    server = make_server(0)
+    server.backend.chunk_size = 8192
+    url = start_in_thread(server)
+    upload = os.urandom(25000)
+    reply = os.urandom(reply_chunks * server.backend.chunk_size)
+
+    clients = (("requests.post", False, None), ("requests.Session", True, None),
+               ("KeepAliveSession", True, KeepAliveSession))
+    ok = True
+    for label, keepalive, session in clients:
+        server.idle_timeout = None
+        server.connections = 0
+        pt = _engine(url, "binary", keepalive=keepalive, session=session)
+        name = pt.upload(upload, format="adpcm")["uuid"]
+        server.backend.set_reply(name, "wav", reply)
+        info = pt.check(name, format="wav")
+        got = b"".join(binascii.a2b_base64(pt.download(name, c, format="wav")["data"])
+                       for c in range(info["chunks"]))
+        turn = server.connections
+        # server closes idle connections; the next request must still work
+        server.idle_timeout = 0.2
+        pt.check(name, format="wav")
+        time.sleep(0.5)
+        after = pt.check(name, format="wav")
+        match = got == reply and after.get("status") == "ready"
+        ok &= match
+        requests_made = sum(v["count"] for v in pt.stats()["requests"].values())
+        total_ms = sum(v["total_ms"] for v in pt.stats()["requests"].values())
+        print(f"{label:16s} {requests_made:3d} requests, {turn:3d} connections for the turn, "
+              f"{server.connections - turn} after idle drop, {total_ms:5d} ms: {'OK' if match else 'FAILED'}")
+        pt.disconnect()
+    server.shutdown()
+    return ok
+
+
+def selftest_download(chunks: int = 8, play_rate: int = 64 * 1024, send_rate: int = 128 * 1024) -> bool:
+    """
+    Ranged and streamed downloads against check/down, per transport and
+    HTTP client.  Each chunk is then "played" for len / play_rate seconds
+    while the server sends at send_rate, once fetching chunk by chunk
+    between plays (download()) and once with iter_download(), where the
+    next chunk arrives during the play.
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "sensor", "protocoll"))
+    from keepAlive import KeepAliveSession
+
+    server = make_server(0)
+    server.backend.chunk_size = 8192
+    url = start_in_thread(server)
+    reply = os.urandom(chunks * server.backend.chunk_size - 1000)
+    size = server.backend.chunk_size
+
+    ok = True
+    for transport in TRANSPORTS:
+        for label, session in (("requests.Session", None), ("KeepAliveSession", KeepAliveSession)):
+            server.send_rate = None
+            pt = _engine(url, transport, session=session)
+            name = pt.upload(b"\0" * 1000, format="adpcm")["uuid"]
+            server.backend.set_reply(name, "wav", reply)
+            part = pt.download_range(name, 2, 3, format="wav")
+            whole = pt.download_range(name, format="wav")
+            streamed = b"".join(bytes(b) for b in pt.iter_download(name, format="wav"))
+            match = (part["data"] == reply[2 * size:5 * size] and whole["data"] == reply
+                     and streamed == reply and whole["chunks"] == chunks)
+
+            server.send_rate = send_rate
+            t0 = time.perf_counter()
+            for c in range(chunks):
+                data = binascii.a2b_base64(pt.download(name, c, format="wav")["data"])
+                time.sleep(len(data) / play_rate)
+            serial = time.perf_counter() - t0
+            before = pt.stats()["requests"].get("range", {}).get("count", 0)
+            t0 = time.perf_counter()
+            for data in pt.iter_download(name, format="wav"):
+                time.sleep(len(data) / play_rate)
+            overlapped = time.perf_counter() - t0
+            requests_used = pt.stats()["requests"].get("range", {}).get("count", 0) - before
+            ok &= match
+            print(f"{transport:7s} {label:16s} range/stream {'OK' if match else 'MISMATCH'}; "
+                  f"{chunks} chunks played: download() {serial:5.2f} s, iter_download() {overlapped:5.2f} s "
+                  f"({requests_used} range requests)")
+            pt.disconnect()
+    server.shutdown()
+    return ok
+
+
+def selftest_wait(delays=(0.3, 1.2, 2.1)) -> bool:
+    """
+    Time to first audio byte (upload start to the first chunk of the reply
+    received) with the server needing `delays` seconds per reply: polling
+    check() every second as chatBotLoop.py did, wait_ready() against a
+    server without long-poll (backoff), and wait_ready() with long-poll.
+    """
+    server = make_server(0)
+    url = start_in_thread(server)
+    upload = os.urandom(16000)
+
+    def poll_1s(pt, name):
+        while pt.check(name, format="wav").get("status") != "ready":
+            time.sleep(1)
+
+    def wait_ready(pt, name):
+        return pt.wait_ready(name, timeout=10, format="wav")
+
+    ok = True
+    for label, longpoll, wait in (("poll 1 s", True, poll_1s), ("backoff", False, wait_ready),
+                                  ("long-poll", True, wait_ready)):
+        server.backend.longpoll = longpoll
+        pt = _engine(url, "binary")
+        ttfb = []
+        for delay in delays:
+            server.backend.processing_delay = delay
+            t0 = time.perf_counter()
+            name = pt.upload(upload, format="wav")["uuid"]
+            wait(pt, name)
+            first = next(pt.iter_download(name, format="wav"))
+            ttfb.append(time.perf_counter() - t0 - delay)
+            ok &= bytes(first) == upload[:len(first)]
+        checks = pt.stats()["requests"]["check"]["count"]
+        print(f"{label:10s} time to first audio byte beyond processing: "
+              f"{' '.join(f'{t * 1000:5.0f}' for t in ttfb)} ms, {checks / len(delays):4.1f} checks per turn")
+        pt.disconnect()
+    server.backend.processing_delay = 0
+    server.shutdown()
+    return ok
+
+
+def selftest_tokens(ttl: float = 2.0) -> bool:
+    """
+    Token caching against a server issuing `ttl` second tokens: restarts
+    (new ProtoEngine, same cache file) reuse the stored token, one close
+    to expiry is renewed before the upload, and one the server revoked
+    is replaced after the 401.  Compared with the same steps uncached.
+    """
+    import tempfile
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "sensor", "protocoll"))
+    from tokenCache import FileTokenCache
+
+    server = make_server(0)
+    server.backend.token_ttl = ttl
+    url = start_in_thread(server)
+    payload = os.urandom(1000)
+
+    def steps(cache):
+        handshakes, avoided = 0, 0
+
+        def boot():
+            return _engine(url, "binary", token_cache=cache, token_margin=ttl / 4)
+
+        def done(pt):
+            nonlocal handshakes, avoided
+            handshakes += pt.handshakes
+            avoided += pt.handshakes_avoided
+            pt.disconnect()
+
+        ok = True
+        for _ in range(3):  # cold starts within the token lifetime
+            pt = boot()
+            ok &= pt.upload(payload)["size"] == len(payload)
+            done(pt)
+        pt = boot()
+        time.sleep(ttl * 0.8)  # inside the renewal margin
+        ok &= pt.upload(payload)["size"] == len(payload)
+        with server.backend.lock:
+            server.backend.tokens.clear()  # server forgets every token
+        ok &= pt.upload(payload)["size"] == len(payload)
+        done(pt)
+        return ok, handshakes, avoided
+
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, cache in (("no cache", None), ("file cache", FileTokenCache(os.path.join(tmp, "token.json")))):
+            match, handshakes, avoided = steps(cache)
+            ok &= match
+            print(f"{label:10s} 4 starts, 5 uploads, {ttl:.0f} s tokens: {handshakes} handshakes, "
+                  f"{avoided} avoided: {'OK' if match else 'FAILED'}")
+    server.shutdown()
+    return ok
+
+
+def selftest_async(capture_chunks: int = 8, delay: float = 0.5, rate: int = 16000,
+                   send_rate: int = 64 * 1024, tick_ms: int = 10) -> bool:
+    """
+    One chatbot turn inside an asyncio loop with a display task that wants
+    to run every tick_ms: upload during a real-time capture of 4 KiB
+    chunks, wait_ready() with the server taking `delay` s, then play the
+    reply (len / rate s per 8 KiB chunk) while the next chunk downloads.
+    ProtoEngine's calls block the loop, AsyncProtoEngine's let the
+    display and playback tasks run; compared are the turn time and the
+    longest gap between display ticks.
+    """
+    import asyncio
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "sensor", "protocoll"))
+    from asyncProtoEngine import AsyncProtoEngine
+
+    server = make_server(0)
+    server.backend.chunk_size = 8192
+    server.backend.processing_delay = delay
+    server.send_rate = send_rate
+    url = start_in_thread(server)
+    capture = os.urandom(capture_chunks * 4096)
+    piece = len(capture) // capture_chunks
+
+    def chunks_blocking():
+        for pos in range(0, len(capture), piece):
+            time.sleep(piece / rate)
+            yield capture[pos:pos + piece]
+
+    class ChunksAsync:
+        def __init__(self):
+            self.pos = 0
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            if self.pos >= len(capture):
+                raise StopAsyncIteration
+            await asyncio.sleep(piece / rate)
+            self.pos += piece
+            return capture[self.pos - piece:self.pos]
+
+    async def play(data, playing_until):
+        # wait for the previous buffer to finish, as chatBotLoop.py polls
+        # getPlayStatus(), then "start" this one
+        while time.perf_counter() < playing_until:
+            await asyncio.sleep(0.001)
+        return time.perf_counter() + len(data) / rate
+
+    async def turn_sync(pt):
+        name = pt.upload_stream(chunks_blocking(), format="wav")["uuid"]
+        pt.wait_ready(name, timeout=10, format="wav")
+        received, until = b"", 0
+        for data in pt.iter_download(name, format="wav"):
+            received += bytes(data)
+            until = await play(data, until)
+        await play(b"", until)
+        return received
+
+    async def turn_async(pt):
+        name = (await pt.upload_stream(ChunksAsync(), format="wav"))["uuid"]
+        await pt.wait_ready(name, timeout=10, format="wav")
+        received, until = b"", 0
+        async for data in pt.iter_download(name, format="wav"):
+            received += bytes(data)
+            until = await play(data, until)
+        await play(b"", until)
+        return received
+
+    async def run(turn, pt):
+        ticks = []
+        done = False
+
+        async def display():
+            while not done:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(tick_ms / 1000)
+
+        task = asyncio.create_task(display())
+        await asyncio.sleep(0)
+        t0 = time.perf_counter()
+        received = await turn(pt)
+        elapsed = time.perf_counter() - t0
+        done = True
+        await task
+        gap = max(b - a for a, b in zip(ticks, ticks[1:]))
+        return received == capture, elapsed, gap
+
+    async def main():
+        ok = True
+        pt = _engine(url, "binary")
+        apt = AsyncProtoEngine("test", url, 1, DEFAULT_DEVICES["1"])
+        apt.transports = ("binary",)
+        await apt.connect()
+        await apt.join()
+        for label, turn, engine in (("ProtoEngine", turn_sync, pt), ("AsyncProtoEngine", turn_async, apt)):
+            match, elapsed, gap = await run(turn, engine)
+            ok &= match
+            print(f"{label:16s} turn {elapsed:5.2f} s ({capture_chunks * piece / rate:.2f} s capture, {delay:.1f} s "
+                  f"processing, {len(capture) / rate:.2f} s play), longest display gap {gap * 1000:5.0f} ms: "
+                  f"{'OK' if match else 'MISMATCH'}")
+        pt.disconnect()
+        await apt.disconnect()
+        return ok
+
+    ok = asyncio.run(main())
+    server.shutdown()
+    return ok
+
+
+def selftest_resume(size: int = 100000, runs: int = 5, faults: dict = None) -> bool:
+    """
+    Resumed transfers on a link that loses requests and replies, breaks
+    reply bodies off and flips bytes (FaultyHandler): `runs` uploads with
+    upload_resumable() and downloads with iter_download() of `size` bytes
+    each must arrive intact.  With the binary transport the body bytes on
+    the wire are compared with retrying whole transfers (upload() and
+    download_range()), which also let flipped bytes through.  Parts and
+    buffers are PART_SIZE bytes, not tuned (chunkSim.py sweeps tuning).
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "sensor", "protocoll"))
+    import asyncio
+    import protoEngine
+    from protoEngine import NET_ERRORS, PART_SIZE
+
+    protoEngine.RESUME_BACKOFF = 0.01
+    faults = faults or {"request": 0.03, "reply": 0.03, "cut": 0.04, "flip": 0.02}
+    server = make_server(0, handler_class=FaultyHandler)
+    url = start_in_thread(server)
+    rng = random.Random(2)
+    total = runs * size
+
+    def faulty(transfer):
+        server.faults = faults
+        try:
+            return transfer()
+        finally:
+            server.faults = {}
+
+    def whole(send):
+        while True:
+            try:
+                return send()
+            except NET_ERRORS:
+                pass
+
+    def report(transport, what, wire, intact, note):
+        more = f" ({100 * (wire / total - 1):5.1f} % more)" if transport == "binary" else ""
+        print(f"{transport:6s} {what:24s} {runs} x {size} bytes, {wire:7d} on the wire{more}{note}: "
+              f"{'OK' if intact else 'FAILED'}")
+
+    ok = True
+    for transport in TRANSPORTS:
+        pt = _engine(url, transport)
+        blobs = [rng.randbytes(size) for _ in range(runs)]
+        names = []
+        server.wire[:] = [0, 0]
+        intact = True
+        for blob in blobs:
+            name = faulty(lambda: pt.upload_resumable(blob, part_size=PART_SIZE))["uuid"]
+            intact &= server.backend.uploads[name]["data"] == blob
+            names.append(name)
+        ok &= intact
+        report(transport, "upload_resumable", server.wire[0], intact, f", {pt.resent_bytes} resent")
+
+        # base64 replies come a chunk at a time, binary ones into small buffers as on the device
+        buffers = [bytearray(4096), bytearray(4096)] if transport == "binary" else None
+        pt.resent_bytes = 0
+        server.wire[:] = [0, 0]
+        intact = True
+        for name, blob in zip(names, blobs):
+            got = faulty(lambda: b"".join(bytes(b) for b in pt.iter_download(name, buffers=buffers)))
+            intact &= got == blob
+        ok &= intact
+        report(transport, "iter_download", server.wire[1], intact, f", {pt.resent_bytes} received again")
+
+        if transport == "binary":
+            resumed = server.wire[1]
+            server.wire[:] = [0, 0]
+            corrupted = 0
+            for blob in blobs:
+                name = faulty(lambda: whole(lambda: pt.upload(blob)))["uuid"]
+                corrupted += server.backend.uploads[name]["data"] != blob
+            report(transport, "upload, whole retries", server.wire[0], True, f", {corrupted} corrupted")
+            server.wire[:] = [0, 0]
+            corrupted = 0
+            for name, blob in zip(names, blobs):
+                corrupted += faulty(lambda: whole(lambda: pt.download_range(name)))["data"] != blob
+            report(transport, "download, whole retries", server.wire[1], True, f", {corrupted} corrupted")
+        pt.disconnect()
+
+    async def async_runs():
+        from asyncProtoEngine import AsyncProtoEngine
+
+        apt = AsyncProtoEngine("test", url, 1, DEFAULT_DEVICES["1"])
+        await apt.connect()
+        await apt.join()
+        intact = True
+        server.faults = faults
+        try:
+            for _ in range(runs):
+                blob = rng.randbytes(size)
+                name = (await apt.upload_resumable(blob, part_size=PART_SIZE))["uuid"]
+                got = bytearray()
+                async for buf in apt.iter_download(name, buffers=[bytearray(4096), bytearray(4096)]):
+                    got += buf
+                intact &= server.backend.uploads[name]["data"] == blob and got == blob
+        finally:
+            server.faults = {}
+        await apt.disconnect()
+        return intact, apt.resent_bytes
+
+    intact, resent = asyncio.run(async_runs())
+    ok &= intact
+    print(f"async  upload_resumable, iter_download {runs} x {size} bytes each way, {resent} resent: "
+          f"{'OK' if intact else 'FAILED'}")
+    server.shutdown()
+    return ok
+
+
+def selftest() -> bool:
+    proc, url = start_in_process()
+    try:
+        ok = selftest_transports(url)
+        ok &= selftest_stream(url)
+    finally:
+        proc.terminate()
+    ok &= selftest_keepalive()
+    ok &= selftest_download()
+    ok &= selftest_wait()
+    ok &= selftest_tokens()
+    ok &= selftest_async()
+    ok &= selftest_resume()
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Reference sensor backend")
+    parser.add_argument("-p", "--port", type=int, default=9000, help="Port to listen on")
+    parser.add_argument("-o", "--outdir", default=None, help="Write uploads to this directory")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to bind")
+    parser.add_argument("--selftest", action="store_true", help="Run ProtoEngine against a server in a child process (and in-thread ones) and exit")
+    args = parser.parse_args()
+
+    if args.selftest:
+        sys.exit(0 if selftest() else 1)
+    srv = make_server(args.port, SensorBackend(outdir=args.outdir), args.host, verbose=True)
+    print(f"Listening on http://{args.host}:{args.port}")
+    srv.serve_forever()
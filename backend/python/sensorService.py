@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Python sensor backend: the sensorUpload.php / sensorRagUpload.php /
+sensorDownload.php protocol with the speech pipeline in a worker pool.
+
+The commands are those of sensorServer.py (join, challenge, data with
+both transports, check with long-poll, down, range), but tokens are the
+PHP backend's HS256 JWTs (sensorJwt.py, key and claims from the [JWT]
+section of config.ini, devices from devices.json) and an upload is not
+echoed: it is queued for STT -> LLM -> TTS (sensorPipeline.py) and the
+data command answers at once with the uuid and the job's place in the
+queue.  check reports the job's progress while it runs
+
+    408 {"status": "file not ready. retry later", "longpoll": true,
+         "stage": "llm", "position": 0, "progress": 0.33}
+
+200 "ready" once the answer exists, and 200 {"status": "failed"} if a
+stage failed.  With more than --queue jobs waiting, uploads get 503.
+An upload, its answer and its job are forgotten REPLY_TTL (10 min) after
+the upload.
+
+The stages are configured from the [SENSOR] section (whisper_cmd/_mdl,
+chaturl/chatmodel/chatkey, piper_cmd/_mdl); with speech_socket set, STT
+and TTS go to the resident speechWorker.py daemon on that socket instead
+of starting whisper-cli and piper per turn.  --fake replaces all three
+with stubs taking --fake-times seconds, so the service runs offline.
+
+Usage:
+    python sensorService.py -c config.ini -d devices.json [-p 9000] [-w 2]
+    python sensorService.py --fake [-p 9000]
+    python sensorService.py --selftest
+"""
+import configparser
+import json
+import os
+import queue
+import sys
+import time
+import uuid
+import zlib
+
+import numpy as np
+
+import sensorServer
+from sensorServer import MAX_UPLOAD, REPLY_TTL, SensorBackend, make_server
+from sensorJwt import create_token, validate_token
+from sensorPipeline import (FakeLlm, FakeStt, FakeTts, OllamaChat, PiperCli, WhisperCli, WorkerPool,
+                            SAMPLE_RATE, wav_bytes)
+import codec
+
+CONFIG_FILE = "/var/www/files/platane/config.ini"
+DEVICES_FILE = "/var/www/files/platane/devices.json"
+
+
+def load_config(path: str) -> dict:
+    """config.ini as parse_ini_file() reads it: {section: {key: value}}, quotes removed."""
+    parser = configparser.ConfigParser(interpolation=None, inline_comment_prefixes=(";",))
+    with open(path, encoding="utf-8") as f:
+        parser.read_file(f)
+    return {name: {k: v.strip().strip('"') for k, v in parser[name].items()} for name in parser.sections()}
+
+
+def make_stages(config: dict, fake: bool = False, fake_times=(0.5, 1.0, 0.5)) -> tuple:
+    """(stt, llm, tts) from the [SENSOR] section, or stubs."""
+    if fake:
+        return FakeStt(fake_times[0]), FakeLlm(fake_times[1]), FakeTts(fake_times[2])
+    sensor = config.get("SENSOR", {})
+    llm = OllamaChat(sensor.get("chaturl", "http://localhost:11434/v1/chat/completions"),
+                     sensor.get("chatmodel", "granite4.1:3b"), sensor.get("chatkey"))
+    if sensor.get("speech_socket"):
+        from speechWorker import SpeechClient
+
+        speech = SpeechClient(sensor["speech_socket"], rate=SAMPLE_RATE)
+        return speech, llm, speech
+    stt = WhisperCli(sensor.get("whisper_cmd", "whisper-cli"),
+                     sensor.get("whisper_mdl", "/opt/llama/whisper/models/ggml-base-q8_0.bin"))
+    tts = PiperCli(sensor.get("piper_cmd", "/opt/pyenvs/pipertts/bin/piper"),
+                   sensor.get("piper_mdl", "/opt/pyenvs/pipertts/voices/de_DE-thorsten-low.onnx"))
+    return stt, llm, tts
+
+
+class ServiceBackend(SensorBackend):
+    """SensorBackend with JWT tokens and the speech pipeline behind check/down."""
+    def __init__(self, devices: dict, jwt: dict, stages: tuple, workers: int = 2, max_queue: int = 16,
+                 outdir: str = None):
+        super().__init__(devices, outdir)
+        self.jwt_key = jwt["key"].encode()
+        self.related_to = jwt["relatedTo"]
+        self.issued_by = jwt["issuedBy"]
+        self.pool = WorkerPool(*stages, self._finished, workers=workers, max_queue=max_queue)
+
+    def issue_token(self, sid: str) -> str:
+        return create_token(self.jwt_key, "Sensor_" + sid, self.related_to, self.issued_by, ttl=self.token_ttl)
+
+    def authorized(self, sid, token) -> bool:
+        return token is not None and validate_token(token, self.related_to, self.issued_by, f"Sensor_{sid}",
+                                                    self.jwt_key)
+
+    @staticmethod
+    def _pcm(fmt: str, data: bytes) -> np.ndarray:
+        if fmt == "adpcm":
+            return codec.adpcm_decode(np.frombuffer(data, dtype=np.uint8))
+        if data[:4] == b"RIFF":
+            return codec.convertFromWav(data, SAMPLE_RATE)
+        return np.frombuffer(data[:len(data) // 2 * 2], dtype="<i2")
+
+    def store(self, sid, fmt: str, data: bytes, transport: str):
+        if len(data) > MAX_UPLOAD:
+            return 401, {"status": "data too large"}
+        if fmt == "readings":
+            # spooled sensor readings: kept as SensorBackend keeps them, no speech turn
+            return super().store(sid, fmt, data, transport)
+        try:
+            pcm = self._pcm(fmt, data)
+        except (ValueError, EOFError):
+            return 400, {"status": "data invalid"}
+        name = f"Sensor_{sid}_{uuid.uuid4().hex}"
+        with self.lock:
+            self._expire(time.time())
+            # only what check needs: the audio is with the job, the reply in self.replies
+            self.uploads[name] = {"id": str(sid), "format": fmt, "size": len(data), "transport": transport,
+                                  "time": time.time()}
+        try:
+            self.pool.submit(name, str(sid), pcm)
+        except queue.Full:
+            with self.lock:
+                del self.uploads[name]
+            return 503, {"status": "busy. retry later"}
+        if self.outdir:
+            os.makedirs(self.outdir, exist_ok=True)
+            with open(os.path.join(self.outdir, f"{name}.wav"), "wb") as f:
+                f.write(wav_bytes(pcm))
+        return 200, {"uuid": name, "status": "processing", "size": len(data), "crc32": zlib.crc32(data),
+                     "position": self.pool.status(name)["position"]}
+
+    def _finished(self, job: dict, audio):
+        # worker thread: publish the answer in both download formats
+        name = job["name"]
+        if audio is not None:
+            replies = {"wav": wav_bytes(audio), "adpcm": codec.adpcm_encode(audio).tobytes()}
+            if self.outdir:
+                for fmt, data in replies.items():
+                    with open(os.path.join(self.outdir, f"{name}_chat.{fmt}"), "wb") as f:
+                        f.write(data)
+            with self.lock:
+                # not if the upload has expired meanwhile
+                if name in self.uploads:
+                    self.replies[name] = replies
+        with self.reply_set:
+            self.reply_set.notify_all()
+
+    def _expire(self, now: float):
+        super()._expire(now)
+        self.pool.expire(now - REPLY_TTL)
+
+    def _pending(self, name: str) -> bool:
+        status = self.pool.status(name)
+        return status is not None and status["state"] != "failed"
+
+    def _not_ready(self, name: str):
+        status = self.pool.status(name)
+        if status is not None and status["state"] == "failed":
+            return 200, {"status": "failed", "error": status.get("error", "")}
+        code, reply = super()._not_ready(name)
+        if status is not None:
+            reply["stage"] = status["state"]
+            reply["position"] = status["position"]
+            reply["progress"] = status.get("progress", 0.0)
+        return code, reply
+
+
+def selftest(stage_times=(0.3, 0.3, 0.2), workers: int = 2, max_queue: int = 3) -> bool:
+    """
+    Against fake stages taking stage_times seconds: the data command
+    returns before the pipeline has run, check shows the stages as they
+    pass, the answer downloads in both formats, tokens are JWTs that
+    checkToken.php's rules accept, a forged one is refused, and a burst
+    beyond workers + max_queue jobs gets 503 for the rest.  Spooled
+    readings are stored without a speech job, and uploads, answers and
+    jobs are forgotten after REPLY_TTL.
+    """
+    from sensorJwt import parse_token
+
+    jwt = {"key": os.urandom(16).hex(), "relatedTo": "PlatanenSensor", "issuedBy": "http://localhost"}
+    backend = ServiceBackend(dict(sensorServer.DEFAULT_DEVICES), jwt, make_stages({}, True, stage_times),
+                             workers, max_queue)
+    server = make_server(0, backend)
+    url = sensorServer.start_in_thread(server)
+    payload = codec.adpcm_encode((np.sin(np.arange(16000) / 5) * 8000).astype(np.int16)).tobytes()
+    ok = True
+
+    pt = sensorServer._engine(url, "binary")
+    claims = parse_token(pt.token)
+    match = (validate_token(pt.token, jwt["relatedTo"], jwt["issuedBy"], "Sensor_1", jwt["key"].encode())
+             and claims["jti"] == "Sensor_1" and claims["exp"] - claims["iat"] == 600)
+    forged = pt.token[:-4] + ("AAAA" if not pt.token.endswith("AAAA") else "BBBB")
+    match &= not backend.authorized("1", forged) and not backend.authorized("2", pt.token)
+    ok &= match
+    print(f"JWT     HS256, jti/sub/iss/exp as buildToken.php, forged and foreign refused: {'OK' if match else 'FAILED'}")
+
+    t0 = time.perf_counter()
+    name = pt.upload(payload, format="adpcm")["uuid"]
+    accepted = time.perf_counter() - t0
+    stages = []
+    while True:
+        r = pt.check(name, format="wav")
+        state = r.get("stage", r.get("status"))
+        if not stages or stages[-1] != state:
+            stages.append(state)
+        if r.get("status") in ("ready", "failed"):
+            break
+        time.sleep(0.02)
+    done = time.perf_counter() - t0
+    wav = b"".join(bytes(b) for b in pt.iter_download(name, format="wav"))
+    adpcm = b"".join(bytes(b) for b in pt.iter_download(name, format="adpcm"))
+    match = stages == ["stt", "llm", "tts", "ready"] and wav[:4] == b"RIFF" and len(adpcm) == (len(wav) - 44) // 4
+    ok &= match
+    print(f"turn    upload answered in {accepted * 1000:.0f} ms, answer after {done:.2f} s "
+          f"(stages {sum(stage_times):.1f} s), check saw {' -> '.join(stages)}: {'OK' if match else 'FAILED'}")
+
+    readings = [{"t": 21.5}, {"t": 21.7}]
+    r = pt.upload(json.dumps(readings).encode(), format="readings")
+    match = (r.get("status") == "stored" and backend.readings.get("1") == readings
+             and backend.pool.status(r["uuid"]) is None)
+    ok &= match
+    print(f"readings {len(readings)} spooled readings stored, no speech job queued: {'OK' if match else 'FAILED'}")
+
+    engines = [sensorServer._engine(url, "binary") for _ in range(workers + max_queue + 3)]
+    codes = []
+    for e in engines:
+        try:
+            codes.append(e.upload(payload, format="adpcm")["uuid"])
+        except ValueError as err:
+            codes.append("503" if "503" in str(err) else str(err))
+    names = [c for c in codes if c != "503"]
+    results = [e.wait_ready(n, timeout=10, format="adpcm") for e, n in zip(engines, codes) if n != "503"]
+    match = len(names) == workers + max_queue and all(r.get("status") == "ready" for r in results)
+    ok &= match
+    print(f"burst   {len(engines)} uploads, {len(names)} queued ({workers} workers + {max_queue} waiting), "
+          f"{codes.count('503')} turned away with 503, all queued answered: {'OK' if match else 'FAILED'}")
+
+    kept = (len(backend.uploads), len(backend.replies), len(backend.pool.jobs))
+    with backend.lock:
+        backend._expire(time.time() + REPLY_TTL + 1)
+    match = (len(backend.uploads), len(backend.replies), len(backend.pool.jobs)) == (0, 0, 0)
+    ok &= match
+    print(f"expiry  {kept[0]} uploads, {kept[1]} replies, {kept[2]} jobs forgotten after {REPLY_TTL} s: "
+          f"{'OK' if match else 'FAILED'}")
+    server.shutdown()
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Python sensor backend with a speech worker pool")
+    parser.add_argument("-c", "--config", default=CONFIG_FILE, help="config.ini with [JWT] and [SENSOR]")
+    parser.add_argument("-d", "--devices", default=DEVICES_FILE, help="devices.json {id: key}")
+    parser.add_argument("-p", "--port", type=int, default=9000, help="Port to listen on")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to bind")
+    parser.add_argument("-w", "--workers", type=int, default=2, help="Pipeline worker threads")
+    parser.add_argument("-q", "--queue", type=int, default=16, help="Jobs that may wait before uploads get 503")
+    parser.add_argument("-o", "--outdir", default=None, help="Write uploads and answers to this directory")
+    parser.add_argument("--fake", action="store_true", help="Stub STT/LLM/TTS stages, run offline")
+    parser.add_argument("--fake-times", type=float, nargs=3, default=(0.5, 1.0, 0.5), metavar=("STT", "LLM", "TTS"),
+                        help="Seconds the stub stages take")
+    parser.add_argument("--selftest", action="store_true", help="Run against fake stages and exit")
+    args = parser.parse_args()
+
+    if args.selftest:
+        sys.exit(0 if selftest() else 1)
+    if os.path.exists(args.config):
+        config = load_config(args.config)
+    elif args.fake:
+        config = {"JWT": {"key": os.urandom(16).hex(), "relatedTo": "PlatanenSensor", "issuedBy": "http://localhost"}}
+    else:
+        sys.exit(f"Config not found: {args.config}")
+    if os.path.exists(args.devices):
+        with open(args.devices) as f:
+            devices = json.load(f)
+    elif args.fake:
+        devices = dict(sensorServer.DEFAULT_DEVICES)
+    else:
+        sys.exit(f"Devices file not found: {args.devices}")
+    backend = ServiceBackend(devices, config["JWT"], make_stages(config, args.fake, args.fake_times),
+                             args.workers, args.queue, args.outdir)
+    srv = make_server(args.port, backend, args.host, verbose=True)
+    print(f"Listening on http://{args.host}:{args.port}, {args.workers} workers, "
+          f"{'fake' if args.fake else 'configured'} stages")
+    srv.serve_forever()
@@ -11,6 +11,8 @@ import numpy as np
 import sounddevice as sd
 import wave
 
+from adpcm.resample import resample
+
 TARGET_SR = 8000       # Hz
 DURATION = 5.0         # seconds
 CHANNELS = 1
@@ -20,7 +22,7 @@ WAV_FILENAME = "recording.wav"
 
 def resample_to_8k(audio: np.ndarray, orig_sr: int) -> np.ndarray:
     """
-    Resample mono audio to 8 kHz using numpy only (linear interpolation).
+    Resample mono audio to 8 kHz with the polyphase resampler in adpcm/.
     audio: shape (n_samples,) or (n_samples, 1), float32 in [-1, 1]
     returns: shape (n_new_samples,), float32
     """
@@ -30,15 +32,7 @@ def resample_to_8k(audio: np.ndarray, orig_sr: int) -> np.ndarray:
     if orig_sr == TARGET_SR:
         return audio
 
-    n_orig = audio.shape[0]
-    n_new = int(round(n_orig * TARGET_SR / orig_sr))
-
-    # original and new sample positions
-    orig_x = np.linspace(0.0, 1.0, num=n_orig, endpoint=False)
-    new_x = np.linspace(0.0, 1.0, num=n_new, endpoint=False)
-
-    audio_8k = np.interp(new_x, orig_x, audio).astype(np.float32)
-    return audio_8k
+    return resample(audio, orig_sr, TARGET_SR)
 
 
 def float_to_int16(audio_f32: np.ndarray) -> np.ndarray:
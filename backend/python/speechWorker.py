@@ -0,0 +1,615 @@
+#!/usr/bin/env python3
+"""
+Resident speech worker: Whisper (STT) and Piper (TTS) loaded once and kept
+in memory, serving requests from a queue, instead of starting whisper-cli
+and piper for every utterance as sensorRagUpload.php and
+generate_german_audio.py do (which reloads the model each time).
+
+SpeechWorker runs one engine thread per model.  Requests from any number
+of callers are queued, and whatever has piled up while the engine was busy
+is handed to it as one batch (at most --batch items), so concurrent
+callers share model calls and nobody waits for a batch to fill.  It can be
+used in-process, or as a daemon on a Unix socket:
+
+    python speechWorker.py -s /run/platane/speech.sock \
+        --whisper ggml-base-q8_0.bin --piper de_DE-thorsten-low.onnx
+
+Protocol: one JSON line per request and per reply, with "size" raw bytes
+following the line when audio travels inline (int16 mono, little endian,
+items described by "audio": [{"rate", "samples"}, ...]).  A connection
+stays open for further requests.
+
+    {"op": "stt", "files": [wav, ...]}            -> {"ok": true, "texts": [...]}
+    {"op": "stt", "audio": [...], "size": n} + pcm -> {"ok": true, "texts": [...]}
+    {"op": "tts", "texts": [...], "rate": 8000, "files": [wav, ...]}
+                                                  -> {"ok": true, "files": [...]}
+    {"op": "tts", "texts": [...], "rate": 8000}    -> {"ok": true, "audio": [...], "size": n} + pcm
+    {"op": "stats"}                               -> {"ok": true, "stt": {...}, "tts": {...}}
+
+Errors come back as {"ok": false, "error": "..."}.  "rate" is optional;
+without it TTS audio has the voice's own rate.  SpeechClient speaks the
+protocol and, like SpeechWorker, has the stt/tts stage methods of
+sensorPipeline.py, so either can be plugged into sensorService.py.
+
+The Whisper engine uses pywhispercpp (whisper.cpp models, as whisper-cli),
+the Piper engine the piper-tts package; both are only imported when used.
+FakeWhisper and FakePiper stand in for them with a load time and a time
+per call and per item, for tests and --bench.
+
+Usage:
+    python speechWorker.py -s speech.sock --whisper MODEL --piper VOICE [--batch 8]
+    python speechWorker.py -s speech.sock --fake
+    python speechWorker.py --bench [--callers 4]
+    python speechWorker.py --selftest
+"""
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+import wave
+from concurrent.futures import Future
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "adpcm"))
+import codec
+from resample import resample, to_int16
+
+log = logging.getLogger(__name__)
+
+SOCKET_PATH = "/run/platane/speech.sock"
+# whisper.cpp wants 16 kHz float input
+WHISPER_RATE = 16000
+MAX_BATCH = 8
+MAX_HEADER = 1 << 20
+
+
+def _resampled(pcm: np.ndarray, src: int, dst: int) -> np.ndarray:
+    if not dst or src == dst:
+        return pcm
+    return to_int16(resample(pcm.astype(np.float64), src, dst))
+
+
+def _write_wav(path: str, pcm: np.ndarray, rate: int):
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.astype("<i2").tobytes())
+
+
+class WhisperCpp:
+    """whisper.cpp model held in memory (pywhispercpp)."""
+    def __init__(self, model: str, language: str = "de", threads: int = 4):
+        from pywhispercpp.model import Model
+
+        self.language = language
+        self.model = Model(model, n_threads=threads, print_progress=False, print_realtime=False)
+
+    def transcribe_batch(self, items: list) -> list:
+        texts = []
+        for pcm, rate in items:
+            audio = _resampled(pcm, rate, WHISPER_RATE).astype(np.float32) / 32768.0
+            segments = self.model.transcribe(audio, language=self.language)
+            texts.append(" ".join(s.text.strip() for s in segments).strip())
+        return texts
+
+
+class PiperVoice:
+    """Piper voice held in memory (piper-tts)."""
+    def __init__(self, model: str):
+        from piper import PiperVoice as Voice
+
+        self.voice = Voice.load(model)
+        self.rate = self.voice.config.sample_rate
+
+    def _synthesize(self, text: str) -> np.ndarray:
+        if hasattr(self.voice, "synthesize_stream_raw"):
+            # piper-tts < 1.3
+            raw = b"".join(self.voice.synthesize_stream_raw(text))
+            return np.frombuffer(raw, dtype="<i2")
+        return np.concatenate([c.audio_int16_array for c in self.voice.synthesize(text)])
+
+    def synthesize_batch(self, texts: list) -> list:
+        return [(self._synthesize(t), self.rate) for t in texts]
+
+
+class FakeWhisper:
+    """Costs `load` seconds once, then `call` per batch plus `item` per utterance."""
+    def __init__(self, load: float = 0.0, call: float = 0.0, item: float = 0.0, text: str = "Hallo, wie geht es dir?"):
+        time.sleep(load)
+        self.call = call
+        self.item = item
+        self.text = text
+
+    def transcribe_batch(self, items: list) -> list:
+        time.sleep(self.call + self.item * len(items))
+        return [self.text if len(pcm) else "" for pcm, _ in items]
+
+
+class FakePiper:
+    """Like FakeWhisper; the audio is a tone as long as the text would take to say."""
+    SECONDS_PER_CHAR = 0.065
+
+    def __init__(self, load: float = 0.0, call: float = 0.0, item: float = 0.0, rate: int = 16000):
+        time.sleep(load)
+        self.call = call
+        self.item = item
+        self.rate = rate
+
+    def synthesize_batch(self, texts: list) -> list:
+        time.sleep(self.call + self.item * len(texts))
+        result = []
+        for text in texts:
+            t = np.arange(int((0.3 + self.SECONDS_PER_CHAR * len(text)) * self.rate)) / self.rate
+            result.append(((np.sin(2 * np.pi * 220 * t) * 8000).astype(np.int16), self.rate))
+        return result
+
+
+class PerCall:
+    """A fresh engine for every item: what spawning whisper-cli / piper per request costs."""
+    def __init__(self, factory):
+        self.factory = factory
+
+    def transcribe_batch(self, items: list) -> list:
+        return [self.factory().transcribe_batch([item])[0] for item in items]
+
+    def synthesize_batch(self, texts: list) -> list:
+        return [self.factory().synthesize_batch([text])[0] for text in texts]
+
+
+class Batcher:
+    """
+    One thread feeding queued items to `run` (list -> list of results).
+    Items that arrive while a batch runs go into the next one, up to
+    max_batch; a batch never waits for more items to arrive.
+    """
+    def __init__(self, run, max_batch: int = MAX_BATCH, name: str = "batcher"):
+        self.run = run
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.counts = {"items": 0, "batches": 0, "largest": 0, "errors": 0, "busy": 0.0}
+        self.thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, items: list) -> list:
+        futures = []
+        for item in items:
+            f = Future()
+            self.queue.put((item, f))
+            futures.append(f)
+        return futures
+
+    def __call__(self, items: list, timeout: float = None) -> list:
+        return [f.result(timeout) for f in self.submit(items)]
+
+    def stats(self) -> dict:
+        with self.lock:
+            result = dict(self.counts)
+        result["queued"] = self.queue.qsize()
+        return result
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            t0 = time.perf_counter()
+            try:
+                results = self.run([item for item, _ in batch])
+                for (_, f), r in zip(batch, results):
+                    f.set_result(r)
+                failed = 0
+            except Exception as e:
+                log.warning("%s failed: %s", self.thread.name, e)
+                for _, f in batch:
+                    f.set_exception(e)
+                failed = len(batch)
+            with self.lock:
+                self.counts["items"] += len(batch)
+                self.counts["batches"] += 1
+                self.counts["largest"] = max(self.counts["largest"], len(batch))
+                self.counts["errors"] += failed
+                self.counts["busy"] += time.perf_counter() - t0
+
+
+class SpeechWorker:
+    """
+    Resident STT and TTS engines behind batchers.  transcribe() and
+    synthesize() are the stage methods of sensorPipeline.py; either engine
+    may be None if only the other is served.
+    """
+    def __init__(self, stt=None, tts=None, max_batch: int = MAX_BATCH, rate: int = None):
+        self.rate = rate  # TTS output rate of synthesize(), None: the voice's
+        self.stt = Batcher(stt.transcribe_batch, max_batch, "stt") if stt is not None else None
+        self.tts = Batcher(tts.synthesize_batch, max_batch, "tts") if tts is not None else None
+
+    def _batcher(self, kind: str) -> Batcher:
+        batcher = getattr(self, kind)
+        if batcher is None:
+            raise ValueError(f"no {kind} engine loaded")
+        return batcher
+
+    def transcribe_many(self, items: list) -> list:
+        return self._batcher("stt")(items)
+
+    def synthesize_many(self, texts: list, rate: int = None) -> list:
+        rate = rate or self.rate
+        result = self._batcher("tts")(texts)
+        if rate:
+            result = [(_resampled(pcm, r, rate), rate) for pcm, r in result]
+        return result
+
+    def transcribe(self, pcm: np.ndarray, rate: int) -> str:
+        return self.transcribe_many([(pcm, rate)])[0]
+
+    def synthesize(self, text: str) -> tuple:
+        return self.synthesize_many([text])[0]
+
+    def stats(self) -> dict:
+        return {kind: getattr(self, kind).stats() for kind in ("stt", "tts") if getattr(self, kind) is not None}
+
+
+def _send(sock: socket.socket, header: dict, payload: bytes = b""):
+    if payload:
+        header["size"] = len(payload)
+    sock.sendall(json.dumps(header).encode() + b"\n" + payload)
+
+
+def _receive(rfile):
+    """(header, payload) of the next message, (None, None) at end of stream."""
+    line = rfile.readline(MAX_HEADER)
+    if not line:
+        return None, None
+    header = json.loads(line)
+    size = int(header.get("size", 0))
+    payload = rfile.read(size) if size else b""
+    if len(payload) != size:
+        raise EOFError("connection closed mid message")
+    return header, payload
+
+
+def _pack_audio(items: list) -> tuple:
+    meta = [{"rate": int(rate), "samples": len(pcm)} for pcm, rate in items]
+    return meta, b"".join(pcm.astype("<i2").tobytes() for pcm, _ in items)
+
+
+def _unpack_audio(meta: list, payload: bytes) -> list:
+    items, offset = [], 0
+    for m in meta:
+        n = int(m["samples"]) * 2
+        items.append((np.frombuffer(payload[offset:offset + n], dtype="<i2"), int(m["rate"])))
+        offset += n
+    if offset != len(payload):
+        raise ValueError("audio sizes do not match the payload")
+    return items
+
+
+class SpeechHandler(socketserver.StreamRequestHandler):
+    worker = None  # set by make_daemon()
+
+    def handle(self):
+        while True:
+            try:
+                header, payload = _receive(self.rfile)
+            except (EOFError, ValueError, OSError):
+                return
+            if header is None:
+                return
+            try:
+                reply, data = self._dispatch(header, payload)
+            except Exception as e:
+                reply, data = {"ok": False, "error": f"{type(e).__name__}: {e}"[:300]}, b""
+            try:
+                _send(self.connection, reply, data)
+            except OSError:
+                return
+
+    def _dispatch(self, header: dict, payload: bytes) -> tuple:
+        op = header.get("op")
+        if op == "stt":
+            if "files" in header:
+                items = [(codec.load_wav_as_mono_pcm(path, WHISPER_RATE), WHISPER_RATE) for path in header["files"]]
+            else:
+                items = _unpack_audio(header.get("audio", []), payload)
+            return {"ok": True, "texts": self.worker.transcribe_many(items)}, b""
+        if op == "tts":
+            texts = [str(t) for t in header.get("texts", [])]
+            audio = self.worker.synthesize_many(texts, header.get("rate"))
+            if "files" in header:
+                for path, (pcm, rate) in zip(header["files"], audio):
+                    _write_wav(path, pcm, rate)
+                return {"ok": True, "files": header["files"][:len(audio)]}, b""
+            meta, data = _pack_audio(audio)
+            return {"ok": True, "audio": meta}, data
+        if op == "stats":
+            return dict(ok=True, **self.worker.stats()), b""
+        raise ValueError(f"unknown op {op!r}")
+
+
+class _Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_daemon(path: str, worker: SpeechWorker, mode: int = 0o660) -> socketserver.UnixStreamServer:
+    """Bind (but do not start) the daemon; a stale socket file is replaced."""
+    if os.path.exists(path):
+        os.unlink(path)
+    handler = type("Handler", (SpeechHandler,), {"worker": worker})
+    server = _Daemon(path, handler)
+    os.chmod(path, mode)
+    return server
+
+
+class SpeechClient:
+    """
+    Client of the daemon, one connection per calling thread.  Has the
+    stt/tts stage methods of sensorPipeline.py; synthesize() asks for
+    `rate` (None: the voice's own).
+    """
+    def __init__(self, path: str = SOCKET_PATH, rate: int = None, timeout: float = 300):
+        self.path = path
+        self.rate = rate
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        self.local.sock = sock
+        self.local.rfile = sock.makefile("rb")
+
+    def close(self):
+        sock = getattr(self.local, "sock", None)
+        if sock is not None:
+            self.local.rfile.close()
+            sock.close()
+            self.local.sock = None
+
+    def request(self, header: dict, payload: bytes = b"") -> tuple:
+        """(reply header, payload); reconnects once if the daemon was restarted."""
+        for attempt in (0, 1):
+            if getattr(self.local, "sock", None) is None:
+                self._connect()
+            try:
+                _send(self.local.sock, dict(header), payload)
+                reply, data = _receive(self.local.rfile)
+                if reply is None:
+                    raise EOFError("daemon closed the connection")
+                break
+            except (OSError, EOFError):
+                self.close()
+                if attempt:
+                    raise
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error", "speech worker failed"))
+        return reply, data
+
+    def transcribe_many(self, items: list) -> list:
+        meta, data = _pack_audio(items)
+        return self.request({"op": "stt", "audio": meta}, data)[0]["texts"]
+
+    def synthesize_many(self, texts: list, rate: int = None) -> list:
+        header = {"op": "tts", "texts": list(texts)}
+        if rate or self.rate:
+            header["rate"] = rate or self.rate
+        reply, data = self.request(header)
+        return _unpack_audio(reply["audio"], data)
+
+    def transcribe(self, pcm: np.ndarray, rate: int) -> str:
+        return self.transcribe_many([(pcm, rate)])[0]
+
+    def synthesize(self, text: str) -> tuple:
+        return self.synthesize_many([text])[0]
+
+    def stats(self) -> dict:
+        reply, _ = self.request({"op": "stats"})
+        reply.pop("ok")
+        return reply
+
+
+def make_worker(whisper: str = None, piper: str = None, max_batch: int = MAX_BATCH, fake: bool = False,
+                fake_times: tuple = (1.0, 0.05, 0.2)) -> SpeechWorker:
+    """SpeechWorker with the given models loaded, or fakes (load, call, item seconds)."""
+    t0 = time.perf_counter()
+    if fake:
+        stt, tts = FakeWhisper(*fake_times), FakePiper(*fake_times)
+    else:
+        stt = WhisperCpp(whisper) if whisper else None
+        tts = PiperVoice(piper) if piper else None
+    log.info("models loaded in %.1f s", time.perf_counter() - t0)
+    return SpeechWorker(stt, tts, max_batch)
+
+
+def _percentile(values: list, p: float) -> float:
+    return float(np.percentile(values, p)) if values else 0.0
+
+
+def _run_callers(synth, sentences: list, callers: int) -> tuple:
+    """Sentences shared round robin by `callers` threads, one request each: (seconds, latencies)."""
+    latencies = []
+    lock = threading.Lock()
+
+    def caller(share):
+        for text in share:
+            t0 = time.perf_counter()
+            synth(text)
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=caller, args=(sentences[i::callers],)) for i in range(callers)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - t0, latencies
+
+
+def bench(sentences: list = None, callers: int = 4, max_batch: int = MAX_BATCH, fake_times: tuple = (1.0, 0.05, 0.2),
+          piper: str = None, piper_cmd: str = None) -> list:
+    """
+    TTS of generate_german_audio's sentences: spawning per sentence against
+    the daemon serving one caller, `callers` concurrent callers, and the
+    whole list as one request (generate_german_audio --socket).  Real
+    engines with piper (+ piper_cmd for the spawn row), fakes otherwise.
+    Returns rows of (name, sentences/s, p50 latency, p95 latency).
+    """
+    import tempfile
+
+    if sentences is None:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "sensor",
+                                        "protocoll", "embeddedBackend"))
+        from generate_german_audio import SAMPLE_SENTENCES
+        sentences = SAMPLE_SENTENCES
+    if piper:
+        from sensorPipeline import PiperCli
+
+        spawn = PiperCli(piper_cmd, piper).synthesize if piper_cmd else None
+        worker = SpeechWorker(None, PiperVoice(piper), max_batch)
+    else:
+        per_call = PerCall(lambda: FakePiper(*fake_times))
+        spawn = lambda text: per_call.synthesize_batch([text])[0]
+        worker = SpeechWorker(None, FakePiper(*fake_times), max_batch)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "speech.sock")
+        server = make_daemon(path, worker)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = SpeechClient(path, rate=8000)
+        client.synthesize(sentences[0])  # connect outside the timings
+        if spawn is not None:
+            seconds, lat = _run_callers(spawn, sentences, 1)
+            rows.append(("spawn per sentence", len(sentences) / seconds, _percentile(lat, 50), _percentile(lat, 95)))
+        for n in (1, callers):
+            seconds, lat = _run_callers(client.synthesize, sentences, n)
+            rows.append((f"resident, {n} caller{'s' if n > 1 else ''}", len(sentences) / seconds,
+                         _percentile(lat, 50), _percentile(lat, 95)))
+        t0 = time.perf_counter()
+        for i in range(0, len(sentences), max_batch):
+            client.synthesize_many(sentences[i:i + max_batch])
+        seconds = time.perf_counter() - t0
+        rows.append((f"resident, batches of {max_batch}", len(sentences) / seconds,
+                     seconds / -(-len(sentences) // max_batch), seconds / -(-len(sentences) // max_batch)))
+        client.close()
+        server.shutdown()
+        server.server_close()
+    return rows
+
+
+def selftest() -> bool:
+    """
+    Against fake engines: the daemon round-trips STT and TTS inline and
+    through files, concurrent callers are served in shared batches, a
+    failed batch reports the error to each caller, the client reconnects
+    after a daemon restart, and the models are loaded once however many
+    requests come.
+    """
+    import tempfile
+
+    ok = True
+    loads = []
+
+    class CountingPiper(FakePiper):
+        def __init__(self, *args):
+            loads.append(1)
+            super().__init__(*args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "speech.sock")
+        worker = SpeechWorker(FakeWhisper(0, 0.01, 0.01), CountingPiper(0.2, 0.05, 0.02), max_batch=8)
+        server = make_daemon(path, worker)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = SpeechClient(path, rate=8000)
+
+        pcm, rate = client.synthesize("Wie alt bist du?")
+        text = client.transcribe(pcm, rate)
+        wav_in = os.path.join(tmp, "in.wav")
+        wav_out = os.path.join(tmp, "out.wav")
+        _write_wav(wav_in, pcm, rate)
+        texts = client.request({"op": "stt", "files": [wav_in]})[0]["texts"]
+        client.request({"op": "tts", "texts": ["Hallo"], "files": [wav_out]})
+        with wave.open(wav_out) as w:
+            out_rate = w.getframerate()
+        match = (rate == 8000 and len(pcm) == int((0.3 + 0.065 * 16) * 16000) // 2 and text == texts[0] != ""
+                 and out_rate == 16000)
+        ok &= match
+        print(f"round trip  inline and file STT/TTS, rate conversion: {'OK' if match else 'FAILED'}")
+
+        sentences = ["Satz %d" % i for i in range(16)]
+        seconds, _ = _run_callers(client.synthesize, sentences, 8)
+        stats = client.stats()["tts"]
+        match = stats["largest"] > 1 and stats["batches"] < 2 + len(sentences) and len(loads) == 1
+        ok &= match
+        print(f"batching    {len(sentences)} requests from 8 callers in {seconds:.2f} s, {stats['batches'] - 2} "
+              f"batches (largest {stats['largest']}), model loaded {len(loads)}x: {'OK' if match else 'FAILED'}")
+
+        try:
+            client.request({"op": "stt", "audio": [{"rate": 8000, "samples": 10}]}, b"\0" * 4)
+            match = False
+        except RuntimeError as e:
+            match = "do not match" in str(e)
+        match &= client.synthesize("noch da?")[1] == 8000
+        ok &= match
+        print(f"errors      bad request answered with the error, connection kept: {'OK' if match else 'FAILED'}")
+
+        server.shutdown()
+        server.server_close()
+        server = make_daemon(path, worker)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        match = client.synthesize("wieder da")[1] == 8000
+        ok &= match
+        print(f"restart     client reconnects to a restarted daemon: {'OK' if match else 'FAILED'}")
+        client.close()
+        server.shutdown()
+        server.server_close()
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Resident Whisper/Piper worker on a Unix socket")
+    parser.add_argument("-s", "--socket", default=SOCKET_PATH, help="Unix socket path")
+    parser.add_argument("--whisper", help="whisper.cpp model (ggml) to keep loaded")
+    parser.add_argument("--piper", help="Piper voice (.onnx) to keep loaded")
+    parser.add_argument("-b", "--batch", type=int, default=MAX_BATCH, help="Most items per model call")
+    parser.add_argument("--mode", type=lambda s: int(s, 8), default=0o660, help="Socket permissions (octal)")
+    parser.add_argument("--fake", action="store_true", help="Fake engines instead of models")
+    parser.add_argument("--fake-times", type=float, nargs=3, default=(1.0, 0.05, 0.2), metavar=("LOAD", "CALL", "ITEM"),
+                        help="Seconds the fake engines take to load, per call and per item")
+    parser.add_argument("--bench", action="store_true", help="Compare per-sentence spawning with the resident worker")
+    parser.add_argument("--callers", type=int, default=4, help="Concurrent callers in --bench")
+    parser.add_argument("--piper-cmd", help="piper binary for the spawn row of --bench with --piper")
+    parser.add_argument("--selftest", action="store_true", help="Run against fake engines and exit")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.selftest:
+        sys.exit(0 if selftest() else 1)
+    if args.bench:
+        rows = bench(callers=args.callers, max_batch=args.batch, fake_times=args.fake_times, piper=args.piper,
+                     piper_cmd=args.piper_cmd)
+        print(f"{'TTS of the sample sentences':32s} {'sent/s':>7s} {'p50 ms':>8s} {'p95 ms':>8s}")
+        for name, rate, p50, p95 in rows:
+            print(f"{name:32s} {rate:7.2f} {p50 * 1000:8.0f} {p95 * 1000:8.0f}")
+        sys.exit(0)
+    if not (args.fake or args.whisper or args.piper):
+        parser.error("give --whisper and/or --piper models, or --fake")
+    worker = make_worker(args.whisper, args.piper, args.batch, args.fake, args.fake_times)
+    server = make_daemon(args.socket, worker, args.mode)
+    log.info("serving %s on %s", ", ".join(worker.stats()), args.socket)
+    try:
+        server.serve_forever()
+    finally:
+        os.unlink(args.socket)
@@ -144,9 +144,28 @@ static mp_obj_t py_adpcm_decode(mp_obj_t adpcm_obj) {
 static MP_DEFINE_CONST_FUN_OBJ_1(adpcm_decode_obj, py_adpcm_decode);
 
 /* in‑place/buffer‑to‑buffer helpers ----------------------------------------- */
-/* These return the encoded/decoded length or ‑1 on size mismatch. */
+/* These return the encoded/decoded length or ‑1 on size mismatch.            */
+/* The optional third argument is a writable buffer of two int32 (valprev,    */
+/* index), e.g. array.array('i', [0, 0]). It is read before and written back  */
+/* after the call, so a stream can be coded piece by piece; pieces must hold  */
+/* an even number of samples. Without it every call starts from zero.         */
+
+static adpcm_state_t *state_arg(size_t n_args, const mp_obj_t *args, adpcm_state_t *local) {
+    if (n_args < 3) {
+        local->valprev = 0;
+        local->index   = 0;
+        return local;
+    }
+    mp_buffer_info_t st_buf;
+    mp_get_buffer_raise(args[2], &st_buf, MP_BUFFER_RW);
+    if (st_buf.len < sizeof(adpcm_state_t)) {
+        mp_raise_ValueError(MP_ERROR_TEXT("state must hold two int32"));
+    }
+    return (adpcm_state_t *)st_buf.buf;
+}
 
-static mp_obj_t py_adpcm_encode_into(mp_obj_t pcm_obj, mp_obj_t out_obj) {
+static mp_obj_t py_adpcm_encode_into(size_t n_args, const mp_obj_t *args) {
+    mp_obj_t pcm_obj = args[0], out_obj = args[1];
     mp_buffer_info_t pcm_buf, out_buf;
     mp_get_buffer_raise(pcm_obj, &pcm_buf, MP_BUFFER_READ);
     mp_get_buffer_raise(out_obj, &out_buf, MP_BUFFER_WRITE);
@@ -160,13 +179,14 @@ static mp_obj_t py_adpcm_encode_into(mp_obj_t pcm_obj, mp_obj_t out_obj) {
         return MP_OBJ_NEW_SMALL_INT(-1);
     }
 
-    adpcm_state_t st = {0};
-    adpcm_encode((const int16_t *)pcm_buf.buf, (uint8_t *)out_buf.buf, nsamples, &st);
+    adpcm_state_t local;
+    adpcm_encode((const int16_t *)pcm_buf.buf, (uint8_t *)out_buf.buf, nsamples, state_arg(n_args, args, &local));
     return MP_OBJ_NEW_SMALL_INT(needed_bytes);
 }
-static MP_DEFINE_CONST_FUN_OBJ_2(adpcm_encode_into_obj, py_adpcm_encode_into);
+static MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(adpcm_encode_into_obj, 2, 3, py_adpcm_encode_into);
 
-static mp_obj_t py_adpcm_decode_into(mp_obj_t adpcm_obj, mp_obj_t out_obj) {
+static mp_obj_t py_adpcm_decode_into(size_t n_args, const mp_obj_t *args) {
+    mp_obj_t adpcm_obj = args[0], out_obj = args[1];
     mp_buffer_info_t adpcm_buf, out_buf;
     mp_get_buffer_raise(adpcm_obj, &adpcm_buf, MP_BUFFER_READ);
     mp_get_buffer_raise(out_obj, &out_buf, MP_BUFFER_WRITE);
@@ -177,11 +197,11 @@ static mp_obj_t py_adpcm_decode_into(mp_obj_t adpcm_obj, mp_obj_t out_obj) {
         return MP_OBJ_NEW_SMALL_INT(-1);
     }
 
-    adpcm_state_t st = {0};
-    adpcm_decode((const uint8_t *)adpcm_buf.buf, (int16_t *)out_buf.buf, nsamples, &st);
+    adpcm_state_t local;
+    adpcm_decode((const uint8_t *)adpcm_buf.buf, (int16_t *)out_buf.buf, nsamples, state_arg(n_args, args, &local));
     return MP_OBJ_NEW_SMALL_INT(needed_bytes);
 }
-static MP_DEFINE_CONST_FUN_OBJ_2(adpcm_decode_into_obj, py_adpcm_decode_into);
+static MP_DEFINE_CONST_FUN_OBJ_VAR_BETWEEN(adpcm_decode_into_obj, 2, 3, py_adpcm_decode_into);
 
 /* -------------------------------------------------------------------------- */
 /*                                Module init                                 */
@@ -5,6 +5,12 @@ import time
 import network
 from cryptolib import aes as AES
 import esp32
+from wifiConnect import WifiConnector, NvsWifiCache
+
+# a cached token is renewed this many seconds before it expires
+TOKEN_MARGIN = 30
+# before this (2024-01-01) the RTC has not been set from NTP
+CLOCK_VALID = 1704067200
 
 class PlatanAuth:
     """
@@ -25,12 +31,17 @@ class PlatanAuth:
         ssid (str): The WiFi SSID.
         password (str): The WiFi password.
         token (str): The authentication token for server communication.
+        token_expires (int or None): Expiry of the token (seconds since the epoch), None if unknown.
+        handshakes (int): join/challenge handshakes performed.
+        handshakes_avoided (int): get_token() calls answered from the cached token.
+        wifi (WifiConnector): Connects to Wi-Fi, fast to the last access point; wifi.stats() has the times.
 
     Methods:
         get_id(): Returns the device ID.
         get_baseUrl(): Returns the base URL for server communication.
-        connect_wifi(): Connects the device to the configured WiFi network.
-        get_token(): Performs authentication with the server and retrieves an access token.
+        connect_wifi(): Connects the device to the configured WiFi network, fast to the last access point.
+        get_token(force=False): Returns the cached token or authenticates with the server for a new one.
+        invalidate_token(): Drops the cached token, e.g. after the server answered 401.
         pkcs7_pad(msg_bytes): Pads the given bytes using PKCS#7 padding.
     """
 
@@ -49,7 +60,12 @@ class PlatanAuth:
         self.ssid = None
         self.password = None
         self.token = None
+        self.token_expires = None
+        self.handshakes = 0
+        self.handshakes_avoided = 0
+        self.wifi = WifiConnector(cache=NvsWifiCache(nvs=self.nvs), net=network)
         self._load_nvs()
+        self._load_token()
 
     def _load_nvs(self):
         """
@@ -81,26 +97,22 @@ class PlatanAuth:
         """
         Connects the device to a Wi-Fi network using the provided SSID and password.
 
-        This method initializes the network interface in station mode, waits for it to become active,
-        and then attempts to connect to the specified Wi-Fi network. It blocks execution until the
-        network interface is active and the connection is established. Once connected, it prints the
-        network configuration.
+        The connect is WifiConnector's (wifiConnect.py): the access point and IP configuration of the
+        last connect are kept in the "wifi" blob of this NVS namespace and tried first, a scan and a
+        plain connect follow only if that fails. Once connected, it prints the network configuration.
+
+        Returns:
+            str: How it connected: "up" (already connected), "fast", "scan" or "plain".
 
         Raises:
-            Any exceptions raised by the underlying network or time modules.
+            OSError: If no attempt connected.
 
         Note:
             Assumes that `self.ssid` and `self.password` are set to valid Wi-Fi credentials.
         """
-        nic = network.WLAN(network.WLAN.IF_STA)
-        while not nic.active():
-            print("Waiting for network interface to become active...")
-            time.sleep(1)
-        nic.connect(self.ssid, self.password)
-        while not nic.isconnected():
-            print("Waiting for network connection...")
-            time.sleep(1)
-        print("Network connected:", nic.ifconfig())
+        path = self.wifi.connect(self.ssid, self.password)
+        print(f"Network connected ({path}, {self.wifi.last_ms} ms):", self.wifi.interface().ifconfig())
+        return path
 
 
     def get_baseUrl(self):
@@ -126,25 +138,96 @@ class PlatanAuth:
         return self.deviceId
 
 
-    def get_token(self):
+    def _load_token(self):
+        """
+        Loads a token stored by an earlier get_token() from the "token" blob in NVS.
+
+        The blob holds JSON {"token", "expires"}; a missing or unreadable blob leaves self.token None.
+        """
+        buf = bytearray(1024)
+        try:
+            l = self.nvs.get_blob("token", buf)
+            entry = json.loads(buf[:l]) if l > 0 else {}
+        except (OSError, ValueError):
+            entry = {}
+        self.token = entry.get("token")
+        self.token_expires = entry.get("expires")
+
+    def _save_token(self):
+        self.nvs.set_blob("token", json.dumps({"token": self.token, "expires": self.token_expires}).encode())
+        self.nvs.commit()
+
+    def invalidate_token(self):
+        """
+        Drops the token from memory and NVS, so the next get_token() authenticates again.
+
+        Call this when the server rejects the token (HTTP 401).
+        """
+        self.token = None
+        self.token_expires = None
+        try:
+            self.nvs.erase_key("token")
+            self.nvs.commit()
+        except OSError:
+            pass
+
+    @staticmethod
+    def token_expiry(token):
+        """
+        Returns the exp claim of a JWT token, or None if the token carries none.
+
+        Args:
+            token (str): The token as returned by the server.
         """
-        Authenticates the device with the server and retrieves an authentication token.
+        parts = token.split(".")
+        if len(parts) != 3:
+            return None
+        b64 = parts[1].replace("-", "+").replace("_", "/")
+        b64 += "=" * (-len(b64) % 4)
+        try:
+            return json.loads(binascii.a2b_base64(b64)).get("exp")
+        except Exception:
+            return None
 
-        This method performs a two-step authentication process:
+    def _token_valid(self):
+        if not self.token:
+            return False
+        now = time.time()
+        if self.token_expires is None or now < CLOCK_VALID:
+            # unknown expiry or clock not set yet: use it until the server rejects it
+            return True
+        return now < self.token_expires - TOKEN_MARGIN
+
+    def get_token(self, force=False):
+        """
+        Returns an authentication token, from the cache if possible.
+
+        A token kept from an earlier call, also from before a restart (NVS), is returned
+        while it is more than TOKEN_MARGIN seconds from expiring. Otherwise, or with
+        force=True, this method performs a two-step authentication process:
         1. Sends a "join" request to the server to receive a challenge and IV.
         2. Encrypts the challenge using AES-CBC with the device key and IV, then sends the encrypted challenge back to the server.
         If successful, stores and returns the authentication token.
 
+        Args:
+            force (bool): Authenticate even if a cached token is still valid.
+
         Returns:
             str or None: The authentication token if successful, otherwise None.
 
         Side Effects:
             - Updates self.token with the received token or None on failure.
+            - Stores a new token with its expiry in NVS.
             - Prints error messages on failure.
 
         Raises:
             None: All exceptions are handled internally.
         """
+        if not force and self._token_valid():
+            self.handshakes_avoided += 1
+            return self.token
+        self.invalidate_token()
+
         # Step 1: Join
         resp = requests.post(f"{self.baseUrl}/sensorUpload.php", json={
             "command": "join",
@@ -197,6 +280,9 @@ class PlatanAuth:
             print("Auth failed")
             self.token = None
             return None
+        self.handshakes += 1
+        self.token_expires = token_data.get('expires') or self.token_expiry(self.token)
+        self._save_token()
         return self.token
 
 
@@ -1,9 +1,13 @@
 import math
 import echoBase
-import adpcm
 import time 
-from protoEngine import ProtoEngine
-import binascii
+import asyncio
+from asyncProtoEngine import AsyncProtoEngine
+from recStream import RecordStream
+from playStream import PlayStream
+from spool import Spool
+from wifiConnect import NvsWifiCache
+from tokenCache import NvsTokenCache
 import json
 import os
 import machine
@@ -122,19 +126,28 @@ class DisPlay:
 
         
 RGB = DisPlay(cfdata)
+# colour the display task should show; set by rgbFill(), drawn by showRGB()
+rgbWanted = [(40,40,40)]
 
 def rgbFill(color):
-    global RGB
     print("Set RGB to",color)
-    RGB.fill(color)
+    rgbWanted[0] = color
 
 def rgbRect(x,y,w,h,color):
     global RGB
     print("Set Rect RGB to",color)
     RGB.fill_rect(x,y,w,h,color)
 
-
-rgbFill((40,40,40))  # off
+async def showRGB():
+    # an LCD fill takes a while: draw in a task of its own, only the
+    # latest colour, so audio and network tasks never wait for it
+    shown = None
+    while True:
+        color = rgbWanted[0]
+        if color != shown:
+            RGB.fill(color)
+            shown = color
+        await asyncio.sleep_ms(20)
 
 # create audio
 eb = echoBase.EchoBase() #debug=True)
@@ -145,134 +158,141 @@ eb.setSpeakerVolume(100)
 # go online
 baseUrl = "https://llama.ok-lab-karlsruhe.de/platane/php"
 
-pt = ProtoEngine("karlsruhe.freifunk.net", baseUrl, deviceId, deviceKey)
+pt = AsyncProtoEngine("karlsruhe.freifunk.net", baseUrl, deviceId, deviceKey)
 #pt.setDebug(True)
-rgbFill((80,20,20)) 
-pt.connect()    
-pt.join()
-if pt.state == "connected":
-    print("Join OK")
-    rgbFill((0,80,80)) 
-else:
-    print("Join failed")
-    rgbFill((80,0,0)) 
-    raise BaseException("Join failed")
-
+# reconnect to the last access point without scanning, see wifiConnect.py
+pt.wifi.cache = NvsWifiCache()
+# keep the token across restarts: a cold start skips the join handshake
+pt.token_cache = NvsTokenCache()
+
+# recordings whose upload failed, kept on flash until we are joined again
+spool = Spool("/spool")
+print("Spooled:", spool.stats())
+
+
+async def rejoin():
+    # (re)connect and join; then send what was spooled meanwhile
+    if pt.state != "connected":
+        try:
+            await pt.disconnect()
+            await pt.connect()
+            await pt.join()
+        except (OSError, ValueError) as e:
+            print("Join error:", e)
+    if pt.state != "connected":
+        return False
+    if spool.pending():
+        sent = await spool.adrain(pt)
+        print("Spool sent", sent, "left", spool.pending())
+    return True
+
+
+async def main():
+    asyncio.create_task(showRGB())
+    rgbFill((80,20,20)) 
+    if await rejoin():
+        print("Join OK")
+        rgbFill((0,80,80)) 
+    else:
+        # carry on offline: recordings are spooled until a join succeeds
+        print("Join failed")
+        rgbFill((80,0,0)) 
 
-rgbFill((40,40,0xc0))  # off
-eb.play("/media/besuch.wav") #test8000mono.wav")
-time.sleep(1)
+    rgbFill((40,40,0xc0))  # off
+    eb.play("/media/besuch.wav") #test8000mono.wav")
+    await asyncio.sleep(1)
 
+    while True:
+        try:
+            await rejoin()
+
+            # record audio, uploading while recording
+            print("Recording audio for upload...")
+            reclen_ = 100000  # 100k ~ 6 seconds at 8kHz,16bit   
+            recbuf_ = bytearray(reclen_)
+            format = "adpcm"  # "wav" or "adpcm"
+            rgbFill((0,0xc0,40)) 
+
+            # each 4 KiB chunk is encoded in the I2S callback and sent right away
+            rec = RecordStream(eb, recbuf_, reclen_, format=format)
+            if not rec.start():
+                raise BaseException("Record failed")
+            try:
+                resp = await pt.upload_stream(rec.achunks(), format=format)
+            except (OSError, ValueError) as e:
+                print("Upload error:", e)
+                resp = {}
+            rgbFill((40,40,40))  # off
+            print("Recording done", reclen_)
+            await asyncio.sleep(1)
+
+            rgbFill((0xa0,0xa0,0))
+            name = resp.get("uuid", None)
+            if not name:
+                # keep it for later and go on; the next turn joins again
+                spool.append(await rec.recording(), format=format)
+                print("Upload failed, spooled:", spool.stats())
+                await pt.disconnect()
+                rgbFill((80,0,0))
+                await asyncio.sleep(2)
+                continue
+            rgbFill((40,40,40))  # off
+
+            print("Upload OK, name:", name)
+            # overwrite name for long audio test 
+            #name = "longAudio"
+            # adpcm download: a quarter of the bytes of wav, decoded on the fly
+            format = "adpcm"  # "wav" or "adpcm"
+            rgbFill((0xa0,0,0xa0))
+            resp = await pt.wait_ready(name, format=format)
+            rgbFill((40,40,40)) 
+            if resp.get("status") != "ready":
+                print("Reply not ready in time")
+                continue
+            print("Check OK, size:", resp.get("size",0))
+            chunks = resp.get("chunks", 0)
+            chunkSize = resp.get("chunksize", 0)
+            print(f"Chunks: {chunks}, Chunk Size: {chunkSize}")
+
+            eb.setShift(1)
+            eb.setSpeakerVolume(100)
+
+            # one streamed response for the whole reply: the next piece arrives
+            # and is decoded while the current one plays, with the decoder state
+            # carried across pieces; the engine sizes the receive buffers
+            ps = PlayStream(eb, format=format)
+            rgbFill((0,0xa0,0xa0))  # off
+            c = 0
+            async for dt in pt.iter_download(name, format=format):
+                for buf, w in ps.pieces(dt):
+                    rgbFill((80,80,80))  # off
+                    await ps.play(buf, w)
+                    rgbFill((40,40,0xc0))  # off
+                    print("Playing piece", c)
+                    c += 1
+            
+            await ps.wait()
+            print("Reply:", ps.received, "bytes received,", ps.played, "bytes played")
+            await asyncio.sleep(1)
+            rgbFill((0,0,0))  # off
+
+            await asyncio.sleep(2)
+        except (OSError, ValueError) as e:
+            # a stalled capture, a full flash or a connection lost after the
+            # upload: start over with the next turn
+            print("Turn error:", e)
+            await pt.disconnect()
+            rgbFill((80,0,0))
+            await asyncio.sleep(2)
 
-while True:
 
-    # record audio
-    print("Recording audio for upload...")
-    reclen_ = 100000  # 100k ~ 6 seconds at 8kHz,16bit   
-    recbuf_ = bytearray(reclen_)
-    rgbFill((0,0xc0,40)) 
-        
-    eb.record(recbuf_,reclen_)
-    while eb.getRecordStatus():
-        time.sleep_ms(100)
-
-    rgbFill((40,40,40))  # off
-    print("Recording done", reclen_)
-    # compress on upload
-    format = "adpcm"  # "wav" or "adpcm"
-    if format == "adpcm":
-        recbuf = bytearray(reclen_//4) # max size after decode
-        reclen = adpcm.encode_into(recbuf_, recbuf)
-        print("Decoded ADPCM data into buffer, size:", reclen)
+try:
+    asyncio.run(main())
+finally:
+    asyncio.run(pt.disconnect())
+    if pt.state != "offline":
+        print("Disconnect failed")
     else:
-        recbuf = recbuf_
-        reclen = reclen_
-
-    # upload audio
-    rgbFill((0xa0,0xa0,0)) 
-    resp = pt.upload(recbuf,format=format)
-    rgbFill((40,40,40))  # off
-    time.sleep(1)
-
-    rgbFill((0xa0,0xa0,0))
-    name = resp.get("uuid", None)
-    if not name:
-        print("Upload failed")
-        pt.disconnect()
-        raise BaseException("Upload failed")
-    rgbFill((40,40,40))  # off
-
-    print("Upload OK, name:", name)
-    # overwrite name for long audio test 
-    #name = "longAudio"
-    # wav download 
-    format = "wav"  # "wav" or "adpcm"
-    while True:
-        rgbFill((0xa0,0,0xa0))
-        resp = pt.check(name, format=format)
-        if resp.get("status") == "ready":
-            break
-        print("File not ready, retrying in 1s...")
-        rgbFill((40,40,40)) 
-        time.sleep(1)
-    print("Check OK, size:", resp.get("size",0))
-    chunks = resp.get("chunks", 0)
-    chunkSize = resp.get("chunksize", 0)
-    print(f"Chunks: {chunks}, Chunk Size: {chunkSize}")
-    bufMult = 4 if format == "adpcm" else 1
-    dtbuf = [bytearray(bufMult*chunkSize),  # max size after decode
-            bytearray(bufMult*chunkSize)]  # max size after decode
-    bufsel = 0
-
-    eb.setShift(1)
-    eb.setSpeakerVolume(100)
-
-    for c in range(chunks):
-        if pt.state != "connected":
-            print("Connection lost, stopping download")
-            break
-        # print(f"Downloading chunk {c+1}/{chunks}...")
-        #task = asyncio.create_task(coroutine=getData(name, c))
-        #await task
-        #resp = task.result()
-        rgbFill((0,0xa0,0xa0))  # off
-        resp = pt.download(name, c, format=format)
-        #print("Downloaded chunk data:", resp)
-        dt = binascii.a2b_base64(resp.get("data", ""))
-        if format == "wav":
-            w = len(dt)
-            idx = bufsel % 2
-            # copy data into buffer (do not assign reference)
-            dtbuf[idx][:w] = dt
-        else:
-            w = adpcm.decode_into(dt, dtbuf[bufsel%2])
-        rgbFill((80,80,80))  # off
-        while True:
-            irqstate = machine.disable_irq()
-            if not eb.getPlayStatus():
-                machine.enable_irq(irqstate)
-                break
-            machine.enable_irq(irqstate)
-            time.sleep_ms(1)
-        #decompress
-        #print("Decoded chunk data, size:", w)
-        # play
-        rgbFill((40,40,0xc0))  # off
-        eb.play(dtbuf[bufsel%2],w,useIrq=True, chain = None)
-        bufsel += 1
-        print("Playing chunk", c)
-        
-    while eb.getPlayStatus():
-        time.sleep_ms(1)
-    time.sleep(1)
-    rgbFill((0,0,0))  # off
-
-    time.sleep(2)
-    
-pt.disconnect()
-if pt.state != "offline":
-    print("Disconnect failed")
-else:
-    print("Disconnect OK")
+        print("Disconnect OK")
         
 machine.soft_reset()
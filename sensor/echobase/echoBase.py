@@ -34,8 +34,8 @@ irqChain = None # chained handler
 # Play IRQ stuff
 def playHandler(port):
     global i2slen, i2spos, i2sbuf, isplaying
-    # port is I2S instance
-    i2slen -= CHUNK_SIZE
+    # port is I2S instance; one chunk has just been written,
+    # i2slen bytes are still to be written
     if i2slen <= 0:
         isplaying = False
         port.irq(None)
@@ -44,6 +44,7 @@ def playHandler(port):
         mv = memoryview(i2sbuf)[i2spos:i2spos+chunk]
         port.write(mv)
         i2spos += chunk
+        i2slen -= chunk
     # call chained handler if any
     if irqChain is not None:
         irqChain(i2slen)
@@ -52,8 +53,8 @@ def playHandler(port):
 isrecording = False
 def recHandler(port):
     global i2slen, i2spos, i2sbuf, isrecording
-    # port is I2S instance
-    i2slen -= CHUNK_SIZE
+    # port is I2S instance; one chunk has just been filled,
+    # i2slen bytes are still to be read
     if i2slen <= 0:
         isrecording = False
         port.irq(None)
@@ -62,7 +63,8 @@ def recHandler(port):
         mv = memoryview(i2sbuf)[i2spos:i2spos+chunk]
         port.readinto(mv)
         i2spos += chunk
-    # call chained handler if any
+        i2slen -= chunk
+    # call chained handler if any, once per finished chunk
     if irqChain is not None:
         irqChain(i2slen)
 
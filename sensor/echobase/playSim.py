@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Host round trip of reply playback (playStream.py): backend -> download ->
+decode -> play buffers, as chatBotLoop.py does it.
+
+echoBase.py and playStream.py run unchanged on the fakes of recSim.py,
+with an I2S whose interrupt driven write() takes len / (rate * 2) /
+--speed seconds and keeps what was played.  adpcm.decode_into(adpcm, out,
+state) is the backend codec with the device module's signature.  The
+reply is a speech-like signal, served by the reference server
+(backend/python/sensorServer.py) as WAV and as ADPCM encoded the way the
+reply pipeline does it (codec.adpcm_encode, one stream), and downloaded with
+AsyncProtoEngine.iter_download over both transports.
+
+For each run the bytes received and what reached the speaker are
+checked: WAV must play its bytes unchanged, ADPCM must play exactly the
+decode of the whole stream (no seams at piece or chunk boundaries).  A
+third run decodes every piece from a zero state, as chatBotLoop.py did,
+to show the seams that avoids.
+
+Usage:
+    python playSim.py [-s 48000] [--chunk 4096] [--speed 8]
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+import recSim
+from recSim import FakeCodec, FakeI2S, codec, sensorServer
+
+sys.path.insert(0, os.path.join(recSim.HERE, "..", "..", "backend", "python"))
+from sensorPipeline import wav_bytes
+
+
+class PlayI2S(FakeI2S):
+    """FakeI2S whose writes take playing time and are kept in `played`."""
+    played = []
+    speed = 8.0
+
+    def write(self, mv):
+        PlayI2S.played.append(bytes(mv))
+        if self.handler is not None:
+            # the next write comes from the handler once this one has played
+            seconds = len(mv) / (self.rate * 2) / PlayI2S.speed
+            threading.Timer(seconds, self.handler, (self,)).start()
+        return len(mv)
+
+
+class PlayCodec(FakeCodec):
+    """es8311 handle stand-in: always in playback mode."""
+    def getOp(self):
+        return "playback"
+
+
+def _install_fakes():
+    recSim._install_fakes()
+    machine = sys.modules["machine"]
+    machine.I2S = PlayI2S
+    machine.disable_irq = lambda: 0
+    machine.enable_irq = lambda state: None
+
+    def decode_into(data, out, state):
+        codes = codec.unpack_codes(np.frombuffer(data, dtype=np.uint8))
+        pcm, state[0], state[1] = codec.decode_codes(codes, state[0], state[1])
+        out[:pcm.nbytes] = pcm.astype("<i2").tobytes()
+        return pcm.nbytes
+    sys.modules["adpcm"].decode_into = decode_into
+
+
+class ReplyBackend(sensorServer.SensorBackend):
+    """Answers every upload with `reply` in both download formats."""
+    reply = None
+
+    def store(self, sid, fmt, data, transport):
+        code, resp = super().store(sid, fmt, data, transport)
+        if code == 200:
+            self.set_reply(resp["uuid"], "wav", wav_bytes(self.reply))
+            self.set_reply(resp["uuid"], "adpcm", codec.adpcm_encode(self.reply).tobytes())
+        return code, resp
+
+
+def _stateless(PlayStream):
+    class StatelessStream(PlayStream):
+        """Every piece decoded from a zero state, as chatBotLoop.py used to."""
+        def pieces(self, data):
+            step = len(self.buffers[0]) // 4
+            for pos in range(0, len(data), step):
+                self.seed()
+                yield from super().pieces(memoryview(data)[pos:pos + step])
+    return StatelessStream
+
+
+async def _turn(url, transport, fmt, stream_class):
+    from asyncProtoEngine import AsyncProtoEngine
+    import echoBase
+
+    pt = AsyncProtoEngine("test", url, 1, sensorServer.DEFAULT_DEVICES["1"])
+    pt.transports = (transport,)
+    await pt.connect()
+    await pt.join()
+    name = (await pt.upload(b"\0" * 64, format="adpcm"))["uuid"]
+    resp = await pt.wait_ready(name, format=fmt)
+
+    eb = echoBase.EchoBase()
+    eb._sample_rate = 8000
+    eb.es_handle = PlayCodec()
+    PlayI2S.played = []
+    ps = stream_class(eb, format=fmt)
+    t0 = time.perf_counter()
+    async for data in pt.iter_download(name, format=fmt):
+        for buf, n in ps.pieces(data):
+            await ps.play(buf, n)
+    await ps.wait()
+    seconds = time.perf_counter() - t0
+    await pt.disconnect()
+    return ps.received, b"".join(PlayI2S.played), seconds
+
+
+def _seams(played: np.ndarray, expected: np.ndarray, piece: int) -> int:
+    """Play pieces (of `piece` samples) that differ from the expected audio."""
+    n = min(len(played), len(expected))
+    bad = played[:n] != expected[:n]
+    return int(np.count_nonzero(bad[:n // piece * piece].reshape(-1, piece).any(axis=1)))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Round trip of reply download and playback on the host")
+    parser.add_argument("-s", "--size", type=int, default=48000, help="Reply size in bytes of PCM (3 s at 8 kHz)")
+    parser.add_argument("--chunk", type=int, default=4096, help="Server download chunk size")
+    parser.add_argument("--speed", type=float, default=8.0, help="Playback speed-up of the fake I2S")
+    args = parser.parse_args()
+
+    _install_fakes()
+    from playStream import PlayStream, PLAY_SIZE
+
+    PlayI2S.speed = args.speed
+    reply = np.frombuffer(recSim.speech_like(args.size, 8000), dtype="<i2")
+    backend = ReplyBackend()
+    backend.reply = reply
+    backend.chunk_size = args.chunk
+    url = sensorServer.start_in_thread(sensorServer.make_server(0, backend))
+
+    stream = codec.adpcm_encode(reply).tobytes()
+    decoded = codec.adpcm_decode(np.frombuffer(stream, dtype=np.uint8))
+    noise = reply.astype(np.float64) - decoded[:len(reply)]
+    snr = 10 * np.log10(np.mean(reply.astype(np.float64) ** 2) / max(np.mean(noise ** 2), 1e-9))
+    print(f"reply {len(reply)} samples, wav {len(wav_bytes(reply))} bytes, adpcm {len(stream)} bytes, "
+          f"ADPCM SNR {snr:.1f} dB, server chunks {args.chunk} bytes, play buffers {PLAY_SIZE} bytes")
+
+    ok = True
+    for transport in sensorServer.TRANSPORTS:
+        received = {}
+        for fmt, cls in (("wav", PlayStream), ("adpcm", PlayStream), ("adpcm stateless", _stateless(PlayStream))):
+            size, played, seconds = asyncio.run(_turn(url, transport, fmt.split()[0], cls))
+            played = np.frombuffer(played, dtype="<i2")
+            if fmt == "wav":
+                expected = np.frombuffer(wav_bytes(reply), dtype="<i2")
+            else:
+                expected = decoded
+            seams = _seams(played, expected, PLAY_SIZE // 2)
+            match = len(played) == len(expected) and (seams == 0) != (fmt == "adpcm stateless")
+            received[fmt] = size
+            ok &= match
+            print(f"{transport:6s} {fmt:16s} {size:6d} bytes received, {len(played) * 2:6d} bytes played in "
+                  f"{seconds:5.2f} s, {seams} of {-(-len(played) // (PLAY_SIZE // 2))} pieces off: "
+                  f"{'OK' if match else 'FAILED'}")
+        ratio = received["wav"] / received["adpcm"]
+        ok &= ratio > 3.9
+        print(f"{transport:6s} wav / adpcm bytes {ratio:.2f}")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,91 @@
+# playStream.py
+#
+# Play a reply while the rest of it downloads, through EchoBase's
+# interrupt driven play() and two play buffers: one plays while the next
+# is filled.
+#
+# "adpcm" replies are a quarter of the bytes of "wav".  They are one IMA
+# ADPCM stream (the backend encodes the whole reply with the predictor
+# state running on), and are decoded here with that state carried from
+# piece to piece (adpcm.decode_into's state argument), so download chunks
+# and receive buffers of any size join without seams.  Decoding each
+# piece from a zero state instead restarts the predictor at every
+# boundary: a click, and a wrong level until it has caught up again.
+# "wav" replies are played straight from the receive buffers.  Those are
+# the engine's: their size follows the link and the free heap
+# (ProtoEngine.down_tuner), and pieces() takes whatever arrives.
+#
+#   ps = PlayStream(eb, format="adpcm")
+#   async for data in pt.iter_download(name, format="adpcm"):
+#       for buf, n in ps.pieces(data):
+#           await ps.play(buf, n)
+#   await ps.wait()
+
+import array
+import adpcm
+import machine
+from asyncProtoEngine import sleep_ms
+
+# bytes of 16 bit PCM per play buffer; an ADPCM piece is a quarter of that
+PLAY_SIZE = 16384
+
+# False once adpcm.decode_into() has refused the state argument: the
+# adpcm.mpy binaries in micropython/mpyMods were built before adpcm.c took
+# it, and then every piece is decoded from a zero state
+_stateful = True
+
+
+def _decode_into(data, buf, state):
+    global _stateful
+    if _stateful:
+        try:
+            return adpcm.decode_into(data, buf, state)
+        except TypeError:
+            _stateful = False
+    return adpcm.decode_into(data, buf)
+
+
+class PlayStream:
+    def __init__(self, eb, format="adpcm", play_size=PLAY_SIZE):
+        self.eb = eb
+        self.format = format
+        self.state = array.array("i", [0, 0])
+        self.buffers = [bytearray(play_size), bytearray(play_size)] if format == "adpcm" else None
+        self.sel = 0
+        self.received = 0
+        self.played = 0
+
+    def seed(self, valprev=0, index=0):
+        """Decoder state for the next piece; 0, 0 at the start of a reply."""
+        self.state[0] = valprev
+        self.state[1] = index
+
+    def pieces(self, data):
+        """(buffer, size) pairs to play for received data, in order."""
+        self.received += len(data)
+        if self.format != "adpcm":
+            yield data, len(data)
+            return
+        step = len(self.buffers[0]) // 4
+        mv = memoryview(data)
+        for pos in range(0, len(data), step):
+            # the other buffer may still be playing, this one has finished
+            buf = self.buffers[self.sel % 2]
+            self.sel += 1
+            n = _decode_into(mv[pos:pos + step], buf, self.state)
+            yield buf, n
+
+    async def wait(self):
+        """Until the buffer playing now has finished."""
+        while True:
+            irqstate = machine.disable_irq()
+            playing = self.eb.getPlayStatus()
+            machine.enable_irq(irqstate)
+            if not playing:
+                return
+            await sleep_ms(1)
+
+    async def play(self, buf, n):
+        await self.wait()
+        self.eb.play(buf, n, useIrq=True, chain=None)
+        self.played += n
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Host simulation of the record-while-uploading pipeline (recStream.py).
+
+echoBase.py runs unchanged on top of a fake `machine` module whose I2S
+delivers PCM in real time: a non-blocking readinto() completes after
+len / (rate * 2) seconds and then calls the IRQ handler, as the ESP32 port
+does through the scheduler.  The adpcm module is replaced by the backend
+codec with the same encode_into(pcm, out, state) signature, and uploads go
+to the reference server (backend/python/sensorServer.py) over a link
+throttled to --link bytes/s.
+
+Two runs are compared:
+
+  sequential  record, wait for the end, then upload_stream() encoding
+              4 KiB at a time (chatBotLoop.py before the pipeline)
+  pipelined   RecordStream: encode in the chain callback, send during capture
+
+and for each the latency from the end of capture (last I2S chunk in) to
+the server having the whole upload is reported, also in chunk durations.
+
+Usage:
+    python recSim.py [-s 100000] [--link 12000] [-t binary]
+"""
+import os
+import sys
+import threading
+import time
+import types
+import zlib
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "protocoll"))
+sys.path.insert(0, os.path.join(HERE, "..", "..", "backend", "python"))
+sys.path.insert(0, os.path.join(HERE, "..", "..", "backend", "python", "adpcm"))
+
+import codec
+import sensorServer
+from protoEngine import ProtoEngine
+
+
+class FakeI2S:
+    """Enough of machine.I2S for EchoBase recording, fed from `signal`."""
+    RX = 0
+    TX = 1
+    MONO = 0
+    STEREO = 1
+    signal = b""
+    fired = []          # perf_counter() of each completed non-blocking read
+
+    def __init__(self, id, sck=None, ws=None, sd=None, mode=RX, bits=16, format=MONO, rate=8000, ibuf=0):
+        self.rate = rate
+        self.handler = None
+        self.pos = 0
+        self.clock = 0.0
+
+    def irq(self, handler):
+        self.handler = handler
+
+    def _fill(self, mv):
+        n = len(mv)
+        mv[:] = FakeI2S.signal[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def readinto(self, mv):
+        seconds = len(mv) / (self.rate * 2)
+        if self.handler is None:
+            time.sleep(seconds)
+            return self._fill(mv)
+        # samples keep arriving back to back while the handler is set
+        now = time.perf_counter()
+        self.clock = max(self.clock, now) + seconds
+        handler = self.handler
+        threading.Timer(self.clock - now, self._complete, (mv, handler)).start()
+        return 0
+
+    def _complete(self, mv, handler):
+        self._fill(mv)
+        FakeI2S.fired.append(time.perf_counter())
+        handler(self)
+
+    def write(self, mv):
+        return len(mv)
+
+    def shift(self, buf, bits, shift):
+        pass
+
+    def deinit(self):
+        self.handler = None
+
+
+class FakeCodec:
+    """es8311 handle stand-in: always in record mode."""
+    def getOp(self):
+        return "record"
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def _install_fakes():
+    machine = types.ModuleType("machine")
+    machine.Pin = lambda *args, **kwargs: None
+    machine.I2C = lambda *args, **kwargs: None
+    machine.I2S = FakeI2S
+    micropython = types.ModuleType("micropython")
+    micropython.const = lambda x: x
+    micropython.alloc_emergency_exception_buf = lambda n: None
+
+    # adpcm.encode_into(pcm, out, state) on top of the backend codec,
+    # taking encode_ms per call as the device would
+    adpcm = types.ModuleType("adpcm")
+    adpcm.encode_ms = 0.0
+    def encode_into(pcm, out, state):
+        time.sleep(adpcm.encode_ms / 1000)
+        codes, state[0], state[1] = codec.encode_codes(np.frombuffer(pcm, dtype="<i2"), state[0], state[1])
+        packed = codec.pack_codes(codes)
+        out[:packed.size] = packed.tobytes()
+        return packed.size
+    adpcm.encode_into = encode_into
+    sys.modules.update({"machine": machine, "micropython": micropython,
+                        "es8311_base": types.ModuleType("es8311_base"), "adpcm": adpcm})
+
+
+class LinkEngine(ProtoEngine):
+    """ProtoEngine whose request bodies leave at `link` bytes/s."""
+    link = 12000
+
+    def _counted(self, chunks):
+        free = time.perf_counter()
+        for chunk in super()._counted(chunks):
+            free = max(free, time.perf_counter()) + len(chunk) / self.link
+            delay = free - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            yield chunk
+
+
+class TimedBackend(sensorServer.SensorBackend):
+    """Notes when an upload has arrived in full."""
+    received = None
+
+    def store(self, sid, fmt, data, transport):
+        self.received = time.perf_counter()
+        return super().store(sid, fmt, data, transport)
+
+
+def speech_like(size, rate):
+    """Tone bursts with pauses, ending in speech (no trailing silence)."""
+    t = np.arange(size // 2) / rate
+    envelope = np.abs(np.sin(2 * np.pi * 1.5 * t)) ** 0.5
+    x = envelope * (np.sin(2 * np.pi * 220 * t) + 0.5 * np.sin(2 * np.pi * 660 * t))
+    return (x * 9000).astype("<i2").tobytes()
+
+
+def _adpcm_chunks(pcm, length, chunk):
+    # the sequential path: encode after the recording, chunk by chunk
+    adpcm = sys.modules["adpcm"]
+    state = [0, 0]
+    out = bytearray(chunk // 4)
+    mv = memoryview(pcm)
+    for pos in range(0, length, chunk):
+        n = adpcm.encode_into(mv[pos:min(pos + chunk, length)], out, state)
+        yield memoryview(out)[:n]
+
+
+def run(eb, pt, backend, size, mode):
+    import echoBase
+    from recStream import RecordStream
+
+    recbuf = bytearray(size)
+    FakeI2S.fired = []
+    if eb.i2s is not None:
+        eb.i2s.pos = 0
+    backend.received = None
+    start = time.perf_counter()
+    if mode == "sequential":
+        eb.record(recbuf, size, useIrq=True)
+        while eb.getRecordStatus():
+            time.sleep(0.1)
+        resp = pt.upload_stream(_adpcm_chunks(recbuf, size, echoBase.CHUNK_SIZE), format="adpcm")
+    else:
+        rec = RecordStream(eb, recbuf, size)
+        rec.start()
+        resp = pt.upload_stream(rec.chunks(), format="adpcm")
+    end_of_capture = FakeI2S.fired[-1]
+    expected = codec.adpcm_encode(np.frombuffer(FakeI2S.signal[:size], dtype="<i2")).tobytes()
+    ok = (bytes(recbuf) == FakeI2S.signal[:size] and resp.get("size") == len(expected)
+          and resp.get("crc32") == zlib.crc32(expected))
+    return {"capture": end_of_capture - start, "latency": backend.received - end_of_capture,
+            "total": backend.received - start, "bytes": pt.last_upload_bytes, "ok": ok}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulate record-while-uploading against a local server")
+    parser.add_argument("-s", "--size", type=int, default=100000, help="Recording size in bytes (chatBotLoop: 100000)")
+    parser.add_argument("-r", "--rate", type=int, default=8000, help="Sample rate")
+    parser.add_argument("--link", type=int, default=12000, help="Uplink throughput in bytes/s")
+    parser.add_argument("--encode-ms", type=float, default=0.5, help="Simulated device time per encode_into() call")
+    parser.add_argument("-t", "--transport", choices=sensorServer.TRANSPORTS, default="binary", help="Upload transport")
+    args = parser.parse_args()
+
+    _install_fakes()
+    import echoBase
+
+    # compile the codec before anything is timed
+    codec.adpcm_encode(np.zeros(16, dtype=np.int16))
+    FakeI2S.signal = speech_like(args.size, args.rate)
+    sys.modules["adpcm"].encode_ms = args.encode_ms
+    LinkEngine.link = args.link
+
+    backend = TimedBackend()
+    url = sensorServer.start_in_thread(sensorServer.make_server(0, backend))
+    pt = LinkEngine("test", url, 1, sensorServer.DEFAULT_DEVICES["1"])
+    pt.transports = (args.transport,)
+    pt.connect()
+    pt.join()
+
+    eb = echoBase.EchoBase()
+    eb._sample_rate = args.rate
+    eb.es_handle = FakeCodec()
+
+    chunk_s = echoBase.CHUNK_SIZE / (args.rate * 2)
+    print(f"{args.size} bytes PCM ({args.size / (args.rate * 2):.2f} s), chunk {chunk_s * 1000:.0f} ms, "
+          f"link {args.link} B/s, {pt.transport} transport")
+    ok = True
+    for mode in ("sequential", "pipelined"):
+        r = run(eb, pt, backend, args.size, mode)
+        ok &= r["ok"]
+        print(f"{mode:10s} capture {r['capture']:6.2f} s  end of capture -> server {r['latency'] * 1000:7.0f} ms "
+              f"({r['latency'] / chunk_s:5.2f} chunks)  total {r['total']:6.2f} s  {r['bytes']} bytes: "
+              f"{'OK' if r['ok'] else 'MISMATCH'}")
+    pt.disconnect()
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,172 @@
+# recStream.py
+#
+# Record-while-uploading: overlap I2S capture, ADPCM encoding and the
+# network send.
+#
+# EchoBase.record(buffer, size, useIrq=True, chain=...) calls the chain once
+# per finished CHUNK_SIZE chunk from the I2S callback.  MicroPython runs that
+# callback in scheduled context (not as a hard IRQ), so the chain may call
+# into the adpcm module: each chunk is encoded there, straight into the
+# output buffer, with the encoder state carried between chunks.  chunks()
+# yields whatever is encoded so far and is meant as the source of
+# ProtoEngine.upload_stream(), which then sends during the recording.
+# When capture ends only the last chunk is left to encode and send.
+#
+#   rec = RecordStream(eb, recbuf, reclen)
+#   rec.start()
+#   resp = pt.upload_stream(rec.chunks(), format="adpcm")
+#
+# achunks() is the same for AsyncProtoEngine: it waits with asyncio sleeps
+# and leaves the loop to other tasks in between.
+
+import array
+import asyncio
+import time
+import adpcm
+from echoBase import CHUNK_SIZE
+
+try:
+    from time import sleep_ms
+except ImportError:
+    def sleep_ms(ms):
+        time.sleep(ms / 1000)
+
+POLL_MS = 5
+# give up if the I2S callback stops delivering for this long
+STALL_MS = 2000
+
+# False once adpcm.encode_into() has refused the state argument: the
+# adpcm.mpy binaries in micropython/mpyMods were built before adpcm.c took
+# it, and then every chunk is encoded from a zero state
+_stateful = True
+
+
+def _encode_into(pcm, out, state):
+    global _stateful
+    if _stateful:
+        try:
+            return adpcm.encode_into(pcm, out, state)
+        except TypeError:
+            _stateful = False
+    return adpcm.encode_into(pcm, out)
+
+
+class _AsyncChunks:
+    """RecordStream.chunks() as an async iterator."""
+    def __init__(self, rec):
+        self.rec = rec
+        self.data = rec.out if rec.out is not None else rec.pcm
+        self.sent = 0
+        self.idle = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        rec = self.rec
+        while True:
+            done = rec.done()
+            ready = rec.ready
+            if ready > self.sent:
+                mv = memoryview(self.data)[self.sent:ready]
+                self.sent = ready
+                self.idle = 0
+                return mv
+            if done:
+                raise StopAsyncIteration
+            if self.idle >= STALL_MS:
+                raise ValueError(f"Recording stalled after {rec.captured} of {rec.size} bytes.")
+            if hasattr(asyncio, "sleep_ms"):
+                await asyncio.sleep_ms(POLL_MS)
+            else:
+                await asyncio.sleep(POLL_MS / 1000)
+            self.idle += POLL_MS
+
+
+class RecordStream:
+    """
+    Pipelined capture of `size` bytes of 16-bit PCM into `pcm`.
+
+    format "adpcm" encodes each chunk in the I2S chain callback into an
+    internal buffer of size/4 bytes; "wav" passes the PCM through as it
+    arrives.  A RecordStream can be started again for the next recording.
+    """
+    def __init__(self, eb, pcm, size, format="adpcm"):
+        self.eb = eb
+        self.pcm = memoryview(pcm)[:size]
+        self.size = size
+        self.format = format
+        if format == "adpcm":
+            # 4 bits per sample, rounded up to a full byte
+            self.out = bytearray((size + 3) // 4)
+        else:
+            self.out = None
+        self.state = array.array("i", [0, 0])
+        self.captured = 0   # PCM bytes delivered by I2S
+        self.ready = 0      # output bytes ready to send
+
+    def start(self):
+        self.captured = 0
+        self.ready = 0
+        self.state[0] = 0
+        self.state[1] = 0
+        return self.eb.record(self.pcm, self.size, useIrq=True, chain=self._chain)
+
+    def done(self):
+        return self.captured >= self.size
+
+    def _chain(self, remaining):
+        # scheduled context: the chunk at self.captured has just been filled
+        pos = self.captured
+        n = CHUNK_SIZE if self.size - pos >= CHUNK_SIZE else self.size - pos
+        if n <= 0:
+            return
+        if self.out is not None:
+            w = _encode_into(self.pcm[pos:pos + n], memoryview(self.out)[self.ready:], self.state)
+            self.ready += w
+        else:
+            self.ready = pos + n
+        # set last: once done() is true, ready is final
+        self.captured = pos + n
+
+    def chunks(self):
+        """Encoded (or raw) data as it becomes available, until capture ends."""
+        data = self.out if self.out is not None else self.pcm
+        sent = 0
+        idle = 0
+        while True:
+            done = self.done()
+            ready = self.ready
+            if ready > sent:
+                yield memoryview(data)[sent:ready]
+                sent = ready
+                idle = 0
+            elif done:
+                return
+            else:
+                if idle >= STALL_MS:
+                    raise ValueError(f"Recording stalled after {self.captured} of {self.size} bytes.")
+                sleep_ms(POLL_MS)
+                idle += POLL_MS
+
+    def achunks(self):
+        """chunks() for AsyncProtoEngine.upload_stream(), with asyncio waits."""
+        return _AsyncChunks(self)
+
+    async def recording(self):
+        """
+        The whole encoded (or raw) recording once capture has ended, e.g.
+        to spool it after the upload failed.  A view into the stream's
+        buffer: copy or write it out before the next start().
+        """
+        idle = 0
+        while not self.done():
+            if idle >= STALL_MS:
+                raise ValueError(f"Recording stalled after {self.captured} of {self.size} bytes.")
+            if hasattr(asyncio, "sleep_ms"):
+                await asyncio.sleep_ms(POLL_MS)
+            else:
+                await asyncio.sleep(POLL_MS / 1000)
+            idle += POLL_MS
+        data = self.out if self.out is not None else self.pcm
+        return memoryview(data)[:self.ready]
@@ -1,40 +1,22 @@
-import struct
+import os
+import sys
 
-def write_adpcm_wav(input_path, output_path, sample_rate=22050, num_channels=1, block_align=256):
+import numpy as np
+
+# block framing lives in the backend codec
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "backend", "python", "adpcm"))
+from codec import adpcm_decode, write_ima_wav, DEFAULT_BLOCK_ALIGN
+
+
+def write_adpcm_wav(input_path, output_path, sample_rate=22050, block_align=DEFAULT_BLOCK_ALIGN):
+    # The sensor stream is headerless IMA ADPCM (high nibble first, state
+    # starting at zero). WAV format 0x11 needs a 4-byte predictor/index
+    # preamble per block and low-nibble-first data, so the stream is decoded
+    # and re-framed instead of being wrapped as is.
     with open(input_path, "rb") as f:
-        adpcm_data = f.read()
-
-    # IMA ADPCM mono: samplesPerBlock = ((blockAlign - 4) * 2) + 1
-    samples_per_block = ((block_align - 4) * 2) + 1
-    byte_rate = (sample_rate * block_align) // samples_per_block
-
-    # Chunks
-    fmt_chunk_size = 20  # 18 + 2 (for extra bytes)
-    data_chunk_size = len(adpcm_data)
-    riff_chunk_size = 4 + (8 + fmt_chunk_size) + (8 + data_chunk_size)
-
-    with open(output_path, "wb") as out:
-        # RIFF chunk
-        out.write(b'RIFF')
-        out.write(struct.pack('<I', riff_chunk_size))
-        out.write(b'WAVE')
-
-        # fmt chunk
-        out.write(b'fmt ')
-        out.write(struct.pack('<I', fmt_chunk_size))      # fmt chunk size
-        out.write(struct.pack('<H', 0x11))                # WAVE_FORMAT_ADPCM
-        out.write(struct.pack('<H', num_channels))        # mono
-        out.write(struct.pack('<I', sample_rate))         # sample rate
-        out.write(struct.pack('<I', byte_rate))           # byte rate
-        out.write(struct.pack('<H', block_align))         # block align
-        out.write(struct.pack('<H', 4))                   # bits per sample (ignored)
-        out.write(struct.pack('<H', 2))                   # cbSize (2 bytes follow)
-        out.write(struct.pack('<H', samples_per_block))   # samples per block
-
-        # data chunk
-        out.write(b'data')
-        out.write(struct.pack('<I', data_chunk_size))
-        out.write(adpcm_data)
+        adpcm_data = np.frombuffer(f.read(), dtype=np.uint8)
+
+    write_ima_wav(output_path, adpcm_decode(adpcm_data), sample_rate, block_align)
 
     print(f"✅ Correct IMA ADPCM WAV written: {output_path}")
 
@@ -0,0 +1,234 @@
+# asyncHttp.py
+#
+# KeepAliveSession (keepAlive.py) on (u)asyncio streams, for AsyncProtoEngine.
+# Same scope and behaviour: POST with a JSON, bytes or iterator body (sync or
+# async iterators go out with chunked transfer encoding), one kept
+# connection to one host, a stale kept connection is replaced before use and
+# a replayable request that fails on a reused connection is sent again.
+# Responses are keepAlive.Response objects; with stream=True a 200 reply's
+# Content-Length body stays on the connection and is read with
+#   n = await resp.raw.readinto(buf)
+# Runs on MicroPython (asyncio, formerly uasyncio) and CPython.
+
+import asyncio
+import json as _json
+from keepAlive import Response, split_url
+try:
+    import select
+except ImportError:
+    select = None
+
+
+class AsyncBody:
+    """Unread Content-Length body of a streamed response."""
+    def __init__(self, http, length, keep):
+        self.http = http
+        self.reader = http.reader
+        self.remaining = length
+        self.keep = keep
+        if not length:
+            self._done()
+
+    def _done(self):
+        if self.http is not None and not self.keep:
+            self.http.close()
+        self.http = None
+
+    async def readinto(self, buf):
+        if self.remaining <= 0:
+            return 0
+        mv = memoryview(buf)
+        if len(mv) > self.remaining:
+            mv = mv[:self.remaining]
+        if hasattr(self.reader, "readinto"):
+            n = await self.reader.readinto(mv)
+        else:
+            # CPython StreamReader has no readinto()
+            part = await self.reader.read(len(mv))
+            n = len(part)
+            mv[:n] = part
+        if not n:
+            self.remaining = 0
+            self.keep = False
+            self._done()
+            raise OSError("connection closed in body")
+        self.remaining -= n
+        if self.remaining <= 0:
+            self._done()
+        return n
+
+    async def read(self, n=-1):
+        if n < 0:
+            n = self.remaining
+        buf = bytearray(min(n, self.remaining))
+        got = 0
+        while got < len(buf):
+            got += await self.readinto(memoryview(buf)[got:])
+        return bytes(buf)
+
+    def close(self):
+        # an unfinished body leaves the connection mid-response
+        if self.http is not None and self.remaining > 0:
+            self.http.close()
+        self.http = None
+
+
+class AsyncHttp:
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.peer = None
+        self.connections = 0  # connections opened
+        self.reconnects = 0   # kept connections found closed or failing
+        self.requests = 0
+
+    def close(self):
+        if self.writer is not None:
+            try:
+                self.writer.close()
+            except Exception:
+                pass
+        self.reader = None
+        self.writer = None
+        self.peer = None
+
+    def _stale(self):
+        # CPython notices the server's FIN by itself, MicroPython's Stream
+        # has to be asked like the socket in KeepAliveSession._stale()
+        at_eof = getattr(self.reader, "at_eof", None)
+        if at_eof is not None:
+            return at_eof()
+        sock = getattr(self.reader, "s", None)
+        if sock is None or select is None:
+            return False
+        p = select.poll()
+        p.register(sock, select.POLLIN)
+        return bool(p.poll(0))
+
+    async def _open(self, proto, host, port):
+        """Make sure a connection to host is open; True if it was kept from before."""
+        peer = (proto, host, port)
+        if self.writer is not None:
+            if self.peer == peer and not self._stale():
+                return True
+            if self.peer == peer:
+                self.reconnects += 1
+            self.close()
+        if proto == "https:":
+            opening = asyncio.open_connection(host, port, ssl=True)
+        else:
+            opening = asyncio.open_connection(host, port)
+        self.reader, self.writer = await asyncio.wait_for(opening, self.timeout)
+        self.peer = peer
+        self.connections += 1
+        return False
+
+    async def post(self, url, data=None, json=None, headers=None, stream=False):
+        proto, host, hostname, port, path = split_url(url)
+        if json is not None:
+            data = _json.dumps(json)
+            headers = dict(headers or {})
+            headers["Content-Type"] = "application/json"
+        if isinstance(data, str):
+            data = data.encode()
+        replay = data is None or isinstance(data, (bytes, bytearray, memoryview))
+        self.requests += 1
+        while True:
+            reused = await self._open(proto, hostname, port)
+            try:
+                await self._send(host, path, data, headers)
+                # a streamed body is sent before the reply is awaited, the
+                # timeout covers the server's answer
+                return await asyncio.wait_for(self._receive(stream), self.timeout)
+            except asyncio.TimeoutError:
+                self.close()
+                raise
+            except (OSError, EOFError):
+                self.close()
+                if not (reused and replay):
+                    raise
+                self.reconnects += 1
+
+    async def _send(self, host, path, data, headers):
+        w = self.writer
+        head = "POST /%s HTTP/1.1\r\nHost: %s\r\n" % (path, host)
+        for k in headers or {}:
+            head += "%s: %s\r\n" % (k, headers[k])
+        chunked = not (data is None or isinstance(data, (bytes, bytearray, memoryview)))
+        if chunked:
+            head += "Transfer-Encoding: chunked\r\n\r\n"
+        else:
+            head += "Content-Length: %d\r\n\r\n" % (len(data) if data is not None else 0)
+        w.write(head.encode())
+        if chunked:
+            if hasattr(data, "__aiter__"):
+                # MicroPython has no async generators: an object with __anext__
+                data = data.__aiter__()
+                while True:
+                    try:
+                        chunk = await data.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    await self._send_chunk(chunk)
+            else:
+                for chunk in data:
+                    await self._send_chunk(chunk)
+            w.write(b"0\r\n\r\n")
+        elif data:
+            w.write(data)
+        await w.drain()
+
+    async def _send_chunk(self, chunk):
+        if len(chunk):
+            w = self.writer
+            w.write(("%x\r\n" % len(chunk)).encode())
+            # write() copies what it cannot send at once, so the caller
+            # may reuse the chunk's buffer after this
+            w.write(chunk)
+            w.write(b"\r\n")
+            await w.drain()
+
+    async def _receive(self, stream=False):
+        r = self.reader
+        line = await r.readline()
+        if not line:
+            raise OSError("connection closed")
+        parts = line.split(None, 2)
+        status = int(parts[1])
+        headers = {}
+        while True:
+            line = await r.readline()
+            if not line or line == b"\r\n" or line == b"\n":
+                break
+            k, v = line.decode().split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+        keep = parts[0] == b"HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            content = bytearray()
+            while True:
+                size = int((await r.readline()).split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    break
+                content += await r.readexactly(size)
+                await r.readline()
+            while (await r.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            content = bytes(content)
+        elif "content-length" in headers:
+            length = int(headers["content-length"])
+            if stream and status == 200:
+                return Response(status, headers, None, AsyncBody(self, length, keep))
+            content = await r.readexactly(length) if length else b""
+        else:
+            # body ends with the connection
+            content = b""
+            while True:
+                part = await r.read(4096)
+                if not part:
+                    break
+                content += part
+            keep = False
+        if not keep:
+            self.close()
+        return Response(status, headers, content)
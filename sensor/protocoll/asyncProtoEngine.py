@@ -0,0 +1,460 @@
+# asyncProtoEngine.py
+#
+# ProtoEngine with coroutines, so recording, uploading, downloading, playback
+# and display updates can run as (u)asyncio tasks side by side instead of one
+# phase blocking the next.  The protocol (payloads, transports, tokens,
+# result handling) is ProtoEngine's; only the waiting is different: network
+# I/O goes through AsyncHttp on asyncio streams and polling sleeps yield to
+# the other tasks.  Every ProtoEngine request method is a coroutine here:
+#
+#   pt = AsyncProtoEngine(ssid, baseUrl, id, key)
+#   await pt.connect()
+#   await pt.join()
+#   resp = await pt.upload_stream(rec.achunks(), format="adpcm")
+#   ready = await pt.wait_ready(resp["uuid"], format="wav")
+#   async for buf in pt.iter_download(resp["uuid"], format="wav"):
+#       ...
+#
+# upload_stream() takes async sources (objects with __aiter__, MicroPython
+# has no async generators) as well as everything ProtoEngine.upload_stream()
+# takes; a blocking source blocks the loop while it is read, of course.
+# Runs on MicroPython and CPython.
+
+import asyncio
+import binascii
+from protoEngine import ProtoEngine, embedded, _ticks_ms, _ticks_diff, LONGPOLL_MAX, BACKOFF_START, BACKOFF_MAX
+from protoEngine import NET_ERRORS, _Resume, _crc32, _crc_list, _check_block
+from chunkTuner import CHUNK_MIN
+from wifiConnect import POLL_MS as WIFI_POLL_MS
+from asyncHttp import AsyncHttp
+
+
+def sleep_ms(ms):
+    if hasattr(asyncio, "sleep_ms"):
+        return asyncio.sleep_ms(ms)
+    return asyncio.sleep(ms / 1000)
+
+
+class _UploadBody:
+    """Upload body from a sync or async source: raw chunks or base64 JSON."""
+    def __init__(self, engine, source, format, chunk_size):
+        self.engine = engine
+        if hasattr(source, "__aiter__"):
+            self.source = source.__aiter__()
+            self.sync = None
+        else:
+            self.source = None
+            self.sync = engine._chunks(source, chunk_size)
+        self.base64 = engine.transport != "binary"
+        self.pending = [engine._base64_head(format)] if self.base64 else []
+        self.carry = b""
+        self.ended = False
+        engine.last_upload_bytes = 0
+
+    def __aiter__(self):
+        return self
+
+    async def _next(self):
+        if self.sync is not None:
+            try:
+                return next(self.sync)
+            except StopIteration:
+                return None
+        try:
+            return await self.source.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    async def __anext__(self):
+        while not self.pending:
+            if self.ended:
+                raise StopAsyncIteration
+            chunk = await self._next()
+            if chunk is None:
+                self.ended = True
+                if self.base64:
+                    if self.carry:
+                        self.pending.append(binascii.b2a_base64(self.carry)[:-1])
+                    self.pending.append(b'"}')
+            elif not len(chunk):
+                # an empty chunk would end the chunked body early
+                continue
+            elif self.base64:
+                pieces, self.carry = self.engine._base64_part(chunk, self.carry)
+                self.pending.extend(pieces)
+            else:
+                self.pending.append(chunk)
+        piece = self.pending.pop(0)
+        self.engine.last_upload_bytes += len(piece)
+        return piece
+
+
+class _Download:
+    """Async iterator of AsyncProtoEngine.iter_download()."""
+    def __init__(self, engine, name, format, buffers, start):
+        self.engine = engine
+        self.name = name
+        self.format = format
+        self.buffers = buffers
+        self.tuned = buffers is None
+        self.block = CHUNK_MIN if self.tuned else len(buffers[0])
+        self.chunk = start
+        self.offset = 0 if start == 0 else None
+        self.resp = None
+        self.streamed = False
+        self.started = False
+        self.finished = False
+        self.i = 0
+        self.down = _Resume()
+        self.crcs = None
+
+    def __aiter__(self):
+        return self
+
+    def close(self):
+        """Stop early; drops the connection if the reply is half read."""
+        self.finished = True
+        if self.resp is not None:
+            self.resp.close()
+            self.resp = None
+
+    async def _start(self):
+        self.started = True
+        engine = self.engine
+        if engine.state != "connected":
+            raise ValueError("Not connected. Cannot download data.")
+        if engine.transport != "binary":
+            return
+        while True:
+            try:
+                self.resp = await engine._range(self.name, self.chunk, 0, self.format, True, stream=True,
+                                                block=self.block)
+            except ValueError:
+                if engine.state != "connected":
+                    raise
+                # 400: no range command on this server
+            except NET_ERRORS as e:
+                await sleep_ms(int(self.down.failed(e) * 1000))
+                continue
+            break
+        if self.resp is None:
+            return
+        self.streamed = True
+        engine.down_tuner.round_trip(engine.last_request_ms)
+        if self.tuned:
+            self.buffers = [None, None]
+        headers = self.resp.headers
+        self.down.size = int(headers.get("x-sensor-size", 0))
+        self.down.offset = self.down.base = int(headers.get("x-sensor-offset", -1))
+        self.crcs = _crc_list(self.resp)
+
+    async def __anext__(self):
+        if self.finished:
+            raise StopAsyncIteration
+        try:
+            if not self.started:
+                await self._start()
+            if self.streamed:
+                part = await self._streamed()
+            else:
+                part = await self._chunked()
+        except BaseException:
+            self.close()
+            raise
+        if part is None:
+            self.close()
+            raise StopAsyncIteration
+        self.i += 1
+        return part
+
+    async def _streamed(self):
+        """The next buffer, checked; resumed at its offset when it breaks (see ProtoEngine.iter_download)."""
+        down = self.down
+        engine = self.engine
+        mv = engine._rx_view(self.buffers, self.i, self.tuned)
+        while True:
+            if self.resp is None:
+                try:
+                    self.resp = await engine._range(self.name, 0, 0, self.format, True, stream=True,
+                                                    offset=down.offset, block=self.block)
+                except NET_ERRORS as e:
+                    await sleep_ms(int(down.failed(e) * 1000))
+                    continue
+                self.crcs = _crc_list(self.resp)
+                down.base = down.offset
+            n = 0
+            try:
+                raw = self.resp.raw
+                t0 = _ticks_ms()
+                while n < len(mv):
+                    got = await raw.readinto(mv[n:])
+                    if not got:
+                        break
+                    n += got
+                engine.down_tuner.transfer(n, _ticks_diff(_ticks_ms(), t0))
+                _check_block(down, self.crcs, mv, n, self.block)
+            except NET_ERRORS as e:
+                self.resp.close()
+                self.resp = None
+                if down.offset < 0:
+                    raise
+                engine.resent_bytes += n
+                engine.down_tuner.failed()
+                await sleep_ms(int(down.failed(e) * 1000))
+                continue
+            break
+        if n == 0:
+            return None
+        down.failures = 0
+        if down.offset >= 0:
+            down.offset += n
+        if n < len(mv):
+            self.finished = True
+        return mv[:n]
+
+    async def _chunked(self):
+        down = self.down
+        engine = self.engine
+        while True:
+            size = engine._chunk_size(self.buffers, self.i)
+            data = b""
+            try:
+                resp = await engine.download(self.name, self.chunk, format=self.format, offset=self.offset, size=size)
+                data = binascii.a2b_base64(resp.get("data", ""))
+                if "crc32" in resp and _crc32(data) != resp["crc32"]:
+                    raise OSError(f"CRC mismatch in chunk {self.chunk}")
+            except NET_ERRORS as e:
+                engine.resent_bytes += len(data)
+                engine.down_tuner.failed()
+                await sleep_ms(int(down.failed(e) * 1000))
+                continue
+            break
+        down.failures = 0
+        self.chunk, self.offset, done = engine._chunk_received(resp, data, size, self.chunk, self.offset)
+        if not data:
+            return None
+        if done:
+            self.finished = True
+        if self.buffers is not None:
+            mv = memoryview(self.buffers[self.i % len(self.buffers)])
+            mv[:len(data)] = data
+            data = mv[:len(data)]
+        return data
+
+
+class AsyncProtoEngine(ProtoEngine):
+    """
+    ProtoEngine whose network calls are coroutines, for use in an
+    asyncio event loop next to audio and display tasks.
+    """
+    def __init__(self, ssid, baseUrl, id, key):
+        super().__init__(ssid, baseUrl, id, key)
+        self.timeout = 30
+
+    async def connect(self):
+        """WifiConnector.connect() with awaited polls."""
+        if self.state != "offline":
+            return
+        wifi = self.wifi
+        if wifi is not None:
+            wifi.debug = self.debug
+            nic = wifi.interface()
+            while not nic.active():
+                await sleep_ms(WIFI_POLL_MS)
+            if not nic.isconnected():
+                for path in wifi.plan(self.ssid):
+                    timeout = wifi.start(nic, path, self.ssid, self.pwd)
+                    t0 = _ticks_ms()
+                    while not nic.isconnected() and _ticks_diff(_ticks_ms(), t0) < timeout:
+                        await sleep_ms(WIFI_POLL_MS)
+                    if wifi.finish(nic, path, self.ssid, nic.isconnected()):
+                        break
+                else:
+                    raise OSError(f"Wi-Fi connect to {self.ssid} failed")
+        if self.debug:
+            print("Network connected")
+        self._transit(self.state, "online")
+
+    async def disconnect(self):
+        super().disconnect()
+
+    async def _post(self, name, path, **kwargs):
+        """ProtoEngine._post() on an AsyncHttp connection."""
+        t0 = _ticks_ms()
+        if self.http is None:
+            self.http = AsyncHttp(self.timeout)
+        try:
+            resp = await self.http.post(self.base_url + path, **kwargs)
+        except Exception:
+            self._close_http()
+            raise
+        if not self.keepalive and resp.raw is None:
+            self._close_http()
+        self._timed(name, _ticks_diff(_ticks_ms(), t0))
+        return resp
+
+    async def _reauth(self):
+        self.token = None
+        if self.token_cache is not None:
+            self.token_cache.clear()
+        self._transit(self.state, "online")
+        await self.join(use_cache=False)
+
+    async def _ensure_token(self):
+        if self.state == "connected" and self._expiring(self.token_expires):
+            if self.debug:
+                print("Token about to expire, renewing")
+            await self._reauth()
+
+    async def _request(self, name, path, build):
+        await self._ensure_token()
+        resp = await self._post(name, path, **build())
+        if resp.status_code == 401:
+            resp.close()
+            if self.debug:
+                print("Token rejected, joining again")
+            await self._reauth()
+            resp = await self._post(name, path, **build())
+        return resp
+
+    async def join(self, use_cache=True):
+        if self.state != "online":
+            return
+        self._new_session()
+        if use_cache and self._cached_join():
+            return True
+        r = await self._post("join", "/sensorUpload.php", json=self._join_payload())
+        payload = self._challenge_payload(r)
+        r2 = await self._post("challenge", "/sensorUpload.php", json=payload)
+        return self._joined(r2)
+
+    async def upload(self, data, format="adpcm"):
+        if self.state != "connected":
+            raise ValueError("Not connected. Cannot upload data.")
+        resp = await self._request("upload", "/sensorUpload.php", lambda: self._upload_args(data, format))
+        return self._upload_result(resp)
+
+    async def upload_stream(self, source, format="adpcm", chunk_size=4096):
+        if self.state != "connected":
+            raise ValueError("Not connected. Cannot upload data.")
+        await self._ensure_token()
+        if self.transport == "binary":
+            headers = self._binary_headers(format)
+        else:
+            headers = {"Content-Type": "application/json"}
+        body = _UploadBody(self, source, format, chunk_size)
+        resp = await self._post("upload", "/sensorUpload.php", data=body, headers=headers)
+        return self._upload_result(resp)
+
+    async def upload_resumable(self, data, format="adpcm", part_size=0, nonce=None):
+        """ProtoEngine.upload_resumable(); the waits before resuming let other tasks run."""
+        if self.state != "connected":
+            raise ValueError("Not connected. Cannot upload data.")
+        mv = memoryview(data)
+        up = _Resume(len(mv), _crc32(mv), nonce)
+        while True:
+            try:
+                if up.key is None:
+                    resp = await self._request("open", "/sensorUpload.php", lambda: self._open_args(up, format))
+                    if resp.status_code == 400:
+                        resp.close()
+                        return await self.upload(data, format=format)
+                else:
+                    part = mv[up.offset:up.offset + (part_size or self.up_tuner.next())]
+                    self.resent_bytes += up.again(len(part))
+                    resp = await self._request("part", "/sensorUpload.php",
+                                               lambda: self._part_args(up, part, format))
+                    self._part_sent(len(part), resp)
+                result = self._resume_result(up, resp)
+            except NET_ERRORS as e:
+                up.key = None
+                self.up_tuner.failed()
+                await sleep_ms(int(up.failed(e) * 1000))
+                continue
+            if result is not None:
+                return result
+
+    async def check(self, name, format="adpcm", wait=0):
+        if self.state != "connected":
+            raise ValueError("Not connected. Cannot upload data.")
+        payload = self._check_payload(name, format, wait)
+        resp = await self._request("check", "/sensorDownload.php", lambda: {"json": self._with_token(payload)})
+        return self._check_result(resp)
+
+    async def download(self, name, chunk, format="adpcm", offset=None, size=0):
+        if self.state != "connected":
+            raise ValueError("Not connected. Cannot upload data.")
+        payload = self._download_payload(name, chunk, format, offset, size)
+        resp = await self._request("download", "/sensorDownload.php", lambda: {"json": self._with_token(payload)})
+        return self._download_result(resp)
+
+    async def wait_ready(self, name, timeout=60, format="adpcm"):
+        """ProtoEngine.wait_ready(); the backoff sleeps let other tasks run."""
+        t0 = _ticks_ms()
+        delay = BACKOFF_START
+        while True:
+            left = timeout - _ticks_diff(_ticks_ms(), t0) / 1000
+            resp = await self.check(name, format=format, wait=min(max(left, 0.1), LONGPOLL_MAX))
+            if resp.get("status") in ("ready", "failed"):
+                return resp
+            left = timeout - _ticks_diff(_ticks_ms(), t0) / 1000
+            if left <= 0:
+                return resp
+            if not resp.get("longpoll"):
+                if self.debug:
+                    print(f"Not ready, retrying in {delay}s...")
+                await sleep_ms(int(min(delay, left) * 1000))
+                delay = min(delay * 2, BACKOFF_MAX)
+
+    async def _range(self, name, start, count, format, binary, stream=False, offset=None, block=0):
+        payload = self._range_payload(name, start, count, format, binary, offset, block)
+        resp = await self._request("range", "/sensorDownload.php",
+                                   lambda: {"json": self._with_token(payload), "stream": stream})
+        return self._range_result(resp)
+
+    async def download_range(self, name, start=0, count=0, format="adpcm"):
+        if self.state != "connected":
+            raise ValueError("Not connected. Cannot download data.")
+        binary = self.transport == "binary"
+        resp = await self._range(name, start, count, format, binary)
+        return self._range_data(resp, start, format, binary)
+
+    def iter_download(self, name, format="adpcm", buffers=None, start=0):
+        """
+        ProtoEngine.iter_download() as an async iterator (async for).  Each
+        buffer is read with awaits, so playback and display tasks keep
+        running while the next chunk arrives, and a broken download is
+        resumed the same way.  close() it when leaving the loop early.
+        """
+        return _Download(self, name, format, buffers, start)
+
+
+if __name__ == "__main__":
+    if not embedded:
+        import argparse
+        parser = argparse.ArgumentParser()
+        parser.add_argument('-u', '--url', default='http://localhost:9000', help='Base URL for the server')
+        args = parser.parse_args()
+        baseUrl = args.url
+    else:
+        baseUrl = "https://llama.ok-lab-karlsruhe.de/platane/php"
+
+    async def main():
+        pt = AsyncProtoEngine("karlsruhe.freifunk.net", baseUrl, 1, "00112233445566778899aabbccddeeff")
+        pt.setDebug(True)
+        await pt.connect()
+        await pt.join()
+        resp = await pt.upload(b'This is a test payload for encryption.', format="adpcm")
+        print("Upload response:", resp)
+        name = resp.get("uuid")
+        if name:
+            resp = await pt.wait_ready(name, timeout=10, format="wav")
+            if resp.get("status") == "ready":
+                size = 0
+                async for buf in pt.iter_download(name, format="wav"):
+                    size += len(buf)
+                print("Downloaded", size, "bytes")
+        print(pt.stats())
+        await pt.disconnect()
+
+    asyncio.run(main())
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Host simulation of chunk sizing (chunkTuner.py): how long the playback of
+a reply stalls, and how much memory its chunks take, on links of
+different latency and bandwidth.
+
+ProtoEngine downloads a reply from the reference server
+(backend/python/sensorServer.py) through a session that runs the link on
+a virtual clock: a request takes the round trip plus its bytes at the
+link's rate, a streamed body its bytes at that rate as they are read (the
+link waits while nothing is read: the device's TCP window is small).
+protoEngine's clock is the virtual one, so the tuner measures the
+simulated link.  The reply is played as PlayStream does it: a buffer
+starts once it has arrived and the one before has finished, and the next
+is only fetched then.
+
+Strategies: fixed 4 KiB chunks (EchoBase's CHUNK_SIZE), fixed 64 KiB
+(sensorDownload.php's $chunkSize), and tuned, where the tuner sees
+--heap bytes of free heap.  Reported per transport, link and strategy:
+time to the first audio, stall time (playback waiting for data after it
+started), requests, and the most bytes held for one chunk, the memory
+footprint, marked when it is more than the free heap.  Checked: every
+reply arrives intact, and the tuned strategy stays within the heap.
+
+Usage:
+    python chunkSim.py [-s 20] [--format adpcm] [--heap 60000]
+"""
+import json
+import os
+import random
+import sys
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "..", "backend", "python"))
+
+import sensorServer
+import protoEngine
+from protoEngine import ProtoEngine
+from chunkTuner import ChunkTuner
+
+# name, round trip ms, kB/s
+PROFILES = (
+    ("lan", 5, 1000),
+    ("wifi", 30, 200),
+    ("far", 400, 64),
+    ("weak wifi", 150, 24),
+    ("slow", 80, 10),
+    ("far slow", 400, 8),
+)
+# bytes per second of playback
+PLAY_RATE = {"adpcm": 4000, "wav": 16000}
+
+
+class Clock:
+    """Virtual milliseconds, protoEngine's _ticks_ms while the simulation runs."""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class LinkSession(requests.Session):
+    """requests.Session whose requests take their time on the virtual clock."""
+    def __init__(self, link):
+        super().__init__()
+        self.link = link
+
+    def post(self, url, **kwargs):
+        link = self.link
+        body = kwargs.get("data")
+        sent = len(body) if isinstance(body, (bytes, str)) else len(json.dumps(kwargs.get("json")))
+        resp = super().post(url, **kwargs)
+        link.requests += 1
+        link.clock.now += link.rtt + sent / link.rate
+        if kwargs.get("stream"):
+            readinto = resp.raw.readinto
+
+            def timed(b):
+                n = readinto(b)
+                link.clock.now += n / link.rate
+                return n
+            resp.raw.readinto = timed
+        else:
+            link.clock.now += len(resp.content) / link.rate
+        return resp
+
+
+class Link:
+    def __init__(self, clock, rtt, kbs):
+        self.clock = clock
+        self.rtt = rtt
+        self.rate = kbs  # kB/s are bytes per ms
+        self.requests = 0
+
+
+class LinkEngine(ProtoEngine):
+    """ProtoEngine whose connections are LinkSessions."""
+    link = None
+
+    def _post(self, name, path, **kwargs):
+        if self.http is None:
+            self.http = LinkSession(self.link)
+        return super()._post(name, path, **kwargs)
+
+
+def _tuner(strategy, heap):
+    mem_free = lambda: heap
+    if strategy == "tuned":
+        return ChunkTuner(copies=3, mem_free=mem_free)
+    size = int(strategy.split()[1]) * 1024
+    return ChunkTuner(min_size=size, max_size=size, start=size, mem_free=mem_free)
+
+
+def play(pt, name, fmt, clock):
+    """Download and play `name`: (data, ms to first audio, ms stalled, ms in all)."""
+    rate = PLAY_RATE[fmt] / 1000
+    t0 = clock.now
+    first = None
+    play_end = None
+    stalled = 0.0
+    got = bytearray()
+    for data in pt.iter_download(name, format=fmt):
+        got += data
+        t = clock.now
+        if first is None:
+            first = t - t0
+            play_end = t
+        elif t > play_end:
+            stalled += t - play_end
+        # the next buffer is fetched once this one has started
+        clock.now = max(t, play_end)
+        play_end = clock.now + len(data) / rate
+    return bytes(got), first, stalled, play_end - t0
+
+
+def run(args):
+    backend = sensorServer.SensorBackend()
+    url = sensorServer.start_in_thread(sensorServer.make_server(0, backend))
+    clock = Clock()
+    protoEngine._ticks_ms = clock
+    reply = random.Random(args.seed).randbytes(int(args.seconds * PLAY_RATE[args.format]))
+    strategies = ("fixed 4", "fixed 64", "tuned")
+
+    print(f"{args.format} reply of {len(reply)} bytes ({args.seconds:.0f} s), {args.heap} bytes of free heap")
+    print(f"{'':6s} {'link':22s} {'chunks':9s} {'first audio':>11s} {'stalled':>9s} {'requests':>8s} {'memory':>8s}")
+    ok = True
+    for transport in sensorServer.TRANSPORTS:
+        for label, rtt, kbs in PROFILES:
+            for strategy in strategies:
+                link = Link(clock, rtt, kbs)
+                pt = LinkEngine("test", url, 1, sensorServer.DEFAULT_DEVICES["1"])
+                pt.transports = (transport,)
+                pt.link = link
+                pt.down_tuner = _tuner(strategy, args.heap)
+                pt.connect()
+                pt.join()
+                name = pt.upload(b"\0" * 64, format="adpcm")["uuid"]
+                backend.set_reply(name, args.format, reply)
+                link.requests = 0
+                data, first, stalled, total = play(pt, name, args.format, clock)
+                pt.disconnect()
+                peak = pt.down_tuner.peak
+                fits = peak <= args.heap
+                intact = data == reply
+                ok &= intact and (fits or strategy != "tuned")
+                note = "" if intact else " CORRUPTED"
+                print(f"{transport:6s} {label:10s} {rtt:4d} ms {kbs:4d} kB/s {strategy:9s} {first:8.0f} ms "
+                      f"{stalled:6.0f} ms {link.requests:8d} {peak:8d}{'' if fits else ' > heap'}{note}")
+    print("OK" if ok else "FAILED")
+    return ok
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stall time and memory of chunk sizes over simulated links")
+    parser.add_argument("-s", "--seconds", type=float, default=20, help="Reply length in seconds of audio")
+    parser.add_argument("--format", default="adpcm", choices=sorted(PLAY_RATE), help="Reply format")
+    parser.add_argument("--heap", type=int, default=60000, help="Free heap the tuner sees, bytes")
+    parser.add_argument("--seed", type=int, default=1)
+    return run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
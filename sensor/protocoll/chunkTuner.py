@@ -0,0 +1,134 @@
+# chunkTuner.py
+#
+# Chunk size for a session's transfers, chosen from the measured round
+# trip time, throughput and free heap, and changed between chunks as the
+# measurements come in.  ProtoEngine keeps one tuner for downloads
+# (download() chunks, iter_download() receive buffers) and one for
+# upload_resumable() parts.
+#
+#   size = tuner.next()              # before each chunk
+#   ... request size bytes, taking ms ...
+#   tuner.transfer(n, ms - rtt)      # after it
+#
+# A request costs a round trip on top of its bytes, so a chunk should
+# carry several bandwidth-delay products: at OVERHEAD = 0.1 the round
+# trip is at most a tenth of a chunk's time, which takes 9 x rate x RTT;
+# larger chunks only take more memory.  Before a round trip has been
+# measured a chunk takes CHUNK_MS at the measured rate.  Streamed replies
+# (one request for all chunks) have no round trip per chunk; their
+# buffers hold STREAM_MS of throughput.  Sizes start at `start` and at
+# most double from chunk to chunk (like TCP's slow start), so the first
+# audio is not held up by a large first chunk on a link not measured yet.
+# A lost chunk halves the size, and from there on it grows by CHUNK_MIN
+# per chunk only: on a lossy link smaller chunks cost less to send again.
+# Sizes are capped by MEM_SHARE of gc.mem_free() for the `copies` of a
+# chunk held at once (two rotating buffers; a base64 chunk is also held
+# as JSON text and decoded), are multiples of CHUNK_MIN and stay within
+# [min_size, max_size]; the server lowers the limit when it serves smaller
+# chunks than asked for.
+
+import gc
+
+CHUNK_MIN = 2048
+CHUNK_MAX = 64 * 1024
+CHUNK_START = 4096
+OVERHEAD = 0.1
+CHUNK_MS = 1000
+STREAM_MS = 250
+MEM_SHARE = 0.5
+# weight of a new measurement in the running averages
+ALPHA = 0.25
+
+
+def _mem_free():
+    return gc.mem_free()
+
+
+class ChunkTuner:
+    def __init__(self, min_size=CHUNK_MIN, max_size=CHUNK_MAX, start=CHUNK_START, copies=2, mem_free=None):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.start = start
+        self.copies = copies
+        # free heap in bytes; None on CPython, where there is no gc.mem_free()
+        if mem_free is None and hasattr(gc, "mem_free"):
+            mem_free = _mem_free
+        self.mem_free = mem_free
+        self.limit = max_size
+        self.reset()
+
+    def reset(self):
+        """A new session: forget the link, start small again."""
+        self.size = max(self.min_size, min(self.start, self.max_size))
+        self.rtt = None    # ms
+        self.rate = None   # bytes per ms
+        self.limit = self.max_size
+        self.threshold = None  # size of the last loss; growth is slow above it
+        self.started = False
+        self.peak = 0      # most bytes held for one chunk
+
+    def round_trip(self, ms):
+        """A request with (next to) no body took ms."""
+        ms = max(ms, 1)
+        self.rtt = ms if self.rtt is None else self.rtt + ALPHA * (ms - self.rtt)
+
+    def transfer(self, n, ms):
+        """n bytes arrived (or went out) in ms, not counting the round trip."""
+        if n < self.min_size // 2:
+            return  # the tail of a reply says little about the link
+        rate = n / max(ms, 1)
+        self.rate = rate if self.rate is None else self.rate + ALPHA * (rate - self.rate)
+
+    def failed(self):
+        """A chunk was lost or broken."""
+        self.size = max(self.min_size, self.size // 2 - self.size // 2 % CHUNK_MIN)
+        self.threshold = self.size
+
+    def server_limit(self, size):
+        """The server serves at most size bytes per chunk."""
+        if size > 0:
+            self.limit = max(self.min_size, min(self.limit, size))
+
+    def hold(self, n):
+        """n bytes are held for the chunk in flight."""
+        if n > self.peak:
+            self.peak = n
+
+    def budget(self):
+        """Largest chunk the free heap allows, None without gc.mem_free()."""
+        if self.mem_free is None:
+            return None
+        return int(self.mem_free() * MEM_SHARE) // self.copies
+
+    def want(self, streamed=False):
+        """The size the link asks for, None before it has been measured."""
+        if self.rate is None:
+            return None
+        if streamed:
+            return int(self.rate * STREAM_MS)
+        if self.rtt is None:
+            return int(self.rate * CHUNK_MS)
+        return int(self.rate * self.rtt * (1 - OVERHEAD) / OVERHEAD)
+
+    def next(self, streamed=False):
+        """Size of the next chunk."""
+        want = self.want(streamed)
+        if not self.started:
+            self.started = True
+            grow = self.size
+        elif self.threshold is not None and self.size >= self.threshold:
+            grow = self.size + CHUNK_MIN
+        else:
+            grow = 2 * self.size
+        size = grow if want is None else min(want, grow)
+        size = min(size, self.limit)
+        budget = self.budget()
+        if budget is not None:
+            size = min(size, budget)
+        size = max(self.min_size, size - size % CHUNK_MIN)
+        self.size = size
+        return size
+
+    def stats(self):
+        return {"size": self.size, "rtt_ms": self.rtt, "rate_kbs": None if self.rate is None else self.rate * 1000 / 1024,
+                "limit": self.limit, "peak": self.peak}
@@ -2,6 +2,11 @@
 """
 generate_german_audio.py - Generate German audio samples using Piper TTS
 Creates WAV files with German text for testing the sensor upload workflow
+
+With --socket the sentences go to the resident speech worker
+(backend/python/speechWorker.py) in batches of --batch, which keeps the
+voice loaded and returns 8000Hz audio, instead of starting piper and
+ffmpeg for every sentence.
 """
 
 import subprocess
@@ -12,6 +17,7 @@ import sys
 import wave
 import struct
 import tempfile
+import time
 
 # German sample sentences for testing
 SAMPLE_SENTENCES = [
@@ -145,19 +151,59 @@ def convert_to_raw_pcm(wav_file, output_pcm):
         print(f"Error extracting PCM: {e}")
         return False
 
-def generate_sample_sentences(output_dir="german_samples", sentences=None):
-    """Generate multiple German sample sentences"""
-    
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    if sentences is None:
-        sentences = SAMPLE_SENTENCES
-    
-    print(f"Generating {len(sentences)} German audio samples...")
-    print(f"Output directory: {output_dir}")
-    print("-" * 60)
-    
+def speech_client(socket_path):
+    """SpeechClient of backend/python/speechWorker.py, 8000Hz output"""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'backend', 'python'))
+    from speechWorker import SpeechClient
+    return SpeechClient(socket_path, rate=8000)
+
+def write_pcm_wav(pcm, rate, wav_path, pcm_path):
+    """Write int16 samples as WAV and raw PCM"""
+    with wave.open(wav_path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.astype('<i2').tobytes())
+    with open(pcm_path, 'wb') as f:
+        f.write(pcm.astype('<i2').tobytes())
+
+def generate_batched(items, speech, batch=8):
+    """Synthesize (text, wav_path, pcm_path) items through the speech worker, batch texts per request; returns the indices written"""
+    done = []
+    for start in range(0, len(items), batch):
+        part = items[start:start + batch]
+        try:
+            audio = speech.synthesize_many([text for text, _, _ in part])
+        except (OSError, RuntimeError) as e:
+            print(f"Speech worker error: {e}")
+            continue
+        for k, ((text, wav_path, pcm_path), (pcm, rate)) in enumerate(zip(part, audio)):
+            write_pcm_wav(pcm, rate, wav_path, pcm_path)
+            done.append(start + k)
+    return done
+
+def generate_sentences_worker(output_dir, sentences, speech, batch=8):
+    """Generate sample sentences through the speech worker"""
+    items = []
+    for i, text in enumerate(sentences, 1):
+        safe_text = text.lower().replace(' ', '_').replace(',', '').replace('?', '')[:30]
+        items.append((text, f"{i:02d}_{safe_text}.wav", f"{i:02d}_{safe_text}.pcm"))
+    start = time.time()
+    done = set(generate_batched([(t, os.path.join(output_dir, w), os.path.join(output_dir, p))
+                                 for t, w, p in items], speech, batch))
+    elapsed = time.time() - start
+    generated_files = []
+    for k, (text, wav_filename, pcm_filename) in enumerate(items):
+        if k in done:
+            print(f"  ✅ Generated: {wav_filename}")
+            generated_files.append({'text': text, 'wav': wav_filename, 'pcm': pcm_filename, 'index': k + 1})
+        else:
+            print(f"  ❌ Failed to generate audio: {text}")
+    print(f"\n⏱  {len(done)} sentences in {elapsed:.2f}s ({len(done) / max(elapsed, 1e-9):.1f} sentences/s)")
+    return generated_files
+
+def generate_sentences_piper(output_dir, sentences):
+    """Generate sample sentences one by one with Piper and FFmpeg"""
     generated_files = []
     
     for i, text in enumerate(sentences, 1):
@@ -208,6 +254,26 @@ def generate_sample_sentences(output_dir="german_samples", sentences=None):
             'index': i
         })
     
+    return generated_files
+
+def generate_sample_sentences(output_dir="german_samples", sentences=None, speech=None, batch=8):
+    """Generate multiple German sample sentences"""
+    
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    if sentences is None:
+        sentences = SAMPLE_SENTENCES
+    
+    print(f"Generating {len(sentences)} German audio samples...")
+    print(f"Output directory: {output_dir}")
+    print("-" * 60)
+    
+    if speech is not None:
+        generated_files = generate_sentences_worker(output_dir, sentences, speech, batch)
+    else:
+        generated_files = generate_sentences_piper(output_dir, sentences)
+    
     # Generate metadata file
     metadata = {
         'description': 'German audio samples generated with Piper TTS',
@@ -231,12 +297,21 @@ def generate_sample_sentences(output_dir="german_samples", sentences=None):
     
     return generated_files
 
-def generate_single_sample(text, output_wav, output_pcm=None):
+def generate_single_sample(text, output_wav, output_pcm=None, speech=None):
     """Generate a single German audio sample"""
     
     print(f"Generating German audio: {text}")
     print("-" * 60)
     
+    if speech is not None:
+        pcm_path = output_pcm or tempfile.NamedTemporaryFile(suffix='.pcm', delete=False).name
+        ok = bool(generate_batched([(text, output_wav, pcm_path)], speech))
+        if not output_pcm:
+            os.unlink(pcm_path)
+        if ok:
+            print(f"✅ Generated: {output_wav}")
+        return ok
+    
     # Generate audio with Piper
     temp_wav = tempfile.NamedTemporaryFile(suffix='.wav', delete=False).name
     
@@ -278,6 +353,9 @@ Examples:
   # Generate single custom sentence
   python3 generate_german_audio.py -t "Wie geht es dir?" -o custom.wav -p custom.pcm
   
+  # Generate through the resident speech worker, 8 sentences per request
+  python3 generate_german_audio.py --socket /run/platane/speech.sock -b 8
+  
   # List available voices
   python3 generate_german_audio.py -l
   
@@ -301,8 +379,13 @@ Examples:
     parser.add_argument('-v', '--voice', 
                        default='/opt/pyenvs/piper/voices/de_DE-thorsten-low.onnx',
                        help='Piper voice model to use')
+    parser.add_argument('--socket',
+                       help='Use the resident speech worker on this Unix socket')
+    parser.add_argument('-b', '--batch', type=int, default=8,
+                       help='Sentences per speech worker request (default: 8)')
     
     args = parser.parse_args()
+    speech = speech_client(args.socket) if args.socket else None
     
     # List voices
     if args.list:
@@ -325,10 +408,10 @@ Examples:
             print("Error: -o/--output required for single text mode")
             return 1
         
-        return 0 if generate_single_sample(args.text, args.output, args.pcm) else 1
+        return 0 if generate_single_sample(args.text, args.output, args.pcm, speech) else 1
     
     # Generate all sample sentences
-    return 0 if generate_sample_sentences(args.dir) else 1
+    return 0 if generate_sample_sentences(args.dir, speech=speech, batch=args.batch) else 1
 
 if __name__ == "__main__":
     try:
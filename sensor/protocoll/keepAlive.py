@@ -0,0 +1,269 @@
+# keepAlive.py
+#
+# Minimal HTTP/1.1 client that keeps its connection open between requests.
+# MicroPython's `requests` opens a new socket (and for https a new TLS
+# handshake) per call; ProtoEngine uses this instead on the device.  It runs
+# on CPython as well (the socket is wrapped with makefile() there), which is
+# how it is tested against backend/python/sensorServer.py.
+#
+# Only what ProtoEngine needs: POST with a JSON, bytes or generator body
+# (generators go out with chunked transfer encoding) and responses with
+# Content-Length, chunked or read-until-close bodies.  With stream=True a
+# Content-Length body is left on the socket and read through resp.raw
+# (readinto/read); the connection is reused once it has been read to the
+# end, resp.close() before that drops it.  One connection, to
+# one host at a time.  A kept connection the server has closed is noticed
+# before it is reused, and a request that fails on a reused connection is
+# sent again on a new one unless its body was a generator.
+
+import socket
+import json as _json
+try:
+    import select
+except ImportError:
+    select = None
+
+ETIMEDOUT = 110
+
+
+def split_url(url):
+    """proto, host (as in the Host header), hostname, port and path of url"""
+    proto, _, host, path = (url + "/").split("/", 3) if url.count("/") == 2 else url.split("/", 3)
+    port = 443 if proto == "https:" else 80
+    hostname = host
+    if ":" in host:
+        hostname, port = host.split(":", 1)
+        port = int(port)
+    return proto, host, hostname, port, path
+
+
+class Body:
+    """Unread Content-Length body of a streamed response."""
+    def __init__(self, session, length, keep):
+        self.session = session
+        self.stream = session.stream
+        self.remaining = length
+        self.keep = keep
+        if not length:
+            self._done()
+
+    def _done(self):
+        if self.session is not None and not self.keep:
+            self.session.close()
+        self.session = None
+
+    def readinto(self, buf):
+        if self.remaining <= 0:
+            return 0
+        mv = memoryview(buf)
+        if len(mv) > self.remaining:
+            mv = mv[:self.remaining]
+        n = self.stream.readinto(mv)
+        if not n:
+            self.remaining = 0
+            self.keep = False
+            self._done()
+            raise OSError("connection closed in body")
+        self.remaining -= n
+        if self.remaining <= 0:
+            self._done()
+        return n
+
+    def read(self, n=-1):
+        if n < 0:
+            n = self.remaining
+        buf = bytearray(min(n, self.remaining))
+        got = 0
+        while got < len(buf):
+            got += self.readinto(memoryview(buf)[got:])
+        return bytes(buf)
+
+    def close(self):
+        # an unfinished body leaves the connection mid-response
+        if self.session is not None and self.remaining > 0:
+            self.session.close()
+        self.session = None
+
+
+class Response:
+    def __init__(self, status_code, headers, content, raw=None):
+        self.status_code = status_code
+        self.headers = headers
+        self._content = content
+        self.raw = raw
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self.raw.read()
+        return self._content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return _json.loads(self.content)
+
+    def close(self):
+        if self.raw is not None:
+            self.raw.close()
+
+
+class KeepAliveSession:
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self.sock = None
+        self.stream = None
+        self.peer = None
+        self.connections = 0  # sockets opened
+        self.reconnects = 0   # kept connections found closed or failing
+        self.requests = 0
+
+    def close(self):
+        for obj in (self.stream, self.sock):
+            if obj is not None:
+                try:
+                    obj.close()
+                except Exception:
+                    pass
+        self.sock = None
+        self.stream = None
+        self.peer = None
+
+    def _stale(self):
+        # an idle kept connection has nothing to read, unless the server
+        # closed it (EOF) or sent something unexpected; both end it
+        if select is None:
+            return False
+        p = select.poll()
+        p.register(self.sock, select.POLLIN)
+        return bool(p.poll(0))
+
+    def _open(self, proto, host, port):
+        """Make sure a connection to host is open; True if it was kept from before."""
+        peer = (proto, host, port)
+        if self.sock is not None:
+            if self.peer == peer and not self._stale():
+                return True
+            if self.peer == peer:
+                self.reconnects += 1
+            self.close()
+        ai = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0]
+        s = socket.socket(ai[0], socket.SOCK_STREAM, ai[2])
+        s.settimeout(self.timeout)
+        try:
+            s.connect(ai[-1])
+            if proto == "https:":
+                import ssl
+                if hasattr(ssl, "create_default_context"):
+                    s = ssl.create_default_context().wrap_socket(s, server_hostname=host)
+                else:
+                    s = ssl.wrap_socket(s, server_hostname=host)
+        except Exception:
+            s.close()
+            raise
+        self.sock = s
+        # MicroPython sockets are streams already, CPython needs a file object
+        self.stream = s if hasattr(s, "readline") else s.makefile("rwb")
+        self.peer = peer
+        self.connections += 1
+        return False
+
+    def post(self, url, data=None, json=None, headers=None, stream=False):
+        proto, host, hostname, port, path = split_url(url)
+        if json is not None:
+            data = _json.dumps(json)
+            headers = dict(headers or {})
+            headers["Content-Type"] = "application/json"
+        if isinstance(data, str):
+            data = data.encode()
+        replay = data is None or isinstance(data, (bytes, bytearray, memoryview))
+        self.requests += 1
+        while True:
+            reused = self._open(proto, hostname, port)
+            try:
+                self._send(host, path, data, headers)
+                return self._receive(stream)
+            except OSError as e:
+                self.close()
+                if not (reused and replay) or getattr(e, "errno", None) == ETIMEDOUT or "timed out" in str(e):
+                    raise
+                self.reconnects += 1
+
+    def _write(self, b):
+        self.stream.write(b)
+
+    def _send(self, host, path, data, headers):
+        head = "POST /%s HTTP/1.1\r\nHost: %s\r\n" % (path, host)
+        for k in headers or {}:
+            head += "%s: %s\r\n" % (k, headers[k])
+        chunked = not (data is None or isinstance(data, (bytes, bytearray, memoryview)))
+        if chunked:
+            head += "Transfer-Encoding: chunked\r\n\r\n"
+        else:
+            head += "Content-Length: %d\r\n\r\n" % (len(data) if data is not None else 0)
+        self._write(head.encode())
+        if chunked:
+            for chunk in data:
+                if len(chunk):
+                    self._write(("%x\r\n" % len(chunk)).encode())
+                    self._write(chunk)
+                    self._write(b"\r\n")
+            self._write(b"0\r\n\r\n")
+        elif data:
+            self._write(data)
+        if hasattr(self.stream, "flush"):
+            self.stream.flush()
+
+    def _read_exact(self, n):
+        buf = bytearray()
+        while len(buf) < n:
+            part = self.stream.read(n - len(buf))
+            if not part:
+                raise OSError("connection closed in body")
+            buf += part
+        return bytes(buf)
+
+    def _receive(self, stream=False):
+        line = self.stream.readline()
+        if not line:
+            raise OSError("connection closed")
+        parts = line.split(None, 2)
+        status = int(parts[1])
+        headers = {}
+        while True:
+            line = self.stream.readline()
+            if not line or line == b"\r\n" or line == b"\n":
+                break
+            k, v = line.decode().split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+        keep = parts[0] == b"HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            content = bytearray()
+            while True:
+                size = int(self.stream.readline().split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    break
+                content += self._read_exact(size)
+                self.stream.readline()
+            while self.stream.readline() not in (b"\r\n", b"\n", b""):
+                pass
+            content = bytes(content)
+        elif "content-length" in headers:
+            length = int(headers["content-length"])
+            if stream:
+                return Response(status, headers, None, Body(self, length, keep))
+            content = self._read_exact(length)
+        else:
+            # body ends with the connection
+            content = b""
+            while True:
+                part = self.stream.read(4096)
+                if not part:
+                    break
+                content += part
+            keep = False
+        if not keep:
+            self.close()
+        return Response(status, headers, content)
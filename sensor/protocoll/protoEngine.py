@@ -2,14 +2,115 @@ import requests
 import json
 import time
 import sys
+import os
 import binascii
 if not sys.platform.lower().startswith("linux"):
-    import network
     import cryptolib
+    from keepAlive import KeepAliveSession
+    from tokenCache import NvsTokenCache
+    from wifiConnect import NvsWifiCache
     embedded = True
+    _ticks_ms = time.ticks_ms
+    _ticks_diff = time.ticks_diff
 else:
     from Crypto.Cipher import AES
+    from urllib3.exceptions import HTTPError as _Urllib3Error
     embedded = False
+    def _ticks_ms():
+        return int(time.perf_counter() * 1000)
+    def _ticks_diff(a, b):
+        return a - b
+from tokenCache import token_expiry
+from chunkTuner import ChunkTuner, CHUNK_MIN
+from wifiConnect import WifiConnector
+
+# a transfer that broke off: connection lost, reply cut short or corrupted
+NET_ERRORS = (OSError, EOFError) if embedded else (OSError, EOFError, _Urllib3Error)
+
+# upload transports, preferred first; "base64" (JSON) works with every backend
+TRANSPORTS = ("binary", "base64")
+# wait_ready(): longest single long-poll (below the HTTP timeouts) and the
+# polling intervals used with servers that answer check() at once
+LONGPOLL_MAX = 20
+BACKOFF_START = 0.2
+BACKOFF_MAX = 2.0
+# a token is renewed this many seconds before it expires
+TOKEN_MARGIN = 30
+# before this (2024-01-01) the clock has not been set, and a cached token
+# is tried without judging its expiry; a 401 then starts a new handshake
+CLOCK_VALID = 1704067200
+# resumable transfers: first upload part size (then tuned, see
+# chunkTuner.py), resumes in a row without progress before giving up, and
+# the first wait before a resume (doubled each time)
+PART_SIZE = 4096
+RESUME_RETRIES = 5
+RESUME_BACKOFF = 0.25
+# headers of resumable transfers (see backend/python/sensorServer.py)
+H_UPLOAD = "X-Sensor-Upload"
+H_OFFSET = "X-Sensor-Offset"
+H_CRC = "X-Sensor-Crc32"
+
+
+def _crc32(data):
+    return binascii.crc32(data) & 0xffffffff
+
+
+def _nonce():
+    """Random hex string that tells uploads of the same data apart."""
+    return binascii.hexlify(os.urandom(6)).decode()
+
+
+class _Resume:
+    """Where a resumable transfer stands: committed offset, failures in a row."""
+    def __init__(self, size=0, crc=0, nonce=None):
+        self.size = size
+        self.crc = crc
+        self.nonce = nonce or _nonce()
+        self.key = None
+        self.offset = 0
+        self.high = 0       # end of what was sent so far
+        self.base = 0       # offset the current range reply started at
+        self.failures = 0
+
+    def again(self, n):
+        """n bytes go out at offset: how many of them went out before."""
+        end = self.offset + n
+        again = max(0, min(self.high, end) - self.offset)
+        self.high = max(self.high, end)
+        return again
+
+    def failed(self, e):
+        """Seconds to wait before resuming; raises `e` once retries are used up."""
+        self.failures += 1
+        if self.failures > RESUME_RETRIES:
+            raise e
+        return min(RESUME_BACKOFF * (1 << (self.failures - 1)), BACKOFF_MAX)
+
+
+def _crc_list(resp):
+    """CRC-32 per block of a range reply, None from servers that send none."""
+    crcs = resp.headers.get("x-sensor-crc32")
+    if crcs is None:
+        return None
+    return [int(c) for c in crcs.split(",")] if crcs else []
+
+
+def _check_block(down, crcs, mv, n, block=0):
+    """
+    Raise OSError if the n bytes just read are cut short or do not match
+    their CRCs, one per `block` bytes (default: the buffer).
+    """
+    if down.offset < 0:
+        return
+    if n < len(mv) and down.offset + n < down.size:
+        raise OSError(f"Reply cut short at {down.offset + n} of {down.size} bytes.")
+    if crcs is None or n == 0:
+        return
+    block = block or len(mv)
+    for pos in range(0, n, block):
+        k = (down.offset + pos - down.base) // block
+        if k >= len(crcs) or _crc32(mv[pos:min(n, pos + block)]) != crcs[k]:
+            raise OSError(f"CRC mismatch at {down.offset + pos}.")
 
 
 class ProtoEngine:
@@ -29,6 +130,29 @@ class ProtoEngine:
         self.key = key
         self.session = None
         self.token = None
+        self.transports = TRANSPORTS
+        self.transport = "base64"  # agreed during join()
+        self.last_upload_bytes = 0
+        # one kept-alive connection for all requests, see _post()
+        self.keepalive = True
+        self.http = None
+        self.timing = {}  # request name -> [count, total ms, max ms]
+        self.last_request_ms = 0
+        # token persistence across restarts, see join()
+        self.token_cache = None  # NvsTokenCache / FileTokenCache
+        self.token_expires = None
+        self.token_margin = TOKEN_MARGIN
+        self.handshakes = 0
+        self.handshakes_avoided = 0
+        # bytes sent or received again by resumed transfers
+        self.resent_bytes = 0
+        # chunk sizes from round trip, throughput and free heap, per session;
+        # a base64 chunk is held as JSON text, decoded and in a buffer
+        self.down_tuner = ChunkTuner(copies=3)
+        self.up_tuner = ChunkTuner(start=PART_SIZE)
+        # Wi-Fi connect, fast from the last access point with a cache
+        # (wifi.cache = NvsWifiCache()); None: the host is connected already
+        self.wifi = WifiConnector() if embedded else None
 
     def _transit(self, from_state, to_state):
         if from_state not in self._valid_states:
@@ -45,34 +169,9 @@ class ProtoEngine:
     def connect(self):
         if self.state != "offline":
             return
-        if embedded:
-            nic = network.WLAN(network.WLAN.IF_STA)
-            if not nic.active():
-                nic.active(True)
-            while not nic.active():
-                if self.debug:
-                    print("Waiting for network interface to become active...")
-                time.sleep(1)
-            try:
-                nic.connect(self.ssid, self.pwd)
-            except Exception as e:
-                if self.debug:
-                    print(f"Failed to connect to network: {e}")
-                nic.disconnect()
-                nic.active(False)
-                time.sleep(1)
-                nic.active(True)
-                nic.connect(self.ssid, self.pwd)
-            
-            while not nic.isconnected():
-                if self.debug:
-                    print("Waiting for network connection...")
-                time.sleep(1)
-                
-            if self.debug:
-                print("Network config:", nic.ifconfig()) 
-
-                
+        if self.wifi is not None:
+            self.wifi.debug = self.debug
+            self.wifi.connect(self.ssid, self.pwd)
         if self.debug:
             print("Network connected") 
 
@@ -81,20 +180,177 @@ class ProtoEngine:
     def disconnect(self):
         if self.state == "offline":
             return
-        if embedded:
-            nic = network.WLAN(network.WLAN.IF_STA)
-            nic.disconnect()
+        if self.wifi is not None:
+            self.wifi.interface().disconnect()
         self.session = None
         self.token = None   
+        self.transport = "base64"
+        self._close_http()
         self._transit(self.state, "offline")
         if self.debug:
             print("Disconnected from network.")
 
-    def join(self):
+    def _close_http(self):
+        if self.http is not None:
+            try:
+                self.http.close()
+            except Exception:
+                pass
+            self.http = None
+
+    def _post(self, name, path, **kwargs):
+        """
+        POST on the kept-alive connection (requests.Session on CPython,
+        KeepAliveSession on the device), which reconnects by itself when the
+        server has dropped it.  After a failure the connection is discarded,
+        so the next request starts over on a new one.  Timings are collected
+        per request name in self.timing.
+        """
+        t0 = _ticks_ms()
+        if not self.keepalive:
+            resp = requests.post(self.base_url + path, **kwargs)
+        else:
+            if self.http is None:
+                self.http = KeepAliveSession() if embedded else requests.Session()
+            try:
+                resp = self.http.post(self.base_url + path, **kwargs)
+            except Exception:
+                self._close_http()
+                raise
+        self._timed(name, _ticks_diff(_ticks_ms(), t0))
+        return resp
+
+    def _timed(self, name, dt):
+        self.last_request_ms = dt
+        if name in ("join", "challenge", "open"):
+            # small requests and replies: their time is the round trip
+            self.down_tuner.round_trip(dt)
+            self.up_tuner.round_trip(dt)
+        t = self.timing.get(name)
+        if t is None:
+            self.timing[name] = [1, dt, dt]
+        else:
+            t[0] += 1
+            t[1] += dt
+            if dt > t[2]:
+                t[2] = dt
+
+    def stats(self):
+        """Request timings and, on the device, connections opened."""
+        result = {"requests": {k: {"count": v[0], "total_ms": v[1], "max_ms": v[2]} for k, v in self.timing.items()}}
+        if self.http is not None and hasattr(self.http, "connections"):
+            result["connections"] = self.http.connections
+            result["reconnects"] = self.http.reconnects
+        result["handshakes"] = self.handshakes
+        result["handshakes_avoided"] = self.handshakes_avoided
+        result["resent_bytes"] = self.resent_bytes
+        result["down_chunks"] = self.down_tuner.stats()
+        result["up_parts"] = self.up_tuner.stats()
+        if self.wifi is not None:
+            result["wifi"] = self.wifi.stats()
+        return result
+
+    def _expiring(self, expires):
+        if not expires:
+            return False
+        now = time.time()
+        if now < CLOCK_VALID:
+            return False
+        return now > expires - self.token_margin
+
+    def _restore_token(self):
+        if self.token_cache is None:
+            return False
+        entry = self.token_cache.load()
+        if not entry or entry.get("url") != self.base_url or str(entry.get("id")) != str(self.id):
+            return False
+        if not entry.get("token") or self._expiring(entry.get("expires")):
+            return False
+        self.token = entry["token"]
+        self.session = entry.get("session")
+        transport = entry.get("transport", "base64")
+        self.transport = transport if transport in self.transports else "base64"
+        self.token_expires = entry.get("expires")
+        return True
+
+    def _store_token(self):
+        if self.token_cache is None:
+            return
+        try:
+            self.token_cache.save({"url": self.base_url, "id": self.id, "token": self.token, "session": self.session,
+                                   "transport": self.transport, "expires": self.token_expires})
+        except OSError as e:
+            if self.debug:
+                print("Token not cached:", e)
+
+    def _reauth(self):
+        """Drop the token (and its cached copy) and run the handshake again."""
+        self.token = None
+        if self.token_cache is not None:
+            self.token_cache.clear()
+        self._transit(self.state, "online")
+        self.join(use_cache=False)
+
+    def _ensure_token(self):
+        # renew shortly before expiry rather than after a rejected request
+        if self.state == "connected" and self._expiring(self.token_expires):
+            if self.debug:
+                print("Token about to expire, renewing")
+            self._reauth()
+
+    def _request(self, name, path, build):
+        """
+        _post() of build()'s arguments with a valid token: renewed first if
+        it is about to expire, and after a 401 renewed and sent once more.
+        build() runs per attempt, so it picks up the new token and session.
+        """
+        self._ensure_token()
+        resp = self._post(name, path, **build())
+        if resp.status_code == 401:
+            resp.close()
+            if self.debug:
+                print("Token rejected, joining again")
+            self._reauth()
+            resp = self._post(name, path, **build())
+        return resp
+
+    def join(self, use_cache=True):
+        """
+        Join/challenge handshake for a token.  With a token_cache a token
+        stored earlier, also before a restart, is taken instead while it
+        is valid; it is renewed lazily, before expiry or after a 401.
+        """
         if self.state != "online":
             return
+        self._new_session()
+        if use_cache and self._cached_join():
+            return True
         # part 1 
-        r = requests.post(self.base_url + "/sensorUpload.php", json={"id": self.id, "command": "join"})
+        r = self._post("join", "/sensorUpload.php", json=self._join_payload())
+        payload = self._challenge_payload(r)
+        # part 2
+        r2 = self._post("challenge", "/sensorUpload.php", json=payload)
+        return self._joined(r2)
+
+    def _new_session(self):
+        """Chunk sizes are found anew for every session (the link may have changed)."""
+        self.down_tuner.reset()
+        self.up_tuner.reset()
+
+    def _cached_join(self):
+        if not self._restore_token():
+            return False
+        self.handshakes_avoided += 1
+        if self.debug:
+            print("Using cached token, expires:", self.token_expires)
+        self._transit(self.state, "connected")
+        return True
+
+    def _join_payload(self):
+        return {"id": self.id, "command": "join", "transports": list(self.transports)}
+
+    def _challenge_payload(self, r):
+        """Take the join reply and answer its challenge."""
         if r.status_code != 200:
             raise ValueError(f"Join request failed with status code {r.status_code}.")
         data = r.json()
@@ -106,8 +362,10 @@ class ProtoEngine:
         if self.debug:
             print("Join response:", data)
         self.session = session
+        # servers that do not know about transports answer without one
+        transport = data.get("transport", "base64")
+        self.transport = transport if transport in self.transports else "base64"
         self._transit(self.state, "joining")
-        # part 2
         if self.debug:
             print("Preparing challenge response...")
             print(f"Challenge: {challenge}, IV: {iv}, Key: {self.key}")
@@ -123,10 +381,11 @@ class ProtoEngine:
         payload = {"command": "challenge", "session": self.session, "id": self.id, "challenge": response.hex()}
         if self.debug:
             print("Challenge payload:", payload)
-        r2 = requests.post(self.base_url + "/sensorUpload.php", json=payload)
+        return payload
+
+    def _joined(self, r2):
+        """Take the token from the challenge reply."""
         if r2.status_code != 200:
-            if r2.status_code == 401:
-                print(json.dumps(r2))
             raise ValueError(f"Join request failed with status code {r2.status_code}, {r2.text}.")
         data = r2.json()
         if self.debug:
@@ -134,15 +393,41 @@ class ProtoEngine:
         self.token = data.get("token", None)
         if not self.token:
             raise ValueError("Invalid challenge response from server.")
+        self.handshakes += 1
+        self.token_expires = token_expiry(self.token, data)
+        self._store_token()
         self._transit(self.state, "connected")
         return True
     
 
+    def _with_token(self, payload):
+        payload["token"] = self.token
+        return payload
+
+    def _binary_headers(self, format):
+        return {"Content-Type": "application/octet-stream",
+                "Authorization": "Bearer " + self.token,
+                "X-Sensor-Id": str(self.id),
+                "X-Sensor-Session": str(self.session),
+                "X-Sensor-Format": format}
+
     def upload(self, data, format="adpcm"):
         if self.state != "connected":
             raise ValueError("Not connected. Cannot upload data.")
+        resp = self._request("upload", "/sensorUpload.php", lambda: self._upload_args(data, format))
+        return self._upload_result(resp)
+
+    def _upload_args(self, data, format):
+        if self.transport == "binary":
+            # raw body, no base64 copy of the recording
+            self.last_upload_bytes = len(data)
+            return {"data": data, "headers": self._binary_headers(format)}
         payload = {"command": "data", "token": self.token, "session": self.session, "id": self.id, "format": format, "data": binascii.b2a_base64(data).decode('utf-8')}
-        resp = requests.post(self.base_url + "/sensorUpload.php", json=payload)
+        body = json.dumps(payload)
+        self.last_upload_bytes = len(body)
+        return {"data": body, "headers": {"Content-Type": "application/json"}}
+
+    def _upload_result(self, resp):
         if resp.status_code != 200:
             self._transit(self.state, "online")
             if self.debug:
@@ -153,11 +438,201 @@ class ProtoEngine:
             print("Upload response:", result)
         return result
 
-    def check(self,name, format="adpcm"):
+    def _chunks(self, source, chunk_size):
+        """Non-empty chunks from a generator, a readable stream or a buffer."""
+        if hasattr(source, "readinto"):
+            buf = bytearray(chunk_size)
+            mv = memoryview(buf)
+            while True:
+                n = source.readinto(buf)
+                if not n:
+                    break
+                yield mv[:n]
+        elif hasattr(source, "read"):
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            mv = memoryview(source)
+            for pos in range(0, len(mv), chunk_size):
+                yield mv[pos:pos + chunk_size]
+        else:
+            for chunk in source:
+                # an empty chunk would end the chunked body early
+                if len(chunk):
+                    yield chunk
+
+    def _base64_json(self, chunks, format):
+        """The JSON data command with the base64 field produced chunk by chunk."""
+        yield self._base64_head(format)
+        carry = b""
+        for chunk in chunks:
+            pieces, carry = self._base64_part(chunk, carry)
+            for piece in pieces:
+                yield piece
+        if carry:
+            yield binascii.b2a_base64(carry)[:-1]
+        yield b'"}'
+
+    def _base64_head(self, format):
+        head = json.dumps({"command": "data", "token": self.token, "session": self.session, "id": self.id, "format": format})
+        return (head[:-1] + ', "data": "').encode()
+
+    def _base64_part(self, chunk, carry):
+        """
+        base64 of carry + chunk as a list of pieces, and the bytes held back
+        for the next chunk: base64 needs groups of 3 bytes.
+        """
+        pieces = []
+        mv = memoryview(chunk)
+        if carry:
+            take = min(3 - len(carry), len(mv))
+            carry += bytes(mv[:take])
+            mv = mv[take:]
+            if len(carry) < 3:
+                return pieces, carry
+            pieces.append(binascii.b2a_base64(carry)[:-1])
+        cut = len(mv) - len(mv) % 3
+        if cut:
+            pieces.append(binascii.b2a_base64(mv[:cut])[:-1])
+        return pieces, bytes(mv[cut:])
+
+    def _counted(self, chunks):
+        self.last_upload_bytes = 0
+        for chunk in chunks:
+            self.last_upload_bytes += len(chunk)
+            yield chunk
+
+    def upload_stream(self, source, format="adpcm", chunk_size=4096):
+        """
+        Upload without holding the recording in one piece: `source` is a
+        generator/iterator of bytes-like chunks, a stream with readinto() or
+        read(), or a buffer sent in chunk_size slices.  The body goes out with
+        chunked transfer encoding, raw with the binary transport or as
+        base64 JSON encoded on the fly otherwise.  Chunks are sent before the
+        next one is requested, so a generator may reuse its output buffer.
+        """
         if self.state != "connected":
             raise ValueError("Not connected. Cannot upload data.")
-        payload = {"command": "check", "token": self.token, "id": self.id, "name": name, "format": format}
-        resp = requests.post(self.base_url + "/sensorDownload.php", json=payload)
+        # a streamed body cannot be sent twice: renew an expiring token now
+        self._ensure_token()
+        chunks = self._chunks(source, chunk_size)
+        if self.transport == "binary":
+            headers = self._binary_headers(format)
+        else:
+            chunks = self._base64_json(chunks, format)
+            headers = {"Content-Type": "application/json"}
+        resp = self._post("upload", "/sensorUpload.php", data=self._counted(chunks), headers=headers)
+        return self._upload_result(resp)
+
+    def upload_resumable(self, data, format="adpcm", part_size=0, nonce=None):
+        """
+        upload() in parts the server commits one by one, each checked with
+        its CRC-32.  When a part or its reply is lost, the server is asked
+        how far it got ("open") and the upload goes on from there, so only
+        that part is sent again (self.resent_bytes).  Gives up, raising the
+        last error, after RESUME_RETRIES failures in a row.  The server
+        knows an upload by sensor, size, CRC-32 and `nonce` (random if not
+        given): the same data sent again with the same nonce, also after a
+        restart, resumes it or returns its result; with a new nonce it is a
+        new upload.  The server forgets an upload minutes after its last
+        part.  Servers without resumable uploads get a plain upload().
+        Parts are part_size bytes, or sized by self.up_tuner with part_size 0.
+        """
+        if self.state != "connected":
+            raise ValueError("Not connected. Cannot upload data.")
+        mv = memoryview(data)
+        up = _Resume(len(mv), _crc32(mv), nonce)
+        while True:
+            try:
+                if up.key is None:
+                    resp = self._request("open", "/sensorUpload.php", lambda: self._open_args(up, format))
+                    if resp.status_code == 400:
+                        resp.close()
+                        return self.upload(data, format=format)
+                else:
+                    part = mv[up.offset:up.offset + (part_size or self.up_tuner.next())]
+                    self.resent_bytes += up.again(len(part))
+                    resp = self._request("part", "/sensorUpload.php", lambda: self._part_args(up, part, format))
+                    self._part_sent(len(part), resp)
+                result = self._resume_result(up, resp)
+            except NET_ERRORS as e:
+                # ask where the server stands before sending more
+                up.key = None
+                self.up_tuner.failed()
+                time.sleep(up.failed(e))
+                continue
+            if result is not None:
+                return result
+
+    def _part_sent(self, n, resp):
+        tuner = self.up_tuner
+        if resp.status_code == 200:
+            tuner.transfer(n, self.last_request_ms - (tuner.rtt or 0))
+        elif resp.status_code == 409:
+            tuner.failed()
+
+    def _open_args(self, up, format):
+        payload = {"command": "open", "id": self.id, "format": format, "size": up.size, "crc32": up.crc,
+                   "nonce": up.nonce}
+        return {"json": self._with_token(payload)}
+
+    def _part_args(self, up, part, format):
+        crc = _crc32(part)
+        self.last_upload_bytes = len(part)
+        if self.transport == "binary":
+            headers = self._binary_headers(format)
+            headers[H_UPLOAD] = up.key
+            headers[H_OFFSET] = str(up.offset)
+            headers[H_CRC] = str(crc)
+            return {"data": bytes(part), "headers": headers}
+        payload = {"command": "part", "token": self.token, "session": self.session, "id": self.id, "upload": up.key,
+                   "offset": up.offset, "crc32": crc, "data": binascii.b2a_base64(part).decode('utf-8')}
+        return {"data": json.dumps(payload), "headers": {"Content-Type": "application/json"}}
+
+    def _resume_result(self, up, resp):
+        """The upload result once complete, else None; `up` follows the server's offset."""
+        if resp.status_code in (404, 409):
+            # upload unknown (server restarted) or not where we thought
+            reply = resp.json()
+            if self.debug:
+                print("Resume:", resp.status_code, reply)
+            if resp.status_code == 404:
+                up.key = None
+            up.offset = reply.get("offset", 0)
+            up.failed(ValueError(f"Upload request failed with status code {resp.status_code}, {reply}."))
+            return None
+        if resp.status_code != 200:
+            return self._upload_result(resp)
+        result = resp.json()
+        up.key = result.get("upload", up.key)
+        offset = result.get("offset", 0)
+        if offset > up.offset or "uuid" in result:
+            up.failures = 0
+        up.offset = offset
+        if "uuid" in result:
+            if self.debug:
+                print("Upload response:", result)
+            return result
+        return None
+
+    def check(self,name, format="adpcm", wait=0):
+        if self.state != "connected":
+            raise ValueError("Not connected. Cannot upload data.")
+        payload = self._check_payload(name, format, wait)
+        resp = self._request("check", "/sensorDownload.php", lambda: {"json": self._with_token(payload)})
+        return self._check_result(resp)
+
+    def _check_payload(self, name, format, wait):
+        payload = {"command": "check", "id": self.id, "name": name, "format": format}
+        if wait > 0:
+            # long-poll: the server may hold the request up to `wait` s
+            payload["wait"] = wait
+        return payload
+
+    def _check_result(self, resp):
         if resp.status_code == 408:
             if self.debug:
                 print("Check response: file not ready, retry later.")
@@ -172,11 +647,26 @@ class ProtoEngine:
             print("Upload response:", result)
         return result
     
-    def download(self,name,chunk, format="adpcm"):
+    def download(self,name,chunk, format="adpcm", offset=None, size=0):
+        """
+        Chunk `chunk` of the reply, or with `offset` the `size` bytes (at
+        most the server's chunk size) from that byte on; servers that serve
+        byte ranges say so with "offset" in their reply.
+        """
         if self.state != "connected":
             raise ValueError("Not connected. Cannot upload data.")
-        payload = {"command": "down", "token": self.token, "id": self.id, "name": name, "chunk": chunk, "format": format}
-        resp = requests.post(self.base_url + "/sensorDownload.php", json=payload)
+        payload = self._download_payload(name, chunk, format, offset, size)
+        resp = self._request("download", "/sensorDownload.php", lambda: {"json": self._with_token(payload)})
+        return self._download_result(resp)
+
+    def _download_payload(self, name, chunk, format, offset=None, size=0):
+        payload = {"command": "down", "id": self.id, "name": name, "chunk": chunk, "format": format}
+        if offset is not None:
+            payload["offset"] = offset
+            payload["chunksize"] = size
+        return payload
+
+    def _download_result(self, resp):
         if resp.status_code != 200:
             self._transit(self.state, "online")
             if self.debug:
@@ -187,6 +677,243 @@ class ProtoEngine:
             print("Download response:", result)
         return result
 
+    def wait_ready(self, name, timeout=60, format="adpcm"):
+        """
+        Wait until the reply for `name` is ready (or the server reports
+        it "failed") and return the check() result, or the last "not
+        ready" one after `timeout` seconds.
+        Servers that support it hold the check until the file exists
+        ("longpoll" in their 408 reply); with others check() is repeated
+        with exponential backoff.
+        """
+        t0 = _ticks_ms()
+        delay = BACKOFF_START
+        while True:
+            left = timeout - _ticks_diff(_ticks_ms(), t0) / 1000
+            resp = self.check(name, format=format, wait=min(max(left, 0.1), LONGPOLL_MAX))
+            if resp.get("status") in ("ready", "failed"):
+                return resp
+            left = timeout - _ticks_diff(_ticks_ms(), t0) / 1000
+            if left <= 0:
+                return resp
+            if not resp.get("longpoll"):
+                if self.debug:
+                    print(f"Not ready, retrying in {delay}s...")
+                time.sleep(min(delay, left))
+                delay = min(delay * 2, BACKOFF_MAX)
+
+    def _range(self, name, start, count, format, binary, stream=False, offset=None, block=0):
+        payload = self._range_payload(name, start, count, format, binary, offset, block)
+        resp = self._request("range", "/sensorDownload.php",
+                             lambda: {"json": self._with_token(payload), "stream": stream})
+        return self._range_result(resp)
+
+    def _range_payload(self, name, start, count, format, binary, offset=None, block=0):
+        payload = {"command": "range", "id": self.id, "name": name, "format": format,
+                   "start": start, "count": count, "transport": "binary" if binary else "base64"}
+        if offset is not None:
+            payload["offset"] = offset
+        if block:
+            # CRC-32 per receive buffer
+            payload["block"] = block
+        return payload
+
+    def _range_result(self, resp):
+        if resp.status_code != 200:
+            if resp.status_code != 400:
+                self._transit(self.state, "online")
+            if self.debug:
+                print("Range response:", resp.status_code, resp.text)
+            raise ValueError(f"Range request failed with status code {resp.status_code}, {resp.text}.")
+        return resp
+
+    def download_range(self, name, start=0, count=0, format="adpcm"):
+        """
+        Chunks start .. start+count-1 (count 0: up to the end) in one
+        request, raw with the binary transport and base64 JSON otherwise.
+        Returns the fields of download() with "data" already decoded.
+        """
+        if self.state != "connected":
+            raise ValueError("Not connected. Cannot download data.")
+        binary = self.transport == "binary"
+        resp = self._range(name, start, count, format, binary)
+        return self._range_data(resp, start, format, binary)
+
+    def _range_data(self, resp, start, format, binary):
+        if binary:
+            data = resp.content
+            result = {"data": data, "format": format, "start": start, "length": len(data),
+                      "chunks": int(resp.headers.get("x-sensor-chunks", 0)),
+                      "chunksize": int(resp.headers.get("x-sensor-chunksize", 0))}
+        else:
+            result = resp.json()
+            result["data"] = binascii.a2b_base64(result.get("data", ""))
+        if self.debug:
+            print("Range response:", result["length"], "bytes from chunk", start)
+        return result
+
+    def iter_download(self, name, format="adpcm", buffers=None, start=0):
+        """
+        The reply from chunk `start` to the end as one streamed response,
+        read into rotating preallocated `buffers`.  Yields a memoryview of
+        each filled buffer, valid until len(buffers) - 1 more have been
+        yielded, so one buffer can play while the next is received over
+        the same connection.  Servers without the binary transport or the
+        range command are read chunk by chunk with download() instead.
+        Without `buffers` two are allocated and their size, like the size
+        of the chunks asked for, follows self.down_tuner from buffer to
+        buffer: small at first, then what the link needs and the heap
+        allows.
+
+        Each buffer is checked against the CRC-32 the server sent for it
+        before it is yielded.  When the connection breaks or a buffer does
+        not match, the download is resumed at the first byte not yet
+        yielded (RESUME_RETRIES times in a row at most), so only the
+        broken buffer comes again.
+        """
+        if self.state != "connected":
+            raise ValueError("Not connected. Cannot download data.")
+        tuned = buffers is None
+        block = CHUNK_MIN if tuned else len(buffers[0])
+        down = _Resume()
+        resp = None
+        while self.transport == "binary":
+            try:
+                resp = self._range(name, start, 0, format, True, stream=True, block=block)
+            except ValueError:
+                if self.state != "connected":
+                    raise
+                break  # 400: no range command on this server
+            except NET_ERRORS as e:
+                time.sleep(down.failed(e))
+                continue
+            break
+        if resp is None:
+            for part in self._iter_chunks(name, format, buffers, start):
+                yield part
+            return
+        self.down_tuner.round_trip(self.last_request_ms)
+        if tuned:
+            buffers = [None, None]
+        down.size = int(resp.headers.get("x-sensor-size", 0))
+        down.offset = down.base = int(resp.headers.get("x-sensor-offset", -1))
+        crcs = _crc_list(resp)
+        i = 0
+        try:
+            while True:
+                mv = self._rx_view(buffers, i, tuned)
+                if resp is None:
+                    try:
+                        resp = self._range(name, 0, 0, format, True, stream=True, offset=down.offset, block=block)
+                    except NET_ERRORS as e:
+                        time.sleep(down.failed(e))
+                        continue
+                    crcs = _crc_list(resp)
+                    down.base = down.offset
+                n = 0
+                try:
+                    raw = resp.raw
+                    t0 = _ticks_ms()
+                    while n < len(mv):
+                        got = raw.readinto(mv[n:])
+                        if not got:
+                            break
+                        n += got
+                    self.down_tuner.transfer(n, _ticks_diff(_ticks_ms(), t0))
+                    _check_block(down, crcs, mv, n, block)
+                except NET_ERRORS as e:
+                    resp.close()
+                    resp = None
+                    if down.offset < 0:
+                        raise  # no offsets from this server: cannot resume
+                    self.resent_bytes += n
+                    self.down_tuner.failed()
+                    time.sleep(down.failed(e))
+                    continue
+                if n == 0:
+                    break
+                down.failures = 0
+                if down.offset >= 0:
+                    down.offset += n
+                yield mv[:n]
+                if n < len(mv):
+                    break
+                i += 1
+        finally:
+            if resp is not None:
+                resp.close()
+
+    def _rx_view(self, buffers, i, tuned):
+        """
+        Where buffer i is received: with tuned buffers the size
+        self.down_tuner asks for, in a buffer replaced when that outgrows
+        it or needs less than half of it.
+        """
+        j = i % len(buffers)
+        if not tuned:
+            return memoryview(buffers[j])
+        tuner = self.down_tuner
+        size = tuner.next(streamed=True)
+        buf = buffers[j]
+        if buf is None or size > len(buf) or size < len(buf) // 2:
+            buffers[j] = None
+            buffers[j] = buf = bytearray(size)
+            tuner.hold(sum(len(b) for b in buffers if b is not None))
+        return memoryview(buf)[:size]
+
+    def _iter_chunks(self, name, format, buffers, start):
+        chunk = start
+        # from the start, chunks are asked for by byte offset and tuned size
+        offset = 0 if start == 0 else None
+        i = 0
+        down = _Resume()
+        while True:
+            size = self._chunk_size(buffers, i)
+            data = b""
+            try:
+                resp = self.download(name, chunk, format=format, offset=offset, size=size)
+                data = binascii.a2b_base64(resp.get("data", ""))
+                if "crc32" in resp and _crc32(data) != resp["crc32"]:
+                    raise OSError(f"CRC mismatch in chunk {chunk}")
+            except NET_ERRORS as e:
+                self.resent_bytes += len(data)
+                self.down_tuner.failed()
+                time.sleep(down.failed(e))
+                continue
+            down.failures = 0
+            chunk, offset, done = self._chunk_received(resp, data, size, chunk, offset)
+            if data:
+                if buffers is not None:
+                    mv = memoryview(buffers[i % len(buffers)])
+                    mv[:len(data)] = data
+                    data = mv[:len(data)]
+                yield data
+                i += 1
+            if done or not data:
+                return
+
+    def _chunk_size(self, buffers, i):
+        size = self.down_tuner.next()
+        if buffers is not None:
+            size = min(size, len(buffers[i % len(buffers)]))
+        return size
+
+    def _chunk_received(self, resp, data, size, chunk, offset):
+        """Measure a download() chunk; (next chunk, next offset, whether it was the last)."""
+        if "offset" not in resp:
+            # the server's own chunks, by number
+            chunk += 1
+            return chunk, None, chunk >= resp.get("chunks", 0)
+        tuner = self.down_tuner
+        tuner.transfer(len(data), self.last_request_ms - (tuner.rtt or 0))
+        tuner.hold(len(data) * 7 // 3)
+        served = resp.get("chunksize", 0)
+        if served < size:
+            tuner.server_limit(served)
+        offset = resp["offset"] + len(data)
+        return chunk + 1, offset, offset >= resp.get("size", 0)
+
+
 #a = cryptolib.aes("1234567812345678",2,b"1234123412341234")
 #x = a.encrypt(b"1234123412341234")
 #x.hex()
@@ -197,6 +924,7 @@ if __name__ == "__main__":
         import argparse
         parser = argparse.ArgumentParser()
         parser.add_argument('-u', '--url', default='http://localhost:9000', help='Base URL for the server')
+        parser.add_argument('-c', '--cache', default=None, help='File to keep the token in between runs')
         args = parser.parse_args()
         baseUrl = args.url
     else:
@@ -208,6 +936,12 @@ if __name__ == "__main__":
 
     pt = ProtoEngine("karlsruhe.freifunk.net", baseUrl, id, key)
     pt.setDebug(True)
+    if embedded:
+        pt.token_cache = NvsTokenCache()
+        pt.wifi.cache = NvsWifiCache()
+    elif args.cache:
+        from tokenCache import FileTokenCache
+        pt.token_cache = FileTokenCache(args.cache)
     pt.connect()    
     pt.join()
     if pt.state == "connected":
@@ -223,12 +957,9 @@ if __name__ == "__main__":
         print("Upload failed")
     else:
         print("Upload OK, name:", name)
-        while True:
-            resp = pt.check(name, format=format)
-            if resp.get("status") == "ready":
-                break
-            print("File not ready, retrying in 1s...")
-            time.sleep(1)
+        resp = pt.wait_ready(name, format=format)
+        if resp.get("status") != "ready":
+            print("File not ready after waiting")
         size = resp.get("size", 0)
         print("Check OK, size:", size)
         if size == 0:
@@ -4,12 +4,30 @@ import time
 import sys
 import binascii
 if not sys.platform.lower().startswith("linux"):
-    import network
     import cryptolib
+    from keepAlive import KeepAliveSession
+    from tokenCache import NvsTokenCache
+    from wifiConnect import NvsWifiCache
     embedded = True
+    _ticks_ms = time.ticks_ms
+    _ticks_diff = time.ticks_diff
 else:
     from Crypto.Cipher import AES
     embedded = False
+    def _ticks_ms():
+        return int(time.perf_counter() * 1000)
+    def _ticks_diff(a, b):
+        return a - b
+from tokenCache import token_expiry
+from wifiConnect import WifiConnector
+
+# upload transports, preferred first; "base64" (JSON) works with every backend
+TRANSPORTS = ("binary", "base64")
+# a token is renewed this many seconds before it expires
+TOKEN_MARGIN = 30
+# before this (2024-01-01) the clock has not been set, and a cached token
+# is tried without judging its expiry; a 401 then starts a new handshake
+CLOCK_VALID = 1704067200
 
 
 class ProtoEngine:
@@ -30,6 +48,23 @@ class ProtoEngine:
         self.key = key
         self.session = None
         self.token = None
+        self.transports = TRANSPORTS
+        self.transport = "base64"  # agreed during join()
+        self.last_upload_bytes = 0
+        # one kept-alive connection for all requests, see _post()
+        self.keepalive = True
+        self.http = None
+        self.timing = {}  # request name -> [count, total ms, max ms]
+        self.last_request_ms = 0
+        # token persistence across restarts, see join()
+        self.token_cache = None  # NvsTokenCache / FileTokenCache
+        self.token_expires = None
+        self.token_margin = TOKEN_MARGIN
+        self.handshakes = 0
+        self.handshakes_avoided = 0
+        # Wi-Fi connect, fast from the last access point with a cache
+        # (wifi.cache = NvsWifiCache()); None: the host is connected already
+        self.wifi = WifiConnector() if embedded else None
         self.conversation_id = None  # Track current conversation ID
         self.conversation_reset = False  # Track if conversation was reset
 
@@ -48,34 +83,9 @@ class ProtoEngine:
     def connect(self):
         if self.state != "offline":
             return
-        if embedded:
-            nic = network.WLAN(network.WLAN.IF_STA)
-            if not nic.active():
-                nic.active(True)
-            while not nic.active():
-                if self.debug:
-                    print("Waiting for network interface to become active...")
-                time.sleep(1)
-            try:
-                nic.connect(self.ssid, self.pwd)
-            except Exception as e:
-                if self.debug:
-                    print(f"Failed to connect to network: {e}")
-                nic.disconnect()
-                nic.active(False)
-                time.sleep(1)
-                nic.active(True)
-                nic.connect(self.ssid, self.pwd)
-            
-            while not nic.isconnected():
-                if self.debug:
-                    print("Waiting for network connection...")
-                time.sleep(1)
-                
-            if self.debug:
-                print("Network config:", nic.ifconfig()) 
-
-                
+        if self.wifi is not None:
+            self.wifi.debug = self.debug
+            self.wifi.connect(self.ssid, self.pwd)
         if self.debug:
             print("Network connected") 
 
@@ -84,20 +94,147 @@ class ProtoEngine:
     def disconnect(self):
         if self.state == "offline":
             return
-        if embedded:
-            nic = network.WLAN(network.WLAN.IF_STA)
-            nic.disconnect()
+        if self.wifi is not None:
+            self.wifi.interface().disconnect()
         self.session = None
         self.token = None   
+        self.transport = "base64"
+        self._close_http()
         self._transit(self.state, "offline")
         if self.debug:
             print("Disconnected from network.")
 
-    def join(self):
+    def _close_http(self):
+        if self.http is not None:
+            try:
+                self.http.close()
+            except Exception:
+                pass
+            self.http = None
+
+    def _post(self, name, path, **kwargs):
+        """
+        POST on the kept-alive connection (requests.Session on CPython,
+        KeepAliveSession on the device), which reconnects by itself when the
+        server has dropped it.  After a failure the connection is discarded,
+        so the next request starts over on a new one.  Timings are collected
+        per request name in self.timing.
+        """
+        t0 = _ticks_ms()
+        if not self.keepalive:
+            resp = requests.post(self.base_url + path, **kwargs)
+        else:
+            if self.http is None:
+                self.http = KeepAliveSession() if embedded else requests.Session()
+            try:
+                resp = self.http.post(self.base_url + path, **kwargs)
+            except Exception:
+                self._close_http()
+                raise
+        dt = _ticks_diff(_ticks_ms(), t0)
+        self.last_request_ms = dt
+        t = self.timing.get(name)
+        if t is None:
+            self.timing[name] = [1, dt, dt]
+        else:
+            t[0] += 1
+            t[1] += dt
+            if dt > t[2]:
+                t[2] = dt
+        return resp
+
+    def stats(self):
+        """Request timings and, on the device, connections opened."""
+        result = {"requests": {k: {"count": v[0], "total_ms": v[1], "max_ms": v[2]} for k, v in self.timing.items()}}
+        if self.http is not None and hasattr(self.http, "connections"):
+            result["connections"] = self.http.connections
+            result["reconnects"] = self.http.reconnects
+        result["handshakes"] = self.handshakes
+        result["handshakes_avoided"] = self.handshakes_avoided
+        if self.wifi is not None:
+            result["wifi"] = self.wifi.stats()
+        return result
+
+    def _expiring(self, expires):
+        if not expires:
+            return False
+        now = time.time()
+        if now < CLOCK_VALID:
+            return False
+        return now > expires - self.token_margin
+
+    def _restore_token(self):
+        if self.token_cache is None:
+            return False
+        entry = self.token_cache.load()
+        if not entry or entry.get("url") != self.base_url or str(entry.get("id")) != str(self.id):
+            return False
+        if not entry.get("token") or self._expiring(entry.get("expires")):
+            return False
+        self.token = entry["token"]
+        self.session = entry.get("session")
+        transport = entry.get("transport", "base64")
+        self.transport = transport if transport in self.transports else "base64"
+        self.token_expires = entry.get("expires")
+        return True
+
+    def _store_token(self):
+        if self.token_cache is None:
+            return
+        try:
+            self.token_cache.save({"url": self.base_url, "id": self.id, "token": self.token, "session": self.session,
+                                   "transport": self.transport, "expires": self.token_expires})
+        except OSError as e:
+            if self.debug:
+                print("Token not cached:", e)
+
+    def _reauth(self):
+        """Drop the token (and its cached copy) and run the handshake again."""
+        self.token = None
+        if self.token_cache is not None:
+            self.token_cache.clear()
+        self._transit(self.state, "online")
+        self.join(use_cache=False)
+
+    def _ensure_token(self):
+        # renew shortly before expiry rather than after a rejected request
+        if self.state == "connected" and self._expiring(self.token_expires):
+            if self.debug:
+                print("Token about to expire, renewing")
+            self._reauth()
+
+    def _request(self, name, path, build):
+        """
+        _post() of build()'s arguments with a valid token: renewed first if
+        it is about to expire, and after a 401 renewed and sent once more.
+        build() runs per attempt, so it picks up the new token and session.
+        """
+        self._ensure_token()
+        resp = self._post(name, path, **build())
+        if resp.status_code == 401:
+            resp.close()
+            if self.debug:
+                print("Token rejected, joining again")
+            self._reauth()
+            resp = self._post(name, path, **build())
+        return resp
+
+    def join(self, use_cache=True):
+        """
+        Join/challenge handshake for a token.  With a token_cache a token
+        stored earlier, also before a restart, is taken instead while it
+        is valid; it is renewed lazily, before expiry or after a 401.
+        """
         if self.state != "online":
             return
+        if use_cache and self._restore_token():
+            self.handshakes_avoided += 1
+            if self.debug:
+                print("Using cached token, expires:", self.token_expires)
+            self._transit(self.state, "connected")
+            return True
         # part 1 
-        r = requests.post(self.base_url + "/sensorRagUpload.php", json={"id": self.id, "command": "join"})
+        r = self._post("join", "/sensorRagUpload.php", json={"id": self.id, "command": "join", "transports": list(self.transports)})
         if r.status_code != 200:
             raise ValueError(f"Join request failed with status code {r.status_code}.")
         data = r.json()
@@ -109,6 +246,9 @@ class ProtoEngine:
         if self.debug:
             print("Join response:", data)
         self.session = session
+        # servers that do not know about transports answer without one
+        transport = data.get("transport", "base64")
+        self.transport = transport if transport in self.transports else "base64"
         self._transit(self.state, "joining")
         # part 2
         if self.debug:
@@ -126,10 +266,8 @@ class ProtoEngine:
         payload = {"command": "challenge", "session": self.session, "id": self.id, "challenge": response.hex()}
         if self.debug:
             print("Challenge payload:", payload)
-        r2 = requests.post(self.base_url + "/sensorRagUpload.php", json=payload)
+        r2 = self._post("challenge", "/sensorRagUpload.php", json=payload)
         if r2.status_code != 200:
-            if r2.status_code == 401:
-                print(json.dumps(r2))
             raise ValueError(f"Join request failed with status code {r2.status_code}, {r2.text}.")
         data = r2.json()
         if self.debug:
@@ -137,43 +275,147 @@ class ProtoEngine:
         self.token = data.get("token", None)
         if not self.token:
             raise ValueError("Invalid challenge response from server.")
+        self.handshakes += 1
+        self.token_expires = token_expiry(self.token, data)
+        self._store_token()
         self._transit(self.state, "connected")
         return True
     
 
+    def _with_token(self, payload):
+        payload["token"] = self.token
+        return payload
+
+    def _binary_headers(self, format):
+        return {"Content-Type": "application/octet-stream",
+                "Authorization": "Bearer " + self.token,
+                "X-Sensor-Id": str(self.id),
+                "X-Sensor-Session": str(self.session),
+                "X-Sensor-Format": format}
+
     def upload(self, data, format="adpcm"):
             if self.state != "connected":
                 raise ValueError("Not connected. Cannot upload data.")
-            payload = {"command": "data", "token": self.token, "session": self.session, "id": self.id, "format": format, "data": binascii.b2a_base64(data).decode('utf-8')}
-            resp = requests.post(self.base_url + "/sensorRagUpload.php", json=payload)
-            if resp.status_code != 200:
-                self._transit(self.state, "online")
-                if self.debug:
-                    print("Upload response:", resp.status_code, resp.text)
-                raise ValueError(f"Upload request failed with status code {resp.status_code}, {resp.text}.")
-            result = resp.json()
-            
-            # Update conversation tracking
-            if result.get("status") == "ok":
-                new_conversation_id = result.get("conversation_id")
-                conversation_reset = result.get("conversation_reset", False)
-                
-                if self.debug:
-                    print(f"Conversation tracking - ID: {new_conversation_id}, Reset: {conversation_reset}")
-                
-                # Update local conversation state
-                if conversation_reset or self.conversation_id != new_conversation_id:
-                    if self.debug and conversation_reset:
-                        print("Conversation was reset by server (stop command or timeout)")
-                    self.conversation_reset = conversation_reset
-                else:
-                    self.conversation_reset = False
-                
-                self.conversation_id = new_conversation_id
+            resp = self._request("upload", "/sensorRagUpload.php", lambda: self._upload_args(data, format))
+            return self._upload_result(resp)
+
+    def _upload_args(self, data, format):
+        if self.transport == "binary":
+            # raw body, no base64 copy of the recording
+            self.last_upload_bytes = len(data)
+            return {"data": data, "headers": self._binary_headers(format)}
+        payload = {"command": "data", "token": self.token, "session": self.session, "id": self.id, "format": format, "data": binascii.b2a_base64(data).decode('utf-8')}
+        body = json.dumps(payload)
+        self.last_upload_bytes = len(body)
+        return {"data": body, "headers": {"Content-Type": "application/json"}}
+
+    def _upload_result(self, resp):
+        if resp.status_code != 200:
+            self._transit(self.state, "online")
+            if self.debug:
+                print("Upload response:", resp.status_code, resp.text)
+            raise ValueError(f"Upload request failed with status code {resp.status_code}, {resp.text}.")
+        result = resp.json()
+        
+        # Update conversation tracking
+        if result.get("status") == "ok":
+            new_conversation_id = result.get("conversation_id")
+            conversation_reset = result.get("conversation_reset", False)
             
             if self.debug:
-                print("Upload response:", result)
-            return result
+                print(f"Conversation tracking - ID: {new_conversation_id}, Reset: {conversation_reset}")
+            
+            # Update local conversation state
+            if conversation_reset or self.conversation_id != new_conversation_id:
+                if self.debug and conversation_reset:
+                    print("Conversation was reset by server (stop command or timeout)")
+                self.conversation_reset = conversation_reset
+            else:
+                self.conversation_reset = False
+            
+            self.conversation_id = new_conversation_id
+        
+        if self.debug:
+            print("Upload response:", result)
+        return result
+
+    def _chunks(self, source, chunk_size):
+        """Non-empty chunks from a generator, a readable stream or a buffer."""
+        if hasattr(source, "readinto"):
+            buf = bytearray(chunk_size)
+            mv = memoryview(buf)
+            while True:
+                n = source.readinto(buf)
+                if not n:
+                    break
+                yield mv[:n]
+        elif hasattr(source, "read"):
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            mv = memoryview(source)
+            for pos in range(0, len(mv), chunk_size):
+                yield mv[pos:pos + chunk_size]
+        else:
+            for chunk in source:
+                # an empty chunk would end the chunked body early
+                if len(chunk):
+                    yield chunk
+
+    def _base64_json(self, chunks, format):
+        """The JSON data command with the base64 field produced chunk by chunk."""
+        head = json.dumps({"command": "data", "token": self.token, "session": self.session, "id": self.id, "format": format})
+        yield (head[:-1] + ', "data": "').encode()
+        carry = b""
+        for chunk in chunks:
+            mv = memoryview(chunk)
+            if carry:
+                take = min(3 - len(carry), len(mv))
+                carry += bytes(mv[:take])
+                mv = mv[take:]
+                if len(carry) < 3:
+                    continue
+                yield binascii.b2a_base64(carry)[:-1]
+                carry = b""
+            # base64 needs groups of 3 bytes, hold back the rest
+            cut = len(mv) - len(mv) % 3
+            if cut:
+                yield binascii.b2a_base64(mv[:cut])[:-1]
+            carry = bytes(mv[cut:])
+        if carry:
+            yield binascii.b2a_base64(carry)[:-1]
+        yield b'"}'
+
+    def _counted(self, chunks):
+        self.last_upload_bytes = 0
+        for chunk in chunks:
+            self.last_upload_bytes += len(chunk)
+            yield chunk
+
+    def upload_stream(self, source, format="adpcm", chunk_size=4096):
+        """
+        Upload without holding the recording in one piece: `source` is a
+        generator/iterator of bytes-like chunks, a stream with readinto() or
+        read(), or a buffer sent in chunk_size slices.  The body goes out with
+        chunked transfer encoding, raw with the binary transport or as
+        base64 JSON encoded on the fly otherwise.  Chunks are sent before the
+        next one is requested, so a generator may reuse its output buffer.
+        """
+        if self.state != "connected":
+            raise ValueError("Not connected. Cannot upload data.")
+        # a streamed body cannot be sent twice: renew an expiring token now
+        self._ensure_token()
+        chunks = self._chunks(source, chunk_size)
+        if self.transport == "binary":
+            headers = self._binary_headers(format)
+        else:
+            chunks = self._base64_json(chunks, format)
+            headers = {"Content-Type": "application/json"}
+        resp = self._post("upload", "/sensorRagUpload.php", data=self._counted(chunks), headers=headers)
+        return self._upload_result(resp)
         
     # Legacy methods for compatibility with old backend - not used with RAG
     def check(self, name, format="adpcm"):
@@ -182,8 +424,8 @@ class ProtoEngine:
             print("WARNING: check() is deprecated with RAG backend - handling is done server-side")
         if self.state != "connected":
             raise ValueError("Not connected. Cannot check data.")
-        payload = {"command": "check", "token": self.token, "id": self.id, "name": name, "format": format}
-        resp = requests.post(self.base_url + "/sensorDownload.php", json=payload)
+        payload = {"command": "check", "id": self.id, "name": name, "format": format}
+        resp = self._request("check", "/sensorDownload.php", lambda: {"json": self._with_token(payload)})
         if resp.status_code == 408:
             if self.debug:
                 print("Check response: file not ready, retry later.")
@@ -204,8 +446,8 @@ class ProtoEngine:
             print("WARNING: download() is deprecated with RAG backend - handling is done server-side")
         if self.state != "connected":
             raise ValueError("Not connected. Cannot download data.")
-        payload = {"command": "down", "token": self.token, "id": self.id, "name": name, "chunk": chunk, "format": format}
-        resp = requests.post(self.base_url + "/sensorDownload.php", json=payload)
+        payload = {"command": "down", "id": self.id, "name": name, "chunk": chunk, "format": format}
+        resp = self._request("download", "/sensorDownload.php", lambda: {"json": self._with_token(payload)})
         if resp.status_code != 200:
             self._transit(self.state, "online")
             if self.debug:
@@ -245,6 +487,9 @@ if __name__ == "__main__":
 
     pt = ProtoEngine("karlsruhe.freifunk.net", baseUrl, id, key)
     pt.setDebug(True)
+    if embedded:
+        pt.token_cache = NvsTokenCache()
+        pt.wifi.cache = NvsWifiCache()
     pt.connect()    
     pt.join()
     if pt.state == "connected":
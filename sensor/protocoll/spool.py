@@ -0,0 +1,353 @@
+# spool.py
+#
+# Store-and-forward queue on flash: recordings and sensor readings that
+# could not be uploaded are appended here, survive resets, and are sent
+# once the device has joined again.
+#
+#   spool = Spool("/spool")
+#   try:
+#       resp = pt.upload(data, format="adpcm")
+#   except (OSError, ValueError):
+#       spool.append(data, format="adpcm")
+#   ...
+#   pt.join()
+#   spool.drain(pt)              # await spool.adrain(pt) with AsyncProtoEngine
+#
+# The queue is a directory of append-only log segments, 00000001.log,
+# 00000002.log, ..., each a sequence of records
+#
+#   b"SP" | kind (1) | meta length (1) | payload length (4) | crc32 (4) | meta | payload
+#
+# (little endian, crc32 over meta and payload, meta is the upload format).
+# Records are only ever appended; a write cut short by a reset leaves a
+# torn record at the end of the last segment, which reading stops at, and
+# appending continues in a new segment.  A record with an intact header
+# whose payload fails the CRC is skipped alone and counted as torn.  The
+# file "head" holds the position of the first record not yet sent
+# ("<segment> <offset>"); it is replaced atomically (write + rename) after
+# every successful upload, and segments behind it are deleted.  An upload that succeeded just before a
+# reset is sent again: delivery is at least once.
+#
+# The spool is bounded: when an append would take it over max_bytes, the
+# oldest segments are dropped first (evicted counts their records).
+# drain() sends a recording with upload_resumable(), so a drain cut short
+# goes on from what the server has (also after a reset: the nonce is the
+# record's position), and runs of consecutive readings as one request
+# (format "readings", a JSON array), stopping at the first failure; a
+# request the server refuses as invalid (400) is dropped
+# instead of blocking the queue.  Runs on MicroPython and CPython; `fs`
+# replaces the filesystem (spoolSim.py simulates flash with power cuts).
+
+import binascii
+import json
+import os
+import struct
+
+RECORDING = 1
+READING = 2
+
+MAGIC = b"SP"
+HEADER = "<2sBBII"
+HEADER_SIZE = 12
+# a segment is closed once it holds this much; bigger records get their own
+SEGMENT_SIZE = 32 * 1024
+MAX_BYTES = 256 * 1024
+# readings per "readings" upload
+READINGS_BATCH = 50
+
+
+def _nonce(end):
+    """Upload nonce of the record ending at `end`: the same on every drain of it."""
+    return "%dx%d" % end
+
+
+class Flash:
+    """The real filesystem (os), as Spool uses it."""
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def open(self, path, mode):
+        return open(path, mode)
+
+    def remove(self, path):
+        os.remove(path)
+
+    def rename(self, old, new):
+        os.rename(old, new)
+
+    def size(self, path):
+        return os.stat(path)[6]
+
+    def mkdir(self, path):
+        try:
+            os.mkdir(path)
+        except OSError:
+            pass
+
+
+def _status(e):
+    # "Upload request failed with status code 400, ..." from ProtoEngine
+    text = str(e)
+    i = text.find("status code ")
+    if i < 0:
+        return 0
+    try:
+        return int(text[i + 12:i + 15])
+    except ValueError:
+        return 0
+
+
+class Spool:
+    def __init__(self, path="/spool", max_bytes=MAX_BYTES, segment_size=SEGMENT_SIZE, fs=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_size = segment_size
+        self.fs = fs if fs is not None else Flash()
+        self.fs.mkdir(path)
+        self.evicted = 0
+        self.rejected = 0
+        self.torn = 0
+        self.sent = 0
+        self._open()
+
+    # ----- layout -----
+
+    def _name(self, seq):
+        return "%s/%08d.log" % (self.path, seq)
+
+    def _segments(self):
+        return sorted(int(n[:-4]) for n in self.fs.listdir(self.path) if n.endswith(".log"))
+
+    def _open(self):
+        """Read the head, drop segments behind it, count what is pending."""
+        self.head = (0, 0)
+        try:
+            with self.fs.open(self.path + "/head", "r") as f:
+                seq, offset = f.read().split()
+                self.head = (int(seq), int(offset))
+        except (OSError, ValueError):
+            pass
+        segments = self._segments()
+        for seq in segments:
+            if seq < self.head[0]:
+                self.fs.remove(self._name(seq))
+        segments = [s for s in segments if s >= self.head[0]]
+        if segments and segments[0] > self.head[0]:
+            self.head = (segments[0], 0)
+        self.sizes = {}
+        self.count = 0
+        torn = 0
+        for seq in segments:
+            end, n, torn = self._scan(seq)
+            self.sizes[seq] = end
+            self.count += n
+            self.torn += torn
+        if segments:
+            # never append behind a torn record: start a new segment instead
+            self.tail = segments[-1] + torn
+        else:
+            self.tail = self.head[0] + 1
+            self.head = (self.tail, 0)
+
+    def _scan(self, seq):
+        """(end of the valid records, records after the head, 1 if torn)."""
+        size = self.fs.size(self._name(seq))
+        start = self.head[1] if seq == self.head[0] else 0
+        pos, n = 0, 0
+        with self.fs.open(self._name(seq), "rb") as f:
+            while pos + HEADER_SIZE <= size:
+                f.seek(pos)
+                head = f.read(HEADER_SIZE)
+                magic, kind, mlen, plen, crc = struct.unpack(HEADER, head)
+                end = pos + HEADER_SIZE + mlen + plen
+                if magic != MAGIC or end > size:
+                    break
+                if pos >= start:
+                    n += 1
+                pos = end
+        return pos, n, 1 if pos < size else 0
+
+    def _read(self, seq, pos):
+        """
+        (kind, format, payload, next position) of a record, None if there
+        is none (or a torn one); payload None if only the CRC is wrong.
+        """
+        name = self._name(seq)
+        if pos >= self.sizes.get(seq, 0):
+            return None
+        with self.fs.open(name, "rb") as f:
+            f.seek(pos)
+            magic, kind, mlen, plen, crc = struct.unpack(HEADER, f.read(HEADER_SIZE))
+            meta = f.read(mlen)
+            payload = f.read(plen)
+        if magic != MAGIC or len(payload) != plen:
+            return None
+        end = pos + HEADER_SIZE + mlen + plen
+        if binascii.crc32(payload, binascii.crc32(meta)) & 0xffffffff != crc:
+            return kind, None, None, end
+        return kind, meta.decode(), payload, end
+
+    # ----- queue -----
+
+    def pending(self):
+        return self.count
+
+    def pending_bytes(self):
+        return sum(self.sizes.values()) - (self.head[1] if self.head[0] in self.sizes else 0)
+
+    def append(self, data, format="adpcm", kind=RECORDING):
+        """Queue an item; False if it alone is larger than the spool."""
+        meta = format.encode()
+        need = HEADER_SIZE + len(meta) + len(data)
+        if need > self.max_bytes:
+            return False
+        while self.sizes and sum(self.sizes.values()) + need > self.max_bytes:
+            self._evict()
+        used = self.sizes.get(self.tail, 0)
+        if used and used + need > self.segment_size:
+            self.tail += 1
+        crc = binascii.crc32(data, binascii.crc32(meta)) & 0xffffffff
+        try:
+            with self.fs.open(self._name(self.tail), "ab") as f:
+                f.write(struct.pack(HEADER, MAGIC, kind, len(meta), len(data), crc) + meta)
+                f.write(data)
+        except OSError:
+            # whatever was written is a torn record: go on in a new segment
+            self.tail += 1
+            raise
+        self.sizes[self.tail] = self.sizes.get(self.tail, 0) + need
+        self.count += 1
+        return True
+
+    def append_reading(self, reading):
+        """Queue a sensor reading (a JSON-serialisable dict)."""
+        return self.append(json.dumps(reading).encode(), format="reading", kind=READING)
+
+    def _evict(self):
+        seq = min(self.sizes)
+        n = self._scan(seq)[1]
+        self.fs.remove(self._name(seq))
+        del self.sizes[seq]
+        self.evicted += n
+        self.count -= n
+        if seq == self.tail:
+            self.tail += 1
+        self._set_head((min(self.sizes) if self.sizes else self.tail, 0))
+
+    def _set_head(self, head):
+        tmp = self.path + "/head.tmp"
+        with self.fs.open(tmp, "w") as f:
+            f.write("%d %d" % head)
+        self.fs.rename(tmp, self.path + "/head")
+        self.head = head
+        for seq in [s for s in self.sizes if s < head[0]]:
+            self.fs.remove(self._name(seq))
+            del self.sizes[seq]
+
+    def _commit(self, end, n):
+        self._set_head(end)
+        self.count -= n
+
+    def _next(self, seq, pos):
+        """Next valid record from (seq, pos): (seq, pos, record) or None at the end."""
+        while True:
+            record = self._read(seq, pos)
+            if record is not None:
+                return seq, pos, record
+            later = [s for s in self.sizes if s > seq]
+            if not later:
+                return None
+            seq, pos = min(later), 0
+
+    def _batches(self, batch):
+        """
+        Uploads from the head: (format, data, records, end), a
+        recording alone or up to `batch` consecutive readings as a JSON
+        array; format None for a record that failed its CRC.  Reads one
+        record at a time, so committing in between is safe.
+        """
+        seq, pos = self.head
+        while True:
+            found = self._next(seq, pos)
+            if found is None:
+                return
+            seq, pos, (kind, format, payload, end) = found
+            if kind != READING or payload is None:
+                yield format, payload, 1, (seq, end)
+                pos = end
+                continue
+            readings = [payload]
+            while len(readings) < batch:
+                found = self._next(seq, end)
+                if found is None or found[2][0] != READING or found[2][2] is None:
+                    break
+                seq, _, (_, _, payload, end) = found
+                readings.append(payload)
+            yield "readings", b"[" + b",".join(readings) + b"]", len(readings), (seq, end)
+            pos = end
+
+    def _failed(self, e, n, end):
+        """After a failed upload: True to go on (item dropped), False to stop."""
+        if _status(e) == 400:
+            self.rejected += n
+            self._commit(end, n)
+            return True
+        return False
+
+    def drain(self, pt, limit=0, batch=READINGS_BATCH):
+        """Upload queued items with a joined ProtoEngine; returns how many were sent."""
+        sent = 0
+        for format, data, n, end in self._batches(batch):
+            if format is None:
+                # intact header, corrupt payload: drop just this record
+                self.torn += n
+                self._commit(end, n)
+                continue
+            if pt.state != "connected":
+                break
+            try:
+                if format == "readings":
+                    pt.upload(data, format=format)
+                else:
+                    pt.upload_resumable(data, format=format, nonce=_nonce(end))
+            except (OSError, ValueError) as e:
+                if self._failed(e, n, end):
+                    continue
+                break
+            self._commit(end, n)
+            sent += n
+            if limit and sent >= limit:
+                break
+        self.sent += sent
+        return sent
+
+    async def adrain(self, pt, limit=0, batch=READINGS_BATCH):
+        """drain() for AsyncProtoEngine."""
+        sent = 0
+        for format, data, n, end in self._batches(batch):
+            if format is None:
+                # intact header, corrupt payload: drop just this record
+                self.torn += n
+                self._commit(end, n)
+                continue
+            if pt.state != "connected":
+                break
+            try:
+                if format == "readings":
+                    await pt.upload(data, format=format)
+                else:
+                    await pt.upload_resumable(data, format=format, nonce=_nonce(end))
+            except (OSError, ValueError) as e:
+                if self._failed(e, n, end):
+                    continue
+                break
+            self._commit(end, n)
+            sent += n
+            if limit and sent >= limit:
+                break
+        self.sent += sent
+        return sent
+
+    def stats(self):
+        return {"pending": self.count, "bytes": self.pending_bytes(), "segments": len(self.sizes),
+                "sent": self.sent, "evicted": self.evicted, "rejected": self.rejected, "torn": self.torn}
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Host simulation of the flash spool (spool.py): a device that records,
+takes sensor readings and loses both its link and its power.
+
+spool.py runs unchanged on a simulated flash filesystem (SimFlash) that
+can cut the power: the write in progress stops after a random number of
+bytes, a pending rename does not happen, and the device "boots" again
+with a new Spool on what was left.  ProtoEngine talks to the reference
+server (backend/python/sensorServer.py) through a session that fails the
+way the field link does: outages lasting several turns, single requests
+that fail, and replies lost after the server has stored the upload.
+
+Each turn the device uploads a recording (spooled when that fails) and
+spools a reading; after joining it drains the spool.  At the end the link
+is good and the rest is drained with AsyncProtoEngine.adrain.  Spooled
+recordings go out with upload_resumable(), which resumes at once here
+(the link changes per turn, not with time).  Checked:
+every recording and reading that was accepted (uploaded, or appended)
+arrives intact, except what the spool evicted to stay within --max-bytes,
+which it never exceeds, and that a record failing its CRC in the middle
+of a segment is skipped alone.  Reported: duplicates (at-least-once after
+lost replies and power cuts), evictions, torn records found after power
+cuts, requests saved by batching readings, and bytes written to flash.
+
+Usage:
+    python spoolSim.py [-n 300] [--rec 6000] [--max-bytes 65536] [--seed 1]
+"""
+import asyncio
+import json
+import os
+import random
+import struct
+import sys
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "..", "backend", "python"))
+
+import sensorServer
+import protoEngine
+from protoEngine import ProtoEngine
+from spool import HEADER_SIZE, Spool
+
+
+class PowerCut(Exception):
+    """The device lost power; nothing after this point happened."""
+
+
+class SimFile:
+    def __init__(self, flash, path, mode):
+        self.flash = flash
+        self.path = path
+        self.pos = 0
+        if "w" in mode:
+            flash.files[path] = bytearray()
+        elif path not in flash.files:
+            if "a" not in mode:
+                raise OSError(2, "ENOENT")
+            flash.files[path] = bytearray()
+        self.text = "b" not in mode
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def seek(self, pos):
+        self.pos = pos
+
+    def read(self, n=-1):
+        data = self.flash.files[self.path]
+        end = len(data) if n < 0 else self.pos + n
+        out = bytes(data[self.pos:end])
+        self.pos += len(out)
+        return out.decode() if self.text else out
+
+    def write(self, data):
+        if self.text:
+            data = data.encode()
+        n = self.flash.spend(len(data))
+        self.flash.files[self.path] += data[:n]
+        if n < len(data):
+            raise PowerCut(self.path)
+        return n
+
+
+class SimFlash:
+    """Flat in-memory filesystem with the calls of spool.Flash, and power cuts."""
+    def __init__(self):
+        self.files = {}
+        self.budget = None   # bytes until the power goes, None: never
+        self.written = 0
+
+    def spend(self, n):
+        if self.budget is None:
+            self.written += n
+            return n
+        n = min(n, self.budget)
+        self.budget -= n
+        self.written += n
+        return n
+
+    def _cut(self):
+        # renames and removes are atomic, but not once the power is gone
+        if self.budget == 0:
+            raise PowerCut("metadata")
+
+    def listdir(self, path):
+        return [p[len(path) + 1:] for p in self.files if p.startswith(path + "/")]
+
+    def open(self, path, mode):
+        return SimFile(self, path, mode)
+
+    def remove(self, path):
+        self._cut()
+        del self.files[path]
+
+    def rename(self, old, new):
+        self._cut()
+        self.files[new] = self.files.pop(old)
+
+    def size(self, path):
+        return len(self.files[path])
+
+    def mkdir(self, path):
+        pass
+
+
+class FlakySession(requests.Session):
+    """requests.Session on a link that drops out, loses requests and loses replies."""
+    def __init__(self, net):
+        super().__init__()
+        self.net = net
+
+    def post(self, url, **kwargs):
+        net = self.net
+        if not net.up or net.rng.random() < net.p_fail:
+            net.failed += 1
+            raise requests.ConnectionError("link down")
+        resp = super().post(url, **kwargs)
+        if net.rng.random() < net.p_lost:
+            net.lost += 1
+            raise requests.ConnectionError("reply lost")
+        return resp
+
+
+class Network:
+    def __init__(self, rng, p_down=0.08, p_up=0.25, p_fail=0.05, p_lost=0.03):
+        self.rng = rng
+        self.up = True
+        self.p_down, self.p_up, self.p_fail, self.p_lost = p_down, p_up, p_fail, p_lost
+        self.failed = 0
+        self.lost = 0
+
+    def step(self):
+        if self.up:
+            self.up = self.rng.random() >= self.p_down
+        else:
+            self.up = self.rng.random() < self.p_up
+
+
+class CountingBackend(sensorServer.SensorBackend):
+    """Counts the "readings" uploads (requests) it stored."""
+    readings_requests = 0
+
+    def store(self, sid, fmt, data, transport):
+        code, resp = super().store(sid, fmt, data, transport)
+        if fmt == "readings" and code == 200:
+            self.readings_requests += 1
+        return code, resp
+
+
+def recording(i, size):
+    """Recording number i: its number and deterministic filler."""
+    return struct.pack("<I", i) + random.Random(i).randbytes(size - 4)
+
+
+class FlakyEngine(ProtoEngine):
+    """ProtoEngine whose connections, also the new ones after a failure, are FlakySessions."""
+    net = None
+
+    def _post(self, name, path, **kwargs):
+        if self.http is None:
+            self.http = FlakySession(self.net)
+        return super()._post(name, path, **kwargs)
+
+
+def _engine(url, net):
+    pt = FlakyEngine("test", url, 1, sensorServer.DEFAULT_DEVICES["1"])
+    pt.transports = ("binary",)
+    pt.net = net
+    pt.connect()
+    return pt
+
+
+def run(args):
+    protoEngine.RESUME_BACKOFF = 0
+    rng = random.Random(args.seed)
+    backend = CountingBackend()
+    url = sensorServer.start_in_thread(sensorServer.make_server(0, backend))
+    flash = SimFlash()
+    net = Network(rng, p_down=args.p_down, p_fail=args.p_fail, p_lost=args.p_lost)
+
+    accepted_rec, accepted_read = set(), set()
+    boots, evicted, torn, readings_spooled = 0, 0, 0, 0
+    spool = pt = None
+    over = 0
+    turn = 0
+    while turn < args.turns:
+        try:
+            if spool is None:
+                boots += 1
+                spool = Spool("/spool", max_bytes=args.max_bytes, segment_size=args.segment, fs=flash)
+                torn += spool.torn
+                pt = _engine(url, net)
+            if rng.random() < args.p_cut:
+                flash.budget = rng.randrange(0, 2 * args.rec)
+            net.step()
+            if pt.state != "connected":
+                try:
+                    pt.join(use_cache=False)
+                except (OSError, ValueError):
+                    # start over, as after a failed join on the device
+                    pt.disconnect()
+                    pt.connect()
+            data = recording(turn, args.rec)
+            try:
+                if pt.state != "connected":
+                    raise ValueError("Not connected. Cannot upload data.")
+                pt.upload(data, format="adpcm")
+                accepted_rec.add(turn)
+            except (OSError, ValueError):
+                if spool.append(data, format="adpcm"):
+                    accepted_rec.add(turn)
+            if spool.append_reading({"n": turn, "temp": round(20 + rng.random() * 5, 2)}):
+                accepted_read.add(turn)
+                readings_spooled += 1
+            if pt.state == "connected":
+                spool.drain(pt)
+            over = max(over, sum(spool.sizes.values()) - args.max_bytes)
+            turn += 1
+        except PowerCut:
+            # reboot: what is on flash stays, everything in RAM is gone
+            flash.budget = None
+            evicted += spool.evicted if spool is not None else 0
+            spool = None
+            turn += 1
+    flash.budget = None
+    net.up, net.p_fail, net.p_lost = True, 0.0, 0.0
+    if spool is None:
+        spool = Spool("/spool", max_bytes=args.max_bytes, segment_size=args.segment, fs=flash)
+        torn += spool.torn
+    before = spool.pending()
+    asyncio.run(_final(url, spool))
+    evicted += spool.evicted
+    left = spool.pending()
+
+    # what the server got
+    got_rec = {}
+    for upload in backend.uploads.values():
+        data = upload["data"]
+        i = struct.unpack("<I", data[:4])[0]
+        if data != recording(i, args.rec):
+            print(f"recording {i} corrupted")
+            return False
+        got_rec[i] = got_rec.get(i, 0) + 1
+    got_read = {}
+    for reading in backend.readings.get("1", []):
+        got_read[reading["n"]] = got_read.get(reading["n"], 0) + 1
+    missing = len(accepted_rec - set(got_rec)) + len(accepted_read - set(got_read))
+    dups = sum(n - 1 for n in got_rec.values()) + sum(n - 1 for n in got_read.values())
+
+    print(f"{args.turns} turns, {boots} boots, link failures {net.failed}, replies lost {net.lost}")
+    print(f"recordings accepted {len(accepted_rec)}, delivered {len(got_rec)}; "
+          f"readings accepted {len(accepted_read)}, delivered {len(got_read)}")
+    print(f"missing {missing}, evicted {evicted}, duplicates {dups}, torn tails at boot {torn}, "
+          f"left for final drain {before}, pending after {left}")
+    print(f"readings spooled {readings_spooled}, sent in {backend.readings_requests} requests,"
+          f" flash written {flash.written} bytes, spool over bound by {max(over, 0)} bytes")
+    ok = missing <= evicted and left == 0 and over <= 0
+    ok &= run_corrupt()
+    print("OK" if ok else "FAILED")
+    return ok
+
+
+def run_corrupt(size=1000):
+    """
+    Records whose payload fails the CRC (header intact) in the middle of
+    a segment: skipped one by one, the rest of the segment and a later
+    append to it are still sent.
+    """
+    backend = sensorServer.SensorBackend()
+    server = sensorServer.make_server(0, backend)
+    url = sensorServer.start_in_thread(server)
+    flash = SimFlash()
+    spool = Spool("/spool", segment_size=64 * 1024, fs=flash)
+    for i in range(4):
+        spool.append(recording(i, size), format="adpcm")
+    for n in range(3):
+        spool.append_reading({"n": n})
+    segment = flash.files[spool._name(spool.tail)]
+    record = HEADER_SIZE + len("adpcm") + size
+    reading = HEADER_SIZE + len("reading") + len(json.dumps({"n": 0}))
+    segment[2 * record - 1] ^= 0xff                 # recording 1
+    segment[4 * record + 2 * reading - 1] ^= 0xff   # reading 1
+    pt = ProtoEngine("test", url, 1, sensorServer.DEFAULT_DEVICES["1"])
+    pt.transports = ("binary",)
+    pt.connect()
+    pt.join()
+    first = spool.drain(pt)
+    spool.append(recording(4, size), format="adpcm")
+    second = spool.drain(pt)
+    pt.disconnect()
+    server.shutdown()
+    got_rec = sorted(struct.unpack("<I", up["data"][:4])[0] for up in backend.uploads.values())
+    got_read = [r["n"] for r in backend.readings.get("1", [])]
+    ok = (first, second, spool.pending(), spool.torn) == (5, 1, 0, 2) and got_rec == [0, 2, 3, 4] and got_read == [0, 2]
+    print(f"corrupt payloads: sent {first} + {second} after an append, skipped {spool.torn}, "
+          f"pending {spool.pending()}: {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+async def _final(url, spool):
+    from asyncProtoEngine import AsyncProtoEngine
+
+    pt = AsyncProtoEngine("test", url, 1, sensorServer.DEFAULT_DEVICES["1"])
+    pt.transports = ("binary",)
+    await pt.connect()
+    await pt.join()
+    await spool.adrain(pt)
+    await pt.disconnect()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Flash spool with power cuts and a flaky link")
+    parser.add_argument("-n", "--turns", type=int, default=300, help="Recordings (one per turn)")
+    parser.add_argument("--rec", type=int, default=6000, help="Recording size in bytes (ADPCM)")
+    parser.add_argument("--max-bytes", type=int, default=64 * 1024, help="Spool bound")
+    parser.add_argument("--segment", type=int, default=16 * 1024, help="Spool segment size")
+    parser.add_argument("--p-down", type=float, default=0.08, help="Chance per turn the link goes down")
+    parser.add_argument("--p-fail", type=float, default=0.05, help="Chance a request fails")
+    parser.add_argument("--p-lost", type=float, default=0.03, help="Chance a reply is lost after the server stored it")
+    parser.add_argument("--p-cut", type=float, default=0.05, help="Chance per turn of a power cut")
+    parser.add_argument("--seed", type=int, default=1)
+    return run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,88 @@
+# tokenCache.py
+#
+# Persistent store for the upload token, so a restarted device can skip the
+# join/challenge handshake while its token is still valid.  NvsTokenCache
+# keeps it in an ESP32 NVS namespace, FileTokenCache in a JSON file on the
+# host.  Both hold one dict:
+#   {"url", "id", "token", "session", "transport", "expires"}
+# and load() returns None when nothing (usable) is stored.
+
+import json
+import binascii
+
+
+def token_expiry(token, reply=None):
+    """
+    Expiry of `token` in seconds since the epoch: "expires" from the
+    challenge reply if the server sent it, else the exp claim of a JWT,
+    else None (unknown, the token is used until the server rejects it).
+    """
+    if reply and reply.get("expires"):
+        return reply["expires"]
+    parts = token.split(".")
+    if len(parts) != 3:
+        return None
+    # base64url without padding
+    b64 = parts[1].replace("-", "+").replace("_", "/")
+    b64 += "=" * (-len(b64) % 4)
+    try:
+        return json.loads(binascii.a2b_base64(b64)).get("exp")
+    except Exception:
+        return None
+
+
+class FileTokenCache:
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, entry):
+        with open(self.path, "w") as f:
+            json.dump(entry, f)
+
+    def clear(self):
+        import os
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class NvsTokenCache:
+    KEY = "token"
+    # a JWT from sensorUpload.php plus the other fields fits easily
+    SIZE = 1024
+
+    def __init__(self, namespace="platane"):
+        import esp32
+        self.nvs = esp32.NVS(namespace)
+
+    def load(self):
+        buf = bytearray(self.SIZE)
+        try:
+            l = self.nvs.get_blob(self.KEY, buf)
+        except OSError:
+            return None
+        if l <= 0:
+            return None
+        try:
+            return json.loads(buf[:l])
+        except ValueError:
+            return None
+
+    def save(self, entry):
+        self.nvs.set_blob(self.KEY, json.dumps(entry).encode())
+        self.nvs.commit()
+
+    def clear(self):
+        try:
+            self.nvs.erase_key(self.KEY)
+            self.nvs.commit()
+        except OSError:
+            pass
@@ -0,0 +1,292 @@
+# wifiConnect.py
+#
+# Fast Wi-Fi (re)connect for ProtoEngine.connect().  A plain
+# nic.connect(ssid, pwd) scans every channel for the access point and
+# then waits for DHCP: a few seconds on every reconnect, also when nothing
+# has changed since the last one.  WifiConnector remembers where it was
+# connected last, the access point's BSSID and channel and the IP
+# configuration (in NVS with NvsWifiCache, in a file with FileWifiCache),
+# and tries that first ("fast"): that BSSID on that channel, and the IP
+# address kept instead of asking DHCP again while the lease is younger
+# than LEASE_TTL (always, with a static configuration).  When the fast
+# attempt has not connected within FAST_TIMEOUT_MS, plus DHCP_TIMEOUT_MS
+# when DHCP is asked (the interface only counts as connected once it has
+# an address), the access point has moved to another channel or is
+# another one now: WifiConnector scans and connects
+# to the strongest access point with the SSID ("scan"), and as a last
+# resort connects the plain way ("plain").  The interface is polled every
+# POLL_MS.  The cache is written only when something in it has changed,
+# to spare the flash.
+#
+#   wifi = WifiConnector(cache=NvsWifiCache())
+#   path = wifi.connect(ssid, pwd)   # "up" (was connected), "fast", "scan" or "plain"
+#   wifi.stats()                     # time to connect per path
+#
+# AsyncProtoEngine runs the same steps (plan, start, finish) with awaited
+# polls.  `net` replaces the network module: wifiSim.py tests this on
+# Linux with a simulated one.
+
+import json
+import time
+import binascii
+try:
+    import network
+except ImportError:
+    network = None  # CPython: pass net=
+
+try:
+    _ticks_ms = time.ticks_ms
+    _ticks_diff = time.ticks_diff
+    _sleep_ms = time.sleep_ms
+except AttributeError:
+    def _ticks_ms():
+        return int(time.perf_counter() * 1000)
+    def _ticks_diff(a, b):
+        return a - b
+    def _sleep_ms(ms):
+        time.sleep(ms / 1000)
+
+
+def _time():
+    return time.time()
+
+
+POLL_MS = 20
+FAST_TIMEOUT_MS = 1500
+DHCP_TIMEOUT_MS = 4000
+CONNECT_TIMEOUT_MS = 20000
+# seconds a DHCP lease is reused without asking again; routers lease for
+# hours or days, so this stays well inside the lease
+LEASE_TTL = 3600
+# before this (2024-01-01) the clock has not been set, and the age of a
+# lease is unknown: DHCP is asked again
+CLOCK_VALID = 1704067200
+
+
+class FileWifiCache:
+    """The last connection in a JSON file (host)."""
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, entry):
+        with open(self.path, "w") as f:
+            json.dump(entry, f)
+
+    def clear(self):
+        import os
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class NvsWifiCache:
+    """The last connection in an ESP32 NVS namespace."""
+    KEY = "wifi"
+    SIZE = 256
+
+    def __init__(self, namespace="platane", nvs=None):
+        if nvs is None:
+            import esp32
+            nvs = esp32.NVS(namespace)
+        self.nvs = nvs
+
+    def load(self):
+        buf = bytearray(self.SIZE)
+        try:
+            l = self.nvs.get_blob(self.KEY, buf)
+        except OSError:
+            return None
+        if l <= 0:
+            return None
+        try:
+            return json.loads(buf[:l])
+        except ValueError:
+            return None
+
+    def save(self, entry):
+        self.nvs.set_blob(self.KEY, json.dumps(entry).encode())
+        self.nvs.commit()
+
+    def clear(self):
+        try:
+            self.nvs.erase_key(self.KEY)
+            self.nvs.commit()
+        except OSError:
+            pass
+
+
+class WifiConnector:
+    def __init__(self, cache=None, static=None, net=None, debug=False):
+        self.cache = cache
+        # (ip, netmask, gateway, dns) to use instead of DHCP, None: DHCP
+        self.static = tuple(static) if static else None
+        self.net = net if net is not None else network
+        self.debug = debug
+        self.entry = None      # the cached connection, once loaded
+        self.found = None      # (bssid, channel) from the last scan
+        self.reused_ip = False
+        self.timing = {}       # path -> [count, total ms, max ms], connected
+        self.failures = {}     # path -> attempts that did not connect
+        self.last_ms = 0
+        self.last_path = None
+        self._t0 = 0
+
+    def interface(self):
+        """The station interface, switched on (poll nic.active() until it is)."""
+        nic = self.net.WLAN(self.net.WLAN.IF_STA)
+        if not nic.active():
+            nic.active(True)
+        return nic
+
+    def plan(self, ssid):
+        """Connect attempts to make, in order."""
+        if self.entry is None and self.cache is not None:
+            self.entry = self.cache.load()
+        entry = self.entry
+        if entry and entry.get("ssid") == ssid and entry.get("bssid"):
+            return ("fast", "scan", "plain")
+        return ("scan", "plain")
+
+    def start(self, nic, path, ssid, pwd):
+        """Start an attempt; returns how long to wait for it in ms (0: it failed already)."""
+        self._t0 = _ticks_ms()
+        if path == "fast":
+            entry = self.entry
+            self._ip(nic, self._reusable_ip(entry))
+            timeout = FAST_TIMEOUT_MS if self.reused_ip else FAST_TIMEOUT_MS + DHCP_TIMEOUT_MS
+            return self._connect(nic, ssid, pwd, entry["bssid"], entry.get("channel"), timeout)
+        self._ip(nic, self.static)
+        if path == "scan":
+            self.found = self._scan(nic, ssid)
+            if self.found is None:
+                return 0
+            return self._connect(nic, ssid, pwd, self.found[0], self.found[1], CONNECT_TIMEOUT_MS)
+        return self._connect(nic, ssid, pwd, None, None, CONNECT_TIMEOUT_MS)
+
+    def finish(self, nic, path, ssid, connected):
+        """After an attempt: record its time, and cache where a connect succeeded."""
+        ms = _ticks_diff(_ticks_ms(), self._t0)
+        if not connected:
+            self.failures[path] = self.failures.get(path, 0) + 1
+            if self.debug:
+                print(f"Wi-Fi {path} connect failed after {ms} ms")
+            try:
+                nic.disconnect()
+            except OSError:
+                pass
+            return False
+        self.last_ms = ms
+        self.last_path = path
+        t = self.timing.get(path)
+        if t is None:
+            self.timing[path] = [1, ms, ms]
+        else:
+            t[0] += 1
+            t[1] += ms
+            if ms > t[2]:
+                t[2] = ms
+        if self.debug:
+            print(f"Wi-Fi connected ({path}) in {ms} ms:", nic.ifconfig())
+        self._remember(nic, path, ssid)
+        return True
+
+    def connect(self, ssid, pwd):
+        """Connect, polling every POLL_MS; returns the path taken, raises OSError if none worked."""
+        nic = self.interface()
+        while not nic.active():
+            _sleep_ms(POLL_MS)
+        if nic.isconnected():
+            return "up"
+        for path in self.plan(ssid):
+            timeout = self.start(nic, path, ssid, pwd)
+            t0 = _ticks_ms()
+            while not nic.isconnected() and _ticks_diff(_ticks_ms(), t0) < timeout:
+                _sleep_ms(POLL_MS)
+            if self.finish(nic, path, ssid, nic.isconnected()):
+                return path
+        raise OSError(f"Wi-Fi connect to {ssid} failed")
+
+    def stats(self):
+        result = {k: {"count": v[0], "total_ms": v[1], "max_ms": v[2]} for k, v in self.timing.items()}
+        return {"connects": result, "failures": dict(self.failures), "last_ms": self.last_ms,
+                "last_path": self.last_path}
+
+    # ----- steps -----
+
+    def _reusable_ip(self, entry):
+        if self.static:
+            return self.static
+        ip, since = entry.get("ifconfig"), entry.get("since", 0)
+        now = _time()
+        if ip and now >= CLOCK_VALID and since >= CLOCK_VALID and now - since < LEASE_TTL:
+            return tuple(ip)
+        return None
+
+    def _ip(self, nic, config):
+        """A fixed IP configuration, or None: DHCP."""
+        self.reused_ip = config is not None
+        try:
+            nic.ifconfig(config if config is not None else "dhcp")
+        except (OSError, ValueError, TypeError):
+            self.reused_ip = False
+
+    def _scan(self, nic, ssid):
+        """(bssid hex, channel) of the strongest access point with `ssid`, None if there is none."""
+        best = None
+        try:
+            found = nic.scan()
+        except OSError:
+            return None
+        for ap in found:
+            # (ssid, bssid, channel, RSSI, security, hidden)
+            if ap[0].decode() == ssid and (best is None or ap[3] > best[2]):
+                best = (binascii.hexlify(ap[1]).decode(), ap[2], ap[3])
+        return best[:2] if best else None
+
+    def _connect(self, nic, ssid, pwd, bssid, channel, timeout):
+        if channel:
+            try:
+                nic.config(channel=channel)
+            except (OSError, ValueError, TypeError):
+                pass
+        kwargs = {"bssid": binascii.unhexlify(bssid)} if bssid else {}
+        try:
+            nic.connect(ssid, pwd, **kwargs)
+        except OSError as e:
+            # a connect still in progress ("Wifi Internal Error"): start over once
+            if self.debug:
+                print(f"Failed to connect to network: {e}")
+            nic.disconnect()
+            try:
+                nic.connect(ssid, pwd, **kwargs)
+            except OSError:
+                return 0
+        return timeout
+
+    def _remember(self, nic, path, ssid):
+        entry = dict(self.entry or {})
+        entry["ssid"] = ssid
+        if path == "scan":
+            entry["bssid"], entry["channel"] = self.found
+        elif path == "plain":
+            # no BSSID to go by: the next connect scans
+            entry.pop("bssid", None)
+        if not self.reused_ip and not self.static:
+            entry["ifconfig"] = list(nic.ifconfig())
+            now = _time()
+            if now >= CLOCK_VALID:
+                entry["since"] = now
+            else:
+                entry.pop("since", None)
+        if entry != self.entry:
+            self.entry = entry
+            if self.cache is not None:
+                self.cache.save(entry)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Host simulation of Wi-Fi (re)connects (wifiConnect.py, also through
+PlatanAuth.connect_wifi()): the time to connect from a cold start, after
+a restart near the same access point, and after the access point has
+changed.
+
+A simulated `network` module (SimNetwork) stands in for MicroPython's:
+WLAN.connect() without a BSSID scans every channel for the access point,
+with a BSSID on a set channel it only looks on that channel, then it
+associates and, without a fixed IP configuration, waits for DHCP;
+isconnected() turns true once all of that is done.  WLAN.scan() takes
+its time for all channels.  The times are on a virtual clock, which is
+wifiConnect's (ticks, sleep and wall clock), so a sim run takes no time.
+
+Scenarios: the old connect (plain connect, polled every second), a cold
+start (nothing cached), restarts with the cache (IP reused, clock not
+set so DHCP is asked, a static IP), the access point moved to another
+channel, replaced by another one, and gone; the same through
+ProtoEngine.connect() and AsyncProtoEngine.connect(), and through
+PlatanAuth.connect_wifi() with fake esp32/cryptolib modules.  Reported
+per scenario: the path taken, time to connect and flash writes.  Checked:
+each connects the way it should, faster than the old connect where
+something was cached, and the cache follows the access point.
+
+Usage:
+    python wifiSim.py [--scan-ms 120] [--dhcp-ms 1500] [--assoc-ms 150]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import wifiConnect
+from wifiConnect import WifiConnector, FileWifiCache, CLOCK_VALID
+
+CHANNELS = 13
+SSID = "platane"
+PWD = "secret"
+# the epoch seconds at virtual time 0: a set clock, or one that is not
+EPOCH_SET = CLOCK_VALID + 86400
+EPOCH_UNSET = 0
+
+
+class Clock:
+    """Virtual milliseconds; `epoch` is what time.time() says at 0."""
+    def __init__(self):
+        self.now = 0
+        self.epoch = EPOCH_SET
+
+    def ticks_ms(self):
+        return self.now
+
+    def ticks_diff(self, a, b):
+        return a - b
+
+    def sleep_ms(self, ms):
+        self.now += ms
+
+    def sleep(self, s):
+        self.now += int(s * 1000)
+
+    def time(self):
+        return self.epoch + self.now // 1000
+
+
+class AccessPoint:
+    def __init__(self, bssid, channel, rssi=-60):
+        self.bssid = bssid
+        self.channel = channel
+        self.rssi = rssi
+
+
+class Air:
+    """Access points in range and what the steps of a connect cost."""
+    def __init__(self, clock, args):
+        self.clock = clock
+        self.aps = []
+        self.scan_ms = args.scan_ms
+        self.assoc_ms = args.assoc_ms
+        self.dhcp_ms = args.dhcp_ms
+
+
+def SimNetwork(air):
+    """A `network` module on `air`."""
+    net = types.ModuleType("network")
+
+    class WLAN:
+        IF_STA = 0
+
+        def __init__(self, interface):
+            pass
+
+        def active(self, on=None):
+            if on is None:
+                return nic.on
+            nic.on = on
+            if not on:
+                nic.ready = None
+
+        def isconnected(self):
+            return nic.ready is not None and air.clock.now >= nic.ready
+
+        def config(self, channel=None, **kwargs):
+            if channel is not None:
+                nic.channel = channel
+
+        def ifconfig(self, config=None):
+            if config is None:
+                return nic.static or nic.leased
+            nic.static = None if config == "dhcp" else tuple(config)
+
+        def scan(self):
+            air.clock.now += CHANNELS * air.scan_ms
+            nic.scans += 1
+            return [(SSID.encode(), ap.bssid, ap.channel, ap.rssi, 3, False) for ap in air.aps]
+
+        def connect(self, ssid, pwd, bssid=None):
+            nic.ready = None
+            cost = air.assoc_ms
+            if bssid is not None and nic.channel:
+                # only that channel is looked at
+                aps = [ap for ap in air.aps if ap.bssid == bssid and ap.channel == nic.channel]
+                cost += air.scan_ms
+            else:
+                aps = [ap for ap in air.aps if bssid is None or ap.bssid == bssid]
+                cost += CHANNELS * air.scan_ms
+            nic.channel = None
+            if not aps:
+                return  # never connects
+            if nic.static is None:
+                cost += air.dhcp_ms
+                nic.dhcps += 1
+            nic.ready = air.clock.now + cost
+
+        def disconnect(self):
+            nic.ready = None
+
+    nic = types.SimpleNamespace(on=False, ready=None, channel=None, static=None,
+                                leased=("192.168.1.23", "255.255.255.0", "192.168.1.1", "192.168.1.1"),
+                                scans=0, dhcps=0)
+    net.WLAN = WLAN
+    net.nic = nic
+    return net
+
+
+class CountingCache(FileWifiCache):
+    """FileWifiCache that counts its writes (flash writes on the device)."""
+    def __init__(self, path):
+        super().__init__(path)
+        self.writes = 0
+
+    def save(self, entry):
+        self.writes += 1
+        super().save(entry)
+
+
+def legacy_connect(net, clock):
+    """ProtoEngine.connect() before wifiConnect: plain connect, polled every second."""
+    nic = net.WLAN(net.WLAN.IF_STA)
+    nic.active(True)
+    nic.ifconfig("dhcp")
+    nic.connect(SSID, PWD)
+    while not nic.isconnected():
+        clock.sleep(1)
+
+
+def _patch_clock(clock):
+    wifiConnect._ticks_ms = clock.ticks_ms
+    wifiConnect._ticks_diff = clock.ticks_diff
+    wifiConnect._sleep_ms = clock.sleep_ms
+    wifiConnect._time = clock.time
+
+
+def _restart(air, net, clock, cache, static=None):
+    """A device booting: interface off, a new connector on the same cache."""
+    net.nic.on = False
+    net.nic.ready = None
+    net.nic.scans = net.nic.dhcps = 0
+    cache.writes = 0
+    clock.now = 0
+    return WifiConnector(cache=cache, static=static, net=net)
+
+
+def run_connector(args, report):
+    clock = Clock()
+    _patch_clock(clock)
+    air = Air(clock, args)
+    air.aps = [AccessPoint(b"\x02\x00\x00\x00\x00\x01", 6, -55), AccessPoint(b"\x02\x00\x00\x00\x00\x02", 11, -75)]
+    net = SimNetwork(air)
+    ok = True
+
+    legacy_connect(net, clock)
+    legacy = clock.now
+    report("old connect, 1 s polls", "plain", legacy, net.nic, None, True)
+
+    tmp = tempfile.mkdtemp()
+    cache = CountingCache(os.path.join(tmp, "wifi.json"))
+
+    def scenario(label, expect, epoch=EPOCH_SET, static=None, faster=True):
+        clock.epoch = epoch
+        wifi = _restart(air, net, clock, cache, static)
+        try:
+            path = wifi.connect(SSID, PWD)
+        except OSError:
+            path = "OSError"
+        good = path == expect and (not faster or clock.now < legacy)
+        report(label, path, clock.now, net.nic, cache, good)
+        return good, wifi
+
+    good, wifi = scenario("cold start", "scan")
+    ok &= good and cache.load()["bssid"] == "020000000001"
+    good, wifi = scenario("restart, IP reused", "fast")
+    ok &= good and net.nic.dhcps == 0 and cache.writes == 0
+    good, wifi = scenario("restart, clock not set", "fast", epoch=EPOCH_UNSET)
+    ok &= good and net.nic.dhcps == 1
+    good, wifi = scenario("restart, lease too old", "fast", epoch=EPOCH_SET + 2 * wifiConnect.LEASE_TTL)
+    ok &= good and net.nic.dhcps == 1
+
+    air.aps[0].channel = 1
+    good, wifi = scenario("AP moved to channel 1", "scan", faster=False)
+    ok &= good and cache.load()["channel"] == 1 and wifi.failures == {"fast": 1}
+    good, wifi = scenario("restart after the move", "fast")
+    ok &= good
+
+    air.aps[0] = AccessPoint(b"\x02\x00\x00\x00\x00\x03", 3, -50)
+    good, wifi = scenario("AP replaced", "scan", faster=False)
+    ok &= good and cache.load()["bssid"] == "020000000003"
+
+    static = ("192.168.1.50", "255.255.255.0", "192.168.1.1", "192.168.1.1")
+    dynamic, cache = cache, CountingCache(os.path.join(tmp, "static.json"))
+    good, wifi = scenario("static IP, cold", "scan", static=static)
+    ok &= good and net.nic.dhcps == 0
+    good, wifi = scenario("static IP, restart", "fast", static=static)
+    ok &= good and net.nic.dhcps == 0
+    cache = dynamic
+
+    aps, air.aps = air.aps, []
+    good, wifi = scenario("no AP", "OSError", faster=False)
+    ok &= good
+    air.aps = aps
+
+    # the engines, with a warm cache
+    from protoEngine import ProtoEngine
+    import asyncProtoEngine
+    from asyncProtoEngine import AsyncProtoEngine
+
+    clock.epoch = EPOCH_SET
+    pt = ProtoEngine(SSID, "http://localhost:9", 1, "00" * 16)
+    pt.pwd = PWD
+    pt.wifi = _restart(air, net, clock, cache)
+    pt.connect()
+    ok &= report("ProtoEngine.connect()", pt.wifi.last_path, clock.now, net.nic, cache,
+                 pt.state == "online" and pt.stats()["wifi"]["last_path"] == "fast")
+    pt.disconnect()
+    ok &= not net.nic.ready
+
+    async def sleep_ms(ms):
+        clock.sleep_ms(ms)
+    asyncProtoEngine.sleep_ms = sleep_ms
+    asyncProtoEngine._ticks_ms = clock.ticks_ms
+    apt = AsyncProtoEngine(SSID, "http://localhost:9", 1, "00" * 16)
+    apt.pwd = PWD
+    apt.wifi = _restart(air, net, clock, cache)
+    asyncio.run(apt.connect())
+    ok &= report("AsyncProtoEngine.connect()", apt.wifi.last_path, clock.now, net.nic, cache,
+                 apt.state == "online" and apt.wifi.last_path == "fast")
+    return ok
+
+
+class FakeNVS:
+    """esp32.NVS on a dict; counts commits (flash writes)."""
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self.writes = 0
+
+    def get_blob(self, key, buf):
+        if key not in self.blobs:
+            raise OSError(-0x1102)  # ESP_ERR_NVS_NOT_FOUND
+        value = self.blobs[key]
+        buf[:len(value)] = value
+        return len(value)
+
+    def set_blob(self, key, value):
+        self.blobs[key] = bytes(value)
+
+    def erase_key(self, key):
+        self.blobs.pop(key, None)
+
+    def commit(self):
+        self.writes += 1
+
+
+def run_platan(args, report):
+    """PlatanAuth.connect_wifi() with fake network, esp32 and cryptolib modules."""
+    clock = Clock()
+    air = Air(clock, args)
+    air.aps = [AccessPoint(b"\x02\x00\x00\x00\x00\x01", 6, -55)]
+    net = SimNetwork(air)
+    blobs = {"deviceId": b"1", "deviceKey": b"00" * 16, "baseurl": b"localhost", "ssid": SSID.encode(),
+             "passwd": PWD.encode()}
+    nvs = FakeNVS(blobs)
+    esp32 = types.ModuleType("esp32")
+    esp32.NVS = lambda namespace: nvs
+    cryptolib = types.ModuleType("cryptolib")
+    cryptolib.aes = None
+    sys.modules.update({"network": net, "esp32": esp32, "cryptolib": cryptolib})
+    sys.path.insert(0, os.path.join(HERE, "..", "..", "micropython", "protocoll", "credentials"))
+    _patch_clock(clock)
+    import platanAuth
+    platanAuth.print = lambda *a, **k: None
+    ok = True
+
+    def scenario(label, expect, faster=True):
+        net.nic.on = False
+        net.nic.ready = None
+        net.nic.scans = net.nic.dhcps = 0
+        nvs.writes = 0
+        clock.now = 0
+        device = platanAuth.PlatanAuth("platane")
+        try:
+            path = device.connect_wifi()
+        except OSError:
+            path = "OSError"
+        good = path == expect and device.wifi.last_path == (None if path == "OSError" else path)
+        report(label, path, clock.now, net.nic, nvs, good)
+        return good, device
+
+    good, device = scenario("PlatanAuth cold start", "scan")
+    ok &= good and device.wifi.last_ms == clock.now
+    good, device = scenario("PlatanAuth restart", "fast")
+    ok &= good and net.nic.dhcps == 0 and nvs.writes == 0
+    air.aps[0].channel = 11
+    good, device = scenario("PlatanAuth AP moved", "scan")
+    ok &= good and device.wifi.failures == {"fast": 1}
+    return ok
+
+
+def run(args):
+    print(f"{CHANNELS} channels, {args.scan_ms} ms scan per channel, {args.assoc_ms} ms association, "
+          f"{args.dhcp_ms} ms DHCP")
+    print(f"{'scenario':28s} {'path':8s} {'connect':>9s} {'scans':>5s} {'DHCP':>4s} {'writes':>6s}")
+
+    def report(label, path, ms, nic, cache, good):
+        writes = "" if cache is None else cache.writes
+        print(f"{label:28s} {path or '-':8s} {ms:6d} ms {nic.scans:5d} {nic.dhcps:4d} {writes:>6}"
+              f"{'' if good else '  FAILED'}")
+        return good
+
+    ok = run_connector(args, report)
+    ok &= run_platan(args, report)
+    print("OK" if ok else "FAILED")
+    return ok
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time to connect to Wi-Fi, cold and with the cached access point")
+    parser.add_argument("--scan-ms", type=int, default=120, help="Scan time per channel, ms")
+    parser.add_argument("--assoc-ms", type=int, default=150, help="Authentication and association, ms")
+    parser.add_argument("--dhcp-ms", type=int, default=1500, help="DHCP, ms")
+    return run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)